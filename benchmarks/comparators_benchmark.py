@@ -0,0 +1,92 @@
+#  Copyright 2020, Intel Corporation
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+#
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in
+#        the documentation and/or other materials provided with the
+#        distribution.
+#
+#      * Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived
+#        from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compares performance of range queries on a sorted engine using built-in
+(native) comparators and an equivalent comparator written in Python.
+
+Usage: PMEM_IS_PMEM_FORCE=1 python3 comparators_benchmark.py [--count N]
+"""
+
+import argparse
+import time
+
+import pmemkv
+
+
+def reverse_bytes(key1, key2):
+    return (key2 > key1) - (key2 < key1)
+
+
+def run(name, comparator, args):
+    config = {"path": args.path, "size": args.size}
+    keys = [str(i).zfill(10) for i in range(args.count)]
+    with pmemkv.Database(args.engine, config, comparator=comparator) as db:
+        start = time.perf_counter()
+        for key in keys:
+            db.put(key, key)
+        put_time = time.perf_counter() - start
+
+        lo, hi = keys[-1], keys[0]
+        if comparator is None:
+            lo, hi = hi, lo
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            db.count_between(lo, hi)
+        count_time = (time.perf_counter() - start) / args.repeat
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            db.get_keys_between(lo, hi, lambda k: None)
+        scan_time = (time.perf_counter() - start) / args.repeat
+
+    print(
+        f"{name:>16}: put {args.count / put_time:12.0f} ops/s, "
+        f"count_between {count_time * 1e3:9.3f} ms, "
+        f"get_keys_between {scan_time * 1e3:9.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--engine", default="vsmap")
+    parser.add_argument("--path", default="/dev/shm")
+    parser.add_argument("--size", type=int, default=1073741824)
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    run("default", None, args)
+    run("reverse_bytes", "reverse_bytes", args)
+    run("python", reverse_bytes, args)
+
+
+if __name__ == "__main__":
+    main()
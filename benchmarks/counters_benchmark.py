@@ -0,0 +1,99 @@
+#  Copyright 2020, Intel Corporation
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+#
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in
+#        the documentation and/or other materials provided with the
+#        distribution.
+#
+#      * Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived
+#        from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compares multi-threaded throughput of counters updated with the native
+incr() and with a Python read-modify-write (get_string, parse, put) guarded
+by a threading.Lock, on a few hot keys and on many keys.
+
+Usage: PMEM_IS_PMEM_FORCE=1 python3 counters_benchmark.py [--threads N]
+"""
+
+import argparse
+import threading
+import time
+
+import pmemkv
+
+
+def python_incr(db, lock, key):
+    with lock:
+        value = int(db.get_string(key)) if key in db else 0
+        db.put(key, str(value + 1))
+
+
+def run(name, engine, keys, args):
+    config = {"path": args.path, "size": args.size}
+    with pmemkv.Database(engine, config) as db:
+        lock = threading.Lock()
+        names = ["counter{}".format(i) for i in range(keys)]
+
+        def worker(n):
+            if name == "incr":
+                for i in range(args.count):
+                    db.incr(names[(n + i) % keys])
+            else:
+                for i in range(args.count):
+                    python_incr(db, lock, names[(n + i) % keys])
+
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(args.threads)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+    print(
+        f"{engine:>8} {name:>6}, {keys:6} keys: "
+        f"{args.threads * args.count / elapsed:12.0f} increments/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--engines", default="vcmap,vsmap",
+                        help="comma-separated list of engines")
+    parser.add_argument("--path", default="/dev/shm")
+    parser.add_argument("--size", type=int, default=1073741824)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--count", type=int, default=100000,
+                        help="number of increments done by each thread")
+    args = parser.parse_args()
+
+    for engine in args.engines.split(","):
+        for keys in (1, 16, 10000):
+            run("python", engine, keys, args)
+            run("incr", engine, keys, args)
+
+
+if __name__ == "__main__":
+    main()
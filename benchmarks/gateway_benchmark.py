@@ -0,0 +1,164 @@
+#  Copyright 2020, Intel Corporation
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+#
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in
+#        the documentation and/or other materials provided with the
+#        distribution.
+#
+#      * Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived
+#        from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Load test of pmemkv.gateway: many keep-alive connections issue a mix of
+reads and writes (single or batched) for a fixed time, then throughput and
+latency percentiles are reported. A local gateway is started on a vsmap
+database, unless --host is given.
+
+Usage: PMEM_IS_PMEM_FORCE=1 python3 gateway_benchmark.py [--connections N]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+
+async def request(reader, writer, method, path, body=b""):
+    writer.write(b"%s %s HTTP/1.1\r\nHost: bench\r\nContent-Length: %d\r\n\r\n"
+                 % (method, path, len(body)) + body)
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    await reader.readexactly(length)
+    return status
+
+
+async def client(args, port, deadline, latencies):
+    reader, writer = await asyncio.open_connection(args.host, port)
+    value = b"x" * args.value_size
+    rnd = random.Random()
+    ops = 0
+    while time.perf_counter() < deadline:
+        read = rnd.random() < args.read_ratio
+        keys = ["key%d" % rnd.randrange(args.keys) for _ in range(args.batch or 1)]
+        start = time.perf_counter()
+        if args.batch and read:
+            await request(reader, writer, b"POST", b"/mget",
+                          json.dumps({"keys": keys}).encode())
+        elif args.batch:
+            await request(reader, writer, b"POST", b"/mput",
+                          json.dumps(dict.fromkeys(keys, value.decode())).encode())
+        elif read:
+            await request(reader, writer, b"GET", b"/db/" + keys[0].encode())
+        else:
+            await request(reader, writer, b"PUT", b"/db/" + keys[0].encode(), value)
+        latencies.append(time.perf_counter() - start)
+        ops += len(keys)
+    writer.close()
+    return ops
+
+
+async def load(args, port):
+    reader, writer = await asyncio.open_connection(args.host, port)
+    value = "x" * args.value_size
+    for start in range(0, args.keys, 1000):
+        items = {"key%d" % i: value for i in range(start, min(start + 1000, args.keys))}
+        await request(reader, writer, b"POST", b"/mput", json.dumps(items).encode())
+    writer.close()
+
+    latencies = []
+    deadline = time.perf_counter() + args.duration
+    ops = await asyncio.gather(*[client(args, port, deadline, latencies)
+                                 for _ in range(args.connections)])
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e3
+
+    print(
+        f"{args.connections} connections, batch {args.batch or 1}: "
+        f"{len(latencies) / args.duration:10.0f} requests/s, "
+        f"{sum(ops) / args.duration:10.0f} keys/s, "
+        f"p50 {percentile(0.5):7.3f} ms, p99 {percentile(0.99):7.3f} ms, "
+        f"max {latencies[-1] * 1e3:7.3f} ms"
+    )
+
+
+def start_gateway(args):
+    """
+    Starts local gateway in a separate process (so it does not share
+    the GIL with clients) and waits until it accepts connections.
+    """
+    config = json.dumps({"path": args.path, "size": args.size})
+    process = subprocess.Popen([sys.executable, "-m", "pmemkv.gateway",
+                                "--engine", args.engine, "--config", config,
+                                "--host", args.host, "--port", str(args.port)])
+    while True:
+        try:
+            socket.create_connection((args.host, args.port)).close()
+            return process
+        except ConnectionRefusedError:
+            if process.poll() is not None:
+                raise RuntimeError("Gateway has failed to start")
+            time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", help="address of a running gateway")
+    parser.add_argument("--port", type=int, default=8000,
+                        help="port of the gateway (also used by the local one)")
+    parser.add_argument("--engine", default="vsmap")
+    parser.add_argument("--path", default="/dev/shm")
+    parser.add_argument("--size", type=int, default=1073741824)
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--keys", type=int, default=100000)
+    parser.add_argument("--value-size", type=int, default=100)
+    parser.add_argument("--read-ratio", type=float, default=0.9)
+    parser.add_argument("--batch", type=int, default=0,
+                        help="number of keys per request (uses /mget and /mput)")
+    args = parser.parse_args()
+
+    if args.host is not None:
+        asyncio.run(load(args, args.port))
+        return
+    args.host = "127.0.0.1"
+    gateway = start_gateway(args)
+    try:
+        asyncio.run(load(args, args.port))
+    finally:
+        gateway.send_signal(signal.SIGINT)
+        gateway.wait()
+
+
+if __name__ == "__main__":
+    main()
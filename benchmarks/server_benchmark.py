@@ -0,0 +1,146 @@
+#  Copyright 2020, Intel Corporation
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+#
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in
+#        the documentation and/or other materials provided with the
+#        distribution.
+#
+#      * Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived
+#        from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Latency of pmemkv.server: client processes issue a mix of single-record
+reads and writes (or batches of them) over the Unix socket for a fixed time,
+then throughput and round-trip latency percentiles are reported. A local
+server is started on a vsmap database, unless --socket is given.
+
+Usage: PMEM_IS_PMEM_FORCE=1 python3 server_benchmark.py [--clients N]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import pmemkv.client
+
+
+def client(args, deadline):
+    """ Runs in a separate process, returns latencies of its requests. """
+    value = b"x" * args.value_size
+    rnd = random.Random()
+    latencies = []
+    with pmemkv.client.Database(args.socket) as db:
+        while time.perf_counter() < deadline:
+            read = rnd.random() < args.read_ratio
+            keys = ["key%d" % rnd.randrange(args.keys) for _ in range(args.batch or 1)]
+            start = time.perf_counter()
+            if args.batch and read:
+                db.get_many(keys)
+            elif args.batch:
+                db.put_many(dict.fromkeys(keys, value))
+            elif read:
+                db.get(keys[0], len)
+            else:
+                db.put(keys[0], value)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def load(args):
+    with pmemkv.client.Database(args.socket) as db:
+        value = b"x" * args.value_size
+        db.put_many(("key%d" % i, value) for i in range(args.keys))
+
+    deadline = time.perf_counter() + args.duration
+    with multiprocessing.Pool(args.clients) as pool:
+        results = pool.starmap(client, [(args, deadline)] * args.clients)
+    latencies = sorted(latency for result in results for latency in result)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e6
+
+    print(
+        f"{args.clients} clients, batch {args.batch or 1}: "
+        f"{len(latencies) / args.duration:10.0f} requests/s, "
+        f"{len(latencies) * (args.batch or 1) / args.duration:10.0f} keys/s, "
+        f"p50 {percentile(0.5):8.1f} us, p99 {percentile(0.99):8.1f} us, "
+        f"max {latencies[-1] * 1e6:8.1f} us"
+    )
+
+
+def start_server(args):
+    """
+    Starts local server in a separate process (so it does not share
+    the GIL with clients) and waits until it accepts connections.
+    """
+    config = json.dumps({"path": args.path, "size": args.size})
+    process = subprocess.Popen([sys.executable, "-m", "pmemkv.server",
+                                "--engine", args.engine, "--config", config,
+                                "--socket", args.socket])
+    while True:
+        try:
+            pmemkv.client.Database(args.socket).stop()
+            return process
+        except (FileNotFoundError, ConnectionRefusedError):
+            if process.poll() is not None:
+                raise RuntimeError("Server has failed to start")
+            time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", help="path of a running server's socket")
+    parser.add_argument("--engine", default="vsmap")
+    parser.add_argument("--path", default="/dev/shm")
+    parser.add_argument("--size", type=int, default=1073741824)
+    parser.add_argument("--clients", type=int, default=os.cpu_count())
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--keys", type=int, default=100000)
+    parser.add_argument("--value-size", type=int, default=100)
+    parser.add_argument("--read-ratio", type=float, default=0.9)
+    parser.add_argument("--batch", type=int, default=0,
+                        help="number of keys per request (uses get_many and put_many)")
+    args = parser.parse_args()
+
+    if args.socket is not None:
+        load(args)
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        args.socket = os.path.join(tmp_dir, "pmemkv.sock")
+        server = start_server(args)
+        try:
+            load(args)
+        finally:
+            server.send_signal(signal.SIGINT)
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -31,7 +31,8 @@
 #  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 """ This example shows how to use pmemkv-python binding as data store backend for
-simple REST API service based on falcon framework."""
+simple REST API service based on falcon framework. For a ready to use service
+(with batches, streamed scans and keep-alive) see pmemkv.gateway module."""
 
 import pmemkv
 
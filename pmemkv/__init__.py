@@ -35,8 +35,27 @@ pmemkv is a local/embedded key-value datastore optimized for persistent memory.
 For more information, see https://pmem.io/pmemkv.
 """
 
-from pmemkv.pmemkv import Database
+from pmemkv.pmemkv import (
+    Change,
+    Count,
+    Database,
+    HotKey,
+    Index,
+    JsonPointer,
+    Length,
+    Max,
+    Min,
+    Prefix,
+    StructField,
+    Suffix,
+    Sum,
+    ValueStream,
+    open_shared,
+    train_zstd_dictionary,
+)
+from pmemkv.tiered import TieredDatabase
 from _pmemkv import (
+    compressions,
     Error,
     UnknownError,
     NotSupported,
@@ -46,4 +65,6 @@ from _pmemkv import (
     StoppedByCallback,
     WrongEngineName,
     TransactionScopeError,
+    DefragError,
+    ComparatorMismatch,
 )
@@ -0,0 +1,316 @@
+#  Copyright 2019-2020, Intel Corporation
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+#
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in
+#        the documentation and/or other materials provided with the
+#        distribution.
+#
+#      * Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived
+#        from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Client of pmemkv.server, for sharing one database between processes.
+"""
+
+import math
+import socket
+import struct
+import threading
+
+import _pmemkv
+
+# Operations and statuses, as defined by the server (see kvengine.cc).
+_GET = 1
+_PUT = 2
+_REMOVE = 3
+_EXISTS = 4
+_COUNT_ALL = 5
+_SCAN_PREFIX = 6
+
+_OK = 0
+_NOT_FOUND = 2
+
+_NO_TTL = 2**64 - 1
+
+_HEADER = struct.Struct("<IB")
+_PUT_HEADER = struct.Struct("<IQ")
+_RECORD_HEADER = struct.Struct("<II")
+_INT64 = struct.Struct("<q")
+_UINT64 = struct.Struct("<Q")
+
+_EXCEPTIONS = {
+    1: _pmemkv.UnknownError,
+    2: KeyError,
+    3: _pmemkv.NotSupported,
+    4: _pmemkv.InvalidArgument,
+    5: _pmemkv.ConfigParsingError,
+    6: _pmemkv.ConfigTypeError,
+    7: _pmemkv.StoppedByCallback,
+    8: MemoryError,
+    9: _pmemkv.WrongEngineName,
+    10: _pmemkv.TransactionScopeError,
+    11: _pmemkv.DefragError,
+    12: _pmemkv.ComparatorMismatch,
+}
+
+
+def _encode(data):
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    return bytes(data)
+
+
+class Database():
+    """
+    Database served by pmemkv.server to other processes. It provides the same
+    methods as pmemkv.Database for reading and writing single records
+    (put, get, get_string, exists, remove, count_all, scan_prefix and dict-like
+    access), with the same exceptions.
+
+    Batch methods (put_many, get_many, remove_many) pipeline their requests -
+    they are sent in windows which fit in the socket buffer, and all requests
+    of a window are executed by the server before their responses are read,
+    so a batch costs about one round trip per window.
+
+    Methods of one object may be called from many threads, but requests are
+    sent one at a time - use separate objects to issue them in parallel.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the server's socket.
+        """
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._reader = self._socket.makefile("rb")
+        self._lock = threading.Lock()
+        # requests which can be sent without waiting for the server
+        self._window = self._socket.getsockopt(socket.SOL_SOCKET,
+                                               socket.SO_SNDBUF) // 2
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __getitem__(self, key):
+        return self.get_string(key)
+
+    def __len__(self):
+        return self.count_all()
+
+    def __contains__(self, key):
+        return self.exists(key)
+
+    def __delitem__(self, key):
+        if not self.remove(key):
+            raise KeyError(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.stop()
+
+    def stop(self):
+        """ Closes the connection. The database keeps running in the server. """
+        self._reader.close()
+        self._socket.close()
+
+    def _request(self, op, body):
+        return _HEADER.pack(len(body), op) + body
+
+    def _call(self, requests):
+        """
+        Sends requests and returns list of (status, body) responses. The server
+        does not read requests while it's blocked sending responses, so they
+        are sent in windows fitting in the socket buffer, and responses of
+        a window are read before the next one is sent.
+        """
+        with self._lock:
+            responses = []
+            window, size = [], 0
+            for request in requests:
+                if window and size + len(request) > self._window:
+                    responses.extend(self._send(window))
+                    window, size = [], 0
+                window.append(request)
+                size += len(request)
+            if window:
+                responses.extend(self._send(window))
+            return responses
+
+    def _send(self, requests):
+        self._socket.sendall(b"".join(requests))
+        responses = []
+        for _ in requests:
+            header = self._reader.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                raise ConnectionError("Connection closed by the server")
+            size, status = _HEADER.unpack(header)
+            body = self._reader.read(size)
+            if len(body) < size:
+                raise ConnectionError("Connection closed by the server")
+            responses.append((status, body))
+        return responses
+
+    def _check(self, status, body, ok=(_OK,)):
+        if status in ok:
+            return
+        raise _EXCEPTIONS.get(status, _pmemkv.Error)(body.decode("utf-8", "replace"))
+
+    def _put_request(self, key, value, ttl):
+        if ttl is None:
+            ttl_ms = _NO_TTL
+        elif ttl < 0:
+            raise ValueError("TTL should be non-negative")
+        else:
+            ttl_ms = math.ceil(ttl * 1000)
+        key = _encode(key)
+        return self._request(_PUT, _PUT_HEADER.pack(len(key), ttl_ms) + key +
+                             _encode(value))
+
+    def put(self, key, value, ttl=None):
+        """
+        Inserts the key/value pair into the database. See pmemkv.Database.put().
+        """
+        self._check(*self._call([self._put_request(key, value, ttl)])[0])
+
+    def get(self, key, func):
+        """
+        Executes callback function for value for given key. Value is passed as
+        a read-only memoryview.
+        """
+        status, body = self._call([self._request(_GET, _encode(key))])[0]
+        if status == _NOT_FOUND:
+            raise KeyError(key)
+        self._check(status, body)
+        func(memoryview(body).toreadonly())
+
+    def get_string(self, key):
+        """ Gets copy (as a string) of value for given key. """
+        status, body = self._call([self._request(_GET, _encode(key))])[0]
+        if status == _NOT_FOUND:
+            raise KeyError(key)
+        self._check(status, body)
+        return body.decode("utf-8")
+
+    def exists(self, key):
+        """ Verifies the presence of key/value pair in the database. """
+        status, body = self._call([self._request(_EXISTS, _encode(key))])[0]
+        self._check(status, body, (_OK, _NOT_FOUND))
+        return status == _OK
+
+    def remove(self, key):
+        """
+        Removes key/value pair for given key. Returns true if element was
+        removed, false if it didn't exist.
+        """
+        status, body = self._call([self._request(_REMOVE, _encode(key))])[0]
+        self._check(status, body, (_OK, _NOT_FOUND))
+        return status == _OK
+
+    def count_all(self):
+        """ Returns number of records in the database. """
+        status, body = self._call([self._request(_COUNT_ALL, b"")])[0]
+        self._check(status, body)
+        return _UINT64.unpack(body)[0]
+
+    def scan_prefix(self, prefix, limit=None):
+        """
+        Returns list of (key, value) tuples, whose keys start with the given
+        prefix. See pmemkv.Database.scan_prefix().
+        """
+        if limit is None:
+            limit = -1
+        elif limit < 0:
+            raise ValueError("Limit should be non-negative")
+        status, body = self._call(
+            [self._request(_SCAN_PREFIX, _INT64.pack(limit) + _encode(prefix))])[0]
+        self._check(status, body)
+        records = []
+        pos = 0
+        while pos < len(body):
+            keybytes, valuebytes = _RECORD_HEADER.unpack_from(body, pos)
+            pos += _RECORD_HEADER.size
+            key = body[pos:pos + keybytes]
+            pos += keybytes
+            records.append((key, body[pos:pos + valuebytes]))
+            pos += valuebytes
+        return records
+
+    def put_many(self, items, ttl=None):
+        """
+        Inserts key/value pairs, pipelined (see Database). Pairs are written
+        one by one, so if one of them fails, the preceding ones remain written.
+
+        Parameters
+        ----------
+        items : dict or iterable of (key, value) pairs
+            Records to insert.
+        ttl : float, optional
+            Time to live of all records, in seconds.
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        requests = [self._put_request(key, value, ttl) for key, value in items]
+        if not requests:
+            return
+        for status, body in self._call(requests):
+            self._check(status, body)
+
+    def get_many(self, keys):
+        """
+        Gets values of keys, pipelined (see Database).
+
+        Returns
+        -------
+        values : list
+            Values (as bytes) in order of keys, None for keys which do not exist.
+        """
+        requests = [self._request(_GET, _encode(key)) for key in keys]
+        if not requests:
+            return []
+        values = []
+        for status, body in self._call(requests):
+            if status == _NOT_FOUND:
+                values.append(None)
+                continue
+            self._check(status, body)
+            values.append(body)
+        return values
+
+    def remove_many(self, keys):
+        """
+        Removes keys, pipelined (see Database). Returns number of removed
+        records.
+        """
+        requests = [self._request(_REMOVE, _encode(key)) for key in keys]
+        if not requests:
+            return 0
+        removed = 0
+        for status, body in self._call(requests):
+            self._check(status, body, (_OK, _NOT_FOUND))
+            removed += status == _OK
+        return removed
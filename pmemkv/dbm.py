@@ -0,0 +1,187 @@
+#  Copyright 2019-2020, Intel Corporation
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+#
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in
+#        the documentation and/or other materials provided with the
+#        distribution.
+#
+#      * Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived
+#        from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+dbm-compatible interface to pmemkv, storing the database in a pmemkv pool.
+
+Keys and values are str (encoded as UTF-8) or bytes-like objects and they are
+returned as bytes, as by other dbm modules.
+"""
+
+import collections.abc
+import os
+
+from pmemkv.pmemkv import Database, _key_bytes
+from _pmemkv import Error
+
+# exceptions raised by open() and by the returned database
+error = (Error, OSError)
+
+
+class _Database(collections.abc.MutableMapping):
+    """ Database returned by open(), a mapping of bytes to bytes. """
+
+    def __init__(self, db, readonly):
+        self.db = db
+        self._readonly = readonly
+
+    def _check_open(self):
+        if self.db is None:
+            raise Error("Database is closed")
+
+    def _check_writable(self):
+        self._check_open()
+        if self._readonly:
+            raise Error("Database is opened for reading only")
+
+    def __getitem__(self, key):
+        self._check_open()
+        key = _key_bytes(key)
+        try:
+            return self.db.read(key)
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        self._check_writable()
+        self.db.put(_key_bytes(key), _key_bytes(value))
+
+    def __delitem__(self, key):
+        self._check_writable()
+        key = _key_bytes(key)
+        if not self.db.remove(key):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        self._check_open()
+        return self.db.exists(_key_bytes(key))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        self._check_open()
+        return self.db.count_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def keys(self):
+        """ Returns list of all keys. """
+        self._check_open()
+        return self.db.scan_range(keys_only=True)
+
+    def get(self, key, default=None):
+        self._check_open()
+        try:
+            return self.db.read(_key_bytes(key))
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=b""):
+        value = self.get(key)
+        if value is None:
+            self[key] = default
+            value = _key_bytes(default)
+        return value
+
+    def update(self, other=(), **kwargs):
+        """
+        Inserts records from a mapping or an iterable of (key, value) pairs
+        and keyword arguments. They are written natively, at once.
+        """
+        self._check_writable()
+        items = other.items() if hasattr(other, "items") else other
+        pairs = [(_key_bytes(k), _key_bytes(v)) for k, v in items]
+        pairs.extend((_key_bytes(k), _key_bytes(v)) for k, v in kwargs.items())
+        self.db.put_many(pairs)
+
+    def sync(self):
+        """ Does nothing, as pmemkv writes are persistent once they return. """
+        self._check_open()
+
+    def close(self):
+        """ Stops the engine. Calling close() more than once has no effect. """
+        if self.db is not None:
+            self.db.stop()
+            self.db = None
+
+
+def open(file, flag="r", mode=0o666, engine="cmap", size=1 << 30, config=None,
+         **kwargs):
+    """
+    Opens a pmemkv pool as a dbm database.
+
+    Parameters
+    ----------
+    file : str or path-like
+        Path of the pool (or a directory, for engines which take one).
+    flag : str, optional
+        'r' opens an existing database for reading only, 'w' for reading and
+        writing, 'c' creates the pool if it does not exist and 'n' always
+        creates a new, empty one.
+    mode : int, optional
+        Accepted for compatibility with dbm, permissions of the pool are set
+        by pmemkv.
+    engine : str, optional
+        Name of the engine, it should be a persistent one.
+    size : int, optional
+        Size of a created pool, in bytes.
+    config : dict, optional
+        Other parameters of the engine.
+    **kwargs
+        Other parameters passed to Database (e.g. compression).
+
+    Returns
+    -------
+    db : mapping
+        Opened database, closed with close().
+
+    Raises
+    ------
+    ValueError
+        If flag is invalid.
+    error
+        If the pool can not be opened.
+    """
+    if flag not in ("r", "w", "c", "n"):
+        raise ValueError("Flag should be one of 'r', 'w', 'c' or 'n'")
+    file = os.fspath(file)
+    cfg = dict(config or {})
+    cfg["path"] = file
+    if flag in ("c", "n"):
+        cfg.setdefault("size", size)
+        cfg.setdefault("create_if_missing", True)
+        if flag == "n" and os.path.isfile(file):
+            os.remove(file)
+    return _Database(Database(engine, cfg, **kwargs), flag == "r")
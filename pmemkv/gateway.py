@@ -0,0 +1,471 @@
+#  Copyright 2019-2020, Intel Corporation
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+#
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in
+#        the documentation and/or other materials provided with the
+#        distribution.
+#
+#      * Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived
+#        from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+HTTP gateway exposing a pmemkv database as a REST service.
+
+It's built on asyncio streams (no web framework is needed) and supports
+HTTP/1.1 keep-alive and chunked transfer encoding. Endpoints:
+
+- GET /db/<key> - value of the key, as application/octet-stream,
+- PUT /db/<key>[?ttl=<seconds>] - stores request body as the value,
+- DELETE /db/<key> - removes the key,
+- POST /mget - body {"keys": [...]}, returns {"values": [...]} (null for
+  missing keys),
+- POST /mput[?ttl=<seconds>] - body {key: value, ...}, returns
+  {"written": <count>},
+- GET /db[?prefix=<prefix>|lo=<key>&hi=<key>][&limit=<n>][&cursor=<key>]
+  [&keys_only=1] - streams records in order of keys, one JSON object
+  {"key": ..., "value": ...} per line. If limit is reached, the last line is
+  {"cursor": <key>} - pass it in the next request to continue.
+
+Keys in paths and query parameters (prefix, lo, hi, cursor) are
+percent-encoded bytes. In JSON, keys and values are strings - bytes which
+are not valid UTF-8 are escaped as lone surrogates (\\udc80-\\udcff), so
+binary data round-trips through any JSON parser which preserves them (e.g.
+Python's json module).
+
+Run it as:
+
+    python -m pmemkv.gateway --engine cmap --config '{"path": "/pmem/pool"}'
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import urllib.parse
+
+from pmemkv.pmemkv import Database
+import _pmemkv
+
+logger = logging.getLogger(__name__)
+
+_REASONS = {
+    200: "OK",
+    204: "No Content",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+}
+
+
+class _HttpError(Exception):
+
+    def __init__(self, status, message=""):
+        super().__init__(message)
+        self.status = status
+
+
+class _Request():
+
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        self.version = version
+        self.headers = headers
+        self.body = body
+        path, _, query = target.partition(b"?")
+        self.path = path
+        self.query = _parse_query(query)
+
+    def param(self, name, default=None):
+        values = self.query.get(name)
+        return values[-1] if values else default
+
+    def keep_alive(self):
+        connection = self.headers.get(b"connection", b"").lower()
+        if self.version == b"HTTP/1.0":
+            return connection == b"keep-alive"
+        return connection != b"close"
+
+
+def _parse_query(query):
+    """
+    Parses the query string into lists of values of parameters. Values are
+    percent-encoded bytes (not necessarily UTF-8), so they are kept as bytes.
+    """
+    params = {}
+    # latin-1 maps each byte to one character, so it can not fail
+    for field in query.decode("latin-1").split("&"):
+        if not field:
+            continue
+        name, _, value = field.replace("+", " ").partition("=")
+        try:
+            name = urllib.parse.unquote_to_bytes(name).decode("ascii")
+        except UnicodeDecodeError:
+            raise _HttpError(400, "Malformed query")
+        params.setdefault(name, []).append(urllib.parse.unquote_to_bytes(value))
+    return params
+
+
+def _text(data):
+    return data.decode("utf-8", "surrogateescape")
+
+
+def _bytes(text):
+    if not isinstance(text, str):
+        raise _HttpError(400, "Keys and values should be strings")
+    return text.encode("utf-8", "surrogateescape")
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body)
+    except ValueError as e:
+        raise _HttpError(400, "Malformed JSON: " + str(e))
+
+
+def _float_param(request, name):
+    value = request.param(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise _HttpError(400, "Parameter " + name + " should be a number")
+
+
+class Gateway():
+    """
+    HTTP gateway of the database (see the module description). Requests
+    of all connections are served by one event loop - single records are
+    read and written directly, while scans and batches are executed in
+    the loop's executor (pmemkv releases the GIL meanwhile).
+
+    Parameters
+    ----------
+    db : pmemkv.Database
+        Database to serve. It's not stopped along with the gateway.
+    host : str, optional
+        Address to listen on.
+    port : int, optional
+        Port to listen on. If 0, a free port is chosen (see the port attribute).
+    page_size : int, optional
+        Number of records read from the database at once by scans. Each page
+        is sent as one chunk of the response.
+    max_body_size : int, optional
+        Maximum size of request body, in bytes.
+    keep_alive_timeout : float, optional
+        Idle connections are closed after this number of seconds.
+    """
+
+    def __init__(self, db, host="127.0.0.1", port=8000, page_size=1000,
+                 max_body_size=64 << 20, keep_alive_timeout=75.0):
+        self.db = db
+        self.host = host
+        self.port = port
+        self.page_size = page_size
+        self.max_body_size = max_body_size
+        self.keep_alive_timeout = keep_alive_timeout
+        self._server = None
+
+    async def start(self):
+        """ Starts listening for connections. """
+        self._server = await asyncio.start_server(self._handle, self.host,
+                                                  self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """ Starts the gateway (if it's not started) and serves until cancelled. """
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    async def close(self):
+        """ Stops listening and waits until the server is closed. """
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        self._read_request(reader, writer), self.keep_alive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    break
+                keep_alive = request.keep_alive()
+                try:
+                    if await self._dispatch(request, writer, keep_alive) is False:
+                        keep_alive = False
+                except _HttpError as e:
+                    self._respond(writer, e.status, str(e).encode(), keep_alive,
+                                  "text/plain")
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except _HttpError as e:
+            # request can not be parsed, so the connection is not reused
+            self._respond(writer, e.status, str(e).encode(), False, "text/plain")
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise
+            return None
+        except asyncio.LimitOverrunError:
+            raise _HttpError(431, "Request header is too large")
+        lines = head[:-4].split(b"\r\n")
+        try:
+            method, target, version = lines[0].split(b" ")
+        except ValueError:
+            raise _HttpError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(b":")
+            if not sep:
+                raise _HttpError(400, "Malformed header")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get(b"expect", b"").lower() == b"100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        if headers.get(b"transfer-encoding", b"").lower() == b"chunked":
+            body = await self._read_chunked(reader)
+        else:
+            try:
+                length = int(headers.get(b"content-length", 0))
+            except ValueError:
+                raise _HttpError(400, "Malformed Content-Length")
+            if length > self.max_body_size:
+                raise _HttpError(413, "Request body is too large")
+            body = await reader.readexactly(length)
+        return _Request(method.decode(), target, version, headers, body)
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        size = 0
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            try:
+                chunk_size = int(line.split(b";")[0], 16)
+            except ValueError:
+                raise _HttpError(400, "Malformed chunk")
+            if chunk_size == 0:
+                # skips trailer
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return b"".join(chunks)
+            size += chunk_size
+            if size > self.max_body_size:
+                raise _HttpError(413, "Request body is too large")
+            chunks.append(await reader.readexactly(chunk_size))
+            await reader.readexactly(2)
+
+    def _respond(self, writer, status, body=b"", keep_alive=True,
+                 content_type="application/json"):
+        head = "HTTP/1.1 %d %s\r\nContent-Length: %d\r\n" % (
+            status, _REASONS[status], len(body))
+        if body:
+            head += "Content-Type: " + content_type + "\r\n"
+        if not keep_alive:
+            head += "Connection: close\r\n"
+        writer.write((head + "\r\n").encode())
+        writer.write(body)
+
+    async def _dispatch(self, request, writer, keep_alive):
+        """ Returns False if the connection can not be reused. """
+        path = request.path
+        method = request.method
+        try:
+            if path.startswith(b"/db/") and len(path) > 4:
+                key = urllib.parse.unquote_to_bytes(path[4:])
+                if method == "GET":
+                    return self._get(key, writer, keep_alive)
+                if method == "PUT":
+                    return self._put(key, request, writer, keep_alive)
+                if method == "DELETE":
+                    return self._delete(key, writer, keep_alive)
+            elif path in (b"/db", b"/db/"):
+                if method == "GET":
+                    return await self._scan(request, writer, keep_alive)
+            elif path == b"/mget":
+                if method == "POST":
+                    return await self._mget(request, writer, keep_alive)
+            elif path == b"/mput":
+                if method == "POST":
+                    return await self._mput(request, writer, keep_alive)
+            else:
+                raise _HttpError(404, "Unknown resource")
+            raise _HttpError(405, "Method not allowed")
+        except KeyError:
+            raise _HttpError(404, "Key not found")
+        except (_pmemkv.InvalidArgument, ValueError) as e:
+            raise _HttpError(400, str(e))
+        except _pmemkv.Error as e:
+            logger.exception("Request %s %s failed", method, path)
+            raise _HttpError(500, str(e))
+
+    def _get(self, key, writer, keep_alive):
+        # value is copied once, from the buffer of pmemkv straight
+        # to the response
+        values = []
+        self.db.get(key, lambda value: values.append(bytes(value)))
+        self._respond(writer, 200, values[0], keep_alive,
+                      "application/octet-stream")
+
+    def _put(self, key, request, writer, keep_alive):
+        self.db.put(key, request.body, _float_param(request, "ttl"))
+        self._respond(writer, 204, keep_alive=keep_alive)
+
+    def _delete(self, key, writer, keep_alive):
+        if not self.db.remove(key):
+            raise _HttpError(404, "Key not found")
+        self._respond(writer, 204, keep_alive=keep_alive)
+
+    def _get_values(self, keys):
+        values = []
+        for key in keys:
+            found = []
+            try:
+                self.db.get(key, lambda value: found.append(_text(bytes(value))))
+            except KeyError:
+                found.append(None)
+            values.append(found[0])
+        return values
+
+    async def _mget(self, request, writer, keep_alive):
+        doc = _json_body(request)
+        if not isinstance(doc, dict) or not isinstance(doc.get("keys"), list):
+            raise _HttpError(400, 'Body should be {"keys": [...]}')
+        keys = [_bytes(key) for key in doc["keys"]]
+        loop = asyncio.get_running_loop()
+        values = await loop.run_in_executor(None, self._get_values, keys)
+        self._respond(writer, 200, json.dumps({"values": values}).encode(),
+                      keep_alive)
+
+    async def _mput(self, request, writer, keep_alive):
+        doc = _json_body(request)
+        if not isinstance(doc, dict):
+            raise _HttpError(400, "Body should be a JSON object")
+        items = [(_bytes(key), _bytes(value)) for key, value in doc.items()]
+        ttl = _float_param(request, "ttl")
+        loop = asyncio.get_running_loop()
+        written = await loop.run_in_executor(None, self.db.put_many, items, ttl)
+        self._respond(writer, 200, json.dumps({"written": written}).encode(),
+                      keep_alive)
+
+    async def _scan(self, request, writer, keep_alive):
+        prefix = request.param("prefix")
+        lo = request.param("lo")
+        hi = request.param("hi")
+        if prefix is not None and (lo is not None or hi is not None):
+            raise _HttpError(400, "Parameter prefix can not be used with lo/hi")
+        limit = request.param("limit")
+        if limit is not None:
+            if not limit.isdigit():
+                raise _HttpError(400, "Limit should be a non-negative integer")
+            limit = int(limit)
+        cursor = request.param("cursor")
+        keys_only = request.param("keys_only", b"0") not in (b"0", b"false", b"")
+
+        def page(after, size):
+            if prefix is not None:
+                return self.db.scan_prefix(prefix, size, after, keys_only)
+            return self.db.scan_range(lo, hi, size, after, keys_only)
+
+        head = "HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n" \
+               "Transfer-Encoding: chunked\r\n"
+        if not keep_alive:
+            head += "Connection: close\r\n"
+        writer.write((head + "\r\n").encode())
+
+        loop = asyncio.get_running_loop()
+        sent = 0
+        while limit is None or sent < limit:
+            size = self.page_size if limit is None else min(self.page_size,
+                                                            limit - sent)
+            try:
+                records = await loop.run_in_executor(None, page, cursor, size)
+            except Exception:
+                # status is already sent, so the response is left incomplete
+                logger.exception("Scan %s failed", request.query)
+                return False
+            if not records:
+                break
+            records = records[:size]
+            if keys_only:
+                cursor = records[-1]
+                lines = [json.dumps({"key": _text(key)}) for key in records]
+            else:
+                cursor = records[-1][0]
+                lines = [json.dumps({"key": _text(key), "value": _text(value)})
+                         for key, value in records]
+            sent += len(records)
+            if limit is not None and sent >= limit:
+                lines.append(json.dumps({"cursor": _text(cursor)}))
+            self._write_chunk(writer, ("\n".join(lines) + "\n").encode())
+            # waits until the client receives the page, before reading the next
+            await writer.drain()
+            if len(records) < size:
+                break
+        writer.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, writer, data):
+        writer.write(b"%x\r\n" % len(data))
+        writer.write(data)
+        writer.write(b"\r\n")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m pmemkv.gateway",
+                                     description="Serves pmemkv database "
+                                     "as a REST service.")
+    parser.add_argument("--engine", required=True, help="name of the engine")
+    parser.add_argument("--config", required=True,
+                        help="configuration of the engine, as JSON object")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument("--expiry", action="store_true",
+                        help="enable time-to-live of records")
+    args = parser.parse_args(args)
+
+    with Database(args.engine, json.loads(args.config), expiry=args.expiry) as db:
+        gateway = Gateway(db, args.host, args.port)
+        try:
+            asyncio.run(gateway.serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -34,25 +34,82 @@
 #include <Python.h>
 #include "structmember.h"
 #include <string>
+#include <fcntl.h>
+#include <unistd.h>
+#include <poll.h>
+#include <sys/mman.h>
+#include <sys/socket.h>
+#include <sys/stat.h>
 #include <libpmemkv.h>
 #include <libpmemkv_json_config.h>
 #include <iostream>
 #include <unordered_map>
+#include <cstring>
+#include <algorithm>
+#include <array>
+#include <atomic>
+#include <cerrno>
+#include <chrono>
+#include <condition_variable>
+#include <deque>
+#include <map>
+#include <mutex>
+#include <random>
+#include <shared_mutex>
+#include <thread>
+#include <vector>
+
+/*
+ * Custom comparators were introduced in pmemkv 1.1, together with
+ * PMEMKV_STATUS_COMPARATOR_MISMATCH. Status is defined here for older
+ * versions, so the exception hierarchy stays the same for each build.
+ */
+#ifdef PMEMKV_STATUS_COMPARATOR_MISMATCH
+#define PMEMKV_PY_COMPARATOR_SUPPORT 1
+#else
+#define PMEMKV_STATUS_COMPARATOR_MISMATCH 12
+#endif
+#ifndef PMEMKV_STATUS_DEFRAG_ERROR
+#define PMEMKV_STATUS_DEFRAG_ERROR 11
+#endif
+
+/*
+ * Compression libraries are optional, setup.py defines these macros
+ * if they are available.
+ */
+#ifdef PMEMKV_PY_LZ4
+#include <lz4.h>
+#endif
+#ifdef PMEMKV_PY_ZSTD
+#include <zstd.h>
+#include <zdict.h>
+#endif
 
 #ifdef __cplusplus
 extern "C" {
 #endif
 
-static PyObject *PmemkvException;
+/*
+ * Free-threaded builds (3.13+) protect objects with critical sections, which
+ * are not needed (and not available) when the GIL is used.
+ */
+#ifndef Py_BEGIN_CRITICAL_SECTION
+#define Py_BEGIN_CRITICAL_SECTION(op) {
+#define Py_END_CRITICAL_SECTION() }
+#endif
 
+/*
+ * Exception raised for each pmemkv status. Exceptions without a builtin
+ * one are created separately for each instance of the module.
+ */
 typedef struct {
-	PyObject *exception;
+	PyObject *builtin;
 	const char *object_name;
 	const char *exception_name;
 	const char *docstring;
 } Exception;
 
-static std::unordered_map<int, Exception> ExceptionDispatcher = {
+static const std::unordered_map<int, Exception> ExceptionDispatcher = {
 	{PMEMKV_STATUS_UNKNOWN_ERROR,
 	 Exception{NULL, "UnknownError", "pmemkv_NI.UnknownError",
 		   "Something unexpected happened"}},
@@ -85,9 +142,164 @@ static std::unordered_map<int, Exception> ExceptionDispatcher = {
 	 Exception{
 		 NULL, "TransactionScopeError", "pmemkv_NI.TransactionScopeError",
 		 "An error with the scope of the libpmemobj transaction. This exception is defined for compatibility with pmemkv API and probably will never occur"}},
+	{PMEMKV_STATUS_DEFRAG_ERROR,
+	 Exception{NULL, "DefragError", "pmemkv_NI.DefragError",
+		   "Defragmentation of the pool failed"}},
+	{PMEMKV_STATUS_COMPARATOR_MISMATCH,
+	 Exception{NULL, "ComparatorMismatch", "pmemkv_NI.ComparatorMismatch",
+		   "Comparator passed to the engine does not match the one used to create the pool"}},
+};
+
+/* Statuses are lower than this value. */
+static const int STATUS_COUNT = 16;
+
+/*
+ * State of the module. It's kept in the module object, so each interpreter
+ * (e.g. a subinterpreter) has its own exceptions and types.
+ */
+typedef struct {
+	/* base class of pmemkv exceptions */
+	PyObject *error;
+	/* exception raised for each status, NULL for unknown statuses */
+	PyObject *exceptions[STATUS_COUNT];
+	PyTypeObject *pmemkv_type;
+	PyTypeObject *value_buffer_type;
+} ModuleState;
+
+/*
+ * Module states of all interpreters. Errors may be raised by helpers which
+ * have no access to the module (or object), so the state is found by
+ * the current interpreter. If the module was loaded more than once by
+ * the same interpreter (e.g. by importlib), the first one is used.
+ */
+static std::mutex ModuleStatesMutex;
+static std::unordered_map<PyInterpreterState *, std::vector<ModuleState *>> ModuleStates;
+
+static PyInterpreterState *current_interpreter()
+{
+#if PY_VERSION_HEX >= 0x03090000
+	return PyInterpreterState_Get();
+#else
+	return PyThreadState_Get()->interp;
+#endif
+}
+
+/*
+ * Returns state of the module imported by the current interpreter, or NULL
+ * if it has none (e.g. the module was already freed during finalization).
+ */
+static ModuleState *module_state()
+{
+	std::lock_guard<std::mutex> lock(ModuleStatesMutex);
+	auto it = ModuleStates.find(current_interpreter());
+	if (it == ModuleStates.end() || it->second.empty())
+		return NULL;
+	return it->second.front();
+}
+
+/*
+ * Returns exception class for the status (RuntimeError, if the interpreter
+ * has no module state). The caller has to hold the GIL.
+ */
+static PyObject *pmemkv_exception(int status)
+{
+	ModuleState *state = module_state();
+	if (state == NULL)
+		return PyExc_RuntimeError;
+	if (status < 0 || status >= STATUS_COUNT || state->exceptions[status] == NULL)
+		return state->error;
+	return state->exceptions[status];
+}
+
+/* Returns thread state attached to the current thread, or NULL. */
+static PyThreadState *attached_thread_state()
+{
+#if PY_VERSION_HEX >= 0x030D0000
+	return PyThreadState_GetUnchecked();
+#elif PY_VERSION_HEX >= 0x030C0000
+	return _PyThreadState_UncheckedGet();
+#else
+	/* before 3.12 it's the thread state holding the GIL, of any thread */
+	PyThreadState *tstate = _PyThreadState_UncheckedGet();
+	if (tstate == NULL ||
+	    (unsigned long)tstate->thread_id != (unsigned long)PyThread_get_thread_ident())
+		return NULL;
+	return tstate;
+#endif
+}
+
+/*
+ * Checks if the current thread holds the GIL (or, in free-threaded builds,
+ * is attached to the interpreter). Unlike PyGILState_Check(), it works with
+ * subinterpreters.
+ */
+static bool holds_gil()
+{
+	return attached_thread_state() != NULL;
+}
+
+static PyInterpreterState *thread_interpreter(PyThreadState *tstate)
+{
+#if PY_VERSION_HEX >= 0x03090000
+	return PyThreadState_GetInterpreter(tstate);
+#else
+	return tstate->interp;
+#endif
+}
+
+/*
+ * Attaches the current thread to the interpreter which owns Python objects
+ * called from native code (comparators, index extractors, file objects),
+ * taking its GIL. PyGILState_Ensure attaches threads without a thread state
+ * to the main interpreter, so it's used only if the thread already has one
+ * of this interpreter (e.g. a Python thread, which released the GIL). Other
+ * threads (e.g. of the server or warm-up) get a temporary thread state.
+ * A thread attached to another interpreter is detached meanwhile.
+ */
+class InterpreterLock {
+public:
+	InterpreterLock(PyInterpreterState *interp)
+	    : mode(ATTACHED), tstate(NULL), detached(NULL)
+	{
+		PyThreadState *current = attached_thread_state();
+		if (current != NULL && thread_interpreter(current) == interp)
+			return;
+		PyThreadState *own = PyGILState_GetThisThreadState();
+		if (current == NULL && own != NULL && thread_interpreter(own) == interp) {
+			mode = ENSURED;
+			gstate = PyGILState_Ensure();
+			return;
+		}
+		mode = TEMPORARY;
+		if (current != NULL)
+			detached = PyEval_SaveThread();
+		tstate = PyThreadState_New(interp);
+		PyEval_RestoreThread(tstate);
+	}
+
+	~InterpreterLock()
+	{
+		if (mode == ENSURED)
+			PyGILState_Release(gstate);
+		if (mode != TEMPORARY)
+			return;
+		PyThreadState_Clear(tstate);
+		PyEval_SaveThread();
+		PyThreadState_Delete(tstate);
+		if (detached != NULL)
+			PyEval_RestoreThread(detached);
+	}
+
+private:
+	enum { ATTACHED, ENSURED, TEMPORARY } mode;
+	PyThreadState *tstate, *detached;
+	PyGILState_STATE gstate;
 };
 
 static const char *memory_exception_msg = "Cannot allocate memory for internal objects";
+static const char *expired_msg = "Key has expired";
+static const char *corrupted_msg = "Value can not be decompressed";
+static const char *expiry_disabled_msg = "Expiry is not enabled for this database";
 
 typedef struct {
 	PyObject_HEAD
@@ -123,12 +335,6 @@ static int PmemkvValueBufferObject_getbuffer(PyObject *obj, Py_buffer *view, int
 	return 0;
 }
 
-static PyBufferProcs PmemkvValueBuffer_as_buffer = {
-	// this definition is only compatible with Python 3.3 and above
-	(getbufferproc)PmemkvValueBufferObject_getbuffer,
-	(releasebufferproc)0, // we do not require any special release function
-};
-
 static PyObject *PmemkvValueBuffer_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
 {
 	PmemkvValueBufferObject *self =
@@ -149,30 +355,217 @@ static int PmemkvValueBuffer_init(PmemkvValueBufferObject *self)
 
 static void PmemkvValueBuffer_dealloc(PmemkvValueBufferObject *self)
 {
+	PyTypeObject *type = Py_TYPE(self);
 	PyObject_Del(self);
+	/* instances of heap types own a reference to the type since 3.8 */
+#if PY_VERSION_HEX >= 0x03080000
+	Py_DECREF(type);
+#else
+	(void)type;
+#endif
 }
 
 /*
- * Configuration of PmemkvValueBuffer object.
+ * Configuration of PmemkvValueBuffer object. It's a heap type, created
+ * for each instance of the module.
  */
-static PyTypeObject PmemkvValueBufferType = {
-	PyVarObject_HEAD_INIT(&PyType_Type, 0)
-	.tp_name = "pmemkv.pmemkv_NI",
-	.tp_basicsize = sizeof(PmemkvValueBufferObject),
-	.tp_dealloc = (destructor)PmemkvValueBuffer_dealloc,
-	.tp_as_buffer = &PmemkvValueBuffer_as_buffer,
-	.tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
-	.tp_doc = "Pmemkv value type",
-	.tp_members = PmemvValueBuffer_members,
-	.tp_init = (initproc)PmemkvValueBuffer_init,
-	.tp_new = PmemkvValueBuffer_new,
+static PyType_Slot PmemkvValueBuffer_slots[] = {
+	{Py_tp_dealloc, (void *)PmemkvValueBuffer_dealloc},
+	{Py_tp_doc, (void *)"Pmemkv value type"},
+	{Py_tp_members, (void *)PmemvValueBuffer_members},
+	{Py_tp_init, (void *)PmemkvValueBuffer_init},
+	{Py_tp_new, (void *)PmemkvValueBuffer_new},
+#if PY_VERSION_HEX >= 0x03090000
+	{Py_bf_getbuffer, (void *)PmemkvValueBufferObject_getbuffer},
+#endif
+	{0, NULL},
+};
+
+static PyType_Spec PmemkvValueBuffer_spec = {
+	"pmemkv.pmemkv_NI",
+	sizeof(PmemkvValueBufferObject),
+	0,
+	Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+	PmemkvValueBuffer_slots,
 };
 
 typedef struct {
 	PyObject_HEAD
 	pmemkv_db *db;
+	PyObject *comparator;
+	/* NULL if engine is thread-safe */
+	std::recursive_mutex *lock;
+	/* KEY_LOCK_STRIPES locks, NULL if engine is not thread-safe (see KeyLock) */
+	std::recursive_mutex *key_locks;
+	/* engine uses a comparator, keys are not ordered bytewise */
+	bool custom_order;
+	/* comparator of the engine, NULL if keys are ordered bytewise */
+	int (*compare)(const char *, size_t, const char *, size_t, void *);
+	/* engine supports range queries, so records are ordered */
+	bool sorted;
+	/* values are written with a header (see encode_value) */
+	bool value_header;
+	struct Reaper *reaper;
+	/* NULL if compression is disabled */
+	struct Compression *compression;
+	struct DefragScheduler *defrag;
+	/* number of writes done by the binding, see engine_put */
+	std::atomic<uint64_t> writes;
+	/* NULL if change log was never enabled */
+	std::atomic<struct ChangeLog *> changes;
+	/* NULL if no index was ever created */
+	std::atomic<struct Indexes *> indexes;
+	/* NULL if statistics are disabled */
+	struct Statistics *stats;
+	/* NULL if hot keys tracking was never enabled */
+	std::atomic<struct HotKeys *> hot_keys;
+	/* state of the module which created the object */
+	ModuleState *state;
+	/* NULL if the engine is not shared (see SharedEngine) */
+	struct SharedEngine *shared;
+	/* NULL if warm-up was never started */
+	struct Warmup *warmup;
+	/* NULL if recording was never started */
+	std::atomic<struct Recorder *> recorder;
+	/* calls of methods in progress (see Activity) */
+	struct Activity *activity;
+	/* interpreter which created the object, it owns the callbacks */
+	PyInterpreterState *interp;
 } PmemkvObject;
 
+/* Engines which may be safely used from many threads at once. */
+static const char *ConcurrentEngines[] = {"cmap", "vcmap", "csmap", "robinhood",
+					  "blackhole", NULL};
+
+/*
+ * Serializes access to engines which are not thread-safe. Operations which
+ * release the GIL may run in parallel with other calls, so every engine call
+ * is done while holding this lock. The GIL is released while waiting for
+ * the lock, so its owner (e.g. thread running a Python callback) can finish.
+ * The lock is recursive, as callbacks may call other operations.
+ */
+class EngineLock {
+public:
+	EngineLock(PmemkvObject *self) : mtx(self->lock)
+	{
+		if (mtx == NULL || mtx->try_lock())
+			return;
+		if (holds_gil()) {
+			Py_BEGIN_ALLOW_THREADS
+			mtx->lock();
+			Py_END_ALLOW_THREADS
+		} else {
+			mtx->lock();
+		}
+	}
+
+	~EngineLock()
+	{
+		if (mtx != NULL)
+			mtx->unlock();
+	}
+
+private:
+	std::recursive_mutex *mtx;
+};
+
+/* Number of locks assigned to keys of thread-safe engines (see KeyLock). */
+static const size_t KEY_LOCK_STRIPES = 256;
+
+/*
+ * Makes read-modify-write operations (e.g. incr) atomic with respect to
+ * other writes of the same key. Engines which are not thread-safe are
+ * already serialized by EngineLock, so it's only taken for thread-safe ones,
+ * which have no global lock - keys are assigned to one of KEY_LOCK_STRIPES
+ * locks by their hash, so operations on different keys rarely wait for each
+ * other. Like EngineLock, it releases the GIL while waiting and it's
+ * recursive (it's taken again by engine_put and engine_remove).
+ */
+class KeyLock {
+public:
+	KeyLock(PmemkvObject *self, const char *key, size_t keybytes) : mtx(NULL)
+	{
+		if (self->key_locks == NULL)
+			return;
+		/* FNV-1a */
+		uint64_t hash = 14695981039346656037ULL;
+		for (size_t i = 0; i < keybytes; i++)
+			hash = (hash ^ (unsigned char)key[i]) * 1099511628211ULL;
+		mtx = &self->key_locks[hash % KEY_LOCK_STRIPES];
+		if (mtx->try_lock())
+			return;
+		if (holds_gil()) {
+			Py_BEGIN_ALLOW_THREADS
+			mtx->lock();
+			Py_END_ALLOW_THREADS
+		} else {
+			mtx->lock();
+		}
+	}
+
+	~KeyLock()
+	{
+		if (mtx != NULL)
+			mtx->unlock();
+	}
+
+private:
+	std::recursive_mutex *mtx;
+};
+
+/*
+ * Calls of the object's methods in progress. Methods release the GIL (and
+ * free-threaded builds have none), so pmemkv_NI_Stop waits for them to finish
+ * before it closes the engine and frees locks and other state they use.
+ * Methods called while the engine is being stopped fail. Threads of the object
+ * (reaper, warm-up etc.) are not counted, they are joined by pmemkv_NI_Stop.
+ */
+struct Activity {
+	std::mutex mtx;
+	/* notified when the last call leaves and when stopping is done */
+	std::condition_variable idle;
+	size_t calls = 0;
+	std::atomic<bool> stopping{false};
+};
+
+/* Objects, which methods are called by the current thread. */
+static thread_local std::vector<PmemkvObject *> ActiveObjects;
+
+/* Enters a method call, sets an exception if the engine is being stopped. */
+class ActivityGuard {
+public:
+	ActivityGuard(PmemkvObject *self) : self(self), entered(false)
+	{
+		Activity *a = self->activity;
+		{
+			std::lock_guard<std::mutex> lock(a->mtx);
+			if (!a->stopping) {
+				a->calls++;
+				entered = true;
+			}
+		}
+		if (entered)
+			ActiveObjects.push_back(self);
+		else
+			PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+					"Engine is being stopped");
+	}
+
+	~ActivityGuard()
+	{
+		if (!entered)
+			return;
+		ActiveObjects.pop_back();
+		Activity *a = self->activity;
+		std::lock_guard<std::mutex> lock(a->mtx);
+		if (--a->calls == 0)
+			a->idle.notify_all();
+	}
+
+	PmemkvObject *self;
+	bool entered;
+};
+
 static PyMemberDef
 pmemkv_NI_members[] = {
 	{"db", T_INT, offsetof(PmemkvObject, db), 0, "Engine instance"},
@@ -182,21 +575,356 @@ pmemkv_NI_members[] = {
 static PyObject *
 Pmemkv_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
 	PmemkvObject *self = (PmemkvObject *) type->tp_alloc(type, 0);
+	if (self == NULL)
+		return NULL;
+	self->activity = new Activity();
+	self->interp = current_interpreter();
+	self->state = module_state();
+	if (self->state == NULL) {
+		PyErr_SetString(PyExc_RuntimeError,
+				"Module is not initialized in this interpreter");
+		Py_DECREF(self);
+		return NULL;
+	}
 	return (PyObject *) self;
 }
 
+// Comparators.
+static int compare_bytes(const char *key1, size_t keybytes1, const char *key2,
+			 size_t keybytes2)
+{
+	int r = memcmp(key1, key2, std::min(keybytes1, keybytes2));
+	if (r != 0)
+		return r;
+	return (keybytes1 > keybytes2) - (keybytes1 < keybytes2);
+}
+
+/*
+ * Keys are compared as unsigned 64-bit little-endian integers. Shorter keys
+ * are zero-extended, bytes above the 8th one are used only to break ties.
+ */
+static int compare_uint64_le(const char *key1, size_t keybytes1, const char *key2,
+			     size_t keybytes2, void *arg)
+{
+	uint64_t n1 = 0, n2 = 0;
+	for (size_t i = std::min(keybytes1, (size_t)8); i > 0; i--)
+		n1 = (n1 << 8) | (unsigned char)key1[i - 1];
+	for (size_t i = std::min(keybytes2, (size_t)8); i > 0; i--)
+		n2 = (n2 << 8) | (unsigned char)key2[i - 1];
+	if (n1 != n2)
+		return n1 < n2 ? -1 : 1;
+	if (keybytes1 <= 8 || keybytes2 <= 8)
+		return (keybytes1 > keybytes2) - (keybytes1 < keybytes2);
+	return compare_bytes(key1 + 8, keybytes1 - 8, key2 + 8, keybytes2 - 8);
+}
+
+static int compare_reverse_bytes(const char *key1, size_t keybytes1, const char *key2,
+				 size_t keybytes2, void *arg)
+{
+	return compare_bytes(key2, keybytes2, key1, keybytes1);
+}
+
+/*
+ * Splits decimal integer (with optional sign) into sign and significant
+ * digits. Returns false if key is not a valid decimal integer.
+ */
+static bool parse_int_string(const char *key, size_t keybytes, int *sign,
+			     const char **digits, size_t *ndigits)
+{
+	size_t i = 0;
+	*sign = 1;
+	*digits = key;
+	*ndigits = 0;
+	if (keybytes > 0 && (key[0] == '-' || key[0] == '+')) {
+		*sign = key[0] == '-' ? -1 : 1;
+		i++;
+	}
+	if (i == keybytes)
+		return false;
+	for (size_t j = i; j < keybytes; j++)
+		if (key[j] < '0' || key[j] > '9')
+			return false;
+	while (i < keybytes - 1 && key[i] == '0')
+		i++;
+	*digits = key + i;
+	*ndigits = keybytes - i;
+	if (*ndigits == 1 && **digits == '0')
+		*sign = 1;
+	return true;
+}
+
+/*
+ * Keys are compared as decimal integers of arbitrary length. Keys which are
+ * not valid integers are ordered after all numbers, in bytewise order.
+ */
+static int compare_int_string(const char *key1, size_t keybytes1, const char *key2,
+			      size_t keybytes2, void *arg)
+{
+	int sign1, sign2;
+	const char *digits1, *digits2;
+	size_t ndigits1, ndigits2;
+	bool valid1 = parse_int_string(key1, keybytes1, &sign1, &digits1, &ndigits1);
+	bool valid2 = parse_int_string(key2, keybytes2, &sign2, &digits2, &ndigits2);
+	if (!valid1 || !valid2) {
+		if (valid1 != valid2)
+			return valid1 ? -1 : 1;
+		return compare_bytes(key1, keybytes1, key2, keybytes2);
+	}
+	if (sign1 != sign2)
+		return sign1 < sign2 ? -1 : 1;
+	int r = (ndigits1 > ndigits2) - (ndigits1 < ndigits2);
+	if (r == 0)
+		r = memcmp(digits1, digits2, ndigits1);
+	if (r == 0) /* e.g. "7" and "007" - keep the order total */
+		r = compare_bytes(key1, keybytes1, key2, keybytes2);
+	return sign1 * r;
+}
+
+/*
+ * Calls Python comparator of the object passed as 'arg'. Engine can not be
+ * notified about failure, so exceptions raised by comparator are reported
+ * as unraisable.
+ */
+static int compare_python(const char *key1, size_t keybytes1, const char *key2,
+			  size_t keybytes2, void *arg)
+{
+	PmemkvObject *self = (PmemkvObject *)arg;
+	InterpreterLock lock(self->interp);
+	PyObject *type, *value, *traceback;
+	PyErr_Fetch(&type, &value, &traceback);
+	int result = 0;
+	PyObject *res = PyObject_CallFunction(self->comparator, "y#y#", key1,
+					      (Py_ssize_t)keybytes1, key2,
+					      (Py_ssize_t)keybytes2);
+	if (res != NULL) {
+		long r = PyLong_AsLong(res);
+		result = (r > 0) - (r < 0);
+		Py_DECREF(res);
+	}
+	if (PyErr_Occurred() != NULL)
+		PyErr_WriteUnraisable(self->comparator);
+	PyErr_Restore(type, value, traceback);
+	return result;
+}
+
+typedef struct {
+	const char *name;
+	int (*compare)(const char *, size_t, const char *, size_t, void *);
+} BuiltinComparator;
+
+static const BuiltinComparator BuiltinComparators[] = {
+	{"uint64_le", compare_uint64_le},
+	{"reverse_bytes", compare_reverse_bytes},
+	{"int_string", compare_int_string},
+	{NULL, NULL},
+};
+
+/*
+ * Puts comparator into config and sets it as the object's one. Built-in
+ * comparators are selected by name, otherwise python_comparator (which has
+ * to be set as the object's comparator) is used. Returns pmemkv status.
+ */
+static int put_comparator(PmemkvObject *self, pmemkv_config *config, const char *name,
+			  PyObject *python_comparator)
+{
+#ifdef PMEMKV_PY_COMPARATOR_SUPPORT
+	pmemkv_compare_function *fn = compare_python;
+	void *arg = self;
+	if (python_comparator == Py_None) {
+		fn = NULL;
+		arg = NULL;
+		for (auto c = BuiltinComparators; c->name != NULL; c++)
+			if (strcmp(c->name, name) == 0)
+				fn = c->compare;
+		if (fn == NULL) {
+			PyErr_Format(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+				     "Unknown comparator: %s", name);
+			return PMEMKV_STATUS_INVALID_ARGUMENT;
+		}
+	}
+	pmemkv_comparator *comparator = pmemkv_comparator_new(fn, name, arg);
+	if (comparator == NULL) {
+		PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_UNKNOWN_ERROR),
+				pmemkv_errormsg());
+		return PMEMKV_STATUS_UNKNOWN_ERROR;
+	}
+	int rv = pmemkv_config_put_comparator(config, comparator);
+	if (rv != PMEMKV_STATUS_OK) {
+		pmemkv_comparator_delete(comparator);
+		PyErr_SetString(pmemkv_exception(rv), pmemkv_errormsg());
+		return rv;
+	}
+	self->compare = fn;
+	return rv;
+#else
+	PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_NOT_SUPPORTED),
+			"Custom comparators require pmemkv 1.1 or later");
+	return PMEMKV_STATUS_NOT_SUPPORTED;
+#endif
+}
+
+static void stop_reaper(PmemkvObject *self);
+static void stop_defrag_scheduler(PmemkvObject *self);
+static void stop_warmup(PmemkvObject *self);
+static void close_changes(struct ChangeLog *log);
+static void delete_changes(PmemkvObject *self);
+static void delete_indexes(PmemkvObject *self);
+static struct Compression *create_compression(const char *name, Py_ssize_t min_size,
+					      int level, Py_buffer *dictionary);
+static void delete_compression(struct Compression *c);
+static int build_statistics(PmemkvObject *self);
+static void delete_statistics(PmemkvObject *self);
+static void delete_hot_keys(PmemkvObject *self);
+static void delete_recorder(PmemkvObject *self);
+
 // Turn on/off operations.
+static PyObject *pmemkv_NI_Stop(PmemkvObject *self);
+static void stop_engine(PmemkvObject *self);
+
+// Shared engines.
+
+/*
+ * Engine opened with a "shared" key, used by all objects started with the same
+ * key in the process (in any interpreter), so opening an already open pool
+ * does not have to recover it again. Objects share the engine along with its
+ * locks and statistics. Features which have to see all writes (change log,
+ * indexes, hot keys) are not supported on shared engines. The engine is
+ * closed when the last object is stopped.
+ */
+struct SharedEngine {
+	std::string key;
+	/* engine, config and options, which have to match on each start */
+	std::string options;
+	size_t refs;
+	pmemkv_db *db;
+	std::recursive_mutex *lock;
+	std::recursive_mutex *key_locks;
+	struct Statistics *stats;
+	bool custom_order;
+	int (*compare)(const char *, size_t, const char *, size_t, void *);
+	bool sorted;
+};
+
+/* Guards SharedEngines, it's never locked while holding the GIL. */
+static std::mutex SharedEnginesMutex;
+static std::unordered_map<std::string, SharedEngine *> SharedEngines;
+
+static void lock_shared_engines(std::unique_lock<std::mutex> &registry)
+{
+	Py_BEGIN_ALLOW_THREADS
+	registry.lock();
+	Py_END_ALLOW_THREADS
+}
+
+static void attach_shared(PmemkvObject *self, SharedEngine *shared)
+{
+	shared->refs++;
+	self->shared = shared;
+	self->db = shared->db;
+	self->lock = shared->lock;
+	self->key_locks = shared->key_locks;
+	self->stats = shared->stats;
+	self->custom_order = shared->custom_order;
+	self->compare = shared->compare;
+	self->sorted = shared->sorted;
+}
+
+/*
+ * Detaches the object from its shared engine. Engine, locks and statistics
+ * of the last object are left to be released by pmemkv_NI_Stop, but the engine
+ * is closed here, so it's not opened again before it's closed.
+ */
+static void release_shared(PmemkvObject *self)
+{
+	std::unique_lock<std::mutex> registry(SharedEnginesMutex, std::defer_lock);
+	lock_shared_engines(registry);
+	SharedEngine *shared = self->shared;
+	self->shared = NULL;
+	if (--shared->refs > 0) {
+		self->db = NULL;
+		self->lock = NULL;
+		self->key_locks = NULL;
+		self->stats = NULL;
+		return;
+	}
+	SharedEngines.erase(shared->key);
+	delete shared;
+	EngineLock guard(self);
+	pmemkv_close(self->db);
+	self->db = NULL;
+}
+
 static PyObject *
-pmemkv_NI_Start(PmemkvObject *self, PyObject* args) {
-	Py_buffer engine, json_config;
-	if (!PyArg_ParseTuple(args, "s*s*", &engine, &json_config)) {
+pmemkv_NI_Start(PmemkvObject *self, PyObject* args, PyObject *kwargs) {
+	static const char *kwlist[] = {"engine", "config", "comparator_name",
+				       "comparator", "expiry", "compression",
+				       "min_size", "level", "dictionary", "stats",
+				       "shared", NULL};
+	Py_buffer engine, json_config, dictionary = {NULL, NULL};
+	const char *comparator_name = NULL, *compression = NULL, *shared = NULL;
+	PyObject *python_comparator = Py_None;
+	int expiry = 0, level = 0, stats = 0;
+	Py_ssize_t min_size = 0;
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s*s*|zOpzniz*pz", (char **)kwlist,
+					 &engine, &json_config, &comparator_name,
+					 &python_comparator, &expiry, &compression,
+					 &min_size, &level, &dictionary, &stats,
+					 &shared)) {
 		return NULL;
 	}
+	std::string options;
+	std::unique_lock<std::mutex> registry(SharedEnginesMutex, std::defer_lock);
+	if (shared != NULL) {
+		if (python_comparator != Py_None) {
+			PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_NOT_SUPPORTED),
+					"Shared engine requires a built-in comparator");
+			if (dictionary.buf != NULL)
+				PyBuffer_Release(&dictionary);
+			return NULL;
+		}
+		/* everything, which affects how records are stored */
+		options.append((const char *)engine.buf).push_back('\0');
+		options.append((const char *)json_config.buf).push_back('\0');
+		options.append(comparator_name ? comparator_name : "").push_back('\0');
+		options.append(compression ? compression : "").push_back('\0');
+		options.append(std::to_string(expiry) + ' ' + std::to_string(min_size) +
+			       ' ' + std::to_string(level) + ' ' + std::to_string(stats));
+		if (dictionary.buf != NULL)
+			options.append((const char *)dictionary.buf, dictionary.len);
+	}
+	if (compression != NULL) {
+		self->compression =
+			create_compression(compression, min_size, level, &dictionary);
+		if (dictionary.buf != NULL)
+			PyBuffer_Release(&dictionary);
+		if (self->compression == NULL)
+			return NULL;
+	}
+
+	if (shared != NULL) {
+		lock_shared_engines(registry);
+		auto it = SharedEngines.find(shared);
+		if (it != SharedEngines.end()) {
+			if (it->second->options != options) {
+				PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+						"Shared engine is already started with different "
+						"engine, config or options");
+				delete_compression(self->compression);
+				self->compression = NULL;
+				return NULL;
+			}
+			attach_shared(self, it->second);
+			self->value_header = expiry || self->compression != NULL;
+			Py_RETURN_NONE;
+		}
+	}
 
 	pmemkv_config *config = pmemkv_config_new();
 	if (config == nullptr) {
 		// "Allocating a new pmemkv config failed"
-		PyErr_SetString(PmemkvException, pmemkv_errormsg());
+		PyErr_SetString(self->state->error, pmemkv_errormsg());
+		delete_compression(self->compression);
+		self->compression = NULL;
 		return NULL;
 	}
 
@@ -204,492 +932,6052 @@ pmemkv_NI_Start(PmemkvObject *self, PyObject* args) {
 	if (rv != PMEMKV_STATUS_OK) {
 		pmemkv_config_delete(config);
 		// "Creating a pmemkv config from JSON string failed"
-		PyErr_SetString(ExceptionDispatcher[rv].exception,
+		PyErr_SetString(pmemkv_exception(rv),
 				pmemkv_config_from_json_errormsg());
+		delete_compression(self->compression);
+		self->compression = NULL;
 		return NULL;
 	}
 
+	if (comparator_name != NULL) {
+		// Python comparator has to outlive the engine
+		if (python_comparator != Py_None) {
+			Py_INCREF(python_comparator);
+			self->comparator = python_comparator;
+		}
+		if (put_comparator(self, config, comparator_name, python_comparator) !=
+		    PMEMKV_STATUS_OK) {
+			pmemkv_config_delete(config);
+			Py_CLEAR(self->comparator);
+			delete_compression(self->compression);
+			self->compression = NULL;
+			return NULL;
+		}
+		self->custom_order = true;
+	}
+
 	rv = pmemkv_open((const char*) engine.buf, config, &self->db);
 	if (rv != PMEMKV_STATUS_OK) {
 		// "pmemkv_open failed"
-		PyErr_SetString(ExceptionDispatcher[rv].exception, pmemkv_errormsg());
+		PyErr_SetString(pmemkv_exception(rv), pmemkv_errormsg());
+		Py_CLEAR(self->comparator);
+		self->custom_order = false;
+		self->compare = NULL;
+		delete_compression(self->compression);
+		self->compression = NULL;
 		return NULL;
 	}
+
+	bool concurrent = false;
+	for (auto e = ConcurrentEngines; *e != NULL; e++)
+		concurrent |= strcmp(*e, (const char *)engine.buf) == 0;
+	if (!concurrent)
+		self->lock = new std::recursive_mutex();
+	else
+		self->key_locks = new std::recursive_mutex[KEY_LOCK_STRIPES];
+	/* unsorted engines do not support get_above */
+	auto stop = [](const char *, size_t, const char *, size_t, void *) { return 1; };
+	self->sorted = pmemkv_get_above(self->db, "", 0, stop, NULL) !=
+		PMEMKV_STATUS_NOT_SUPPORTED;
+	self->value_header = expiry || self->compression != NULL;
+	if (stats) {
+		Py_BEGIN_ALLOW_THREADS
+		rv = build_statistics(self);
+		Py_END_ALLOW_THREADS
+		if (rv != PMEMKV_STATUS_OK) {
+			PyErr_SetString(pmemkv_exception(rv), pmemkv_errormsg());
+			stop_engine(self);
+			return NULL;
+		}
+	}
+	if (shared != NULL) {
+		SharedEngine *entry = new SharedEngine{shared, options, 0, self->db,
+						       self->lock, self->key_locks,
+						       self->stats, self->custom_order,
+						       self->compare, self->sorted};
+		SharedEngines[shared] = entry;
+		attach_shared(self, entry);
+	}
 	Py_RETURN_NONE;
 }
 
+/* Closes the engine and releases everything, once no method is running. */
+static void stop_engine(PmemkvObject *self)
+{
+	stop_reaper(self);
+	stop_defrag_scheduler(self);
+	stop_warmup(self);
+	if (self->shared != NULL)
+		release_shared(self);
+	if (self->db != NULL) {
+		EngineLock guard(self);
+		pmemkv_close(self->db);
+		self->db = NULL;
+	}
+	delete self->lock;
+	self->lock = NULL;
+	delete[] self->key_locks;
+	self->key_locks = NULL;
+	self->custom_order = false;
+	self->compare = NULL;
+	self->sorted = false;
+	self->value_header = false;
+	delete_compression(self->compression);
+	self->compression = NULL;
+	delete_changes(self);
+	delete_indexes(self);
+	delete_statistics(self);
+	delete_hot_keys(self);
+	delete_recorder(self);
+	Py_CLEAR(self->comparator);
+}
+
+/*
+ * Waits for methods running in other threads (see Activity), new calls fail
+ * in the meantime. Concurrent stops are serialized. Stopping the engine
+ * from its own callback is not possible, as the callback's method has
+ * to finish first.
+ */
 static PyObject *
 pmemkv_NI_Stop(PmemkvObject *self) {
-	if( self->db != NULL)
-		pmemkv_close(self->db);
-	self->db = NULL;
+	if (std::find(ActiveObjects.begin(), ActiveObjects.end(), self) !=
+	    ActiveObjects.end()) {
+		PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+				"Engine can not be stopped by its own callback");
+		return NULL;
+	}
+	Activity *a = self->activity;
+	Py_BEGIN_ALLOW_THREADS
+	{
+		std::unique_lock<std::mutex> lock(a->mtx);
+		a->idle.wait(lock, [a] { return !a->stopping; });
+		a->stopping = true;
+	}
+	Py_END_ALLOW_THREADS
+	/* wakes up readers and writers waiting for each other */
+	if (self->changes != NULL)
+		close_changes(self->changes);
+	Py_BEGIN_ALLOW_THREADS
+	{
+		std::unique_lock<std::mutex> lock(a->mtx);
+		a->idle.wait(lock, [a] { return a->calls == 0; });
+	}
+	Py_END_ALLOW_THREADS
+	stop_engine(self);
+	{
+		std::lock_guard<std::mutex> lock(a->mtx);
+		a->stopping = false;
+	}
+	a->idle.notify_all();
 	Py_RETURN_NONE;
 }
 
 static void
 Pmemkv_dealloc(PmemkvObject *self) {
-    pmemkv_NI_Stop(self);
-    Py_TYPE(self)->tp_free((PyObject *) self);
+    PyTypeObject *type = Py_TYPE(self);
+    PyObject_GC_UnTrack(self);
+    Py_XDECREF(pmemkv_NI_Stop(self));
+    delete self->activity;
+    type->tp_free((PyObject *) self);
+    Py_DECREF(type);
 }
 
-void value_callback(const char *value, size_t valuebyte, void *context)
-{
-	PmemkvValueBufferObject *entry =
-		PyObject_New(PmemkvValueBufferObject, &PmemkvValueBufferType);
-	if (entry == NULL) {
+enum ChangeOp { CHANGE_PUT = 1, CHANGE_REMOVE = 2 };
 
-		PyErr_SetString(PyExc_MemoryError, memory_exception_msg);
-		return;
+static void record_change(PmemkvObject *self, int op, const char *key, size_t keybytes,
+			  const char *value, size_t valuebytes);
+static int indexed_put(PmemkvObject *self, const char *key, size_t keybytes,
+		       const char *value, size_t valuebytes);
+static int indexed_remove(PmemkvObject *self, const char *key, size_t keybytes);
+
+// Statistics.
+
+/*
+ * Value sizes are counted in buckets of powers of two: bucket 0 holds empty
+ * values, bucket i values of size within [2^(i-1), 2^i).
+ */
+static const size_t STATS_BUCKETS = 65;
+
+/*
+ * Statistics of stored records, built when the database is opened and then
+ * maintained by engine_put and engine_remove. Sizes are sizes of stored
+ * values (i.e. with header, after compression). Expired records are counted
+ * until they are removed.
+ */
+struct Statistics {
+	std::atomic<uint64_t> keys{0};
+	std::atomic<uint64_t> key_bytes{0};
+	std::atomic<uint64_t> value_bytes{0};
+	std::atomic<uint64_t> value_sizes[STATS_BUCKETS];
+
+	Statistics()
+	{
+		for (auto &b : value_sizes)
+			b.store(0, std::memory_order_relaxed);
 	}
-	entry->value = value;
-	entry->length = valuebyte;
-	PyObject *args = PyTuple_New(1);
-	if (args == NULL) {
-		Py_DECREF(entry);
-		PyErr_SetString(PyExc_MemoryError, memory_exception_msg);
-		return;
+
+	static size_t bucket(size_t size)
+	{
+		size_t b = 0;
+		for (; size != 0; size >>= 1)
+			b++;
+		return b;
 	}
-	// PyTuple_SetItem sets en exception on failure on its own
-	if (PyTuple_SetItem(args, 0, (PyObject *)entry) == 0) {
-		PyObject *res = PyObject_CallObject((PyObject *)context, args);
-		Py_XDECREF(res);
+
+	void add(size_t keybytes, size_t valuebytes)
+	{
+		keys.fetch_add(1, std::memory_order_relaxed);
+		key_bytes.fetch_add(keybytes, std::memory_order_relaxed);
+		value_bytes.fetch_add(valuebytes, std::memory_order_relaxed);
+		value_sizes[bucket(valuebytes)].fetch_add(1, std::memory_order_relaxed);
 	}
-	Py_XDECREF(args); // args is the owner of the entry reference counter
+
+	void sub(size_t keybytes, size_t valuebytes)
+	{
+		keys.fetch_sub(1, std::memory_order_relaxed);
+		key_bytes.fetch_sub(keybytes, std::memory_order_relaxed);
+		value_bytes.fetch_sub(valuebytes, std::memory_order_relaxed);
+		value_sizes[bucket(valuebytes)].fetch_sub(1, std::memory_order_relaxed);
+	}
+};
+
+static void delete_statistics(PmemkvObject *self)
+{
+	delete self->stats;
+	self->stats = NULL;
 }
 
-int key_callback(const char *key, size_t keybytes, const char *value, size_t valuebyte,
-		 void *context)
+/* Returns size of the stored value or false if there is no such key. */
+static bool stored_size(PmemkvObject *self, const char *key, size_t keybytes,
+			size_t *size)
 {
-	value_callback(key, keybytes, context);
-	if (PyErr_Occurred() != NULL)
-		return -1;
-	return 0;
+	auto callback = [](const char *, size_t vb, void *arg) { *(size_t *)arg = vb; };
+	return pmemkv_get(self->db, key, keybytes, callback, size) == PMEMKV_STATUS_OK;
 }
 
-int key_value_callback(const char *key, size_t keybytes, const char *value,
-		       size_t valuebyte, void *context)
+/*
+ * All writes done by the binding go through these functions.
+ * Caller has to hold EngineLock.
+ */
+static int engine_put(PmemkvObject *self, const char *key, size_t keybytes,
+		      const char *value, size_t valuebytes)
 {
-	PmemkvValueBufferObject *value_buffer =
-		PyObject_New(PmemkvValueBufferObject, &PmemkvValueBufferType);
-	PmemkvValueBufferObject *key_buffer =
-		PyObject_New(PmemkvValueBufferObject, &PmemkvValueBufferType);
-	if ((value_buffer == NULL) || (key_buffer == NULL)) {
-		Py_XDECREF(value_buffer);
-		Py_XDECREF(key_buffer);
-		PyErr_SetString(PyExc_MemoryError, memory_exception_msg);
-		return -1;
+	KeyLock guard(self, key, keybytes);
+	self->writes.fetch_add(1, std::memory_order_relaxed);
+	Statistics *stats = self->stats;
+	size_t old_size;
+	bool had = stats != NULL && stored_size(self, key, keybytes, &old_size);
+	int result = self->indexes != NULL
+		? indexed_put(self, key, keybytes, value, valuebytes)
+		: pmemkv_put(self->db, key, keybytes, value, valuebytes);
+	if (result == PMEMKV_STATUS_OK) {
+		if (stats != NULL) {
+			if (had)
+				stats->sub(keybytes, old_size);
+			stats->add(keybytes, valuebytes);
+		}
+		record_change(self, CHANGE_PUT, key, keybytes, value, valuebytes);
 	}
-	value_buffer->value = value;
-	value_buffer->length = valuebyte;
-	key_buffer->value = key;
-	key_buffer->length = keybytes;
+	return result;
+}
 
-	PyObject *args = PyTuple_New(2);
-	if (args == NULL) {
-		Py_DECREF(value_buffer);
-		Py_DECREF(key_buffer);
-		return -1;
+static int engine_remove(PmemkvObject *self, const char *key, size_t keybytes)
+{
+	KeyLock guard(self, key, keybytes);
+	self->writes.fetch_add(1, std::memory_order_relaxed);
+	Statistics *stats = self->stats;
+	size_t old_size;
+	bool had = stats != NULL && stored_size(self, key, keybytes, &old_size);
+	int result = self->indexes != NULL ? indexed_remove(self, key, keybytes)
+					   : pmemkv_remove(self->db, key, keybytes);
+	if (result == PMEMKV_STATUS_OK) {
+		if (had)
+			stats->sub(keybytes, old_size);
+		record_change(self, CHANGE_REMOVE, key, keybytes, NULL, 0);
 	}
-	// PyTuple_SetItem sets an exception on failure on its own
-	if ((PyTuple_SetItem(args, 0, (PyObject *)key_buffer) == 0) &&
-	    (PyTuple_SetItem(args, 1, (PyObject *)value_buffer) == 0)) {
-		PyObject *res = PyObject_CallObject((PyObject *)context, args);
+	return result;
+}
+
+// Hot keys.
+
+static uint64_t now_ms();
+
+/*
+ * Tracks the most frequently accessed keys with the Space-Saving algorithm:
+ * at most 'capacity' keys are counted and a new key replaces the one with
+ * the lowest count, inheriting it (as an error of its estimate). Only one of
+ * 'sample_rate' operations is counted, so the overhead stays small.
+ */
+struct HotKeys {
+	struct Entry {
+		uint64_t count, error, reads, writes;
+		std::multimap<uint64_t, std::string>::iterator position;
+	};
+
+	std::atomic<bool> enabled{false};
+	std::mutex mtx;
+	size_t capacity = 0;
+	uint64_t sample_rate = 1;
+	uint64_t started = 0;
+	std::unordered_map<std::string, Entry> entries;
+	/* counts of entries, the lowest is replaced */
+	std::multimap<uint64_t, std::string> counts;
+
+	void clear()
+	{
+		entries.clear();
+		counts.clear();
+		started = now_ms();
+	}
+
+	void add(const char *key, size_t keybytes, bool write)
+	{
+		std::string k(key, keybytes);
+		auto it = entries.find(k);
+		if (it == entries.end()) {
+			uint64_t lowest = 0;
+			if (entries.size() >= capacity) {
+				auto victim = counts.begin();
+				lowest = victim->first;
+				entries.erase(victim->second);
+				counts.erase(victim);
+			}
+			it = entries.emplace(k, Entry{lowest, lowest, 0, 0, counts.end()}).first;
+		} else {
+			counts.erase(it->second.position);
+		}
+		Entry &e = it->second;
+		e.count++;
+		(write ? e.writes : e.reads)++;
+		e.position = counts.emplace(e.count, std::move(k));
+	}
+};
+
+/* Returns true for one of 'rate' calls, at random. */
+static bool sampled(uint64_t rate)
+{
+	/* xorshift64*, separate for each thread */
+	static thread_local uint64_t state = 0;
+	if (rate <= 1)
+		return true;
+	if (state == 0)
+		state = std::hash<std::thread::id>()(std::this_thread::get_id()) | 1;
+	state ^= state >> 12;
+	state ^= state << 25;
+	state ^= state >> 27;
+	return (state * 0x2545F4914F6CDD1DULL) % rate == 0;
+}
+
+/* Counts access to the key, if hot keys tracking is enabled. */
+static void track_key(PmemkvObject *self, const void *key, size_t keybytes, bool write)
+{
+	HotKeys *h = self->hot_keys.load(std::memory_order_acquire);
+	if (h == NULL || !h->enabled.load(std::memory_order_relaxed) ||
+	    !sampled(h->sample_rate))
+		return;
+	std::lock_guard<std::mutex> lock(h->mtx);
+	if (h->enabled)
+		h->add((const char *)key, keybytes, write);
+}
+
+static void delete_hot_keys(PmemkvObject *self)
+{
+	delete self->hot_keys.load();
+	self->hot_keys = NULL;
+}
+
+static PyObject *
+pmemkv_NI_EnableHotKeys(PmemkvObject *self, PyObject* args) {
+	Py_ssize_t capacity, sample_rate;
+	if (!PyArg_ParseTuple(args, "nn", &capacity, &sample_rate)) {
+		return NULL;
+	}
+	if (capacity <= 0 || sample_rate <= 0) {
+		PyErr_SetString(PyExc_ValueError,
+				"Capacity and sample rate should be positive");
+		return NULL;
+	}
+	/* accesses done through other objects would not be counted */
+	if (self->shared != NULL) {
+		PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_NOT_SUPPORTED),
+				"Hot keys can not be tracked on a shared engine");
+		return NULL;
+	}
+	HotKeys *h = self->hot_keys;
+	if (h == NULL) {
+		h = new HotKeys();
+		self->hot_keys.store(h, std::memory_order_release);
+	}
+	std::lock_guard<std::mutex> lock(h->mtx);
+	if (!h->enabled || (size_t)capacity < h->entries.size() ||
+	    (uint64_t)sample_rate != h->sample_rate)
+		h->clear();
+	h->capacity = capacity;
+	h->sample_rate = sample_rate;
+	h->enabled = true;
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_DisableHotKeys(PmemkvObject *self) {
+	HotKeys *h = self->hot_keys;
+	if (h != NULL)
+		h->enabled = false;
+	Py_RETURN_NONE;
+}
+
+/*
+ * Returns (enabled, seconds since tracking started or was reset, list of up
+ * to k (key, count, error, reads, writes) tuples, the most frequent first),
+ * with counts scaled by the sample rate. Returns None if tracking was never
+ * enabled.
+ */
+static PyObject *
+pmemkv_NI_HotKeys(PmemkvObject *self, PyObject* args) {
+	Py_ssize_t k;
+	int reset;
+	if (!PyArg_ParseTuple(args, "np", &k, &reset)) {
+		return NULL;
+	}
+	HotKeys *h = self->hot_keys;
+	if (h == NULL)
+		Py_RETURN_NONE;
+	std::vector<std::pair<std::string, HotKeys::Entry>> top;
+	uint64_t rate, elapsed;
+	bool enabled;
+	{
+		std::lock_guard<std::mutex> lock(h->mtx);
+		for (auto it = h->counts.rbegin();
+		     it != h->counts.rend() && top.size() < (size_t)k; ++it)
+			top.emplace_back(it->second, h->entries[it->second]);
+		rate = h->sample_rate;
+		enabled = h->enabled;
+		elapsed = now_ms() - h->started;
+		if (reset)
+			h->clear();
+	}
+	PyObject *list = PyList_New(top.size());
+	if (list == NULL)
+		return NULL;
+	for (size_t i = 0; i < top.size(); i++) {
+		auto &e = top[i].second;
+		PyObject *item = Py_BuildValue(
+			"(y#KKKK)", top[i].first.data(), (Py_ssize_t)top[i].first.size(),
+			(unsigned long long)(e.count * rate),
+			(unsigned long long)(e.error * rate),
+			(unsigned long long)(e.reads * rate),
+			(unsigned long long)(e.writes * rate));
+		if (item == NULL) {
+			Py_DECREF(list);
+			return NULL;
+		}
+		PyList_SET_ITEM(list, i, item);
+	}
+	return Py_BuildValue("(NdN)", PyBool_FromLong(enabled), elapsed / 1000.0, list);
+}
+
+// Recording.
+
+/*
+ * Trace of operations, written by record_op to a file:
+ *   header: TRACE_MAGIC (8 bytes), flags (4 bytes), reserved (4 bytes)
+ *   records: time in microseconds since recording started (8 bytes),
+ *	operation (1 byte, TraceOp), key size (4 bytes), value size (4 bytes),
+ *	64-bit FNV-1a hash of the key (8 bytes), followed by the key, if
+ *	TRACE_FLAG_KEYS is set
+ * All numbers are little-endian. Records are buffered and written in chunks
+ * of TRACE_BUFFER bytes.
+ */
+static const char TRACE_MAGIC[8] = {'P', 'M', 'K', 'V', 'T', 'R', 'C', '1'};
+static const uint32_t TRACE_FLAG_KEYS = 0x01;
+static const size_t TRACE_BUFFER = 1 << 20;
+
+enum TraceOp { TRACE_GET = 1, TRACE_PUT = 2, TRACE_REMOVE = 3, TRACE_EXISTS = 4 };
+
+struct Recorder {
+	std::atomic<bool> enabled{false};
+	std::mutex mtx;
+	int fd = -1;
+	bool keys = false;
+	std::chrono::steady_clock::time_point started;
+	std::string buffer;
+	uint64_t records = 0;
+	/* errno of the first failed write, 0 if none failed */
+	int error = 0;
+
+	void flush()
+	{
+		size_t written = 0;
+		while (written < buffer.size() && error == 0) {
+			ssize_t n = write(fd, buffer.data() + written,
+					  buffer.size() - written);
+			if (n < 0 && errno != EINTR)
+				error = errno;
+			else if (n > 0)
+				written += n;
+		}
+		buffer.clear();
+	}
+};
+
+static void append_le(std::string &buffer, uint64_t value, size_t bytes)
+{
+	for (size_t i = 0; i < bytes; i++)
+		buffer.push_back((char)(value >> (8 * i)));
+}
+
+static uint64_t fnv1a(const char *data, size_t bytes)
+{
+	uint64_t hash = 0xcbf29ce484222325ULL;
+	for (size_t i = 0; i < bytes; i++) {
+		hash ^= (unsigned char)data[i];
+		hash *= 0x100000001b3ULL;
+	}
+	return hash;
+}
+
+/* Appends the operation to the trace, if recording is enabled. */
+static void record_op(PmemkvObject *self, TraceOp op, const void *key, size_t keybytes,
+		      size_t valuebytes)
+{
+	Recorder *r = self->recorder.load(std::memory_order_acquire);
+	if (r == NULL || !r->enabled.load(std::memory_order_relaxed))
+		return;
+	auto now = std::chrono::steady_clock::now();
+	std::lock_guard<std::mutex> lock(r->mtx);
+	if (!r->enabled)
+		return;
+	auto us = std::chrono::duration_cast<std::chrono::microseconds>(now - r->started);
+	append_le(r->buffer, std::max<int64_t>(us.count(), 0), 8);
+	r->buffer.push_back((char)op);
+	append_le(r->buffer, keybytes, 4);
+	append_le(r->buffer, std::min<size_t>(valuebytes, UINT32_MAX), 4);
+	append_le(r->buffer, fnv1a((const char *)key, keybytes), 8);
+	if (r->keys)
+		r->buffer.append((const char *)key, keybytes);
+	r->records++;
+	if (r->buffer.size() >= TRACE_BUFFER)
+		r->flush();
+}
+
+/* Flushes and closes the trace, returns errno of a failed write or 0. */
+static int close_trace(Recorder *r)
+{
+	std::lock_guard<std::mutex> lock(r->mtx);
+	if (!r->enabled)
+		return 0;
+	r->enabled = false;
+	r->flush();
+	if (close(r->fd) != 0 && r->error == 0)
+		r->error = errno;
+	r->fd = -1;
+	return r->error;
+}
+
+static void delete_recorder(PmemkvObject *self)
+{
+	Recorder *r = self->recorder.load();
+	if (r == NULL)
+		return;
+	close_trace(r);
+	delete r;
+	self->recorder = NULL;
+}
+
+static PyObject *
+pmemkv_NI_StartRecording(PmemkvObject *self, PyObject* args) {
+	PyObject *path;
+	int keys;
+	if (!PyArg_ParseTuple(args, "O&p", PyUnicode_FSConverter, &path, &keys)) {
+		return NULL;
+	}
+	Recorder *r = self->recorder;
+	if (r == NULL) {
+		r = new Recorder();
+		self->recorder.store(r, std::memory_order_release);
+	}
+	close_trace(r);
+	int fd = open(PyBytes_AS_STRING(path), O_WRONLY | O_CREAT | O_TRUNC | O_CLOEXEC,
+		      0666);
+	if (fd < 0) {
+		PyErr_SetFromErrnoWithFilenameObject(PyExc_OSError, path);
+		Py_DECREF(path);
+		return NULL;
+	}
+	Py_DECREF(path);
+	std::lock_guard<std::mutex> lock(r->mtx);
+	r->fd = fd;
+	r->keys = keys;
+	r->records = 0;
+	r->error = 0;
+	r->buffer.assign(TRACE_MAGIC, sizeof(TRACE_MAGIC));
+	append_le(r->buffer, keys ? TRACE_FLAG_KEYS : 0, 4);
+	append_le(r->buffer, 0, 4);
+	r->started = std::chrono::steady_clock::now();
+	r->enabled = true;
+	Py_RETURN_NONE;
+}
+
+/* Returns number of recorded operations, None if recording was not enabled. */
+static PyObject *
+pmemkv_NI_StopRecording(PmemkvObject *self) {
+	Recorder *r = self->recorder;
+	if (r == NULL || !r->enabled)
+		Py_RETURN_NONE;
+	uint64_t records;
+	int error;
+	Py_BEGIN_ALLOW_THREADS
+	error = close_trace(r);
+	Py_END_ALLOW_THREADS
+	records = r->records;
+	if (error != 0) {
+		errno = error;
+		return PyErr_SetFromErrno(PyExc_OSError);
+	}
+	return PyLong_FromUnsignedLongLong(records);
+}
+
+// Value header.
+
+/*
+ * If expiry or compression is enabled, values are stored with a header:
+ *   byte 0: VALUE_MAGIC
+ *   byte 1: flags
+ *   8 bytes: expiration time in milliseconds since epoch, little-endian
+ *	(only if VALUE_FLAG_EXPIRY is set)
+ *   4 bytes: size of uncompressed value, little-endian
+ *	(only if VALUE_FLAG_LZ4 or VALUE_FLAG_ZSTD is set)
+ * Values which do not start with a valid header (e.g. written before the
+ * header was enabled) are read as they are. Compressed and raw values may
+ * coexist, as small (or incompressible) values are never compressed.
+ */
+static const unsigned char VALUE_MAGIC = 0xB7;
+static const unsigned char VALUE_FLAG_EXPIRY = 0x01;
+static const unsigned char VALUE_FLAG_LZ4 = 0x02;
+static const unsigned char VALUE_FLAG_ZSTD = 0x04;
+/* compressed with zstd dictionary */
+static const unsigned char VALUE_FLAG_DICT = 0x08;
+static const unsigned char VALUE_FLAGS_KNOWN =
+	VALUE_FLAG_EXPIRY | VALUE_FLAG_LZ4 | VALUE_FLAG_ZSTD | VALUE_FLAG_DICT;
+static const size_t VALUE_HEADER_SIZE = 2;
+static const size_t VALUE_HEADER_MAX_SIZE = VALUE_HEADER_SIZE + 8 + 4;
+
+/* Value never expires. */
+static const uint64_t NO_EXPIRY = 0;
+
+struct ValueHeader {
+	unsigned char flags;
+	uint64_t expire_at;
+	uint32_t raw_size;
+	size_t size;
+};
+
+static uint64_t now_ms()
+{
+	return std::chrono::duration_cast<std::chrono::milliseconds>(
+		       std::chrono::system_clock::now().time_since_epoch())
+		.count();
+}
+
+/* CPU time used by the calling thread, in nanoseconds. */
+static uint64_t thread_cpu_ns()
+{
+	struct timespec ts;
+	clock_gettime(CLOCK_THREAD_CPUTIME_ID, &ts);
+	return (uint64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+}
+
+static uint64_t load_le64(const char *data)
+{
+	uint64_t n = 0;
+	for (int i = 7; i >= 0; i--)
+		n = (n << 8) | (unsigned char)data[i];
+	return n;
+}
+
+static uint32_t load_le32(const char *data)
+{
+	uint32_t n = 0;
+	for (int i = 3; i >= 0; i--)
+		n = (n << 8) | (unsigned char)data[i];
+	return n;
+}
+
+static void store_le64(char *data, uint64_t n)
+{
+	for (int i = 0; i < 8; i++)
+		data[i] = (char)((n >> (8 * i)) & 0xFF);
+}
+
+static void store_le32(char *data, uint32_t n)
+{
+	for (int i = 0; i < 4; i++)
+		data[i] = (char)((n >> (8 * i)) & 0xFF);
+}
+
+/* Returns false if value does not start with a valid header. */
+static bool parse_value_header(const char *value, size_t valuebytes, ValueHeader *h)
+{
+	if (valuebytes < VALUE_HEADER_SIZE || (unsigned char)value[0] != VALUE_MAGIC)
+		return false;
+	h->flags = (unsigned char)value[1];
+	h->expire_at = NO_EXPIRY;
+	h->raw_size = 0;
+	h->size = VALUE_HEADER_SIZE;
+	if ((h->flags & ~VALUE_FLAGS_KNOWN) != 0)
+		return false;
+	if ((h->flags & VALUE_FLAG_LZ4) && (h->flags & VALUE_FLAG_ZSTD))
+		return false;
+	if (h->flags & VALUE_FLAG_EXPIRY) {
+		if (valuebytes < h->size + 8)
+			return false;
+		h->expire_at = load_le64(value + h->size);
+		h->size += 8;
+	}
+	if (h->flags & (VALUE_FLAG_LZ4 | VALUE_FLAG_ZSTD)) {
+		if (valuebytes < h->size + 4)
+			return false;
+		h->raw_size = load_le32(value + h->size);
+		h->size += 4;
+	}
+	return true;
+}
+
+static bool is_expired(const ValueHeader &h, uint64_t now)
+{
+	return (h.flags & VALUE_FLAG_EXPIRY) && h.expire_at <= now;
+}
+
+// Compression.
+
+enum CompressionType { COMPRESSION_LZ4 = 1, COMPRESSION_ZSTD = 2 };
+
+/* Compressions available in this build. */
+static const char *Compressions[] = {
+#ifdef PMEMKV_PY_LZ4
+	"lz4",
+#endif
+#ifdef PMEMKV_PY_ZSTD
+	"zstd",
+#endif
+	NULL};
+
+/*
+ * Compression settings and statistics of a database. Counters are updated
+ * without the GIL, from many threads.
+ */
+struct Compression {
+	int type;
+	size_t min_size;
+	int level;
+	std::string dictionary;
+#ifdef PMEMKV_PY_ZSTD
+	ZSTD_CDict *cdict = NULL;
+	ZSTD_DDict *ddict = NULL;
+#endif
+	std::atomic<uint64_t> compressed{0};
+	std::atomic<uint64_t> stored_raw{0};
+	std::atomic<uint64_t> raw_bytes{0};
+	std::atomic<uint64_t> compressed_bytes{0};
+	std::atomic<uint64_t> compress_ns{0};
+	std::atomic<uint64_t> decompressed{0};
+	std::atomic<uint64_t> decompress_ns{0};
+
+	~Compression()
+	{
+#ifdef PMEMKV_PY_ZSTD
+		ZSTD_freeCDict(cdict);
+		ZSTD_freeDDict(ddict);
+#endif
+	}
+};
+
+#ifdef PMEMKV_PY_ZSTD
+/* zstd contexts are not thread-safe, so each thread uses its own ones. */
+struct ZstdContexts {
+	ZSTD_CCtx *cctx = ZSTD_createCCtx();
+	ZSTD_DCtx *dctx = ZSTD_createDCtx();
+
+	~ZstdContexts()
+	{
+		ZSTD_freeCCtx(cctx);
+		ZSTD_freeDCtx(dctx);
+	}
+};
+
+static thread_local ZstdContexts zstd_contexts;
+#endif
+
+static size_t compress_bound(const Compression *c, size_t size)
+{
+#ifdef PMEMKV_PY_LZ4
+	if (c->type == COMPRESSION_LZ4)
+		return LZ4_compressBound((int)size);
+#endif
+#ifdef PMEMKV_PY_ZSTD
+	if (c->type == COMPRESSION_ZSTD)
+		return ZSTD_compressBound(size);
+#endif
+	return 0;
+}
+
+/*
+ * Compresses data into dst, sets flags describing used compression.
+ * Returns size of compressed data or 0 on failure.
+ */
+static size_t compress_data(const Compression *c, const char *src, size_t size,
+			    char *dst, size_t capacity, unsigned char *flags)
+{
+#ifdef PMEMKV_PY_LZ4
+	if (c->type == COMPRESSION_LZ4) {
+		*flags |= VALUE_FLAG_LZ4;
+		int n = LZ4_compress_default(src, dst, (int)size, (int)capacity);
+		return n > 0 ? (size_t)n : 0;
+	}
+#endif
+#ifdef PMEMKV_PY_ZSTD
+	if (c->type == COMPRESSION_ZSTD) {
+		*flags |= VALUE_FLAG_ZSTD;
+		size_t n;
+		if (c->cdict != NULL) {
+			*flags |= VALUE_FLAG_DICT;
+			n = ZSTD_compress_usingCDict(zstd_contexts.cctx, dst, capacity, src,
+						     size, c->cdict);
+		} else {
+			n = ZSTD_compressCCtx(zstd_contexts.cctx, dst, capacity, src, size,
+					      c->level);
+		}
+		return ZSTD_isError(n) ? 0 : n;
+	}
+#endif
+	return 0;
+}
+
+/*
+ * Decompresses data described by the header into dst, which is already
+ * resized to h.raw_size. Returns false if data is corrupted or the value
+ * can not be decompressed by this build.
+ */
+static bool decompress_data(const Compression *c, const ValueHeader &h, const char *src,
+			    size_t size, char *dst)
+{
+#ifdef PMEMKV_PY_LZ4
+	if (h.flags & VALUE_FLAG_LZ4)
+		return LZ4_decompress_safe(src, dst, (int)size, (int)h.raw_size) ==
+			(int)h.raw_size;
+#endif
+#ifdef PMEMKV_PY_ZSTD
+	if (h.flags & VALUE_FLAG_ZSTD) {
+		size_t n;
+		if (h.flags & VALUE_FLAG_DICT) {
+			if (c == NULL || c->ddict == NULL)
+				return false;
+			n = ZSTD_decompress_usingDDict(zstd_contexts.dctx, dst, h.raw_size,
+						       src, size, c->ddict);
+		} else {
+			n = ZSTD_decompressDCtx(zstd_contexts.dctx, dst, h.raw_size, src,
+						size);
+		}
+		return !ZSTD_isError(n) && n == h.raw_size;
+	}
+#endif
+	return false;
+}
+
+/*
+ * Strips the header from the value read from the engine, decompressing it
+ * into 'buffer' if needed. If 'buffer' is NULL, only expiration time is
+ * checked and the value is not usable afterwards. Returns
+ * PMEMKV_STATUS_NOT_FOUND if the value has expired (unless 'check_expiry'
+ * is false) and PMEMKV_STATUS_UNKNOWN_ERROR if it can not be decompressed.
+ */
+static int decode_value(PmemkvObject *self, const char **value, size_t *valuebytes,
+			std::string *buffer, bool check_expiry = true)
+{
+	ValueHeader h;
+	if (!self->value_header || !parse_value_header(*value, *valuebytes, &h))
+		return PMEMKV_STATUS_OK;
+	if (check_expiry && is_expired(h, now_ms()))
+		return PMEMKV_STATUS_NOT_FOUND;
+	*value += h.size;
+	*valuebytes -= h.size;
+	if (buffer == NULL || !(h.flags & (VALUE_FLAG_LZ4 | VALUE_FLAG_ZSTD)))
+		return PMEMKV_STATUS_OK;
+
+	Compression *c = self->compression;
+	uint64_t start = c != NULL ? thread_cpu_ns() : 0;
+	buffer->resize(h.raw_size);
+	if (!decompress_data(c, h, *value, *valuebytes, &(*buffer)[0]))
+		return PMEMKV_STATUS_UNKNOWN_ERROR;
+	if (c != NULL) {
+		c->decompressed++;
+		c->decompress_ns += thread_cpu_ns() - start;
+	}
+	*value = buffer->data();
+	*valuebytes = buffer->size();
+	return PMEMKV_STATUS_OK;
+}
+
+/* Checks if value will be compressed, so it's worth to release the GIL. */
+static bool will_compress(PmemkvObject *self, size_t valuebytes)
+{
+	return self->compression != NULL && valuebytes >= self->compression->min_size;
+}
+
+static void encode_value(PmemkvObject *self, std::string &out, const char *value,
+			 size_t valuebytes, uint64_t expire_at)
+{
+	unsigned char flags = expire_at != NO_EXPIRY ? VALUE_FLAG_EXPIRY : 0;
+	size_t header_size = VALUE_HEADER_SIZE + (expire_at != NO_EXPIRY ? 8 : 0);
+	Compression *c = self->compression;
+	if (will_compress(self, valuebytes) && valuebytes <= UINT32_MAX) {
+		uint64_t start = thread_cpu_ns();
+		size_t capacity = compress_bound(c, valuebytes);
+		out.resize(header_size + 4 + capacity);
+		size_t n = compress_data(c, value, valuebytes, &out[header_size + 4],
+					 capacity, &flags);
+		c->compress_ns += thread_cpu_ns() - start;
+		if (n > 0 && n < valuebytes) {
+			out.resize(header_size + 4 + n);
+			store_le32(&out[header_size], (uint32_t)valuebytes);
+			c->compressed++;
+			c->raw_bytes += valuebytes;
+			c->compressed_bytes += n;
+		} else {
+			flags = expire_at != NO_EXPIRY ? VALUE_FLAG_EXPIRY : 0;
+			c = NULL;
+		}
+	} else {
+		c = NULL;
+	}
+	if (c == NULL) {
+		if (self->compression != NULL)
+			self->compression->stored_raw++;
+		out.resize(header_size);
+		out.append(value, valuebytes);
+	}
+	out[0] = (char)VALUE_MAGIC;
+	out[1] = (char)flags;
+	if (expire_at != NO_EXPIRY)
+		store_le64(&out[VALUE_HEADER_SIZE], expire_at);
+}
+
+static Compression *create_compression(const char *name, Py_ssize_t min_size,
+				       int level, Py_buffer *dictionary)
+{
+	Compression *c = new Compression();
+	c->min_size = min_size > 0 ? min_size : 0;
+	c->level = level;
+	if (dictionary->buf != NULL)
+		c->dictionary.assign((const char *)dictionary->buf, dictionary->len);
+#ifdef PMEMKV_PY_LZ4
+	if (strcmp(name, "lz4") == 0) {
+		c->type = COMPRESSION_LZ4;
+		if (c->dictionary.empty())
+			return c;
+		delete c;
+		PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+				"Dictionary is supported only by zstd compression");
+		return NULL;
+	}
+#endif
+#ifdef PMEMKV_PY_ZSTD
+	if (strcmp(name, "zstd") == 0) {
+		c->type = COMPRESSION_ZSTD;
+		if (c->level == 0)
+			c->level = ZSTD_CLEVEL_DEFAULT;
+		if (c->dictionary.empty())
+			return c;
+		c->cdict = ZSTD_createCDict(c->dictionary.data(), c->dictionary.size(),
+					    c->level);
+		c->ddict = ZSTD_createDDict(c->dictionary.data(), c->dictionary.size());
+		if (c->cdict != NULL && c->ddict != NULL)
+			return c;
+		delete c;
+		PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+				"Invalid zstd dictionary");
+		return NULL;
+	}
+#endif
+	delete c;
+	if (strcmp(name, "lz4") == 0 || strcmp(name, "zstd") == 0)
+		PyErr_Format(pmemkv_exception(PMEMKV_STATUS_NOT_SUPPORTED),
+			     "Binding was built without %s support", name);
+	else
+		PyErr_Format(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+			     "Unknown compression: %s", name);
+	return NULL;
+}
+
+static void delete_compression(Compression *c)
+{
+	delete c;
+}
+
+/*
+ * Writes value, adding the header if it's enabled. Caller has to hold
+ * EngineLock.
+ */
+static int store_value(PmemkvObject *self, const char *key, size_t keybytes,
+		       const char *value, size_t valuebytes, uint64_t expire_at)
+{
+	if (!self->value_header)
+		return engine_put(self, key, keybytes, value, valuebytes);
+	std::string encoded;
+	encode_value(self, encoded, value, valuebytes, expire_at);
+	return engine_put(self, key, keybytes, encoded.data(), encoded.size());
+}
+
+/*
+ * Checks if the key exists and has not expired. Returns pmemkv status.
+ * Caller has to hold EngineLock.
+ */
+static int exists_value(PmemkvObject *self, const char *key, size_t keybytes)
+{
+	if (!self->value_header)
+		return pmemkv_exists(self->db, key, keybytes);
+	struct ExistsContext {
+		PmemkvObject *self;
+		int status;
+	} cxt = {self, PMEMKV_STATUS_NOT_FOUND};
+	auto callback = [](const char *v, size_t vb, void *context) {
+		auto c = (ExistsContext *)context;
+		c->status = decode_value(c->self, &v, &vb, NULL);
+	};
+	int result = pmemkv_get(self->db, key, keybytes, callback, &cxt);
+	if (result == PMEMKV_STATUS_OK)
+		return cxt.status;
+	return result;
+}
+
+/*
+ * Context of callbacks passed to pmemkv, which call Python functions.
+ * 'status' is set if the value can not be decoded (e.g. it has expired).
+ */
+struct CallbackContext {
+	PmemkvObject *self;
+	PyObject *callback;
+	int status;
+	std::string buffer;
+};
+
+/* Sets Python exception for status returned by decode_value(). */
+static void set_decode_error(int status)
+{
+	PyErr_SetString(pmemkv_exception(status),
+			status == PMEMKV_STATUS_NOT_FOUND ? expired_msg : corrupted_msg);
+}
+
+static void call_with_buffer(PmemkvObject *self, PyObject *callback, const char *value,
+			     size_t valuebyte)
+{
+	PmemkvValueBufferObject *entry =
+		PyObject_New(PmemkvValueBufferObject, self->state->value_buffer_type);
+	if (entry == NULL) {
+
+		PyErr_SetString(PyExc_MemoryError, memory_exception_msg);
+		return;
+	}
+	entry->value = value;
+	entry->length = valuebyte;
+	PyObject *args = PyTuple_New(1);
+	if (args == NULL) {
+		Py_DECREF(entry);
+		PyErr_SetString(PyExc_MemoryError, memory_exception_msg);
+		return;
+	}
+	// PyTuple_SetItem sets en exception on failure on its own
+	if (PyTuple_SetItem(args, 0, (PyObject *)entry) == 0) {
+		PyObject *res = PyObject_CallObject(callback, args);
 		Py_XDECREF(res);
 	}
-	key_buffer->value = NULL;
-	key_buffer->length = 0;
-	value_buffer->value = NULL;
-	value_buffer->length = 0;
+	Py_XDECREF(args); // args is the owner of the entry reference counter
+}
+
+void value_callback(const char *value, size_t valuebyte, void *context)
+{
+	CallbackContext *c = (CallbackContext *)context;
+	c->status = decode_value(c->self, &value, &valuebyte, &c->buffer);
+	if (c->status != PMEMKV_STATUS_OK)
+		return;
+	call_with_buffer(c->self, c->callback, value, valuebyte);
+}
+
+int key_callback(const char *key, size_t keybytes, const char *value, size_t valuebyte,
+		 void *context)
+{
+	CallbackContext *c = (CallbackContext *)context;
+	if (decode_value(c->self, &value, &valuebyte, NULL) != PMEMKV_STATUS_OK)
+		return 0;
+	call_with_buffer(c->self, c->callback, key, keybytes);
+	if (PyErr_Occurred() != NULL)
+		return -1;
+	return 0;
+}
+
+int key_value_callback(const char *key, size_t keybytes, const char *value,
+		       size_t valuebyte, void *context)
+{
+	CallbackContext *c = (CallbackContext *)context;
+	int status = decode_value(c->self, &value, &valuebyte, &c->buffer);
+	if (status == PMEMKV_STATUS_NOT_FOUND)
+		return 0;
+	if (status != PMEMKV_STATUS_OK) {
+		set_decode_error(status);
+		return -1;
+	}
+	PmemkvValueBufferObject *value_buffer =
+		PyObject_New(PmemkvValueBufferObject, c->self->state->value_buffer_type);
+	PmemkvValueBufferObject *key_buffer =
+		PyObject_New(PmemkvValueBufferObject, c->self->state->value_buffer_type);
+	if ((value_buffer == NULL) || (key_buffer == NULL)) {
+		Py_XDECREF(value_buffer);
+		Py_XDECREF(key_buffer);
+		PyErr_SetString(PyExc_MemoryError, memory_exception_msg);
+		return -1;
+	}
+	value_buffer->value = value;
+	value_buffer->length = valuebyte;
+	key_buffer->value = key;
+	key_buffer->length = keybytes;
+
+	PyObject *args = PyTuple_New(2);
+	if (args == NULL) {
+		Py_DECREF(value_buffer);
+		Py_DECREF(key_buffer);
+		return -1;
+	}
+	// PyTuple_SetItem sets an exception on failure on its own
+	if ((PyTuple_SetItem(args, 0, (PyObject *)key_buffer) == 0) &&
+	    (PyTuple_SetItem(args, 1, (PyObject *)value_buffer) == 0)) {
+		PyObject *res = PyObject_CallObject(c->callback, args);
+		Py_XDECREF(res);
+	}
+	key_buffer->value = NULL;
+	key_buffer->length = 0;
+	value_buffer->value = NULL;
+	value_buffer->length = 0;
+
+	Py_DECREF(args); // args is the owner of the contained objects reference counters
+
+	if (PyErr_Occurred() != NULL)
+		return -1;
+	return 0;
+}
+
+// "All" Methods.
+static PyObject *
+pmemkv_NI_GetKeys(PmemkvObject *self, PyObject* args) {
+	PyObject* python_callback;
+	if (!PyArg_ParseTuple(args, "O:set_callback", &python_callback)) {
+		return NULL;
+	}
+	CallbackContext cxt = {self, python_callback, PMEMKV_STATUS_OK};
+	EngineLock guard(self);
+	int result = pmemkv_get_all(self->db, key_callback, &cxt);
+	if (PyErr_Occurred() != NULL)
+		return NULL;
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_GetKeysAbove(PmemkvObject *self, PyObject* args) {
+	Py_buffer key;
+	PyObject* python_callback;
+	if (!PyArg_ParseTuple(args, "s*O:set_callback", &key, &python_callback)) {
+		return NULL;
+	}
+	CallbackContext cxt = {self, python_callback, PMEMKV_STATUS_OK};
+	EngineLock guard(self);
+	int result = pmemkv_get_above(self->db, (const char *)key.buf, key.len,
+				      key_callback, &cxt);
+	if (PyErr_Occurred() != NULL)
+		return NULL;
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_GetKeysBelow(PmemkvObject *self, PyObject* args) {
+	Py_buffer key;
+	PyObject* python_callback;
+	if (!PyArg_ParseTuple(args, "s*O:set_callback", &key, &python_callback)) {
+		return NULL;
+	}
+	CallbackContext cxt = {self, python_callback, PMEMKV_STATUS_OK};
+	EngineLock guard(self);
+	int result = pmemkv_get_below(self->db, (const char *)key.buf, key.len,
+				      key_callback, &cxt);
+	if (PyErr_Occurred() != NULL)
+		return NULL;
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_GetKeysBetween(PmemkvObject *self, PyObject* args) {
+	Py_buffer key1, key2;
+	PyObject* python_callback;
+	if (!PyArg_ParseTuple(args, "s*s*O:set_callback", &key1, &key2, &python_callback)) {
+		return NULL;
+	}
+	CallbackContext cxt = {self, python_callback, PMEMKV_STATUS_OK};
+	EngineLock guard(self);
+	int result = pmemkv_get_between(self->db, (const char *)key1.buf, key1.len,
+					(const char *)key2.buf, key2.len, key_callback,
+					&cxt);
+	if (PyErr_Occurred() != NULL)
+		return NULL;
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	Py_RETURN_NONE;
+}
+
+// "Count" Methods.
+static PyObject *
+pmemkv_NI_CountAll(PmemkvObject *self) {
+	size_t cnt;
+	EngineLock guard(self);
+	int result = pmemkv_count_all(self->db, &cnt);
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return Py_BuildValue("i", cnt);
+}
+
+static PyObject *
+pmemkv_NI_CountAbove(PmemkvObject *self, PyObject* args) {
+	Py_buffer key;
+	if (!PyArg_ParseTuple(args, "s*", &key)) {
+		return NULL;
+	}
+	size_t cnt;
+	EngineLock guard(self);
+	int result = pmemkv_count_above(self->db, (const char*) key.buf, key.len, &cnt);
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return Py_BuildValue("i", cnt);
+}
+
+static PyObject *
+pmemkv_NI_CountBelow(PmemkvObject *self, PyObject* args) {
+	Py_buffer key;
+	if (!PyArg_ParseTuple(args, "s*", &key)) {
+		return NULL;
+	}
+	size_t cnt;
+	EngineLock guard(self);
+	int result = pmemkv_count_below(self->db, (const char*) key.buf, key.len, &cnt);
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return Py_BuildValue("i", cnt);
+}
+
+static PyObject *
+pmemkv_NI_CountBetween(PmemkvObject *self, PyObject* args) {
+	Py_buffer key1, key2;
+	if (!PyArg_ParseTuple(args, "s*s*", &key1, &key2)) {
+		return NULL;
+	}
+	size_t cnt;
+	EngineLock guard(self);
+	int result = pmemkv_count_between(self->db, (const char*) key1.buf, key1.len, (const char*) key2.buf, key2.len, &cnt);
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return Py_BuildValue("i", cnt);
+}
+
+// "Each" Methods.
+static PyObject *
+pmemkv_NI_GetAll(PmemkvObject *self, PyObject* args) {
+	PyObject* python_callback;
+	if (!PyArg_ParseTuple(args, "O:set_callback", &python_callback)) {
+		return NULL;
+	}
+	CallbackContext cxt = {self, python_callback, PMEMKV_STATUS_OK};
+	EngineLock guard(self);
+	int result = pmemkv_get_all(self->db, key_value_callback, &cxt);
+	if (PyErr_Occurred() != NULL)
+		return NULL;
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_GetAbove(PmemkvObject *self, PyObject* args) {
+	Py_buffer key;
+	PyObject* python_callback;
+	if (!PyArg_ParseTuple(args, "s*O:set_callback", &key, &python_callback)) {
+		return NULL;
+	}
+	CallbackContext cxt = {self, python_callback, PMEMKV_STATUS_OK};
+	EngineLock guard(self);
+	int result = pmemkv_get_above(self->db, (const char *)key.buf, key.len,
+				      key_value_callback, &cxt);
+	if (PyErr_Occurred() != NULL)
+		return NULL;
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_GetBelow(PmemkvObject *self, PyObject* args) {
+	Py_buffer key;
+	PyObject* python_callback;
+	if (!PyArg_ParseTuple(args, "s*O:set_callback", &key, &python_callback)) {
+		return NULL;
+	}
+	CallbackContext cxt = {self, python_callback, PMEMKV_STATUS_OK};
+	EngineLock guard(self);
+	int result = pmemkv_get_below(self->db, (const char *)key.buf, key.len,
+				      key_value_callback, &cxt);
+	if (PyErr_Occurred() != NULL)
+		return NULL;
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_GetBetween(PmemkvObject *self, PyObject* args) {
+	Py_buffer key1, key2;
+	PyObject* python_callback;
+	if (!PyArg_ParseTuple(args, "s*s*O:set_callback", &key1, &key2, &python_callback)) {
+		return NULL;
+	}
+	CallbackContext cxt = {self, python_callback, PMEMKV_STATUS_OK};
+	EngineLock guard(self);
+	int result = pmemkv_get_between(self->db, (const char *)key1.buf, key1.len,
+					(const char *)key2.buf, key2.len,
+					key_value_callback, &cxt);
+	if (PyErr_Occurred() != NULL)
+		return NULL;
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	Py_RETURN_NONE;
+}
+
+// "Exists" Method.
+static PyObject *
+pmemkv_NI_Exists(PmemkvObject *self, PyObject* args) {
+	Py_buffer key;
+	if (!PyArg_ParseTuple(args, "s*", &key)) {
+		return NULL;
+	}
+	track_key(self, key.buf, key.len, false);
+	record_op(self, TRACE_EXISTS, key.buf, key.len, 0);
+	EngineLock guard(self);
+	int result = exists_value(self, (const char*) key.buf, key.len);
+	if (result != PMEMKV_STATUS_OK && result != PMEMKV_STATUS_NOT_FOUND) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return PyBool_FromLong(result == PMEMKV_STATUS_OK);
+}
+
+// "CRUD" Operations.
+static PyObject *
+pmemkv_NI_Put(PmemkvObject *self, PyObject* args) {
+	Py_buffer key, value;
+	long long ttl = -1;
+	if (!PyArg_ParseTuple(args, "s*s*|L", &key, &value, &ttl)) {
+		return NULL;
+	}
+	track_key(self, key.buf, key.len, true);
+	record_op(self, TRACE_PUT, key.buf, key.len, value.len);
+	uint64_t expire_at = NO_EXPIRY;
+	if (ttl >= 0) {
+		if (!self->value_header) {
+			PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+					expiry_disabled_msg);
+			return NULL;
+		}
+		expire_at = now_ms() + ttl;
+	}
+	int result;
+	if (will_compress(self, value.len)) {
+		// value is compressed with the GIL released, before locking the engine
+		Py_BEGIN_ALLOW_THREADS
+		std::string encoded;
+		encode_value(self, encoded, (const char*) value.buf, value.len, expire_at);
+		{
+			EngineLock guard(self);
+			result = engine_put(self, (const char*) key.buf, key.len, encoded.data(), encoded.size());
+		}
+		Py_END_ALLOW_THREADS
+	} else {
+		EngineLock guard(self);
+		result = store_value(self, (const char*) key.buf, key.len, (const char*) value.buf, value.len, expire_at);
+	}
+	PyBuffer_Release(&key);
+	PyBuffer_Release(&value);
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	Py_RETURN_NONE;
+}
+
+static PyObject *pmemkv_NI_GetString(PmemkvObject *self, PyObject *args)
+{
+	Py_buffer key;
+	if (!PyArg_ParseTuple(args, "s*", &key)) {
+		return NULL;
+	}
+	struct GetCallbackContext {
+		PmemkvObject *self;
+		int status;
+		std::string value;
+	};
+	GetCallbackContext cxt = {self, PMEMKV_STATUS_NOT_FOUND, ""};
+	track_key(self, key.buf, key.len, false);
+
+	auto callback = [](const char* v, size_t vb, void* context) {
+		const auto c = ((GetCallbackContext*) context);
+		// compressed values are decompressed directly into c->value
+		c->status = decode_value(c->self, &v, &vb, &c->value);
+		if (c->status == PMEMKV_STATUS_OK && v != c->value.data())
+			c->value.assign(v, vb);
+	};
+	int result;
+	if (self->compression != NULL) {
+		// decompression may take a while, let other threads run
+		Py_BEGIN_ALLOW_THREADS
+		{
+			EngineLock guard(self);
+			result = pmemkv_get(self->db, (const char*) key.buf, key.len, callback, &cxt);
+		}
+		Py_END_ALLOW_THREADS
+	} else {
+		EngineLock guard(self);
+		result = pmemkv_get(self->db, (const char*) key.buf, key.len, callback, &cxt);
+	}
+	record_op(self, TRACE_GET, key.buf, key.len, cxt.value.size());
+	PyBuffer_Release(&key);
+	if (PyErr_Occurred() != NULL)
+		return NULL;
+	if (result == PMEMKV_STATUS_OK && cxt.status != PMEMKV_STATUS_OK) {
+		set_decode_error(cxt.status);
+		return NULL;
+	}
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	} else if (cxt.status == PMEMKV_STATUS_OK) {
+		return Py_BuildValue("s#", cxt.value.data(), cxt.value.size());
+	}
+	Py_RETURN_NONE;
+}
+
+static PyObject *pmemkv_NI_Get(PmemkvObject *self, PyObject *args)
+{
+	Py_buffer key;
+	PyObject *python_callback;
+	if (!PyArg_ParseTuple(args, "s*O:set_callback", &key, &python_callback)) {
+		return NULL;
+	}
+	CallbackContext cxt = {self, python_callback, PMEMKV_STATUS_OK};
+	track_key(self, key.buf, key.len, false);
+	/* size of the value is not known here */
+	record_op(self, TRACE_GET, key.buf, key.len, 0);
+	EngineLock guard(self);
+	int result = pmemkv_get(self->db, (const char *)key.buf, key.len, value_callback,
+				&cxt);
+	if (PyErr_Occurred() != NULL)
+		return NULL;
+	if (result == PMEMKV_STATUS_OK && cxt.status != PMEMKV_STATUS_OK) {
+		set_decode_error(cxt.status);
+		return NULL;
+	}
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_Remove(PmemkvObject *self, PyObject* args) {
+	Py_buffer key;
+	if (!PyArg_ParseTuple(args, "s*", &key)) {
+		return NULL;
+	}
+	track_key(self, key.buf, key.len, true);
+	record_op(self, TRACE_REMOVE, key.buf, key.len, 0);
+	EngineLock guard(self);
+	int result = engine_remove(self, (const char*) key.buf, key.len);
+	if (result != PMEMKV_STATUS_OK && result != PMEMKV_STATUS_NOT_FOUND) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return PyBool_FromLong(result == PMEMKV_STATUS_OK);
+}
+
+// "Partial value" Methods.
+static PyObject *
+pmemkv_NI_Read(PmemkvObject *self, PyObject* args) {
+	Py_buffer key;
+	Py_ssize_t offset, length;
+	if (!PyArg_ParseTuple(args, "s*nn", &key, &offset, &length)) {
+		return NULL;
+	}
+	struct ReadContext {
+		PmemkvObject *self;
+		size_t offset, length;
+		int status;
+		std::string buffer, value;
+	};
+	ReadContext cxt = {self, (size_t)offset, length < 0 ? SIZE_MAX : (size_t)length,
+			   PMEMKV_STATUS_NOT_FOUND, "", ""};
+	auto callback = [](const char *v, size_t vb, void *context) {
+		auto c = (ReadContext *)context;
+		c->status = decode_value(c->self, &v, &vb, &c->buffer);
+		// only the requested part is copied
+		if (c->status == PMEMKV_STATUS_OK && c->offset < vb)
+			c->value.assign(v + c->offset, std::min(c->length, vb - c->offset));
+	};
+	int result;
+	Py_BEGIN_ALLOW_THREADS
+	{
+		EngineLock guard(self);
+		result = pmemkv_get(self->db, (const char *)key.buf, key.len, callback, &cxt);
+	}
+	Py_END_ALLOW_THREADS
+	PyBuffer_Release(&key);
+	if (result == PMEMKV_STATUS_OK && cxt.status != PMEMKV_STATUS_OK) {
+		set_decode_error(cxt.status);
+		return NULL;
+	}
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return PyBytes_FromStringAndSize(cxt.value.data(), cxt.value.size());
+}
+
+/*
+ * Reads the value for read-modify-write operations. Decoded value is copied
+ * to 'value' and its expiration time to 'expire_at'. Expired records are
+ * reported as missing. Caller has to hold EngineLock and KeyLock of the key.
+ * Returns pmemkv status and sets 'errormsg' on failure (other than
+ * PMEMKV_STATUS_NOT_FOUND).
+ */
+static int read_for_update(PmemkvObject *self, const char *key, size_t keybytes,
+			   std::string *value, uint64_t *expire_at, const char **errormsg)
+{
+	struct UpdateContext {
+		PmemkvObject *self;
+		int status;
+		uint64_t expire_at;
+		std::string *value;
+	} cxt = {self, PMEMKV_STATUS_OK, NO_EXPIRY, value};
+	auto callback = [](const char *v, size_t vb, void *context) {
+		auto c = (UpdateContext *)context;
+		ValueHeader h;
+		if (c->self->value_header && parse_value_header(v, vb, &h))
+			c->expire_at = h.expire_at;
+		c->status = decode_value(c->self, &v, &vb, c->value);
+		if (c->status == PMEMKV_STATUS_OK && v != c->value->data())
+			c->value->assign(v, vb);
+	};
+	value->clear();
+	*expire_at = NO_EXPIRY;
+	int result = pmemkv_get(self->db, key, keybytes, callback, &cxt);
+	if (result == PMEMKV_STATUS_NOT_FOUND)
+		return result;
+	if (result != PMEMKV_STATUS_OK) {
+		*errormsg = pmemkv_errormsg();
+		return result;
+	}
+	if (cxt.status == PMEMKV_STATUS_NOT_FOUND) {
+		value->clear();
+		return cxt.status;
+	}
+	if (cxt.status != PMEMKV_STATUS_OK) {
+		*errormsg = corrupted_msg;
+		return cxt.status;
+	}
+	*expire_at = cxt.expire_at;
+	return PMEMKV_STATUS_OK;
+}
+
+/* Offset passed to modify_value() to append data. */
+static const size_t APPEND_OFFSET = SIZE_MAX;
+
+/*
+ * Overwrites part of the value starting at 'offset' with 'data', extending
+ * the value if needed. The value is decoded and written back natively,
+ * keeping its expiration time. If the key does not exist, it's created
+ * when appending, otherwise PMEMKV_STATUS_NOT_FOUND is returned. Caller has
+ * to hold EngineLock. Returns pmemkv status and sets 'errormsg' on failure.
+ */
+static int modify_value(PmemkvObject *self, const char *key, size_t keybytes,
+			size_t offset, const char *data, size_t size, size_t *newsize,
+			const char **errormsg)
+{
+	KeyLock guard(self, key, keybytes);
+	std::string value;
+	uint64_t expire_at;
+	int result = read_for_update(self, key, keybytes, &value, &expire_at, errormsg);
+	if (result == PMEMKV_STATUS_NOT_FOUND && offset != APPEND_OFFSET) {
+		*errormsg = "Key not found";
+		return result;
+	}
+	if (result != PMEMKV_STATUS_OK && result != PMEMKV_STATUS_NOT_FOUND)
+		return result;
+
+	if (offset == APPEND_OFFSET)
+		offset = value.size();
+	if (offset > value.size()) {
+		*errormsg = "Offset is beyond the end of the value";
+		return PMEMKV_STATUS_INVALID_ARGUMENT;
+	}
+	if (offset + size > value.size())
+		value.resize(offset + size);
+	memcpy(&value[offset], data, size);
+	*newsize = value.size();
+	result = store_value(self, key, keybytes, value.data(), value.size(), expire_at);
+	if (result != PMEMKV_STATUS_OK)
+		*errormsg = pmemkv_errormsg();
+	return result;
+}
+
+static PyObject *
+pmemkv_NI_WriteRange(PmemkvObject *self, PyObject* args) {
+	Py_buffer key, data;
+	Py_ssize_t offset;
+	if (!PyArg_ParseTuple(args, "s*ns*", &key, &offset, &data)) {
+		return NULL;
+	}
+	size_t newsize = 0;
+	const char *errormsg = NULL;
+	int result;
+	Py_BEGIN_ALLOW_THREADS
+	{
+		EngineLock guard(self);
+		result = modify_value(self, (const char *)key.buf, key.len,
+				      offset < 0 ? APPEND_OFFSET : (size_t)offset,
+				      (const char *)data.buf, data.len, &newsize, &errormsg);
+	}
+	Py_END_ALLOW_THREADS
+	PyBuffer_Release(&key);
+	PyBuffer_Release(&data);
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), errormsg);
+		return NULL;
+	}
+	return PyLong_FromSize_t(newsize);
+}
+
+// "Read-modify-write" Methods.
+static PyObject *
+pmemkv_NI_Incr(PmemkvObject *self, PyObject* args) {
+	Py_buffer key;
+	long long delta, initial;
+	if (!PyArg_ParseTuple(args, "s*LL", &key, &delta, &initial)) {
+		return NULL;
+	}
+	const char *k = (const char *)key.buf;
+	std::string value;
+	uint64_t expire_at;
+	const char *errormsg = NULL;
+	int64_t n = 0;
+	int result;
+	Py_BEGIN_ALLOW_THREADS
+	{
+		EngineLock guard(self);
+		KeyLock key_guard(self, k, key.len);
+		result = read_for_update(self, k, key.len, &value, &expire_at, &errormsg);
+		if (result == PMEMKV_STATUS_NOT_FOUND) {
+			n = initial;
+			result = PMEMKV_STATUS_OK;
+		} else if (result == PMEMKV_STATUS_OK && value.size() != 8) {
+			errormsg = "Value is not a 64-bit integer";
+			result = PMEMKV_STATUS_INVALID_ARGUMENT;
+		} else if (result == PMEMKV_STATUS_OK) {
+			n = (int64_t)load_le64(value.data());
+		}
+		if (result == PMEMKV_STATUS_OK && __builtin_add_overflow(n, delta, &n)) {
+			errormsg = "Integer overflow";
+			result = PMEMKV_STATUS_INVALID_ARGUMENT;
+		}
+		if (result == PMEMKV_STATUS_OK) {
+			char data[8];
+			store_le64(data, (uint64_t)n);
+			result = store_value(self, k, key.len, data, sizeof(data), expire_at);
+			if (result != PMEMKV_STATUS_OK)
+				errormsg = pmemkv_errormsg();
+		}
+	}
+	Py_END_ALLOW_THREADS
+	PyBuffer_Release(&key);
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), errormsg);
+		return NULL;
+	}
+	return PyLong_FromLongLong(n);
+}
+
+static PyObject *
+pmemkv_NI_Cas(PmemkvObject *self, PyObject* args) {
+	Py_buffer key, expected = {NULL, NULL}, new_value = {NULL, NULL};
+	long long ttl = -1;
+	if (!PyArg_ParseTuple(args, "s*z*z*|L", &key, &expected, &new_value, &ttl)) {
+		return NULL;
+	}
+	const char *k = (const char *)key.buf;
+	std::string value;
+	uint64_t expire_at;
+	const char *errormsg = NULL;
+	bool swapped = false;
+	int result = PMEMKV_STATUS_OK;
+	if (ttl >= 0 && !self->value_header) {
+		errormsg = expiry_disabled_msg;
+		result = PMEMKV_STATUS_INVALID_ARGUMENT;
+	}
+	if (result == PMEMKV_STATUS_OK) {
+		Py_BEGIN_ALLOW_THREADS
+		{
+			EngineLock guard(self);
+			KeyLock key_guard(self, k, key.len);
+			result = read_for_update(self, k, key.len, &value, &expire_at, &errormsg);
+			bool found = result == PMEMKV_STATUS_OK;
+			if (result == PMEMKV_STATUS_OK || result == PMEMKV_STATUS_NOT_FOUND) {
+				swapped = expected.buf == NULL
+					? !found
+					: found && value.size() == (size_t)expected.len &&
+						memcmp(value.data(), expected.buf, expected.len) == 0;
+				result = PMEMKV_STATUS_OK;
+			}
+			if (swapped && new_value.buf != NULL) {
+				result = store_value(self, k, key.len, (const char *)new_value.buf,
+						     new_value.len,
+						     ttl >= 0 ? now_ms() + ttl : NO_EXPIRY);
+			} else if (swapped && found) {
+				result = engine_remove(self, k, key.len);
+			}
+			if (result != PMEMKV_STATUS_OK && errormsg == NULL)
+				errormsg = pmemkv_errormsg();
+		}
+		Py_END_ALLOW_THREADS
+	}
+	PyBuffer_Release(&key);
+	if (expected.buf != NULL)
+		PyBuffer_Release(&expected);
+	if (new_value.buf != NULL)
+		PyBuffer_Release(&new_value);
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), errormsg);
+		return NULL;
+	}
+	return PyBool_FromLong(swapped);
+}
+
+/*
+ * Calls Python function with the current value (or None) and writes
+ * the result back, holding KeyLock (or EngineLock, for engines which are not
+ * thread-safe) meanwhile. Returns the result or NULL if an exception is set.
+ */
+static PyObject *update_value(PmemkvObject *self, const char *key, size_t keybytes,
+			      PyObject *function)
+{
+	EngineLock guard(self);
+	KeyLock key_guard(self, key, keybytes);
+	std::string value;
+	uint64_t expire_at;
+	const char *errormsg = NULL;
+	int result = read_for_update(self, key, keybytes, &value, &expire_at, &errormsg);
+	if (result != PMEMKV_STATUS_OK && result != PMEMKV_STATUS_NOT_FOUND) {
+		PyErr_SetString(pmemkv_exception(result), errormsg);
+		return NULL;
+	}
+	bool found = result == PMEMKV_STATUS_OK;
+	PyObject *old_value = found ? PyBytes_FromStringAndSize(value.data(), value.size())
+				    : (Py_INCREF(Py_None), Py_None);
+	if (old_value == NULL)
+		return NULL;
+	PyObject *new_value = PyObject_CallFunctionObjArgs(function, old_value, NULL);
+	Py_DECREF(old_value);
+	if (new_value == NULL)
+		return NULL;
+
+	if (new_value == Py_None) {
+		result = found ? engine_remove(self, key, keybytes) : PMEMKV_STATUS_OK;
+	} else if (PyUnicode_Check(new_value)) {
+		Py_ssize_t size;
+		const char *data = PyUnicode_AsUTF8AndSize(new_value, &size);
+		if (data == NULL) {
+			Py_DECREF(new_value);
+			return NULL;
+		}
+		result = store_value(self, key, keybytes, data, size, expire_at);
+	} else {
+		Py_buffer buffer;
+		if (PyObject_GetBuffer(new_value, &buffer, PyBUF_SIMPLE) < 0) {
+			Py_DECREF(new_value);
+			return NULL;
+		}
+		result = store_value(self, key, keybytes, (const char *)buffer.buf,
+				     buffer.len, expire_at);
+		PyBuffer_Release(&buffer);
+	}
+	if (result != PMEMKV_STATUS_OK) {
+		Py_DECREF(new_value);
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return new_value;
+}
+
+static PyObject *
+pmemkv_NI_Update(PmemkvObject *self, PyObject* args) {
+	Py_buffer key;
+	PyObject *function;
+	if (!PyArg_ParseTuple(args, "s*O", &key, &function)) {
+		return NULL;
+	}
+	PyObject *result = update_value(self, (const char *)key.buf, key.len, function);
+	PyBuffer_Release(&key);
+	return result;
+}
+
+// Range operations, done natively with the GIL released.
+
+/*
+ * Range of keys. Lower bound may be inclusive. Keys are ordered bytewise,
+ * unless the engine uses custom comparator (then 'bytewise' is false and
+ * bounds are passed to the engine as they are).
+ */
+struct KeyRange {
+	std::string lo, hi;
+	bool has_lo = false, has_hi = false, lo_inclusive = false;
+	bool bytewise = true;
+
+	bool empty() const
+	{
+		return bytewise && has_lo && has_hi &&
+			compare_bytes(lo.data(), lo.size(), hi.data(), hi.size()) >= 0;
+	}
+
+	bool contains(const char *key, size_t keybytes) const
+	{
+		if (has_lo) {
+			int r = compare_bytes(key, keybytes, lo.data(), lo.size());
+			if (r < 0 || (r == 0 && !lo_inclusive))
+				return false;
+		}
+		return !has_hi || compare_bytes(key, keybytes, hi.data(), hi.size()) < 0;
+	}
+};
+
+/*
+ * Compares keys in order of the engine. Caller does not need to hold the GIL.
+ */
+static int compare_key(PmemkvObject *self, const char *key1, size_t keybytes1,
+		       const char *key2, size_t keybytes2)
+{
+	if (self->compare == NULL)
+		return compare_bytes(key1, keybytes1, key2, keybytes2);
+	return self->compare(key1, keybytes1, key2, keybytes2, self);
+}
+
+/*
+ * Checks if the range is empty. Bounds of ranges which are not bytewise are
+ * compared by the engine's comparator.
+ */
+static bool range_empty(PmemkvObject *self, const KeyRange &range)
+{
+	if (range.bytewise)
+		return range.empty();
+	return range.has_lo && range.has_hi &&
+		compare_key(self, range.lo.data(), range.lo.size(), range.hi.data(),
+			    range.hi.size()) >= 0;
+}
+
+/*
+ * Computes the lowest key greater than all keys starting with prefix.
+ * Returns false if there is no such key (prefix is empty or consists
+ * of 0xFF bytes only).
+ */
+static bool prefix_successor(std::string prefix, std::string *successor)
+{
+	while (!prefix.empty() && (unsigned char)prefix.back() == 0xFF)
+		prefix.pop_back();
+	if (prefix.empty())
+		return false;
+	prefix.back() = (char)((unsigned char)prefix.back() + 1);
+	*successor = std::move(prefix);
+	return true;
+}
+
+static KeyRange prefix_range(const char *prefix, size_t prefixbytes)
+{
+	KeyRange range;
+	range.lo.assign(prefix, prefixbytes);
+	range.has_lo = true;
+	range.lo_inclusive = true;
+	range.has_hi = prefix_successor(range.lo, &range.hi);
+	return range;
+}
+
+/*
+ * Receives records found by scan_range(). Records are passed in key order,
+ * unless engine is unsorted - then 'ordered' is set to false before the
+ * first record.
+ */
+struct RangeVisitor {
+	bool ordered = true;
+	virtual ~RangeVisitor() = default;
+	/* returns false to stop the scan */
+	virtual bool visit(const char *key, size_t keybytes, const char *value,
+			   size_t valuebytes) = 0;
+};
+
+struct ScanContext {
+	const KeyRange *range;
+	RangeVisitor *visitor;
+	bool filter;
+	std::string skip; /* key already visited, if filter is set */
+	bool has_skip;
+	bool stopped;
+};
+
+static int scan_callback(const char *key, size_t keybytes, const char *value,
+			 size_t valuebytes, void *arg)
+{
+	ScanContext *c = (ScanContext *)arg;
+	if (c->filter) {
+		if (!c->range->contains(key, keybytes))
+			return 0;
+		if (c->has_skip &&
+		    compare_bytes(key, keybytes, c->skip.data(), c->skip.size()) == 0)
+			return 0;
+	}
+	if (!c->visitor->visit(key, keybytes, value, valuebytes)) {
+		c->stopped = true;
+		return 1;
+	}
+	return 0;
+}
+
+/*
+ * Visits all records within the range. Engines which do not support range
+ * queries are scanned with pmemkv_get_all and filtered. Caller has to hold
+ * EngineLock and it does not need to hold the GIL. Returns pmemkv status.
+ */
+static int scan_range(PmemkvObject *self, const KeyRange &range, RangeVisitor &visitor)
+{
+	pmemkv_db *db = self->db;
+	ScanContext c = {&range, &visitor, false, "", false, false};
+	int result = PMEMKV_STATUS_OK;
+	if (range_empty(self, range))
+		return result;
+	/*
+	 * Range queries exclude lo, so it's read first. Unsorted engines are
+	 * scanned with get_all, which visits lo along with other records
+	 * (in any order), so it must not be visited twice.
+	 */
+	if (range.has_lo && range.lo_inclusive && self->sorted) {
+		struct ExactContext {
+			ScanContext *c;
+			const std::string *key;
+		} exact = {&c, &range.lo};
+		auto callback = [](const char *v, size_t vb, void *arg) {
+			auto e = (ExactContext *)arg;
+			e->c->has_skip = true;
+			e->c->skip = *e->key;
+			e->c->stopped = !e->c->visitor->visit(e->key->data(),
+							      e->key->size(), v, vb);
+		};
+		result = pmemkv_get(db, range.lo.data(), range.lo.size(), callback,
+				    &exact);
+		if (result != PMEMKV_STATUS_OK && result != PMEMKV_STATUS_NOT_FOUND)
+			return result;
+		if (c.stopped)
+			return PMEMKV_STATUS_OK;
+	}
+
+	if (range.has_lo && range.has_hi)
+		result = pmemkv_get_between(db, range.lo.data(), range.lo.size(),
+					    range.hi.data(), range.hi.size(),
+					    scan_callback, &c);
+	else if (range.has_lo)
+		result = pmemkv_get_above(db, range.lo.data(), range.lo.size(),
+					  scan_callback, &c);
+	else if (range.has_hi)
+		result = pmemkv_get_below(db, range.hi.data(), range.hi.size(),
+					  scan_callback, &c);
+	else {
+		/* get_all of unsorted engines returns records in any order */
+		visitor.ordered = self->sorted;
+		result = pmemkv_get_all(db, scan_callback, &c);
+	}
+
+	if (result == PMEMKV_STATUS_NOT_SUPPORTED) {
+		c.filter = true;
+		visitor.ordered = false;
+		result = pmemkv_get_all(db, scan_callback, &c);
+	}
+	if (result == PMEMKV_STATUS_STOPPED_BY_CB && c.stopped)
+		result = PMEMKV_STATUS_OK;
+	return result;
+}
+
+/*
+ * Skips expired records and strips value headers, before passing records
+ * to the next visitor.
+ */
+struct DecodingVisitor : RangeVisitor {
+	PmemkvObject *self;
+	RangeVisitor &next;
+
+	DecodingVisitor(PmemkvObject *self, RangeVisitor &next) : self(self), next(next)
+	{
+	}
+
+	int status = PMEMKV_STATUS_OK;
+	std::string buffer;
+
+	bool visit(const char *key, size_t keybytes, const char *value,
+		   size_t valuebytes) override
+	{
+		next.ordered = ordered;
+		int s = decode_value(self, &value, &valuebytes, &buffer);
+		if (s == PMEMKV_STATUS_NOT_FOUND)
+			return true;
+		if (s != PMEMKV_STATUS_OK) {
+			status = s;
+			return false;
+		}
+		return next.visit(key, keybytes, value, valuebytes);
+	}
+};
+
+struct CountingVisitor : RangeVisitor {
+	size_t count = 0;
+	bool visit(const char *, size_t, const char *, size_t) override
+	{
+		count++;
+		return true;
+	}
+};
+
+/*
+ * Counts records within the range, using pmemkv count functions if the
+ * engine supports them. Caller has to hold EngineLock.
+ */
+static int count_range(PmemkvObject *self, const KeyRange &range, size_t *cnt)
+{
+	pmemkv_db *db = self->db;
+	size_t exact = 0;
+	int result = PMEMKV_STATUS_OK;
+	*cnt = 0;
+	if (range_empty(self, range))
+		return result;
+	if (range.has_lo && range.lo_inclusive) {
+		result = pmemkv_exists(db, range.lo.data(), range.lo.size());
+		if (result != PMEMKV_STATUS_OK && result != PMEMKV_STATUS_NOT_FOUND)
+			return result;
+		exact = result == PMEMKV_STATUS_OK ? 1 : 0;
+	}
+	if (range.has_lo && range.has_hi)
+		result = pmemkv_count_between(db, range.lo.data(), range.lo.size(),
+					      range.hi.data(), range.hi.size(), cnt);
+	else if (range.has_lo)
+		result = pmemkv_count_above(db, range.lo.data(), range.lo.size(), cnt);
+	else if (range.has_hi)
+		result = pmemkv_count_below(db, range.hi.data(), range.hi.size(), cnt);
+	else
+		result = pmemkv_count_all(db, cnt);
+
+	if (result == PMEMKV_STATUS_NOT_SUPPORTED) {
+		CountingVisitor visitor;
+		result = scan_range(self, range, visitor);
+		*cnt = visitor.count;
+		return result;
+	}
+	*cnt += exact;
+	return result;
+}
+
+/*
+ * Copies up to 'limit' records. For unsorted engines the lowest keys
+ * are kept, so results may be paginated the same way as for sorted ones.
+ */
+struct RecordCollector : RangeVisitor {
+	size_t limit;
+	bool keys_only;
+	std::vector<std::pair<std::string, std::string>> records;
+	std::map<std::string, std::string> lowest;
+
+	RecordCollector(size_t limit, bool keys_only)
+	    : limit(limit), keys_only(keys_only)
+	{
+	}
+
+	bool visit(const char *key, size_t keybytes, const char *value,
+		   size_t valuebytes) override
+	{
+		if (ordered) {
+			records.emplace_back(std::string(key, keybytes),
+					     keys_only ? std::string()
+						       : std::string(value, valuebytes));
+			return records.size() < limit;
+		}
+		if (lowest.size() == limit &&
+		    compare_bytes(key, keybytes, lowest.rbegin()->first.data(),
+				  lowest.rbegin()->first.size()) >= 0)
+			return true;
+		lowest.emplace(std::string(key, keybytes),
+			       keys_only ? std::string() : std::string(value, valuebytes));
+		if (lowest.size() > limit)
+			lowest.erase(std::prev(lowest.end()));
+		return true;
+	}
+
+	void finish()
+	{
+		for (auto &r : lowest)
+			records.emplace_back(r.first, std::move(r.second));
+		lowest.clear();
+	}
+};
+
+struct KeyCollector : RangeVisitor {
+	size_t limit;
+	std::vector<std::string> keys;
+
+	KeyCollector(size_t limit) : limit(limit)
+	{
+	}
+
+	bool visit(const char *key, size_t keybytes, const char *, size_t) override
+	{
+		keys.emplace_back(key, keybytes);
+		return keys.size() < limit;
+	}
+};
+
+/* Number of keys removed at once by remove_range(). */
+static const size_t REMOVE_BATCH_SIZE = 1024;
+
+/*
+ * Removes all records within the range, in batches. The EngineLock is
+ * acquired for each batch separately, so other threads are not stalled.
+ * It's called with the GIL released. Returns pmemkv status.
+ */
+static int remove_range(PmemkvObject *self, KeyRange range, size_t *removed)
+{
+	*removed = 0;
+	while (true) {
+		KeyCollector collector(REMOVE_BATCH_SIZE);
+		EngineLock guard(self);
+		int result = scan_range(self, range, collector);
+		if (result != PMEMKV_STATUS_OK)
+			return result;
+		for (auto &key : collector.keys) {
+			result = engine_remove(self, key.data(), key.size());
+			if (result == PMEMKV_STATUS_OK)
+				(*removed)++;
+			else if (result != PMEMKV_STATUS_NOT_FOUND)
+				return result;
+		}
+		if (collector.keys.size() < REMOVE_BATCH_SIZE)
+			return PMEMKV_STATUS_OK;
+		/* unsorted engines are scanned from the beginning again */
+		if (collector.ordered) {
+			range.lo = collector.keys.back();
+			range.has_lo = true;
+			range.lo_inclusive = false;
+		}
+	}
+}
+
+// Expired records reaper.
+
+/*
+ * Background thread, which removes expired records. Each step scans up to
+ * batch_size records (or, for unsorted engines, until batch_size expired
+ * records are found) holding EngineLock, then removes them one by one.
+ * After a full pass over the database it sleeps for 'interval'.
+ */
+struct Reaper {
+	std::thread thread;
+	std::mutex mtx;
+	std::condition_variable cv;
+	bool stop = false;
+	std::chrono::milliseconds interval;
+	size_t batch_size;
+	/* maximum number of removals per second, 0 if unlimited */
+	double max_rate;
+	std::atomic<uint64_t> removed{0};
+	std::atomic<uint64_t> passes{0};
+};
+
+struct ExpiredCollector : RangeVisitor {
+	size_t limit;
+	uint64_t now;
+	size_t visited = 0;
+	std::string last;
+	std::vector<std::string> expired;
+
+	ExpiredCollector(size_t limit, uint64_t now) : limit(limit), now(now)
+	{
+	}
+
+	bool visit(const char *key, size_t keybytes, const char *value,
+		   size_t valuebytes) override
+	{
+		ValueHeader h;
+		visited++;
+		if (parse_value_header(value, valuebytes, &h) && is_expired(h, now))
+			expired.emplace_back(key, keybytes);
+		if (!ordered)
+			return expired.size() < limit;
+		last.assign(key, keybytes);
+		return visited < limit;
+	}
+};
+
+/*
+ * Removes the key if it's still expired - it might have been overwritten
+ * since it was found.
+ */
+static bool remove_expired(PmemkvObject *self, const std::string &key)
+{
+	EngineLock guard(self);
+	int result = exists_value(self, key.data(), key.size());
+	if (result != PMEMKV_STATUS_NOT_FOUND)
+		return false;
+	return engine_remove(self, key.data(), key.size()) == PMEMKV_STATUS_OK;
+}
+
+static void reaper_loop(PmemkvObject *self, Reaper *r)
+{
+	KeyRange range;
+	while (true) {
+		ExpiredCollector collector(r->batch_size, now_ms());
+		int result;
+		{
+			EngineLock guard(self);
+			result = scan_range(self, range, collector);
+		}
+
+		size_t removed = 0;
+		auto start = std::chrono::steady_clock::now();
+		for (auto &key : collector.expired) {
+			removed += remove_expired(self, key) ? 1 : 0;
+			if (r->max_rate <= 0)
+				continue;
+			auto due = start +
+				std::chrono::duration<double>(removed / r->max_rate);
+			std::unique_lock<std::mutex> lock(r->mtx);
+			if (r->cv.wait_until(lock, due, [r] { return r->stop; }))
+				break;
+		}
+		r->removed += removed;
+
+		bool pass_done = result != PMEMKV_STATUS_OK;
+		if (collector.ordered) {
+			pass_done |= collector.visited < r->batch_size;
+			range.lo = collector.last;
+			range.has_lo = true;
+		} else {
+			pass_done |= collector.expired.size() < r->batch_size;
+		}
+		std::unique_lock<std::mutex> lock(r->mtx);
+		if (pass_done) {
+			r->passes++;
+			range = KeyRange();
+			r->cv.wait_for(lock, r->interval, [r] { return r->stop; });
+		}
+		if (r->stop)
+			return;
+	}
+}
+
+static void stop_reaper(PmemkvObject *self)
+{
+	Reaper *r = self->reaper;
+	if (r == NULL)
+		return;
+	{
+		std::lock_guard<std::mutex> lock(r->mtx);
+		r->stop = true;
+	}
+	r->cv.notify_all();
+	Py_BEGIN_ALLOW_THREADS
+	r->thread.join();
+	Py_END_ALLOW_THREADS
+	self->reaper = NULL;
+	delete r;
+}
+
+static PyObject *
+pmemkv_NI_StartReaper(PmemkvObject *self, PyObject* args) {
+	double interval, max_rate;
+	Py_ssize_t batch_size;
+	if (!PyArg_ParseTuple(args, "dnd", &interval, &batch_size, &max_rate)) {
+		return NULL;
+	}
+	if (!self->value_header || self->db == NULL) {
+		PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+				expiry_disabled_msg);
+		return NULL;
+	}
+	if (interval < 0 || batch_size <= 0 || max_rate < 0) {
+		PyErr_SetString(PyExc_ValueError, "Reaper parameters should be positive");
+		return NULL;
+	}
+	stop_reaper(self);
+	Reaper *r = new Reaper();
+	r->interval = std::chrono::milliseconds((long long)(interval * 1000));
+	r->batch_size = batch_size;
+	r->max_rate = max_rate;
+	r->thread = std::thread(reaper_loop, self, r);
+	self->reaper = r;
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_StopReaper(PmemkvObject *self) {
+	stop_reaper(self);
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_ReaperStats(PmemkvObject *self) {
+	if (self->reaper == NULL)
+		Py_RETURN_NONE;
+	return Py_BuildValue("{s:K,s:K}", "removed",
+			     (unsigned long long)self->reaper->removed.load(), "passes",
+			     (unsigned long long)self->reaper->passes.load());
+}
+
+// Defragmentation.
+static PyObject *
+pmemkv_NI_Defrag(PmemkvObject *self, PyObject* args) {
+	double start_percent, amount_percent;
+	if (!PyArg_ParseTuple(args, "dd", &start_percent, &amount_percent)) {
+		return NULL;
+	}
+	int result;
+	Py_BEGIN_ALLOW_THREADS
+	{
+		EngineLock guard(self);
+		result = pmemkv_defrag(self->db, start_percent, amount_percent);
+	}
+	Py_END_ALLOW_THREADS
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	Py_RETURN_NONE;
+}
+
+/*
+ * Background thread, which defragments the pool in slices of at most
+ * slice_percent. Slices are deferred while the write rate (measured since
+ * the previous slice) exceeds max_write_rate. Slice size is halved when
+ * a slice takes longer than max_latency (engine may be locked for that
+ * long) and grown back when it's fast. After each slice the thread sleeps,
+ * so it uses at most cpu_budget of a CPU. After a full pass over the pool
+ * it sleeps for 'interval'.
+ */
+struct DefragScheduler {
+	std::thread thread;
+	std::mutex mtx;
+	std::condition_variable cv;
+	bool stop = false;
+	std::chrono::milliseconds interval;
+	double slice_percent;
+	double cpu_budget;
+	std::chrono::duration<double> max_latency;
+	/* maximum writes per second, 0 if slices are never deferred */
+	double max_write_rate;
+	std::atomic<uint64_t> slices{0};
+	std::atomic<uint64_t> passes{0};
+	std::atomic<uint64_t> deferred{0};
+	std::atomic<uint64_t> errors{0};
+	std::atomic<uint64_t> time_ns{0};
+	std::atomic<uint64_t> cpu_ns{0};
+	std::atomic<double> current_slice{0};
+	/* status of the last failed slice, PMEMKV_STATUS_OK if none failed */
+	std::atomic<int> last_error{PMEMKV_STATUS_OK};
+};
+
+static const double MIN_DEFRAG_SLICE = 0.01;
+
+static void defrag_loop(PmemkvObject *self, DefragScheduler *d)
+{
+	double start_percent = 0, amount = d->slice_percent;
+	uint64_t writes = self->writes.load();
+	auto checked = std::chrono::steady_clock::now();
+	std::chrono::duration<double> pause(0);
+	while (true) {
+		{
+			std::unique_lock<std::mutex> lock(d->mtx);
+			if (d->cv.wait_for(lock, pause, [d] { return d->stop; }))
+				return;
+		}
+		auto now = std::chrono::steady_clock::now();
+		std::chrono::duration<double> elapsed = now - checked;
+		uint64_t current_writes = self->writes.load();
+		double write_rate = elapsed.count() > 0
+			? (current_writes - writes) / elapsed.count()
+			: 0;
+		writes = current_writes;
+		checked = now;
+		if (d->max_write_rate > 0 && write_rate > d->max_write_rate) {
+			d->deferred++;
+			pause = std::max(d->max_latency * 10,
+					 std::chrono::duration<double>(0.1));
+			continue;
+		}
+
+		double slice = std::min(amount, 100 - start_percent);
+		uint64_t cpu_start = thread_cpu_ns();
+		int result;
+		{
+			EngineLock guard(self);
+			result = pmemkv_defrag(self->db, start_percent, slice);
+		}
+		std::chrono::duration<double> took =
+			std::chrono::steady_clock::now() - now;
+		uint64_t cpu = thread_cpu_ns() - cpu_start;
+		d->slices++;
+		d->time_ns += (uint64_t)(took.count() * 1e9);
+		d->cpu_ns += cpu;
+		if (result != PMEMKV_STATUS_OK) {
+			d->errors++;
+			d->last_error = result;
+			if (result == PMEMKV_STATUS_NOT_SUPPORTED)
+				return;
+		}
+
+		if (took > d->max_latency)
+			amount = std::max(amount / 2, MIN_DEFRAG_SLICE);
+		else if (took < d->max_latency / 2)
+			amount = std::min(amount * 2, d->slice_percent);
+		d->current_slice = amount;
+
+		start_percent += slice;
+		pause = std::chrono::duration<double>(cpu / 1e9 / d->cpu_budget) - took;
+		if (start_percent >= 100) {
+			d->passes++;
+			start_percent = 0;
+			pause = std::max(pause, std::chrono::duration<double>(d->interval));
+		}
+		pause = std::max(pause, std::chrono::duration<double>(0));
+	}
+}
+
+static void stop_defrag_scheduler(PmemkvObject *self)
+{
+	DefragScheduler *d = self->defrag;
+	if (d == NULL)
+		return;
+	{
+		std::lock_guard<std::mutex> lock(d->mtx);
+		d->stop = true;
+	}
+	d->cv.notify_all();
+	Py_BEGIN_ALLOW_THREADS
+	d->thread.join();
+	Py_END_ALLOW_THREADS
+	self->defrag = NULL;
+	delete d;
+}
+
+static PyObject *
+pmemkv_NI_StartDefragScheduler(PmemkvObject *self, PyObject* args) {
+	double interval, slice_percent, cpu_budget, max_latency, max_write_rate;
+	if (!PyArg_ParseTuple(args, "ddddd", &interval, &slice_percent, &cpu_budget,
+			      &max_latency, &max_write_rate)) {
+		return NULL;
+	}
+	if (interval < 0 || slice_percent < MIN_DEFRAG_SLICE || slice_percent > 100 ||
+	    cpu_budget <= 0 || cpu_budget > 1 || max_latency <= 0 || max_write_rate < 0) {
+		PyErr_SetString(PyExc_ValueError, "Invalid defragmentation scheduler parameters");
+		return NULL;
+	}
+	stop_defrag_scheduler(self);
+	DefragScheduler *d = new DefragScheduler();
+	d->interval = std::chrono::milliseconds((long long)(interval * 1000));
+	d->slice_percent = slice_percent;
+	d->current_slice = slice_percent;
+	d->cpu_budget = cpu_budget;
+	d->max_latency = std::chrono::duration<double>(max_latency);
+	d->max_write_rate = max_write_rate;
+	d->thread = std::thread(defrag_loop, self, d);
+	self->defrag = d;
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_StopDefragScheduler(PmemkvObject *self) {
+	stop_defrag_scheduler(self);
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_DefragStats(PmemkvObject *self) {
+	DefragScheduler *d = self->defrag;
+	if (d == NULL)
+		Py_RETURN_NONE;
+	PyObject *last_error = Py_None;
+	int status = d->last_error;
+	if (status != PMEMKV_STATUS_OK)
+		last_error = pmemkv_exception(status);
+	/* pmemkv does not report how much space was reclaimed */
+	return Py_BuildValue("{s:K,s:K,s:K,s:K,s:O,s:d,s:d,s:d,s:O}", "slices",
+			     (unsigned long long)d->slices.load(), "passes",
+			     (unsigned long long)d->passes.load(), "deferred",
+			     (unsigned long long)d->deferred.load(), "errors",
+			     (unsigned long long)d->errors.load(), "last_error",
+			     last_error, "time_s", d->time_ns.load() / 1e9, "cpu_s",
+			     d->cpu_ns.load() / 1e9, "slice_percent",
+			     d->current_slice.load(), "reclaimed_bytes", Py_None);
+}
+
+// Warm-up.
+
+/*
+ * Background threads, which fault in pages of a freshly opened engine by
+ * walking all records and reading a byte of each page of keys (and values,
+ * unless keys_only is set). Keys of bytewise sorted engines are split into
+ * ranges by their first byte, taken by threads one by one, other engines are
+ * walked by a single thread. Each step scans up to batch_size records holding
+ * EngineLock, then the thread sleeps, so it uses at most cpu_budget of a CPU.
+ * Unordered walks can not be resumed, so they are done in one scan, which
+ * checks the deadline and sleeps every batch_size records instead.
+ * Threads give up when the deadline passes.
+ */
+struct Warmup {
+	std::vector<std::thread> threads;
+	std::mutex mtx;
+	std::condition_variable cv;
+	std::atomic<bool> stop{false};
+	bool keys_only;
+	size_t batch_size;
+	double cpu_budget;
+	bool has_deadline;
+	std::chrono::steady_clock::time_point started, deadline;
+	size_t ranges;
+	std::atomic<size_t> next_range{0};
+	std::atomic<size_t> ranges_done{0};
+	std::atomic<uint64_t> records{0};
+	std::atomic<uint64_t> bytes{0};
+	std::atomic<bool> timed_out{false};
+	/* guarded by mtx */
+	size_t running = 0;
+	std::chrono::steady_clock::time_point finished;
+};
+
+static const size_t WARMUP_PAGE = 4096;
+
+/* keeps reads of warmed up pages from being optimized out */
+static volatile unsigned char warmup_sink;
+
+static unsigned char touch_pages(const char *data, size_t bytes)
+{
+	unsigned char sum = 0;
+	for (size_t i = 0; i < bytes; i += WARMUP_PAGE)
+		sum += (unsigned char)data[i];
+	if (bytes != 0)
+		sum += (unsigned char)data[bytes - 1];
+	return sum;
+}
+
+/*
+ * Sleeps after a step, which started at the given time and thread CPU time,
+ * to keep within cpu_budget. Returns false if warm-up was stopped meanwhile.
+ */
+static bool warmup_pause(Warmup *w, std::chrono::steady_clock::time_point start,
+			 uint64_t cpu_start)
+{
+	std::chrono::duration<double> took =
+		std::chrono::steady_clock::now() - start;
+	std::chrono::duration<double> pause =
+		std::chrono::duration<double>((thread_cpu_ns() - cpu_start) / 1e9 /
+					      w->cpu_budget) - took;
+	std::unique_lock<std::mutex> lock(w->mtx);
+	return !w->cv.wait_for(lock,
+			       std::max(pause, std::chrono::duration<double>(0)),
+			       [w] { return w->stop.load(); });
+}
+
+/* returns true (and marks the warm-up) if its deadline has passed */
+static bool warmup_expired(Warmup *w, std::chrono::steady_clock::time_point now)
+{
+	if (!w->has_deadline || now < w->deadline)
+		return false;
+	w->timed_out = true;
+	return true;
+}
+
+struct WarmupVisitor : RangeVisitor {
+	Warmup *w;
+	size_t visited = 0;
+	uint64_t bytes = 0;
+	unsigned char sum = 0;
+	std::string last;
+	/* start of the current batch of an unordered walk */
+	std::chrono::steady_clock::time_point batch_start;
+	uint64_t batch_cpu_start;
+
+	WarmupVisitor(Warmup *w)
+	    : w(w),
+	      batch_start(std::chrono::steady_clock::now()),
+	      batch_cpu_start(thread_cpu_ns())
+	{
+	}
+
+	bool visit(const char *key, size_t keybytes, const char *value,
+		   size_t valuebytes) override
+	{
+		sum += touch_pages(key, keybytes);
+		bytes += keybytes;
+		if (!w->keys_only) {
+			sum += touch_pages(value, valuebytes);
+			bytes += valuebytes;
+		}
+		visited++;
+		if (ordered) {
+			last.assign(key, keybytes);
+			return visited < w->batch_size;
+		}
+		/* unordered walks are done in one scan, throttled by batches */
+		if (w->stop)
+			return false;
+		if (visited % w->batch_size != 0)
+			return true;
+		if (warmup_expired(w, std::chrono::steady_clock::now()) ||
+		    !warmup_pause(w, batch_start, batch_cpu_start))
+			return false;
+		batch_start = std::chrono::steady_clock::now();
+		batch_cpu_start = thread_cpu_ns();
+		return true;
+	}
+};
+
+/* i-th range of keys, split by their first byte if there are many ranges */
+static KeyRange warmup_range(PmemkvObject *self, Warmup *w, size_t i)
+{
+	KeyRange range;
+	range.bytewise = !self->custom_order;
+	if (w->ranges == 1)
+		return range;
+	if (i > 0) {
+		range.lo.assign(1, (char)i);
+		range.has_lo = true;
+		range.lo_inclusive = true;
+	}
+	if (i + 1 < w->ranges) {
+		range.hi.assign(1, (char)(i + 1));
+		range.has_hi = true;
+	}
+	return range;
+}
+
+/* Walks the range, returns false if warm-up should be finished. */
+static bool warmup_walk(PmemkvObject *self, Warmup *w, KeyRange range)
+{
+	while (true) {
+		auto now = std::chrono::steady_clock::now();
+		if (warmup_expired(w, now))
+			return false;
+		uint64_t cpu_start = thread_cpu_ns();
+		WarmupVisitor visitor(w);
+		int result;
+		{
+			EngineLock guard(self);
+			result = scan_range(self, range, visitor);
+		}
+		warmup_sink = visitor.sum;
+		w->records += visitor.visited;
+		w->bytes += visitor.bytes;
+		if (!visitor.ordered)
+			return !w->stop && !w->timed_out;
+		if (result != PMEMKV_STATUS_OK || visitor.visited < w->batch_size)
+			return !w->stop;
+		range.lo = visitor.last;
+		range.has_lo = true;
+		range.lo_inclusive = false;
+		if (!warmup_pause(w, now, cpu_start))
+			return false;
+	}
+}
+
+static void warmup_loop(PmemkvObject *self, Warmup *w)
+{
+	while (!w->stop) {
+		size_t i = w->next_range++;
+		if (i >= w->ranges || !warmup_walk(self, w, warmup_range(self, w, i)))
+			break;
+		w->ranges_done++;
+	}
+	std::lock_guard<std::mutex> lock(w->mtx);
+	if (--w->running == 0)
+		w->finished = std::chrono::steady_clock::now();
+}
+
+static void stop_warmup(PmemkvObject *self)
+{
+	Warmup *w = self->warmup;
+	if (w == NULL)
+		return;
+	{
+		std::lock_guard<std::mutex> lock(w->mtx);
+		w->stop = true;
+	}
+	w->cv.notify_all();
+	Py_BEGIN_ALLOW_THREADS
+	for (auto &thread : w->threads)
+		thread.join();
+	Py_END_ALLOW_THREADS
+	self->warmup = NULL;
+	delete w;
+}
+
+static PyObject *
+pmemkv_NI_StartWarmup(PmemkvObject *self, PyObject* args) {
+	int keys_only;
+	double budget, cpu_budget;
+	Py_ssize_t threads, batch_size;
+	if (!PyArg_ParseTuple(args, "pdnnd", &keys_only, &budget, &threads,
+			      &batch_size, &cpu_budget)) {
+		return NULL;
+	}
+	if (self->db == NULL) {
+		PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+				"Engine is not started");
+		return NULL;
+	}
+	if (budget < 0 || threads <= 0 || batch_size <= 0 || cpu_budget <= 0 ||
+	    cpu_budget > 1) {
+		PyErr_SetString(PyExc_ValueError, "Invalid warm-up parameters");
+		return NULL;
+	}
+	stop_warmup(self);
+	Warmup *w = new Warmup();
+	w->keys_only = keys_only;
+	w->batch_size = batch_size;
+	w->cpu_budget = cpu_budget;
+	w->started = std::chrono::steady_clock::now();
+	w->has_deadline = budget > 0;
+	w->deadline = w->started +
+		std::chrono::duration_cast<std::chrono::steady_clock::duration>(
+			std::chrono::duration<double>(budget));
+	w->ranges = self->sorted && !self->custom_order ? 256 : 1;
+	w->running = std::min((size_t)threads, w->ranges);
+	for (size_t i = 0; i < w->running; i++)
+		w->threads.emplace_back(warmup_loop, self, w);
+	self->warmup = w;
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_StopWarmup(PmemkvObject *self) {
+	stop_warmup(self);
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+pmemkv_NI_WarmupStats(PmemkvObject *self) {
+	Warmup *w = self->warmup;
+	if (w == NULL)
+		Py_RETURN_NONE;
+	bool running;
+	std::chrono::duration<double> elapsed;
+	{
+		std::lock_guard<std::mutex> lock(w->mtx);
+		running = w->running != 0;
+		elapsed = (running ? std::chrono::steady_clock::now() : w->finished) -
+			w->started;
+	}
+	uint64_t records = w->records;
+	double progress = (double)w->ranges_done / w->ranges;
+	/* walked records are a better measure, if their number is known */
+	if (self->stats != NULL && progress < 1) {
+		uint64_t keys = self->stats->keys;
+		if (keys != 0)
+			progress = std::min(1.0, (double)records / keys);
+	}
+	return Py_BuildValue("{s:O,s:K,s:K,s:d,s:d,s:O}", "running",
+			     running ? Py_True : Py_False, "records",
+			     (unsigned long long)records, "bytes",
+			     (unsigned long long)w->bytes.load(), "progress", progress,
+			     "time_s", elapsed.count(), "timed_out",
+			     w->timed_out ? Py_True : Py_False);
+}
+
+static PyObject *records_to_list(RecordCollector &collector)
+{
+	PyObject *list = PyList_New(collector.records.size());
+	if (list == NULL)
+		return NULL;
+	for (size_t i = 0; i < collector.records.size(); i++) {
+		auto &r = collector.records[i];
+		PyObject *item;
+		if (collector.keys_only)
+			item = PyBytes_FromStringAndSize(r.first.data(), r.first.size());
+		else
+			item = Py_BuildValue("y#y#", r.first.data(),
+					     (Py_ssize_t)r.first.size(), r.second.data(),
+					     (Py_ssize_t)r.second.size());
+		if (item == NULL) {
+			Py_DECREF(list);
+			return NULL;
+		}
+		PyList_SET_ITEM(list, i, item);
+	}
+	return list;
+}
+
+// "Prefix" Methods.
+static PyObject *
+pmemkv_NI_ScanPrefix(PmemkvObject *self, PyObject* args) {
+	Py_buffer prefix, start_after = {NULL, NULL};
+	Py_ssize_t limit = -1;
+	int keys_only = 0;
+	if (!PyArg_ParseTuple(args, "s*|nz*p", &prefix, &limit, &start_after,
+			      &keys_only)) {
+		return NULL;
+	}
+	KeyRange range = prefix_range((const char *)prefix.buf, prefix.len);
+	PyBuffer_Release(&prefix);
+	if (start_after.buf != NULL) {
+		std::string after((const char *)start_after.buf, start_after.len);
+		if (compare_bytes(after.data(), after.size(), range.lo.data(),
+				  range.lo.size()) >= 0) {
+			range.lo = std::move(after);
+			range.lo_inclusive = false;
+		}
+		PyBuffer_Release(&start_after);
+	}
+
+	RecordCollector collector(limit < 0 ? SIZE_MAX : (size_t)limit, keys_only);
+	int result = PMEMKV_STATUS_OK, decode_status = PMEMKV_STATUS_OK;
+	if (limit != 0) {
+		Py_BEGIN_ALLOW_THREADS
+		{
+			EngineLock guard(self);
+			DecodingVisitor decoder(self, collector);
+			result = scan_range(self, range, decoder);
+			decode_status = decoder.status;
+		}
+		collector.finish();
+		Py_END_ALLOW_THREADS
+	}
+	if (decode_status != PMEMKV_STATUS_OK) {
+		set_decode_error(decode_status);
+		return NULL;
+	}
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return records_to_list(collector);
+}
+
+static PyObject *
+pmemkv_NI_CountPrefix(PmemkvObject *self, PyObject* args) {
+	Py_buffer prefix;
+	if (!PyArg_ParseTuple(args, "s*", &prefix)) {
+		return NULL;
+	}
+	KeyRange range = prefix_range((const char *)prefix.buf, prefix.len);
+	PyBuffer_Release(&prefix);
+	size_t cnt = 0;
+	int result;
+	Py_BEGIN_ALLOW_THREADS
+	{
+		EngineLock guard(self);
+		result = count_range(self, range, &cnt);
+	}
+	Py_END_ALLOW_THREADS
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return PyLong_FromSize_t(cnt);
+}
+
+static PyObject *
+pmemkv_NI_RemovePrefix(PmemkvObject *self, PyObject* args) {
+	Py_buffer prefix;
+	if (!PyArg_ParseTuple(args, "s*", &prefix)) {
+		return NULL;
+	}
+	KeyRange range = prefix_range((const char *)prefix.buf, prefix.len);
+	PyBuffer_Release(&prefix);
+	size_t removed = 0;
+	int result;
+	Py_BEGIN_ALLOW_THREADS
+	result = remove_range(self, range, &removed);
+	Py_END_ALLOW_THREADS
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return PyLong_FromSize_t(removed);
+}
+
+// "Batch" Methods.
+
+/* Number of records written by put_many() holding EngineLock once. */
+static const size_t PUT_BATCH_SIZE = 1024;
+
+static PyObject *
+pmemkv_NI_PutMany(PmemkvObject *self, PyObject* args) {
+	PyObject *items;
+	long long ttl = -1;
+	if (!PyArg_ParseTuple(args, "O|L", &items, &ttl)) {
+		return NULL;
+	}
+	uint64_t expire_at = NO_EXPIRY;
+	if (ttl >= 0) {
+		if (!self->value_header) {
+			PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+					expiry_disabled_msg);
+			return NULL;
+		}
+		expire_at = now_ms() + ttl;
+	}
+	PyObject *seq = PySequence_Fast(items, "Items should be a sequence of (key, value) pairs");
+	if (seq == NULL) {
+		return NULL;
+	}
+	Py_ssize_t n = PySequence_Fast_GET_SIZE(seq);
+	std::vector<Py_buffer> buffers;
+	buffers.reserve(2 * n);
+	for (Py_ssize_t i = 0; i < n; i++) {
+		PyObject *pair = PySequence_Tuple(PySequence_Fast_GET_ITEM(seq, i));
+		Py_buffer key, value;
+		bool parsed = pair != NULL &&
+			PyArg_ParseTuple(pair, "s*s*:put_many", &key, &value);
+		Py_XDECREF(pair);
+		if (!parsed) {
+			for (auto &b : buffers)
+				PyBuffer_Release(&b);
+			Py_DECREF(seq);
+			return NULL;
+		}
+		buffers.push_back(key);
+		buffers.push_back(value);
+	}
+	Py_DECREF(seq);
+
+	size_t written = 0;
+	int result = PMEMKV_STATUS_OK;
+	Py_BEGIN_ALLOW_THREADS
+	while (result == PMEMKV_STATUS_OK && written < (size_t)n) {
+		EngineLock guard(self);
+		size_t end = std::min((size_t)n, written + PUT_BATCH_SIZE);
+		for (; written < end; written++) {
+			Py_buffer &key = buffers[2 * written], &value = buffers[2 * written + 1];
+			result = store_value(self, (const char *)key.buf, key.len,
+					     (const char *)value.buf, value.len, expire_at);
+			if (result != PMEMKV_STATUS_OK)
+				break;
+		}
+	}
+	Py_END_ALLOW_THREADS
+	for (auto &b : buffers)
+		PyBuffer_Release(&b);
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return PyLong_FromSize_t(written);
+}
+
+// "Range" Methods.
+static PyObject *
+pmemkv_NI_ScanRange(PmemkvObject *self, PyObject* args) {
+	Py_buffer lo = {NULL, NULL}, hi = {NULL, NULL}, start_after = {NULL, NULL};
+	Py_ssize_t limit = -1;
+	int keys_only = 0;
+	if (!PyArg_ParseTuple(args, "|z*z*nz*p", &lo, &hi, &limit, &start_after,
+			      &keys_only)) {
+		return NULL;
+	}
+	KeyRange range;
+	range.bytewise = !self->custom_order;
+	if (lo.buf != NULL) {
+		range.lo.assign((const char *)lo.buf, lo.len);
+		range.has_lo = true;
+		range.lo_inclusive = true;
+		PyBuffer_Release(&lo);
+	}
+	if (hi.buf != NULL) {
+		range.hi.assign((const char *)hi.buf, hi.len);
+		range.has_hi = true;
+		PyBuffer_Release(&hi);
+	}
+	if (start_after.buf != NULL) {
+		std::string after((const char *)start_after.buf, start_after.len);
+		/* with custom order the key is assumed to come from this range */
+		if (!range.has_lo || !range.bytewise ||
+		    compare_bytes(after.data(), after.size(), range.lo.data(),
+				  range.lo.size()) >= 0) {
+			range.lo = std::move(after);
+			range.has_lo = true;
+			range.lo_inclusive = false;
+		}
+		PyBuffer_Release(&start_after);
+	}
+
+	RecordCollector collector(limit < 0 ? SIZE_MAX : (size_t)limit, keys_only);
+	int result = PMEMKV_STATUS_OK, decode_status = PMEMKV_STATUS_OK;
+	if (limit != 0) {
+		Py_BEGIN_ALLOW_THREADS
+		{
+			EngineLock guard(self);
+			DecodingVisitor decoder(self, collector);
+			result = scan_range(self, range, decoder);
+			decode_status = decoder.status;
+		}
+		collector.finish();
+		Py_END_ALLOW_THREADS
+	}
+	if (decode_status != PMEMKV_STATUS_OK) {
+		set_decode_error(decode_status);
+		return NULL;
+	}
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return records_to_list(collector);
+}
+
+// Scans with filters and aggregates.
+
+/*
+ * Conditions and aggregates of pmemkv_NI_Scan are evaluated natively, for
+ * each record within the range. They are passed as tuples built by Python
+ * classes (e.g. Prefix, StructField).
+ */
+enum ScanTarget { SCAN_KEY = 0, SCAN_VALUE = 1 };
+
+/* Integer field of a value or length of key or value. */
+struct ScanField {
+	bool length = false;
+	int target = SCAN_VALUE;
+	size_t offset = 0, size = 0;
+	bool little = false, is_signed = false;
+
+	/* Returns false if record has no such field. */
+	bool get(const char *key, size_t keybytes, const char *value, size_t valuebytes,
+		 __int128 *out) const
+	{
+		if (length) {
+			*out = target == SCAN_KEY ? keybytes : valuebytes;
+			return true;
+		}
+		if (valuebytes < offset || valuebytes - offset < size)
+			return false;
+		const unsigned char *p = (const unsigned char *)value + offset;
+		uint64_t n = 0;
+		for (size_t i = 0; i < size; i++)
+			n = (n << 8) | p[little ? size - 1 - i : i];
+		if (is_signed && size < 8 && (n >> (size * 8 - 1)) != 0)
+			n |= ~0ULL << (size * 8);
+		*out = is_signed ? (__int128)(int64_t)n : (__int128)n;
+		return true;
+	}
+};
+
+enum ScanOp { SCAN_EQ, SCAN_NE, SCAN_LT, SCAN_LE, SCAN_GT, SCAN_GE };
+static const char *ScanOps[] = {"==", "!=", "<", "<=", ">", ">=", NULL};
+
+struct ScanCondition {
+	enum { PREFIX, SUFFIX, LENGTH, COMPARE } type;
+	int target = SCAN_KEY;
+	std::string bytes;
+	Py_ssize_t min = -1, max = -1;
+	ScanField field;
+	int op = SCAN_EQ;
+	__int128 operand = 0;
+
+	bool matches(const char *key, size_t keybytes, const char *value,
+		     size_t valuebytes) const
+	{
+		const char *data = target == SCAN_KEY ? key : value;
+		size_t size = target == SCAN_KEY ? keybytes : valuebytes;
+		__int128 n;
+		switch (type) {
+			case PREFIX:
+				return size >= bytes.size() &&
+					memcmp(data, bytes.data(), bytes.size()) == 0;
+			case SUFFIX:
+				return size >= bytes.size() &&
+					memcmp(data + size - bytes.size(), bytes.data(),
+					       bytes.size()) == 0;
+			case LENGTH:
+				return (min < 0 || size >= (size_t)min) &&
+					(max < 0 || size <= (size_t)max);
+			case COMPARE:
+				if (!field.get(key, keybytes, value, valuebytes, &n))
+					return false;
+				switch (op) {
+					case SCAN_EQ:
+						return n == operand;
+					case SCAN_NE:
+						return n != operand;
+					case SCAN_LT:
+						return n < operand;
+					case SCAN_LE:
+						return n <= operand;
+					case SCAN_GT:
+						return n > operand;
+					default:
+						return n >= operand;
+				}
+		}
+		return false;
+	}
+};
+
+struct ScanAggregate {
+	enum { COUNT, SUM, MIN, MAX } type;
+	ScanField field;
+	bool has_value = false;
+	__int128 value = 0;
+
+	void add(const char *key, size_t keybytes, const char *value_, size_t valuebytes)
+	{
+		__int128 n = 1;
+		if (type != COUNT && !field.get(key, keybytes, value_, valuebytes, &n))
+			return;
+		if (!has_value || type == COUNT || type == SUM)
+			value = has_value ? value + n : n;
+		else if (type == MIN)
+			value = std::min(value, n);
+		else
+			value = std::max(value, n);
+		has_value = true;
+	}
+};
+
+/* Passes matching records to the next visitor or adds them to aggregates. */
+struct FilteringVisitor : RangeVisitor {
+	const std::vector<ScanCondition> &where;
+	std::vector<ScanAggregate> &aggregates;
+	RangeVisitor &next;
+
+	FilteringVisitor(const std::vector<ScanCondition> &where,
+			 std::vector<ScanAggregate> &aggregates, RangeVisitor &next)
+	    : where(where), aggregates(aggregates), next(next)
+	{
+	}
+
+	bool visit(const char *key, size_t keybytes, const char *value,
+		   size_t valuebytes) override
+	{
+		next.ordered = ordered;
+		for (auto &cond : where)
+			if (!cond.matches(key, keybytes, value, valuebytes))
+				return true;
+		if (aggregates.empty())
+			return next.visit(key, keybytes, value, valuebytes);
+		for (auto &a : aggregates)
+			a.add(key, keybytes, value, valuebytes);
+		return true;
+	}
+};
+
+static const char *scan_spec_kind(PyObject *spec)
+{
+	PyObject *first = PyTuple_Check(spec) && PyTuple_GET_SIZE(spec) > 0
+		? PyTuple_GET_ITEM(spec, 0)
+		: NULL;
+	return first != NULL && PyUnicode_Check(first) ? PyUnicode_AsUTF8(first) : "";
+}
+
+/* Parses ("field", offset, size, little, signed) or ("length", target). */
+static bool parse_scan_field(PyObject *spec, ScanField *field)
+{
+	const char *kind = scan_spec_kind(spec);
+	if (kind == NULL)
+		return false;
+	if (strcmp(kind, "length") == 0) {
+		field->length = true;
+		return PyArg_ParseTuple(spec, "si", &kind, &field->target);
+	}
+	if (strcmp(kind, "field") == 0) {
+		Py_ssize_t offset, size;
+		int little, is_signed;
+		if (!PyArg_ParseTuple(spec, "snnpp", &kind, &offset, &size, &little,
+				      &is_signed))
+			return false;
+		if (offset < 0 || size <= 0 || size > 8) {
+			PyErr_SetString(PyExc_ValueError,
+					"Integer field should have 1 to 8 bytes");
+			return false;
+		}
+		field->offset = offset;
+		field->size = size;
+		field->little = little;
+		field->is_signed = is_signed;
+		return true;
+	}
+	PyErr_SetString(PyExc_TypeError, "Unknown field specification");
+	return false;
+}
+
+static bool parse_scan_condition(PyObject *spec, ScanCondition *cond)
+{
+	const char *kind = scan_spec_kind(spec);
+	Py_buffer bytes;
+	if (kind == NULL)
+		return false;
+	if (strcmp(kind, "prefix") == 0 || strcmp(kind, "suffix") == 0) {
+		cond->type = kind[0] == 'p' ? ScanCondition::PREFIX : ScanCondition::SUFFIX;
+		if (!PyArg_ParseTuple(spec, "siy*", &kind, &cond->target, &bytes))
+			return false;
+		cond->bytes.assign((const char *)bytes.buf, bytes.len);
+		PyBuffer_Release(&bytes);
+		return true;
+	}
+	if (strcmp(kind, "length") == 0) {
+		cond->type = ScanCondition::LENGTH;
+		return PyArg_ParseTuple(spec, "sinn", &kind, &cond->target, &cond->min,
+					&cond->max);
+	}
+	if (strcmp(kind, "compare") == 0) {
+		PyObject *field, *operand;
+		const char *op;
+		cond->type = ScanCondition::COMPARE;
+		if (!PyArg_ParseTuple(spec, "sOsO!", &kind, &field, &op, &PyLong_Type,
+				      &operand) ||
+		    !parse_scan_field(field, &cond->field))
+			return false;
+		for (cond->op = 0; ScanOps[cond->op] != NULL; cond->op++)
+			if (strcmp(ScanOps[cond->op], op) == 0)
+				break;
+		if (ScanOps[cond->op] == NULL) {
+			PyErr_Format(PyExc_ValueError, "Unknown operator: %s", op);
+			return false;
+		}
+		int overflow;
+		long long n = PyLong_AsLongLongAndOverflow(operand, &overflow);
+		if (overflow > 0) {
+			unsigned long long u = PyLong_AsUnsignedLongLong(operand);
+			if (PyErr_Occurred() != NULL)
+				return false;
+			cond->operand = u;
+		} else if (overflow < 0) {
+			PyErr_SetString(PyExc_OverflowError, "Operand is out of range");
+			return false;
+		} else {
+			cond->operand = n;
+		}
+		return true;
+	}
+	PyErr_SetString(PyExc_TypeError, "Unknown scan condition");
+	return false;
+}
+
+static bool parse_scan_aggregate(PyObject *spec, ScanAggregate *a)
+{
+	const char *kind = scan_spec_kind(spec);
+	PyObject *field;
+	if (kind == NULL)
+		return false;
+	if (strcmp(kind, "count") == 0) {
+		a->type = ScanAggregate::COUNT;
+		return true;
+	}
+	if (strcmp(kind, "sum") == 0)
+		a->type = ScanAggregate::SUM;
+	else if (strcmp(kind, "min") == 0)
+		a->type = ScanAggregate::MIN;
+	else if (strcmp(kind, "max") == 0)
+		a->type = ScanAggregate::MAX;
+	else {
+		PyErr_SetString(PyExc_TypeError, "Unknown aggregate");
+		return false;
+	}
+	return PyArg_ParseTuple(spec, "sO", &kind, &field) &&
+		parse_scan_field(field, &a->field);
+}
+
+static PyObject *int128_to_long(__int128 n)
+{
+	if (n >= INT64_MIN && n <= INT64_MAX)
+		return PyLong_FromLongLong((long long)n);
+	/* n = high * 2^64 + low */
+	PyObject *high = PyLong_FromLongLong((long long)(n >> 64));
+	PyObject *low = PyLong_FromUnsignedLongLong((unsigned long long)n);
+	PyObject *shift = PyLong_FromLong(64);
+	PyObject *shifted = high && shift ? PyNumber_Lshift(high, shift) : NULL;
+	PyObject *result = shifted && low ? PyNumber_Add(shifted, low) : NULL;
+	Py_XDECREF(high);
+	Py_XDECREF(low);
+	Py_XDECREF(shift);
+	Py_XDECREF(shifted);
+	return result;
+}
+
+static PyObject *
+pmemkv_NI_Scan(PmemkvObject *self, PyObject* args) {
+	Py_buffer lo = {NULL, NULL}, hi = {NULL, NULL};
+	PyObject *where_specs, *aggregate_specs;
+	int select;
+	Py_ssize_t limit;
+	if (!PyArg_ParseTuple(args, "z*z*O!iO!n", &lo, &hi, &PyList_Type, &where_specs,
+			      &select, &PyList_Type, &aggregate_specs, &limit)) {
+		return NULL;
+	}
+	KeyRange range;
+	range.bytewise = !self->custom_order;
+	if (lo.buf != NULL) {
+		range.lo.assign((const char *)lo.buf, lo.len);
+		range.has_lo = true;
+		range.lo_inclusive = true;
+		PyBuffer_Release(&lo);
+	}
+	if (hi.buf != NULL) {
+		range.hi.assign((const char *)hi.buf, hi.len);
+		range.has_hi = true;
+		PyBuffer_Release(&hi);
+	}
+	std::vector<ScanCondition> where(PyList_GET_SIZE(where_specs));
+	for (size_t i = 0; i < where.size(); i++)
+		if (!parse_scan_condition(PyList_GET_ITEM(where_specs, i), &where[i]))
+			return NULL;
+	std::vector<ScanAggregate> aggregates(PyList_GET_SIZE(aggregate_specs));
+	for (size_t i = 0; i < aggregates.size(); i++)
+		if (!parse_scan_aggregate(PyList_GET_ITEM(aggregate_specs, i),
+					  &aggregates[i]))
+			return NULL;
+
+	RecordCollector collector(limit < 0 ? SIZE_MAX : (size_t)limit, select == SCAN_KEY);
+	int result = PMEMKV_STATUS_OK, decode_status = PMEMKV_STATUS_OK;
+	if (limit != 0) {
+		Py_BEGIN_ALLOW_THREADS
+		{
+			EngineLock guard(self);
+			FilteringVisitor filter(where, aggregates, collector);
+			DecodingVisitor decoder(self, filter);
+			result = scan_range(self, range, decoder);
+			decode_status = decoder.status;
+		}
+		collector.finish();
+		Py_END_ALLOW_THREADS
+	}
+	if (decode_status != PMEMKV_STATUS_OK) {
+		set_decode_error(decode_status);
+		return NULL;
+	}
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	if (aggregates.empty() && select != SCAN_VALUE)
+		return records_to_list(collector);
+
+	PyObject *list = PyList_New(aggregates.empty() ? collector.records.size()
+						       : aggregates.size());
+	if (list == NULL)
+		return NULL;
+	for (Py_ssize_t i = 0; i < PyList_GET_SIZE(list); i++) {
+		PyObject *item;
+		if (aggregates.empty()) {
+			auto &value = collector.records[i].second;
+			item = PyBytes_FromStringAndSize(value.data(), value.size());
+		} else if (aggregates[i].has_value || aggregates[i].type == ScanAggregate::COUNT ||
+			   aggregates[i].type == ScanAggregate::SUM) {
+			item = int128_to_long(aggregates[i].value);
+		} else {
+			Py_INCREF(Py_None);
+			item = Py_None;
+		}
+		if (item == NULL) {
+			Py_DECREF(list);
+			return NULL;
+		}
+		PyList_SET_ITEM(list, i, item);
+	}
+	return list;
+}
+
+// "Sampling" Methods.
+
+/* Builds statistics of all records. It's called with the GIL released. */
+static int build_statistics(PmemkvObject *self)
+{
+	struct StatisticsBuilder : RangeVisitor {
+		Statistics *stats = new Statistics();
+
+		bool visit(const char *, size_t keybytes, const char *,
+			   size_t valuebytes) override
+		{
+			stats->add(keybytes, valuebytes);
+			return true;
+		}
+	} builder;
+	int result;
+	{
+		EngineLock guard(self);
+		result = scan_range(self, KeyRange(), builder);
+	}
+	if (result == PMEMKV_STATUS_OK)
+		self->stats = builder.stats;
+	else
+		delete builder.stats;
+	return result;
+}
+
+/*
+ * Keeps a uniform random sample of visited records (reservoir sampling),
+ * with the position of each record, so the sample may be put in scan order.
+ */
+struct SamplingVisitor : RangeVisitor {
+	PmemkvObject *self;
+	size_t n;
+	std::mt19937_64 rng;
+	uint64_t now = now_ms();
+	uint64_t seen = 0;
+	std::vector<std::pair<uint64_t, std::pair<std::string, size_t>>> sample;
+
+	SamplingVisitor(PmemkvObject *self, size_t n, uint64_t seed)
+	    : self(self), n(n), rng(seed)
+	{
+	}
+
+	bool visit(const char *key, size_t keybytes, const char *value,
+		   size_t valuebytes) override
+	{
+		ValueHeader h;
+		if (self->value_header && parse_value_header(value, valuebytes, &h) &&
+		    is_expired(h, now))
+			return true;
+		uint64_t i = seen++;
+		if (sample.size() < n) {
+			sample.emplace_back(i, std::make_pair(std::string(key, keybytes),
+							      valuebytes));
+			return true;
+		}
+		uint64_t j = std::uniform_int_distribution<uint64_t>(0, i)(rng);
+		if (j < n)
+			sample[j] = std::make_pair(
+				i, std::make_pair(std::string(key, keybytes), valuebytes));
+		return true;
+	}
+};
+
+static PyObject *
+pmemkv_NI_Sample(PmemkvObject *self, PyObject* args) {
+	Py_ssize_t n;
+	Py_buffer lo = {NULL, NULL}, hi = {NULL, NULL};
+	PyObject *seed = Py_None;
+	if (!PyArg_ParseTuple(args, "n|z*z*O", &n, &lo, &hi, &seed)) {
+		return NULL;
+	}
+	KeyRange range;
+	range.bytewise = !self->custom_order;
+	if (lo.buf != NULL) {
+		range.lo.assign((const char *)lo.buf, lo.len);
+		range.has_lo = true;
+		range.lo_inclusive = true;
+		PyBuffer_Release(&lo);
+	}
+	if (hi.buf != NULL) {
+		range.hi.assign((const char *)hi.buf, hi.len);
+		range.has_hi = true;
+		PyBuffer_Release(&hi);
+	}
+	uint64_t s;
+	if (seed == Py_None) {
+		s = std::random_device()();
+		s = (s << 32) ^ std::random_device()();
+	} else {
+		s = PyLong_AsUnsignedLongLongMask(seed);
+		if (PyErr_Occurred() != NULL)
+			return NULL;
+	}
+
+	SamplingVisitor sampler(self, n, s);
+	int result = PMEMKV_STATUS_OK;
+	if (n > 0) {
+		Py_BEGIN_ALLOW_THREADS
+		{
+			EngineLock guard(self);
+			result = scan_range(self, range, sampler);
+		}
+		auto &sample = sampler.sample;
+		if (sampler.ordered)
+			std::sort(sample.begin(), sample.end(),
+				  [](const decltype(sample[0]) &a, const decltype(sample[0]) &b) {
+					  return a.first < b.first;
+				  });
+		else
+			std::sort(sample.begin(), sample.end(),
+				  [](const decltype(sample[0]) &a, const decltype(sample[0]) &b) {
+					  return a.second.first < b.second.first;
+				  });
+		Py_END_ALLOW_THREADS
+	}
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	PyObject *list = PyList_New(sampler.sample.size());
+	if (list == NULL)
+		return NULL;
+	for (size_t i = 0; i < sampler.sample.size(); i++) {
+		auto &record = sampler.sample[i].second;
+		PyObject *item = Py_BuildValue("(y#n)", record.first.data(),
+					       (Py_ssize_t)record.first.size(),
+					       (Py_ssize_t)record.second);
+		if (item == NULL) {
+			Py_DECREF(list);
+			return NULL;
+		}
+		PyList_SET_ITEM(list, i, item);
+	}
+	return list;
+}
+
+static PyObject *
+pmemkv_NI_Stats(PmemkvObject *self) {
+	Statistics *stats = self->stats;
+	if (stats == NULL)
+		Py_RETURN_NONE;
+	PyObject *histogram = PyList_New(0);
+	if (histogram == NULL)
+		return NULL;
+	for (size_t b = 0; b < STATS_BUCKETS; b++) {
+		uint64_t count = stats->value_sizes[b].load(std::memory_order_relaxed);
+		if (count == 0)
+			continue;
+		unsigned long long min = b == 0 ? 0 : 1ULL << (b - 1);
+		unsigned long long max = b == 0 ? 0 : (min << 1) - 1;
+		PyObject *item = Py_BuildValue("(KKK)", min, max, (unsigned long long)count);
+		if (item == NULL || PyList_Append(histogram, item) != 0) {
+			Py_XDECREF(item);
+			Py_DECREF(histogram);
+			return NULL;
+		}
+		Py_DECREF(item);
+	}
+	return Py_BuildValue("{s:K,s:K,s:K,s:N}", "keys",
+			     (unsigned long long)stats->keys.load(), "key_bytes",
+			     (unsigned long long)stats->key_bytes.load(), "value_bytes",
+			     (unsigned long long)stats->value_bytes.load(), "value_sizes",
+			     histogram);
+}
+
+// "Remove range" Methods.
+static PyObject *
+pmemkv_NI_RemoveRange(PmemkvObject *self, PyObject* args) {
+	Py_buffer lo = {NULL, NULL}, hi = {NULL, NULL};
+	if (!PyArg_ParseTuple(args, "|z*z*", &lo, &hi)) {
+		return NULL;
+	}
+	KeyRange range;
+	range.bytewise = !self->custom_order;
+	if (lo.buf != NULL) {
+		range.lo.assign((const char *)lo.buf, lo.len);
+		range.has_lo = true;
+		range.lo_inclusive = true;
+		PyBuffer_Release(&lo);
+	}
+	if (hi.buf != NULL) {
+		range.hi.assign((const char *)hi.buf, hi.len);
+		range.has_hi = true;
+		PyBuffer_Release(&hi);
+	}
+	size_t removed = 0;
+	int result;
+	Py_BEGIN_ALLOW_THREADS
+	result = remove_range(self, range, &removed);
+	Py_END_ALLOW_THREADS
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return PyLong_FromSize_t(removed);
+}
+
+// Snapshots.
+
+/*
+ * Snapshot format (all integers are little-endian):
+ *   header: "PMKVSNAP", version (1 byte), codec (1 byte: 0 - none,
+ *	1 - lz4, 2 - zstd), 2 reserved bytes
+ *   blocks: raw size (4 bytes), stored size (4 bytes), number of records
+ *	(4 bytes), CRC-32C of stored data (4 bytes), stored data
+ *   end marker: block header with zero sizes and number of records,
+ *	followed by the total number of records (8 bytes), which CRC-32C
+ *	is stored in the marker
+ * Block data is compressed, unless it did not shrink (then stored size
+ * equals raw size). Uncompressed data is a sequence of records: key size
+ * (4 bytes), value size (4 bytes), expiration time in milliseconds since
+ * epoch or 0 (8 bytes), key, value. Values are stored decoded, so
+ * a snapshot may be imported into a database with different settings.
+ */
+static const char SNAPSHOT_MAGIC[] = "PMKVSNAP";
+static const size_t SNAPSHOT_MAGIC_SIZE = 8;
+static const unsigned char SNAPSHOT_VERSION = 1;
+static const size_t SNAPSHOT_HEADER_SIZE = 12;
+static const size_t SNAPSHOT_BLOCK_HEADER_SIZE = 16;
+static const size_t SNAPSHOT_RECORD_HEADER_SIZE = 16;
+/* Block is written when its data reaches this size. */
+static const size_t SNAPSHOT_BLOCK_SIZE = 4 << 20;
+
+static const char *snapshot_corrupted_msg = "Snapshot is corrupted";
+static const char *snapshot_format_msg = "Not a pmemkv snapshot";
+
+/* Computes CRC-32C of data, continuing from 'crc' of preceding data. */
+static uint32_t crc32c(const char *data, size_t size, uint32_t crc = 0)
+{
+	static const std::array<uint32_t, 256> table = [] {
+		std::array<uint32_t, 256> t;
+		for (uint32_t i = 0; i < 256; i++) {
+			uint32_t c = i;
+			for (int k = 0; k < 8; k++)
+				c = (c & 1) ? (c >> 1) ^ 0x82F63B78 : c >> 1;
+			t[i] = c;
+		}
+		return t;
+	}();
+	crc = ~crc;
+	for (size_t i = 0; i < size; i++)
+		crc = table[(crc ^ (unsigned char)data[i]) & 0xFF] ^ (crc >> 8);
+	return ~crc;
+}
+
+/*
+ * Snapshot file - a file descriptor or a Python file object. Methods are
+ * called without the GIL. On failure 'error' is set to errno, or to -1 if
+ * Python exception was raised.
+ */
+struct SnapshotFile {
+	int fd = -1;
+	PyObject *file = NULL;
+	/* interpreter which owns the file object */
+	PyInterpreterState *interp = NULL;
+	int error = 0;
+
+	bool write(const char *data, size_t size)
+	{
+		if (file != NULL) {
+			InterpreterLock lock(interp);
+			PyObject *r = PyObject_CallMethod(file, "write", "y#", data,
+							  (Py_ssize_t)size);
+			error = r == NULL ? -1 : 0;
+			Py_XDECREF(r);
+			return error == 0;
+		}
+		while (size > 0) {
+			ssize_t n = ::write(fd, data, size);
+			if (n < 0 && errno == EINTR)
+				continue;
+			if (n < 0) {
+				error = errno;
+				return false;
+			}
+			data += n;
+			size -= n;
+		}
+		return true;
+	}
+
+	/*
+	 * Reads 'size' bytes, or less if end of file is reached.
+	 * Returns number of bytes read or -1 on failure.
+	 */
+	ssize_t read(char *data, size_t size)
+	{
+		size_t done = 0;
+		if (file != NULL) {
+			InterpreterLock lock(interp);
+			while (done < size && error == 0) {
+				PyObject *r = PyObject_CallMethod(file, "read", "n",
+								  (Py_ssize_t)(size - done));
+				char *buf;
+				Py_ssize_t len;
+				if (r == NULL || PyBytes_AsStringAndSize(r, &buf, &len) < 0) {
+					error = -1;
+				} else if (len == 0) {
+					Py_DECREF(r);
+					break;
+				} else if ((size_t)len > size - done) {
+					PyErr_SetString(PyExc_ValueError,
+							"read() returned too much data");
+					error = -1;
+				} else {
+					memcpy(data + done, buf, len);
+					done += len;
+				}
+				Py_XDECREF(r);
+			}
+			return error == 0 ? (ssize_t)done : -1;
+		}
+		while (done < size) {
+			ssize_t n = ::read(fd, data + done, size - done);
+			if (n < 0 && errno == EINTR)
+				continue;
+			if (n < 0) {
+				error = errno;
+				return -1;
+			}
+			if (n == 0)
+				break;
+			done += n;
+		}
+		return done;
+	}
+};
+
+/*
+ * Serializes records into blocks. For sorted engines the scan is stopped
+ * when a block is full, so it can be written without holding EngineLock.
+ * Unsorted engines are scanned at once, so blocks are written in visit().
+ */
+struct SnapshotWriter : RangeVisitor {
+	PmemkvObject *self;
+	SnapshotFile &file;
+	Compression *c;
+	std::string block, stored, buffer, last;
+	uint32_t block_records = 0;
+	uint64_t records = 0;
+	int status = PMEMKV_STATUS_OK;
+
+	SnapshotWriter(PmemkvObject *self, SnapshotFile &file, Compression *c)
+	    : self(self), file(file), c(c)
+	{
+	}
+
+	bool visit(const char *key, size_t keybytes, const char *value,
+		   size_t valuebytes) override
+	{
+		ValueHeader h;
+		uint64_t expire_at = NO_EXPIRY;
+		if (self->value_header && parse_value_header(value, valuebytes, &h))
+			expire_at = h.expire_at;
+		int s = decode_value(self, &value, &valuebytes, &buffer);
+		if (s == PMEMKV_STATUS_NOT_FOUND)
+			return true;
+		if (s != PMEMKV_STATUS_OK ||
+		    keybytes + valuebytes > UINT32_MAX - SNAPSHOT_BLOCK_SIZE) {
+			status = s != PMEMKV_STATUS_OK ? s : PMEMKV_STATUS_INVALID_ARGUMENT;
+			return false;
+		}
+		size_t offset = block.size();
+		block.resize(offset + SNAPSHOT_RECORD_HEADER_SIZE);
+		store_le32(&block[offset], (uint32_t)keybytes);
+		store_le32(&block[offset + 4], (uint32_t)valuebytes);
+		store_le64(&block[offset + 8], expire_at);
+		block.append(key, keybytes);
+		block.append(value, valuebytes);
+		block_records++;
+		records++;
+		if (!full())
+			return true;
+		if (ordered) {
+			last.assign(key, keybytes);
+			return false;
+		}
+		return flush();
+	}
+
+	bool full() const
+	{
+		return block.size() >= SNAPSHOT_BLOCK_SIZE;
+	}
+
+	bool flush()
+	{
+		if (block_records == 0)
+			return true;
+		size_t n = 0;
+		if (c != NULL) {
+			unsigned char flags = 0;
+			size_t capacity = compress_bound(c, block.size());
+			stored.resize(SNAPSHOT_BLOCK_HEADER_SIZE + capacity);
+			n = compress_data(c, block.data(), block.size(),
+					  &stored[SNAPSHOT_BLOCK_HEADER_SIZE], capacity, &flags);
+		}
+		if (n > 0 && n < block.size()) {
+			stored.resize(SNAPSHOT_BLOCK_HEADER_SIZE + n);
+		} else {
+			stored.resize(SNAPSHOT_BLOCK_HEADER_SIZE);
+			stored.append(block);
+		}
+		size_t stored_size = stored.size() - SNAPSHOT_BLOCK_HEADER_SIZE;
+		store_le32(&stored[0], (uint32_t)block.size());
+		store_le32(&stored[4], (uint32_t)stored_size);
+		store_le32(&stored[8], block_records);
+		store_le32(&stored[12],
+			   crc32c(&stored[SNAPSHOT_BLOCK_HEADER_SIZE], stored_size));
+		block.clear();
+		block_records = 0;
+		return file.write(stored.data(), stored.size());
+	}
+
+	bool finish()
+	{
+		char marker[SNAPSHOT_BLOCK_HEADER_SIZE + 8] = {0};
+		store_le64(&marker[SNAPSHOT_BLOCK_HEADER_SIZE], records);
+		store_le32(&marker[12], crc32c(&marker[SNAPSHOT_BLOCK_HEADER_SIZE], 8));
+		return flush() && file.write(marker, sizeof(marker));
+	}
+};
+
+/*
+ * Writes records within the range to the file. It's called with the GIL
+ * released. Returns pmemkv status - if writing failed, file.error is set.
+ */
+static int export_snapshot(PmemkvObject *self, KeyRange range, SnapshotWriter &writer)
+{
+	char header[SNAPSHOT_HEADER_SIZE] = {0};
+	memcpy(header, SNAPSHOT_MAGIC, SNAPSHOT_MAGIC_SIZE);
+	header[8] = (char)SNAPSHOT_VERSION;
+	header[9] = (char)(writer.c != NULL ? writer.c->type : 0);
+	if (!writer.file.write(header, sizeof(header)))
+		return PMEMKV_STATUS_UNKNOWN_ERROR;
+	while (true) {
+		int result;
+		{
+			EngineLock guard(self);
+			result = scan_range(self, range, writer);
+		}
+		if (writer.file.error != 0)
+			return PMEMKV_STATUS_UNKNOWN_ERROR;
+		if (result == PMEMKV_STATUS_OK)
+			result = writer.status;
+		if (result != PMEMKV_STATUS_OK)
+			return result;
+		bool more = writer.ordered && writer.full();
+		if (!writer.flush())
+			return PMEMKV_STATUS_UNKNOWN_ERROR;
+		if (!more)
+			break;
+		range.lo = writer.last;
+		range.has_lo = true;
+		range.lo_inclusive = false;
+	}
+	return writer.finish() ? PMEMKV_STATUS_OK : PMEMKV_STATUS_UNKNOWN_ERROR;
+}
+
+/*
+ * Reads records from the file and writes them to the database, holding
+ * EngineLock once per block. Each block is verified before any of its
+ * records is written. Expired records are skipped. It's called with
+ * the GIL released. Returns pmemkv status and sets 'msg' - if reading
+ * failed, file.error is set.
+ */
+static int import_snapshot(PmemkvObject *self, SnapshotFile &file, uint64_t *imported,
+			   const char **msg)
+{
+	char header[SNAPSHOT_HEADER_SIZE];
+	*imported = 0;
+	*msg = snapshot_format_msg;
+	ssize_t n = file.read(header, sizeof(header));
+	if (n < 0)
+		return PMEMKV_STATUS_UNKNOWN_ERROR;
+	if (n != sizeof(header) || memcmp(header, SNAPSHOT_MAGIC, SNAPSHOT_MAGIC_SIZE) != 0 ||
+	    (unsigned char)header[8] != SNAPSHOT_VERSION)
+		return PMEMKV_STATUS_INVALID_ARGUMENT;
+	ValueHeader h = {0, NO_EXPIRY, 0, 0};
+	if (header[9] == COMPRESSION_LZ4)
+		h.flags = VALUE_FLAG_LZ4;
+	else if (header[9] == COMPRESSION_ZSTD)
+		h.flags = VALUE_FLAG_ZSTD;
+	else if (header[9] != 0)
+		return PMEMKV_STATUS_INVALID_ARGUMENT;
+#ifndef PMEMKV_PY_LZ4
+	if (h.flags == VALUE_FLAG_LZ4) {
+		*msg = "Binding was built without lz4 support";
+		return PMEMKV_STATUS_NOT_SUPPORTED;
+	}
+#endif
+#ifndef PMEMKV_PY_ZSTD
+	if (h.flags == VALUE_FLAG_ZSTD) {
+		*msg = "Binding was built without zstd support";
+		return PMEMKV_STATUS_NOT_SUPPORTED;
+	}
+#endif
+
+	*msg = snapshot_corrupted_msg;
+	std::string stored, block;
+	std::vector<size_t> offsets;
+	uint64_t records = 0;
+	while (true) {
+		char bh[SNAPSHOT_BLOCK_HEADER_SIZE];
+		n = file.read(bh, sizeof(bh));
+		if (n != sizeof(bh))
+			return PMEMKV_STATUS_UNKNOWN_ERROR;
+		uint32_t raw_size = load_le32(&bh[0]), stored_size = load_le32(&bh[4]);
+		uint32_t count = load_le32(&bh[8]), crc = load_le32(&bh[12]);
+		if (raw_size == 0 && stored_size == 0 && count == 0) {
+			char total[8];
+			if (file.read(total, sizeof(total)) != sizeof(total))
+				return PMEMKV_STATUS_UNKNOWN_ERROR;
+			if (crc32c(total, sizeof(total)) != crc || load_le64(total) != records)
+				return PMEMKV_STATUS_UNKNOWN_ERROR;
+			return PMEMKV_STATUS_OK;
+		}
+
+		stored.resize(stored_size);
+		if (file.read(&stored[0], stored_size) != (ssize_t)stored_size ||
+		    crc32c(stored.data(), stored_size) != crc || stored_size > raw_size)
+			return PMEMKV_STATUS_UNKNOWN_ERROR;
+		if (stored_size == raw_size) {
+			block.swap(stored);
+		} else {
+			if (h.flags == 0)
+				return PMEMKV_STATUS_UNKNOWN_ERROR;
+			h.raw_size = raw_size;
+			block.resize(raw_size);
+			if (!decompress_data(NULL, h, stored.data(), stored_size, &block[0]))
+				return PMEMKV_STATUS_UNKNOWN_ERROR;
+		}
+
+		offsets.clear();
+		bool has_expiry = false;
+		for (size_t pos = 0; pos < block.size();) {
+			if (block.size() - pos < SNAPSHOT_RECORD_HEADER_SIZE)
+				return PMEMKV_STATUS_UNKNOWN_ERROR;
+			size_t size = SNAPSHOT_RECORD_HEADER_SIZE +
+				(size_t)load_le32(&block[pos]) + load_le32(&block[pos + 4]);
+			if (block.size() - pos < size)
+				return PMEMKV_STATUS_UNKNOWN_ERROR;
+			has_expiry |= load_le64(&block[pos + 8]) != NO_EXPIRY;
+			offsets.push_back(pos);
+			pos += size;
+		}
+		if (offsets.size() != count)
+			return PMEMKV_STATUS_UNKNOWN_ERROR;
+		if (has_expiry && !self->value_header) {
+			*msg = expiry_disabled_msg;
+			return PMEMKV_STATUS_INVALID_ARGUMENT;
+		}
+		records += count;
+
+		uint64_t now = now_ms();
+		EngineLock guard(self);
+		for (size_t pos : offsets) {
+			const char *record = &block[pos];
+			size_t keybytes = load_le32(record), valuebytes = load_le32(record + 4);
+			uint64_t expire_at = load_le64(record + 8);
+			if (expire_at != NO_EXPIRY && expire_at <= now)
+				continue;
+			const char *key = record + SNAPSHOT_RECORD_HEADER_SIZE;
+			int result = store_value(self, key, keybytes, key + keybytes,
+						 valuebytes, expire_at);
+			if (result != PMEMKV_STATUS_OK) {
+				*msg = pmemkv_errormsg();
+				return result;
+			}
+			(*imported)++;
+		}
+	}
+}
+
+/*
+ * Opens snapshot file. 'target' is a Python file object (if it has 'method'
+ * attribute) or a path. Returns false with Python exception set on failure.
+ */
+static bool open_snapshot_file(PyObject *target, const char *method, int flags,
+			       SnapshotFile *file)
+{
+	if (PyObject_HasAttrString(target, method)) {
+		file->file = target;
+		file->interp = current_interpreter();
+		return true;
+	}
+	PyObject *path;
+	if (!PyUnicode_FSConverter(target, &path))
+		return false;
+	Py_BEGIN_ALLOW_THREADS
+	file->fd = open(PyBytes_AS_STRING(path), flags | O_CLOEXEC, 0644);
+	Py_END_ALLOW_THREADS
+	Py_DECREF(path);
+	if (file->fd < 0) {
+		PyErr_SetFromErrnoWithFilenameObject(PyExc_OSError, target);
+		return false;
+	}
+	return true;
+}
+
+/* Closes snapshot file and sets Python exception if it has failed. */
+static void close_snapshot_file(PyObject *target, SnapshotFile *file)
+{
+	if (file->fd >= 0 && close(file->fd) < 0 && file->error == 0)
+		file->error = errno;
+	if (file->error > 0) {
+		errno = file->error;
+		PyErr_SetFromErrnoWithFilenameObject(PyExc_OSError, target);
+	}
+}
+
+static PyObject *
+pmemkv_NI_Export(PmemkvObject *self, PyObject* args) {
+	PyObject *target;
+	Py_buffer lo = {NULL, NULL}, hi = {NULL, NULL}, no_dictionary = {NULL, NULL};
+	const char *compression = NULL;
+	int level = 0;
+	if (!PyArg_ParseTuple(args, "O|z*z*zi", &target, &lo, &hi, &compression,
+			      &level)) {
+		return NULL;
+	}
+	KeyRange range;
+	range.bytewise = !self->custom_order;
+	if (lo.buf != NULL) {
+		range.lo.assign((const char *)lo.buf, lo.len);
+		range.has_lo = true;
+		range.lo_inclusive = true;
+		PyBuffer_Release(&lo);
+	}
+	if (hi.buf != NULL) {
+		range.hi.assign((const char *)hi.buf, hi.len);
+		range.has_hi = true;
+		PyBuffer_Release(&hi);
+	}
+	Compression *c = NULL;
+	if (compression != NULL) {
+		c = create_compression(compression, 0, level, &no_dictionary);
+		if (c == NULL)
+			return NULL;
+	}
+	SnapshotFile file;
+	if (!open_snapshot_file(target, "write", O_WRONLY | O_CREAT | O_TRUNC, &file)) {
+		delete_compression(c);
+		return NULL;
+	}
+
+	SnapshotWriter writer(self, file, c);
+	int result;
+	Py_BEGIN_ALLOW_THREADS
+	result = export_snapshot(self, range, writer);
+	Py_END_ALLOW_THREADS
+	delete_compression(c);
+	close_snapshot_file(target, &file);
+	if (file.error != 0)
+		return NULL;
+	if (writer.status != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(writer.status),
+				writer.status == PMEMKV_STATUS_INVALID_ARGUMENT
+					? "Record is too large for a snapshot"
+					: corrupted_msg);
+		return NULL;
+	}
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
+		return NULL;
+	}
+	return PyLong_FromUnsignedLongLong(writer.records);
+}
+
+static PyObject *
+pmemkv_NI_Import(PmemkvObject *self, PyObject* args) {
+	PyObject *source;
+	if (!PyArg_ParseTuple(args, "O", &source)) {
+		return NULL;
+	}
+	SnapshotFile file;
+	if (!open_snapshot_file(source, "read", O_RDONLY, &file))
+		return NULL;
+	uint64_t imported = 0;
+	const char *msg = NULL;
+	int result;
+	Py_BEGIN_ALLOW_THREADS
+	result = import_snapshot(self, file, &imported, &msg);
+	Py_END_ALLOW_THREADS
+	close_snapshot_file(source, &file);
+	if (file.error != 0)
+		return NULL;
+	if (result != PMEMKV_STATUS_OK) {
+		PyErr_SetString(pmemkv_exception(result), msg);
+		return NULL;
+	}
+	return PyLong_FromUnsignedLongLong(imported);
+}
+
+// Images of volatile engines.
+
+/*
+ * Image file format (all integers are little-endian):
+ *   header: "PMKVIMAG", version (1 byte), flags (1 byte), 6 reserved bytes,
+ *	number of records (8 bytes), size of data (8 bytes), CRC-32C of data
+ *	(4 bytes), 4 reserved bytes
+ *   data: records sorted by key - key size (4 bytes), value size (4 bytes),
+ *	key, value
+ * Values are stored as they are kept by the engine (with headers, if
+ * IMAGE_FLAG_VALUE_HEADER is set), so loading does not encode them again.
+ */
+static const char IMAGE_MAGIC[] = "PMKVIMAG";
+static const unsigned char IMAGE_VERSION = 1;
+static const unsigned char IMAGE_FLAG_VALUE_HEADER = 0x01;
+static const size_t IMAGE_HEADER_SIZE = 40;
+static const size_t IMAGE_RECORD_HEADER_SIZE = 8;
+/* Number of records loaded holding EngineLock once. */
+static const size_t IMAGE_BATCH_SIZE = 4096;
+
+static const char *image_corrupted_msg = "Image is corrupted";
+
+struct ImageCollector : RangeVisitor {
+	PmemkvObject *self;
+	uint64_t now = now_ms();
+	std::string data;
+	std::vector<size_t> offsets;
+	bool too_large = false;
+
+	ImageCollector(PmemkvObject *self) : self(self)
+	{
+	}
+
+	bool visit(const char *key, size_t keybytes, const char *value,
+		   size_t valuebytes) override
+	{
+		ValueHeader h;
+		if (self->value_header && parse_value_header(value, valuebytes, &h) &&
+		    is_expired(h, now))
+			return true;
+		if (keybytes > UINT32_MAX || valuebytes > UINT32_MAX) {
+			too_large = true;
+			return false;
+		}
+		char header[IMAGE_RECORD_HEADER_SIZE];
+		store_le32(&header[0], (uint32_t)keybytes);
+		store_le32(&header[4], (uint32_t)valuebytes);
+		offsets.push_back(data.size());
+		data.append(header, sizeof(header));
+		data.append(key, keybytes);
+		data.append(value, valuebytes);
+		return true;
+	}
+
+	const char *record(size_t offset, size_t *size) const
+	{
+		const char *r = &data[offset];
+		*size = IMAGE_RECORD_HEADER_SIZE + load_le32(r) + load_le32(r + 4);
+		return r;
+	}
+
+	/* Sorts records of unsorted engines by key. */
+	void sort()
+	{
+		if (ordered)
+			return;
+		std::sort(offsets.begin(), offsets.end(), [this](size_t a, size_t b) {
+			const char *ra = &data[a], *rb = &data[b];
+			return compare_bytes(ra + IMAGE_RECORD_HEADER_SIZE, load_le32(ra),
+					     rb + IMAGE_RECORD_HEADER_SIZE,
+					     load_le32(rb)) < 0;
+		});
+	}
+};
 
-	Py_DECREF(args); // args is the owner of the contained objects reference counters
+/*
+ * Writes the image into a temporary file, which is renamed to 'path' when
+ * it's complete. It's called with the GIL released. Returns 0 or errno.
+ */
+static int write_image(const ImageCollector &collector, bool value_header,
+		       const std::string &path)
+{
+	std::string tmp_path = path + ".tmp";
+	SnapshotFile file;
+	file.fd = open(tmp_path.c_str(), O_WRONLY | O_CREAT | O_TRUNC | O_CLOEXEC, 0644);
+	if (file.fd < 0)
+		return errno;
 
-	if (PyErr_Occurred() != NULL)
-		return -1;
-	return 0;
+	char header[IMAGE_HEADER_SIZE] = {0};
+	uint32_t crc = 0;
+	bool ok = file.write(header, sizeof(header));
+	if (collector.ordered) {
+		crc = crc32c(collector.data.data(), collector.data.size());
+		ok = ok && file.write(collector.data.data(), collector.data.size());
+	} else {
+		std::string chunk;
+		for (size_t i = 0; ok && i < collector.offsets.size(); i++) {
+			size_t size;
+			const char *r = collector.record(collector.offsets[i], &size);
+			chunk.append(r, size);
+			if (chunk.size() < SNAPSHOT_BLOCK_SIZE &&
+			    i + 1 < collector.offsets.size())
+				continue;
+			crc = crc32c(chunk.data(), chunk.size(), crc);
+			ok = file.write(chunk.data(), chunk.size());
+			chunk.clear();
+		}
+	}
+
+	memcpy(header, IMAGE_MAGIC, sizeof(IMAGE_MAGIC) - 1);
+	header[8] = (char)IMAGE_VERSION;
+	header[9] = (char)(value_header ? IMAGE_FLAG_VALUE_HEADER : 0);
+	store_le64(&header[16], collector.offsets.size());
+	store_le64(&header[24], collector.data.size());
+	store_le32(&header[32], crc);
+	if (ok && pwrite(file.fd, header, sizeof(header), 0) != sizeof(header))
+		file.error = errno;
+	if (file.error == 0 && fsync(file.fd) < 0)
+		file.error = errno;
+	if (close(file.fd) < 0 && file.error == 0)
+		file.error = errno;
+	if (file.error == 0 && rename(tmp_path.c_str(), path.c_str()) < 0)
+		file.error = errno;
+	if (file.error != 0)
+		unlink(tmp_path.c_str());
+	return file.error;
 }
 
-// "All" Methods.
 static PyObject *
-pmemkv_NI_GetKeys(PmemkvObject *self, PyObject* args) {
-	PyObject* python_callback;
-	if (!PyArg_ParseTuple(args, "O:set_callback", &python_callback)) {
+pmemkv_NI_SaveImage(PmemkvObject *self, PyObject* args) {
+	PyObject *path_object, *path;
+	if (!PyArg_ParseTuple(args, "O", &path_object)) {
 		return NULL;
 	}
-	int result = pmemkv_get_all(self->db, key_callback, python_callback);
-	if (PyErr_Occurred() != NULL)
+	if (!PyUnicode_FSConverter(path_object, &path))
 		return NULL;
+	std::string image_path(PyBytes_AS_STRING(path), PyBytes_GET_SIZE(path));
+	Py_DECREF(path);
+
+	ImageCollector collector(self);
+	int result, error = 0;
+	Py_BEGIN_ALLOW_THREADS
+	{
+		EngineLock guard(self);
+		result = scan_range(self, KeyRange(), collector);
+	}
+	if (result == PMEMKV_STATUS_OK && !collector.too_large) {
+		collector.sort();
+		error = write_image(collector, self->value_header, image_path);
+	}
+	Py_END_ALLOW_THREADS
 	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
 		return NULL;
 	}
-	Py_RETURN_NONE;
-}
-
-static PyObject *
-pmemkv_NI_GetKeysAbove(PmemkvObject *self, PyObject* args) {
-	Py_buffer key;
-	PyObject* python_callback;
-	if (!PyArg_ParseTuple(args, "s*O:set_callback", &key, &python_callback)) {
+	if (collector.too_large) {
+		PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+				"Record is too large for an image");
 		return NULL;
 	}
-	int result = pmemkv_get_above(self->db, (const char *)key.buf, key.len,
-				      key_callback, python_callback);
-	if (PyErr_Occurred() != NULL)
-		return NULL;
-	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
+	if (error != 0) {
+		errno = error;
+		PyErr_SetFromErrnoWithFilenameObject(PyExc_OSError, path_object);
 		return NULL;
 	}
-	Py_RETURN_NONE;
+	return PyLong_FromSize_t(collector.offsets.size());
+}
+
+/*
+ * Checks framing, number of records and checksum of the image data, so
+ * records of a corrupted image are not inserted.
+ */
+static bool verify_image(const char *data, size_t data_size, uint64_t records,
+			 uint32_t crc)
+{
+	uint64_t count = 0;
+	size_t pos = 0;
+	while (pos < data_size) {
+		if (data_size - pos < IMAGE_RECORD_HEADER_SIZE)
+			return false;
+		size_t record_size = IMAGE_RECORD_HEADER_SIZE + load_le32(data + pos) +
+			load_le32(data + pos + 4);
+		if (data_size - pos < record_size)
+			return false;
+		pos += record_size;
+		count++;
+	}
+	return count == records && crc32c(data, data_size) == crc;
+}
+
+/*
+ * Puts records from the mapped image into the database, once the image is
+ * verified. Returns pmemkv status and sets 'msg'.
+ */
+static int load_image(PmemkvObject *self, const char *image, size_t size,
+		      uint64_t *loaded, const char **msg)
+{
+	*loaded = 0;
+	*msg = "Not a pmemkv image";
+	if (size < IMAGE_HEADER_SIZE ||
+	    memcmp(image, IMAGE_MAGIC, sizeof(IMAGE_MAGIC) - 1) != 0 ||
+	    (unsigned char)image[8] != IMAGE_VERSION)
+		return PMEMKV_STATUS_INVALID_ARGUMENT;
+	bool value_header = (unsigned char)image[9] & IMAGE_FLAG_VALUE_HEADER;
+	if (value_header && !self->value_header) {
+		*msg = "Image was saved with expiry or compression enabled";
+		return PMEMKV_STATUS_INVALID_ARGUMENT;
+	}
+	uint64_t records = load_le64(image + 16);
+	uint64_t data_size = load_le64(image + 24);
+	uint32_t crc = load_le32(image + 32);
+	*msg = image_corrupted_msg;
+	const char *data = image + IMAGE_HEADER_SIZE;
+	if (data_size != size - IMAGE_HEADER_SIZE ||
+	    !verify_image(data, data_size, records, crc))
+		return PMEMKV_STATUS_UNKNOWN_ERROR;
+
+	uint64_t now = now_ms();
+	size_t pos = 0;
+	while (pos < data_size) {
+		EngineLock guard(self);
+		for (size_t i = 0; i < IMAGE_BATCH_SIZE && pos < data_size; i++) {
+			size_t keybytes = load_le32(data + pos);
+			size_t valuebytes = load_le32(data + pos + 4);
+			const char *key = data + pos + IMAGE_RECORD_HEADER_SIZE;
+			const char *value = key + keybytes;
+			pos += IMAGE_RECORD_HEADER_SIZE + keybytes + valuebytes;
+
+			ValueHeader h;
+			if (value_header && parse_value_header(value, valuebytes, &h) &&
+			    is_expired(h, now))
+				continue;
+			int result = engine_put(self, key, keybytes, value, valuebytes);
+			if (result != PMEMKV_STATUS_OK) {
+				*msg = pmemkv_errormsg();
+				return result;
+			}
+			(*loaded)++;
+		}
+	}
+	return PMEMKV_STATUS_OK;
 }
 
 static PyObject *
-pmemkv_NI_GetKeysBelow(PmemkvObject *self, PyObject* args) {
-	Py_buffer key;
-	PyObject* python_callback;
-	if (!PyArg_ParseTuple(args, "s*O:set_callback", &key, &python_callback)) {
+pmemkv_NI_LoadImage(PmemkvObject *self, PyObject* args) {
+	PyObject *path_object, *path;
+	if (!PyArg_ParseTuple(args, "O", &path_object)) {
 		return NULL;
 	}
-	int result = pmemkv_get_below(self->db, (const char *)key.buf, key.len,
-				      key_callback, python_callback);
-	if (PyErr_Occurred() != NULL)
+	if (!PyUnicode_FSConverter(path_object, &path))
+		return NULL;
+	int fd;
+	Py_BEGIN_ALLOW_THREADS
+	fd = open(PyBytes_AS_STRING(path), O_RDONLY | O_CLOEXEC);
+	Py_END_ALLOW_THREADS
+	Py_DECREF(path);
+	struct stat st;
+	void *image = MAP_FAILED;
+	if (fd >= 0 && fstat(fd, &st) == 0)
+		image = st.st_size > 0
+			? mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0)
+			: (void *)"";
+	if (image == MAP_FAILED) {
+		PyErr_SetFromErrnoWithFilenameObject(PyExc_OSError, path_object);
+		if (fd >= 0)
+			close(fd);
 		return NULL;
+	}
+	close(fd);
+
+	uint64_t loaded = 0;
+	const char *msg = NULL;
+	int result;
+	Py_BEGIN_ALLOW_THREADS
+	if (st.st_size > 0)
+		madvise(image, st.st_size, MADV_SEQUENTIAL);
+	result = load_image(self, (const char *)image, st.st_size, &loaded, &msg);
+	if (st.st_size > 0)
+		munmap(image, st.st_size);
+	Py_END_ALLOW_THREADS
 	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
+		PyErr_SetString(pmemkv_exception(result), msg);
 		return NULL;
 	}
-	Py_RETURN_NONE;
+	return PyLong_FromUnsignedLongLong(loaded);
+}
+
+// Change data capture.
+
+/*
+ * Bounded log of mutations done through the binding. Records are appended
+ * by engine_put/engine_remove after a successful write (so for engines
+ * which are not thread-safe, in the order of writes) and consumed by
+ * read_changes(). When the log is full, the oldest record is dropped or,
+ * if 'block' is set, the writer waits until there is space. The log is
+ * allocated once and freed when the database is stopped. The GIL is never
+ * acquired while holding its mutex.
+ */
+struct Change {
+	uint64_t seq;
+	int op;
+	std::string key;
+	std::string value;
+	size_t value_len;
+	bool has_value;
+};
+
+struct ChangeLog {
+	std::mutex mtx;
+	std::condition_variable readable, writable;
+	std::atomic<bool> enabled{false};
+	std::deque<Change> records;
+	size_t capacity;
+	bool values;
+	bool block;
+	/* readers and writers waiting on the log */
+	size_t waiting = 0;
+	uint64_t seq = 0;
+	uint64_t dropped = 0;
+	uint64_t blocked = 0;
+};
+
+static const char *ChangeOps[] = {NULL, "put", "remove"};
+
+/*
+ * Appends the record to the log. Returns false if the log is full and
+ * writers should block, unless 'wait' is set.
+ */
+static bool append_change(ChangeLog *log, Change &change, bool wait)
+{
+	std::unique_lock<std::mutex> lock(log->mtx);
+	if (log->records.size() >= log->capacity && log->block && log->enabled) {
+		if (!wait)
+			return false;
+		log->blocked++;
+		log->waiting++;
+		log->writable.wait(lock, [log] {
+			return log->records.size() < log->capacity || !log->enabled;
+		});
+		log->waiting--;
+		log->writable.notify_all();
+	}
+	if (!log->enabled)
+		return true;
+	if (log->records.size() >= log->capacity) {
+		log->records.pop_front();
+		log->dropped++;
+	}
+	change.seq = ++log->seq;
+	log->records.push_back(std::move(change));
+	log->readable.notify_one();
+	return true;
+}
+
+static void record_change(PmemkvObject *self, int op, const char *key, size_t keybytes,
+			  const char *value, size_t valuebytes)
+{
+	ChangeLog *log = self->changes.load(std::memory_order_acquire);
+	if (log == NULL || !log->enabled.load(std::memory_order_relaxed))
+		return;
+	Change change = {0, op, std::string(key, keybytes), std::string(), valuebytes,
+			 false};
+	ValueHeader h;
+	if (op == CHANGE_PUT && log->values) {
+		std::string buffer;
+		if (decode_value(self, &value, &valuebytes, &buffer) == PMEMKV_STATUS_OK)
+			change.value.assign(value, valuebytes);
+		change.value_len = change.value.size();
+		change.has_value = true;
+	} else if (op == CHANGE_PUT && self->value_header &&
+		   parse_value_header(value, valuebytes, &h)) {
+		change.value_len = (h.flags & (VALUE_FLAG_LZ4 | VALUE_FLAG_ZSTD))
+			? h.raw_size
+			: valuebytes - h.size;
+	}
+
+	if (append_change(log, change, false))
+		return;
+	/* writer has to wait for the consumer, which may need the GIL */
+	if (holds_gil()) {
+		Py_BEGIN_ALLOW_THREADS
+		append_change(log, change, true);
+		Py_END_ALLOW_THREADS
+	} else {
+		append_change(log, change, true);
+	}
+}
+
+/* Disables the log and wakes up all waiting readers and writers. */
+static void close_changes(ChangeLog *log)
+{
+	std::lock_guard<std::mutex> lock(log->mtx);
+	log->enabled = false;
+	log->readable.notify_all();
+	log->writable.notify_all();
+}
+
+static void delete_changes(PmemkvObject *self)
+{
+	ChangeLog *log = self->changes;
+	if (log == NULL)
+		return;
+	close_changes(log);
+	Py_BEGIN_ALLOW_THREADS
+	{
+		std::unique_lock<std::mutex> lock(log->mtx);
+		log->writable.wait(lock, [log] { return log->waiting == 0; });
+	}
+	Py_END_ALLOW_THREADS
+	self->changes = NULL;
+	delete log;
 }
 
 static PyObject *
-pmemkv_NI_GetKeysBetween(PmemkvObject *self, PyObject* args) {
-	Py_buffer key1, key2;
-	PyObject* python_callback;
-	if (!PyArg_ParseTuple(args, "s*s*O:set_callback", &key1, &key2, &python_callback)) {
+pmemkv_NI_EnableChanges(PmemkvObject *self, PyObject* args) {
+	Py_ssize_t capacity;
+	int values, block;
+	if (!PyArg_ParseTuple(args, "npp", &capacity, &values, &block)) {
 		return NULL;
 	}
-	int result = pmemkv_get_between(self->db, (const char *)key1.buf, key1.len,
-					(const char *)key2.buf, key2.len, key_callback,
-					python_callback);
-	if (PyErr_Occurred() != NULL)
+	if (capacity <= 0) {
+		PyErr_SetString(PyExc_ValueError, "Capacity should be positive");
 		return NULL;
-	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
+	}
+	/* writes done through other objects would not be logged */
+	if (self->shared != NULL) {
+		PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_NOT_SUPPORTED),
+				"Change log can not be enabled on a shared engine");
 		return NULL;
 	}
+	ChangeLog *log = self->changes;
+	if (log == NULL) {
+		log = new ChangeLog();
+		self->changes.store(log, std::memory_order_release);
+	}
+	std::lock_guard<std::mutex> lock(log->mtx);
+	log->capacity = capacity;
+	log->values = values;
+	log->block = block;
+	if (!log->enabled) {
+		log->records.clear();
+		log->dropped = 0;
+		log->blocked = 0;
+	}
+	log->enabled = true;
+	log->writable.notify_all();
 	Py_RETURN_NONE;
 }
 
-// "Count" Methods.
 static PyObject *
-pmemkv_NI_CountAll(PmemkvObject *self) {
-	size_t cnt;
-	int result = pmemkv_count_all(self->db, &cnt);
-	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
-		return NULL;
-	}
-	return Py_BuildValue("i", cnt);
+pmemkv_NI_DisableChanges(PmemkvObject *self) {
+	if (self->changes != NULL)
+		close_changes(self->changes);
+	Py_RETURN_NONE;
 }
 
 static PyObject *
-pmemkv_NI_CountAbove(PmemkvObject *self, PyObject* args) {
-	Py_buffer key;
-	if (!PyArg_ParseTuple(args, "s*", &key)) {
+pmemkv_NI_ReadChanges(PmemkvObject *self, PyObject* args) {
+	Py_ssize_t max_records;
+	double timeout;
+	if (!PyArg_ParseTuple(args, "nd", &max_records, &timeout)) {
 		return NULL;
 	}
-	size_t cnt;
-	int result = pmemkv_count_above(self->db, (const char*) key.buf, key.len, &cnt);
-	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
+	ChangeLog *log = self->changes;
+	if (log == NULL)
+		Py_RETURN_NONE;
+	std::vector<Change> batch;
+	bool open;
+	Py_BEGIN_ALLOW_THREADS
+	{
+		std::unique_lock<std::mutex> lock(log->mtx);
+		log->waiting++;
+		auto ready = [log] { return !log->records.empty() || !log->enabled; };
+		if (timeout < 0)
+			log->readable.wait(lock, ready);
+		else
+			log->readable.wait_for(
+				lock, std::chrono::duration<double>(timeout), ready);
+		while (!log->records.empty() && batch.size() < (size_t)max_records) {
+			batch.push_back(std::move(log->records.front()));
+			log->records.pop_front();
+		}
+		open = log->enabled || !batch.empty();
+		log->waiting--;
+		log->writable.notify_all();
+	}
+	Py_END_ALLOW_THREADS
+	if (!open)
+		Py_RETURN_NONE;
+
+	PyObject *list = PyList_New(batch.size());
+	if (list == NULL)
 		return NULL;
+	for (size_t i = 0; i < batch.size(); i++) {
+		Change &c = batch[i];
+		PyObject *item;
+		if (c.has_value)
+			item = Py_BuildValue("(Ksy#y#)", (unsigned long long)c.seq,
+					     ChangeOps[c.op], c.key.data(),
+					     (Py_ssize_t)c.key.size(), c.value.data(),
+					     (Py_ssize_t)c.value.size());
+		else
+			item = Py_BuildValue("(Ksy#n)", (unsigned long long)c.seq,
+					     ChangeOps[c.op], c.key.data(),
+					     (Py_ssize_t)c.key.size(), (Py_ssize_t)c.value_len);
+		if (item == NULL) {
+			Py_DECREF(list);
+			return NULL;
+		}
+		PyList_SET_ITEM(list, i, item);
 	}
-	return Py_BuildValue("i", cnt);
+	return list;
 }
 
 static PyObject *
-pmemkv_NI_CountBelow(PmemkvObject *self, PyObject* args) {
-	Py_buffer key;
-	if (!PyArg_ParseTuple(args, "s*", &key)) {
-		return NULL;
+pmemkv_NI_ChangesStats(PmemkvObject *self) {
+	ChangeLog *log = self->changes;
+	if (log == NULL)
+		Py_RETURN_NONE;
+	std::lock_guard<std::mutex> lock(log->mtx);
+	return Py_BuildValue("{s:O,s:K,s:n,s:n,s:K,s:K}", "enabled",
+			     log->enabled ? Py_True : Py_False, "seq",
+			     (unsigned long long)log->seq, "pending",
+			     (Py_ssize_t)log->records.size(), "capacity",
+			     (Py_ssize_t)log->capacity, "dropped",
+			     (unsigned long long)log->dropped, "blocked",
+			     (unsigned long long)log->blocked);
+}
+
+// Secondary indexes.
+
+/*
+ * Index is kept in a separate (sorted) database, with entries mapping
+ * encoded index key followed by the primary key to an empty value. Index key
+ * is escaped (0x00 becomes 0x00 0xFF) and terminated with 0x00 0x01, so
+ * entries are ordered by index key and then by primary key. Entries are
+ * updated by engine_put/engine_remove, which read the old value first.
+ * For thread-safe engines concurrent writes of the same key may leave
+ * a stale entry, until the key is written again.
+ */
+enum IndexExtractor { EXTRACT_JSON = 1, EXTRACT_STRUCT = 2, EXTRACT_PYTHON = 3 };
+
+struct Index {
+	std::string name;
+	PmemkvObject *db;
+	int extractor;
+	std::vector<std::string> pointer;
+	size_t offset = 0, size = 0;
+	bool reverse = false;
+	PyObject *callable = NULL;
+};
+
+/*
+ * Indexes of a database. Writers hold the lock shared, while indexes are
+ * created or dropped holding it exclusively.
+ */
+struct Indexes {
+	std::shared_timed_mutex mtx;
+	std::vector<Index *> list;
+};
+
+/* Holds Indexes lock shared, releasing the GIL while waiting (see EngineLock). */
+class IndexLock {
+public:
+	IndexLock(Indexes *indexes) : mtx(indexes->mtx)
+	{
+		if (mtx.try_lock_shared())
+			return;
+		if (holds_gil()) {
+			Py_BEGIN_ALLOW_THREADS
+			mtx.lock_shared();
+			Py_END_ALLOW_THREADS
+		} else {
+			mtx.lock_shared();
+		}
 	}
-	size_t cnt;
-	int result = pmemkv_count_below(self->db, (const char*) key.buf, key.len, &cnt);
-	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
-		return NULL;
+
+	~IndexLock()
+	{
+		mtx.unlock_shared();
 	}
-	return Py_BuildValue("i", cnt);
+
+private:
+	std::shared_timed_mutex &mtx;
+};
+
+static void skip_json_whitespace(const char *&p, const char *end)
+{
+	while (p < end && (*p == ' ' || *p == '\t' || *p == '\n' || *p == '\r'))
+		p++;
 }
 
-static PyObject *
-pmemkv_NI_CountBetween(PmemkvObject *self, PyObject* args) {
-	Py_buffer key1, key2;
-	if (!PyArg_ParseTuple(args, "s*s*", &key1, &key2)) {
-		return NULL;
+static bool parse_hex4(const char *&p, const char *end, uint32_t *cp)
+{
+	if (end - p < 4)
+		return false;
+	*cp = 0;
+	for (int i = 0; i < 4; i++, p++) {
+		char c = *p;
+		int digit = c >= '0' && c <= '9' ? c - '0'
+			: c >= 'a' && c <= 'f'   ? c - 'a' + 10
+			: c >= 'A' && c <= 'F'   ? c - 'A' + 10
+						 : -1;
+		if (digit < 0)
+			return false;
+		*cp = (*cp << 4) | digit;
 	}
-	size_t cnt;
-	int result = pmemkv_count_between(self->db, (const char*) key1.buf, key1.len, (const char*) key2.buf, key2.len, &cnt);
-	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
-		return NULL;
+	return true;
+}
+
+static void append_utf8(std::string *out, uint32_t cp)
+{
+	if (cp < 0x80) {
+		out->push_back((char)cp);
+	} else if (cp < 0x800) {
+		out->push_back((char)(0xC0 | (cp >> 6)));
+		out->push_back((char)(0x80 | (cp & 0x3F)));
+	} else if (cp < 0x10000) {
+		out->push_back((char)(0xE0 | (cp >> 12)));
+		out->push_back((char)(0x80 | ((cp >> 6) & 0x3F)));
+		out->push_back((char)(0x80 | (cp & 0x3F)));
+	} else {
+		out->push_back((char)(0xF0 | (cp >> 18)));
+		out->push_back((char)(0x80 | ((cp >> 12) & 0x3F)));
+		out->push_back((char)(0x80 | ((cp >> 6) & 0x3F)));
+		out->push_back((char)(0x80 | (cp & 0x3F)));
+	}
+}
+
+/* Parses JSON string starting at p, unescaping it into 'out' (if not NULL). */
+static bool parse_json_string(const char *&p, const char *end, std::string *out)
+{
+	static const char escapes[] = "\"\"\\\\//b\bf\fn\nr\rt\t";
+	for (p++; p < end;) {
+		char c = *p++;
+		if (c == '"')
+			return true;
+		if (c != '\\') {
+			if (out != NULL)
+				out->push_back(c);
+			continue;
+		}
+		if (p == end)
+			return false;
+		c = *p++;
+		if (c == 'u') {
+			uint32_t cp, low;
+			if (!parse_hex4(p, end, &cp))
+				return false;
+			if (cp >= 0xD800 && cp < 0xDC00) {
+				if (end - p < 2 || p[0] != '\\' || p[1] != 'u')
+					return false;
+				p += 2;
+				if (!parse_hex4(p, end, &low) || low < 0xDC00 || low > 0xDFFF)
+					return false;
+				cp = 0x10000 + ((cp - 0xD800) << 10) + (low - 0xDC00);
+			}
+			if (out != NULL)
+				append_utf8(out, cp);
+			continue;
+		}
+		const char *e = escapes;
+		while (*e != '\0' && *e != c)
+			e += 2;
+		if (*e == '\0')
+			return false;
+		if (out != NULL)
+			out->push_back(e[1]);
+	}
+	return false;
+}
+
+static const int MAX_JSON_DEPTH = 128;
+
+/* Skips JSON value starting at p. */
+static bool skip_json_value(const char *&p, const char *end, int depth = 0)
+{
+	skip_json_whitespace(p, end);
+	if (p == end || depth > MAX_JSON_DEPTH)
+		return false;
+	if (*p == '"')
+		return parse_json_string(p, end, NULL);
+	if (*p != '{' && *p != '[') {
+		const char *start = p;
+		while (p < end && (isalnum((unsigned char)*p) || strchr("+-.", *p) != NULL))
+			p++;
+		return p > start;
+	}
+	char close = *p == '{' ? '}' : ']';
+	p++;
+	skip_json_whitespace(p, end);
+	if (p < end && *p == close) {
+		p++;
+		return true;
+	}
+	while (true) {
+		if (close == '}') {
+			skip_json_whitespace(p, end);
+			if (p == end || *p != '"' || !parse_json_string(p, end, NULL))
+				return false;
+			skip_json_whitespace(p, end);
+			if (p == end || *p++ != ':')
+				return false;
+		}
+		if (!skip_json_value(p, end, depth + 1))
+			return false;
+		skip_json_whitespace(p, end);
+		if (p == end)
+			return false;
+		if (*p == close) {
+			p++;
+			return true;
+		}
+		if (*p++ != ',')
+			return false;
+	}
+}
+
+/*
+ * Extracts scalar value pointed by JSON pointer (split into tokens). Strings
+ * are unescaped, other scalars are returned as they are written. Returns false
+ * if there is no such value, it's null, an object or an array.
+ */
+static bool extract_json(const char *p, const char *end,
+			 const std::vector<std::string> &pointer, std::string *out)
+{
+	for (auto &token : pointer) {
+		skip_json_whitespace(p, end);
+		if (p == end || (*p != '{' && *p != '['))
+			return false;
+		bool object = *p++ == '{';
+		char *index_end;
+		unsigned long index = strtoul(token.c_str(), &index_end, 10);
+		if (!object && (token.empty() || *index_end != '\0' ||
+				(token[0] == '0' && token.size() > 1) || token[0] == '-'))
+			return false;
+		for (unsigned long i = 0;; i++) {
+			skip_json_whitespace(p, end);
+			if (p == end || *p == '}' || *p == ']')
+				return false;
+			if (object) {
+				std::string key;
+				if (*p != '"' || !parse_json_string(p, end, &key))
+					return false;
+				skip_json_whitespace(p, end);
+				if (p == end || *p++ != ':')
+					return false;
+				if (key == token)
+					break;
+			} else if (i == index) {
+				break;
+			}
+			if (!skip_json_value(p, end))
+				return false;
+			skip_json_whitespace(p, end);
+			if (p == end || *p++ != ',')
+				return false;
+		}
+	}
+	skip_json_whitespace(p, end);
+	if (p == end || *p == '{' || *p == '[')
+		return false;
+	if (*p == '"')
+		return parse_json_string(p, end, out);
+	const char *start = p;
+	if (!skip_json_value(p, end) ||
+	    (p - start == 4 && strncmp(start, "null", 4) == 0))
+		return false;
+	out->assign(start, p - start);
+	return true;
+}
+
+/* Computes index key of the value. Returns false if value is not indexed. */
+static bool extract_index_key(const Index *index, const char *value, size_t valuebytes,
+			      std::string *out)
+{
+	out->clear();
+	if (index->extractor == EXTRACT_JSON)
+		return extract_json(value, value + valuebytes, index->pointer, out);
+	if (index->extractor == EXTRACT_STRUCT) {
+		if (valuebytes < index->offset + index->size)
+			return false;
+		out->assign(value + index->offset, index->size);
+		if (index->reverse)
+			std::reverse(out->begin(), out->end());
+		return true;
+	}
+
+	InterpreterLock lock(index->db->interp);
+	bool indexed = false;
+	PyObject *result = PyObject_CallFunction(index->callable, "y#", value,
+						 (Py_ssize_t)valuebytes);
+	if (result != NULL && result != Py_None) {
+		Py_buffer key;
+		if (PyUnicode_Check(result)) {
+			Py_ssize_t size;
+			const char *data = PyUnicode_AsUTF8AndSize(result, &size);
+			if (data != NULL) {
+				out->assign(data, size);
+				indexed = true;
+			}
+		} else if (PyObject_GetBuffer(result, &key, PyBUF_SIMPLE) == 0) {
+			out->assign((const char *)key.buf, key.len);
+			PyBuffer_Release(&key);
+			indexed = true;
+		}
+	}
+	Py_XDECREF(result);
+	/* write can not be aborted at this point, so errors are only reported */
+	if (PyErr_Occurred() != NULL)
+		PyErr_WriteUnraisable(index->callable);
+	return indexed;
+}
+
+static std::string index_entry(const std::string &index_key, const char *key = NULL,
+			       size_t keybytes = 0)
+{
+	std::string entry;
+	entry.reserve(index_key.size() + 2 + keybytes);
+	for (char c : index_key) {
+		entry.push_back(c);
+		if (c == '\0')
+			entry.push_back('\xFF');
+	}
+	entry.append("\0\x01", 2);
+	entry.append(key, keybytes);
+	return entry;
+}
+
+/* Returns primary key of the index entry. */
+static bool index_entry_key(const char *entry, size_t size, std::string *key)
+{
+	for (size_t i = 0; i + 1 < size; i++) {
+		if (entry[i] != '\0')
+			continue;
+		if (entry[i + 1] == '\x01') {
+			key->assign(entry + i + 2, size - i - 2);
+			return true;
+		}
+		i++;
+	}
+	return false;
+}
+
+/*
+ * Updates entries of all indexes after the value of the key was changed from
+ * 'old' to 'value'. NULL means that there was (or is) no value.
+ */
+static void update_indexes(Indexes *indexes, const char *key, size_t keybytes,
+			   const std::string *old, const char *value, size_t valuebytes)
+{
+	std::string old_key, new_key;
+	for (Index *index : indexes->list) {
+		bool had = old != NULL &&
+			extract_index_key(index, old->data(), old->size(), &old_key);
+		bool has = value != NULL &&
+			extract_index_key(index, value, valuebytes, &new_key);
+		if (had && has && old_key == new_key)
+			continue;
+		EngineLock guard(index->db);
+		if (had) {
+			std::string entry = index_entry(old_key, key, keybytes);
+			pmemkv_remove(index->db->db, entry.data(), entry.size());
+		}
+		if (has) {
+			std::string entry = index_entry(new_key, key, keybytes);
+			pmemkv_put(index->db->db, entry.data(), entry.size(), "", 0);
+		}
+	}
+}
+
+/*
+ * Reads the current (decoded, even if expired) value of the key, so index
+ * entries may be updated after it's overwritten or removed.
+ */
+static bool read_indexed_value(PmemkvObject *self, const char *key, size_t keybytes,
+			       std::string *value)
+{
+	struct ReadContext {
+		PmemkvObject *self;
+		std::string *value;
+		bool found;
+	} cxt = {self, value, false};
+	auto callback = [](const char *v, size_t vb, void *context) {
+		auto c = (ReadContext *)context;
+		std::string buffer;
+		c->found = decode_value(c->self, &v, &vb, &buffer, false) ==
+			PMEMKV_STATUS_OK;
+		if (c->found)
+			c->value->assign(v, vb);
+	};
+	pmemkv_get(self->db, key, keybytes, callback, &cxt);
+	return cxt.found;
+}
+
+/* Writes the value and updates indexes. Caller has to hold EngineLock. */
+static int indexed_put(PmemkvObject *self, const char *key, size_t keybytes,
+		       const char *value, size_t valuebytes)
+{
+	Indexes *indexes = self->indexes;
+	IndexLock lock(indexes);
+	std::string old, buffer;
+	bool had = !indexes->list.empty() &&
+		read_indexed_value(self, key, keybytes, &old);
+	int result = pmemkv_put(self->db, key, keybytes, value, valuebytes);
+	if (result != PMEMKV_STATUS_OK || indexes->list.empty())
+		return result;
+	const char *decoded = value;
+	size_t decodedbytes = valuebytes;
+	if (decode_value(self, &decoded, &decodedbytes, &buffer, false) ==
+	    PMEMKV_STATUS_OK)
+		update_indexes(indexes, key, keybytes, had ? &old : NULL, decoded,
+			       decodedbytes);
+	return result;
+}
+
+/* Removes the key and its index entries. Caller has to hold EngineLock. */
+static int indexed_remove(PmemkvObject *self, const char *key, size_t keybytes)
+{
+	Indexes *indexes = self->indexes;
+	IndexLock lock(indexes);
+	std::string old;
+	bool had = !indexes->list.empty() &&
+		read_indexed_value(self, key, keybytes, &old);
+	int result = pmemkv_remove(self->db, key, keybytes);
+	if (result == PMEMKV_STATUS_OK && had)
+		update_indexes(indexes, key, keybytes, &old, NULL, 0);
+	return result;
+}
+
+/*
+ * Adds entries of all records to the new index. It's called with the GIL
+ * released, holding EngineLock and Indexes lock.
+ */
+struct IndexBuilder : RangeVisitor {
+	Index *index;
+	Indexes one;
+
+	IndexBuilder(Index *index) : index(index)
+	{
+		one.list.push_back(index);
+	}
+
+	bool visit(const char *key, size_t keybytes, const char *value,
+		   size_t valuebytes) override
+	{
+		update_indexes(&one, key, keybytes, NULL, value, valuebytes);
+		return true;
+	}
+};
+
+static void delete_index(Index *index)
+{
+	Py_XDECREF(index->callable);
+	Py_DECREF((PyObject *)index->db);
+	delete index;
+}
+
+static void delete_indexes(PmemkvObject *self)
+{
+	Indexes *indexes = self->indexes;
+	if (indexes == NULL)
+		return;
+	for (Index *index : indexes->list)
+		delete_index(index);
+	self->indexes = NULL;
+	delete indexes;
+}
+
+static Index *find_index(PmemkvObject *self, const char *name)
+{
+	Indexes *indexes = self->indexes;
+	if (indexes != NULL)
+		for (Index *index : indexes->list)
+			if (index->name == name)
+				return index;
+	PyErr_Format(PyExc_KeyError, "Unknown index: %s", name);
+	return NULL;
+}
+
+/* Parses extractor specification: ("json", pointer), ("struct", offset, size,
+ * reverse) or ("python", callable). */
+static bool parse_extractor(PyObject *spec, Index *index)
+{
+	const char *kind, *pointer;
+	PyObject *first = PyTuple_Check(spec) && PyTuple_GET_SIZE(spec) > 0
+		? PyTuple_GET_ITEM(spec, 0)
+		: NULL;
+	kind = first != NULL && PyUnicode_Check(first) ? PyUnicode_AsUTF8(first) : "";
+	if (kind == NULL)
+		return false;
+	if (strcmp(kind, "json") == 0) {
+		if (!PyArg_ParseTuple(spec, "ss", &kind, &pointer))
+			return false;
+		if (*pointer != '\0' && *pointer != '/') {
+			PyErr_SetString(PyExc_ValueError, "JSON pointer should start with '/'");
+			return false;
+		}
+		index->extractor = EXTRACT_JSON;
+		for (const char *p = pointer; *p != '\0';) {
+			std::string token;
+			for (p++; *p != '\0' && *p != '/'; p++) {
+				if (*p == '~' && (p[1] == '0' || p[1] == '1'))
+					token.push_back(*++p == '0' ? '~' : '/');
+				else
+					token.push_back(*p);
+			}
+			index->pointer.push_back(token);
+		}
+		return true;
+	}
+	if (strcmp(kind, "struct") == 0) {
+		Py_ssize_t offset, size;
+		int reverse;
+		if (!PyArg_ParseTuple(spec, "snnp", &kind, &offset, &size, &reverse))
+			return false;
+		if (offset < 0 || size <= 0) {
+			PyErr_SetString(PyExc_ValueError, "Invalid field offset or size");
+			return false;
+		}
+		index->extractor = EXTRACT_STRUCT;
+		index->offset = offset;
+		index->size = size;
+		index->reverse = reverse;
+		return true;
+	}
+	if (strcmp(kind, "python") == 0) {
+		if (!PyArg_ParseTuple(spec, "sO", &kind, &index->callable))
+			return false;
+		if (!PyCallable_Check(index->callable)) {
+			PyErr_SetString(PyExc_TypeError, "Extractor should be callable");
+			return false;
+		}
+		Py_INCREF(index->callable);
+		index->extractor = EXTRACT_PYTHON;
+		return true;
 	}
-	return Py_BuildValue("i", cnt);
+	PyErr_SetString(PyExc_ValueError, "Unknown extractor");
+	return false;
 }
 
-// "Each" Methods.
 static PyObject *
-pmemkv_NI_GetAll(PmemkvObject *self, PyObject* args) {
-	PyObject* python_callback;
-	if (!PyArg_ParseTuple(args, "O:set_callback", &python_callback)) {
+pmemkv_NI_CreateIndex(PmemkvObject *self, PyObject* args) {
+	const char *name;
+	PyObject *index_db, *spec;
+	if (!PyArg_ParseTuple(args, "sO!O", &name, Py_TYPE(self), &index_db, &spec)) {
 		return NULL;
 	}
-	int result = pmemkv_get_all(self->db, key_value_callback, python_callback);
-	if (PyErr_Occurred() != NULL)
+	PmemkvObject *db = (PmemkvObject *)index_db;
+	if (db->db == self->db || db->db == NULL || !db->sorted) {
+		PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_NOT_SUPPORTED),
+				"Index requires a separate, sorted engine");
+		return NULL;
+	}
+	/* writes done through other objects would not be indexed */
+	if (self->shared != NULL) {
+		PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_NOT_SUPPORTED),
+				"Index can not be created on a shared engine");
 		return NULL;
+	}
+	Indexes *indexes = self->indexes;
+	if (indexes != NULL) {
+		for (Index *index : indexes->list) {
+			if (index->name == name) {
+				PyErr_Format(PyExc_ValueError, "Index already exists: %s",
+					     name);
+				return NULL;
+			}
+		}
+	}
+	Index *index = new Index();
+	index->name = name;
+	if (!parse_extractor(spec, index)) {
+		Py_XDECREF(index->callable);
+		delete index;
+		return NULL;
+	}
+	Py_INCREF(index_db);
+	index->db = db;
+	if (indexes == NULL) {
+		indexes = new Indexes();
+		self->indexes.store(indexes, std::memory_order_release);
+	}
+
+	/* writes wait until index is built */
+	size_t removed;
+	int result;
+	Py_BEGIN_ALLOW_THREADS
+	remove_range(db, KeyRange(), &removed);
+	{
+		EngineLock guard(self);
+		std::unique_lock<std::shared_timed_mutex> lock(indexes->mtx);
+		IndexBuilder builder(index);
+		DecodingVisitor decoder(self, builder);
+		result = scan_range(self, KeyRange(), decoder);
+		if (result == PMEMKV_STATUS_OK)
+			result = decoder.status;
+		if (result == PMEMKV_STATUS_OK)
+			indexes->list.push_back(index);
+	}
+	Py_END_ALLOW_THREADS
 	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
+		delete_index(index);
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
 		return NULL;
 	}
 	Py_RETURN_NONE;
 }
 
 static PyObject *
-pmemkv_NI_GetAbove(PmemkvObject *self, PyObject* args) {
-	Py_buffer key;
-	PyObject* python_callback;
-	if (!PyArg_ParseTuple(args, "s*O:set_callback", &key, &python_callback)) {
+pmemkv_NI_DropIndex(PmemkvObject *self, PyObject* args) {
+	const char *name;
+	if (!PyArg_ParseTuple(args, "s", &name)) {
 		return NULL;
 	}
-	int result = pmemkv_get_above(self->db, (const char *)key.buf, key.len,
-				      key_value_callback, python_callback);
-	if (PyErr_Occurred() != NULL)
-		return NULL;
-	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
+	Index *index = find_index(self, name);
+	if (index == NULL)
 		return NULL;
+	Indexes *indexes = self->indexes;
+	Py_BEGIN_ALLOW_THREADS
+	{
+		std::unique_lock<std::shared_timed_mutex> lock(indexes->mtx);
+		auto &list = indexes->list;
+		list.erase(std::find(list.begin(), list.end(), index));
 	}
+	Py_END_ALLOW_THREADS
+	delete_index(index);
 	Py_RETURN_NONE;
 }
 
+/* Collects primary keys from index entries. */
+struct IndexKeyCollector : RangeVisitor {
+	size_t limit;
+	std::vector<std::string> keys;
+
+	IndexKeyCollector(size_t limit) : limit(limit)
+	{
+	}
+
+	bool visit(const char *entry, size_t size, const char *, size_t) override
+	{
+		std::string key;
+		if (!index_entry_key(entry, size, &key))
+			return true;
+		keys.push_back(std::move(key));
+		return keys.size() < limit;
+	}
+};
+
 static PyObject *
-pmemkv_NI_GetBelow(PmemkvObject *self, PyObject* args) {
-	Py_buffer key;
-	PyObject* python_callback;
-	if (!PyArg_ParseTuple(args, "s*O:set_callback", &key, &python_callback)) {
+pmemkv_NI_IndexRange(PmemkvObject *self, PyObject* args) {
+	const char *name;
+	Py_buffer lo = {NULL, NULL}, hi = {NULL, NULL};
+	Py_ssize_t limit = -1;
+	int exact = 0;
+	if (!PyArg_ParseTuple(args, "sz*z*|np", &name, &lo, &hi, &limit, &exact)) {
 		return NULL;
 	}
-	int result = pmemkv_get_below(self->db, (const char *)key.buf, key.len,
-				      key_value_callback, python_callback);
-	if (PyErr_Occurred() != NULL)
+	KeyRange range;
+	if (lo.buf != NULL) {
+		range.lo = index_entry(std::string((const char *)lo.buf, lo.len));
+		range.has_lo = true;
+		range.lo_inclusive = true;
+		PyBuffer_Release(&lo);
+	}
+	if (hi.buf != NULL) {
+		range.hi = index_entry(std::string((const char *)hi.buf, hi.len));
+		range.has_hi = true;
+		PyBuffer_Release(&hi);
+	}
+	if (exact && !range.has_lo) {
+		PyErr_SetString(PyExc_ValueError, "Index key is required");
+		return NULL;
+	}
+	if (exact) {
+		/* all entries of index key lo: 0x00 0x01 terminator becomes 0x00 0x02 */
+		range.hi = range.lo;
+		range.hi.back() = '\x02';
+		range.has_hi = true;
+	}
+	Index *index = find_index(self, name);
+	if (index == NULL)
 		return NULL;
+
+	IndexKeyCollector collector(limit < 0 ? SIZE_MAX : (size_t)limit);
+	int result = PMEMKV_STATUS_OK;
+	if (limit != 0) {
+		Py_BEGIN_ALLOW_THREADS
+		{
+			EngineLock guard(index->db);
+			result = scan_range(index->db, range, collector);
+		}
+		Py_END_ALLOW_THREADS
+	}
 	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
+		PyErr_SetString(pmemkv_exception(result), pmemkv_errormsg());
 		return NULL;
 	}
-	Py_RETURN_NONE;
+	PyObject *list = PyList_New(collector.keys.size());
+	if (list == NULL)
+		return NULL;
+	for (size_t i = 0; i < collector.keys.size(); i++) {
+		PyObject *key = PyBytes_FromStringAndSize(collector.keys[i].data(),
+							  collector.keys[i].size());
+		if (key == NULL) {
+			Py_DECREF(list);
+			return NULL;
+		}
+		PyList_SET_ITEM(list, i, key);
+	}
+	return list;
+}
+
+// Server.
+
+/*
+ * Native loop of pmemkv.server. Each client connection is handled by its own
+ * thread, without the GIL. Requests may be pipelined - all complete requests
+ * received at once are executed and their responses are sent together.
+ * Frames (all integers are little-endian):
+ *   request: body size (4 bytes), operation (1 byte), body
+ *   response: body size (4 bytes), pmemkv status (1 byte), body - error
+ *	message if status is not PMEMKV_STATUS_OK
+ * Request and response bodies:
+ *   SERVER_GET: key -> value
+ *   SERVER_PUT: key size (4 bytes), time-to-live in milliseconds or
+ *	SERVER_NO_TTL (8 bytes), key, value -> empty
+ *   SERVER_REMOVE: key -> empty (PMEMKV_STATUS_NOT_FOUND if it did not exist)
+ *   SERVER_EXISTS: key -> empty (PMEMKV_STATUS_NOT_FOUND if it does not exist)
+ *   SERVER_COUNT_ALL: empty -> number of records (8 bytes)
+ *   SERVER_SCAN_PREFIX: limit or -1 (8 bytes), prefix -> records: key size
+ *	(4 bytes), value size (4 bytes), key, value
+ */
+enum ServerOp {
+	SERVER_GET = 1,
+	SERVER_PUT = 2,
+	SERVER_REMOVE = 3,
+	SERVER_EXISTS = 4,
+	SERVER_COUNT_ALL = 5,
+	SERVER_SCAN_PREFIX = 6,
+};
+
+static const size_t SERVER_FRAME_HEADER_SIZE = 5;
+static const uint64_t SERVER_NO_TTL = UINT64_MAX;
+/* Connections sending larger requests are closed. */
+static const size_t SERVER_MAX_REQUEST_SIZE = 1 << 30;
+static const size_t SERVER_READ_SIZE = 1 << 16;
+/* Interval of checking for signals, in milliseconds. */
+static const int SERVER_POLL_INTERVAL = 100;
+
+struct ServerConnection {
+	std::thread thread;
+	int fd;
+	std::atomic<bool> done{false};
+};
+
+static void server_response(std::string &out, int status, const char *body, size_t size)
+{
+	char header[SERVER_FRAME_HEADER_SIZE];
+	store_le32(header, (uint32_t)size);
+	header[4] = (char)status;
+	out.append(header, sizeof(header));
+	out.append(body, size);
+}
+
+static void server_error(std::string &out, int status, const char *msg)
+{
+	server_response(out, status, msg, strlen(msg));
+}
+
+static void server_request(PmemkvObject *self, int op, const char *body, size_t size,
+			   std::string &out)
+{
+	int result = PMEMKV_STATUS_OK;
+	if (op == SERVER_GET) {
+		CallbackContext cxt = {self, NULL, PMEMKV_STATUS_OK, std::string()};
+		auto callback = [](const char *v, size_t vb, void *context) {
+			auto c = (CallbackContext *)context;
+			std::string buffer;
+			c->status = decode_value(c->self, &v, &vb, &buffer);
+			c->buffer.assign(v, vb);
+		};
+		{
+			EngineLock guard(self);
+			result = pmemkv_get(self->db, body, size, callback, &cxt);
+		}
+		if (result == PMEMKV_STATUS_OK && cxt.status != PMEMKV_STATUS_OK)
+			return server_error(out, cxt.status,
+					    cxt.status == PMEMKV_STATUS_NOT_FOUND
+						    ? expired_msg
+						    : corrupted_msg);
+		if (result == PMEMKV_STATUS_OK)
+			return server_response(out, result, cxt.buffer.data(),
+					       cxt.buffer.size());
+	} else if (op == SERVER_PUT) {
+		if (size < 12 || size - 12 < load_le32(body))
+			return server_error(out, PMEMKV_STATUS_INVALID_ARGUMENT,
+					    "Malformed request");
+		size_t keybytes = load_le32(body);
+		uint64_t ttl = load_le64(body + 4);
+		if (ttl != SERVER_NO_TTL && !self->value_header)
+			return server_error(out, PMEMKV_STATUS_INVALID_ARGUMENT,
+					    expiry_disabled_msg);
+		const char *key = body + 12;
+		EngineLock guard(self);
+		result = store_value(self, key, keybytes, key + keybytes,
+				     size - 12 - keybytes,
+				     ttl != SERVER_NO_TTL ? now_ms() + ttl : NO_EXPIRY);
+	} else if (op == SERVER_REMOVE) {
+		EngineLock guard(self);
+		result = engine_remove(self, body, size);
+	} else if (op == SERVER_EXISTS) {
+		EngineLock guard(self);
+		result = exists_value(self, body, size);
+	} else if (op == SERVER_COUNT_ALL) {
+		size_t cnt = 0;
+		{
+			EngineLock guard(self);
+			result = count_range(self, KeyRange(), &cnt);
+		}
+		if (result == PMEMKV_STATUS_OK) {
+			char count[8];
+			store_le64(count, cnt);
+			return server_response(out, result, count, sizeof(count));
+		}
+	} else if (op == SERVER_SCAN_PREFIX) {
+		if (size < 8)
+			return server_error(out, PMEMKV_STATUS_INVALID_ARGUMENT,
+					    "Malformed request");
+		int64_t limit = (int64_t)load_le64(body);
+		KeyRange range = prefix_range(body + 8, size - 8);
+		size_t offset = out.size();
+		server_response(out, PMEMKV_STATUS_OK, NULL, 0);
+		RecordCollector collector(limit < 0 ? SIZE_MAX : (size_t)limit, false);
+		int decode_status = PMEMKV_STATUS_OK;
+		if (limit != 0) {
+			EngineLock guard(self);
+			DecodingVisitor decoder(self, collector);
+			result = scan_range(self, range, decoder);
+			decode_status = decoder.status;
+		}
+		collector.finish();
+		if (decode_status != PMEMKV_STATUS_OK) {
+			out.resize(offset);
+			return server_error(out, decode_status, corrupted_msg);
+		}
+		if (result == PMEMKV_STATUS_OK) {
+			for (auto &r : collector.records) {
+				char header[8];
+				store_le32(header, (uint32_t)r.first.size());
+				store_le32(header + 4, (uint32_t)r.second.size());
+				out.append(header, sizeof(header));
+				out.append(r.first);
+				out.append(r.second);
+			}
+			store_le32(&out[offset],
+				   (uint32_t)(out.size() - offset - SERVER_FRAME_HEADER_SIZE));
+			return;
+		}
+		out.resize(offset);
+	} else {
+		return server_error(out, PMEMKV_STATUS_NOT_SUPPORTED, "Unknown operation");
+	}
+	if (result == PMEMKV_STATUS_OK || result == PMEMKV_STATUS_NOT_FOUND)
+		server_response(out, result, NULL, 0);
+	else
+		server_error(out, result, pmemkv_errormsg());
+}
+
+static bool send_all(int fd, const char *data, size_t size)
+{
+	while (size > 0) {
+		ssize_t n = send(fd, data, size, MSG_NOSIGNAL);
+		if (n < 0 && errno == EINTR)
+			continue;
+		if (n <= 0)
+			return false;
+		data += n;
+		size -= n;
+	}
+	return true;
+}
+
+static void serve_connection(PmemkvObject *self, ServerConnection *connection)
+{
+	std::string in, out;
+	std::vector<char> buffer(SERVER_READ_SIZE);
+	while (true) {
+		ssize_t n = ::read(connection->fd, buffer.data(), buffer.size());
+		if (n < 0 && errno == EINTR)
+			continue;
+		if (n <= 0)
+			break;
+		in.append(buffer.data(), n);
+		size_t pos = 0;
+		bool malformed = false;
+		while (in.size() - pos >= SERVER_FRAME_HEADER_SIZE) {
+			size_t size = load_le32(&in[pos]);
+			if (size > SERVER_MAX_REQUEST_SIZE) {
+				malformed = true;
+				break;
+			}
+			if (in.size() - pos - SERVER_FRAME_HEADER_SIZE < size)
+				break;
+			server_request(self, (unsigned char)in[pos + 4],
+				       &in[pos + SERVER_FRAME_HEADER_SIZE], size, out);
+			pos += SERVER_FRAME_HEADER_SIZE + size;
+		}
+		in.erase(0, pos);
+		if (malformed || !send_all(connection->fd, out.data(), out.size()))
+			break;
+		out.clear();
+	}
+	shutdown(connection->fd, SHUT_RDWR);
+	connection->done = true;
+}
+
+static void join_connections(std::vector<ServerConnection *> &connections, bool all)
+{
+	for (auto it = connections.begin(); it != connections.end();) {
+		ServerConnection *c = *it;
+		if (!all && !c->done) {
+			it++;
+			continue;
+		}
+		/* wakes up the thread, if it's still reading */
+		shutdown(c->fd, SHUT_RDWR);
+		c->thread.join();
+		close(c->fd);
+		delete c;
+		it = connections.erase(it);
+	}
 }
 
 static PyObject *
-pmemkv_NI_GetBetween(PmemkvObject *self, PyObject* args) {
-	Py_buffer key1, key2;
-	PyObject* python_callback;
-	if (!PyArg_ParseTuple(args, "s*s*O:set_callback", &key1, &key2, &python_callback)) {
+pmemkv_NI_Serve(PmemkvObject *self, PyObject* args) {
+	int listen_fd, wake_fd;
+	if (!PyArg_ParseTuple(args, "ii", &listen_fd, &wake_fd)) {
 		return NULL;
 	}
-	int result = pmemkv_get_between(self->db, (const char *)key1.buf, key1.len,
-					(const char *)key2.buf, key2.len,
-					key_value_callback, python_callback);
+	std::vector<ServerConnection *> connections;
+	bool failed = false;
+	while (!failed) {
+		struct pollfd fds[2] = {{listen_fd, POLLIN, 0}, {wake_fd, POLLIN, 0}};
+		int n;
+		Py_BEGIN_ALLOW_THREADS
+		n = poll(fds, 2, SERVER_POLL_INTERVAL);
+		Py_END_ALLOW_THREADS
+		if (n < 0 && errno != EINTR) {
+			PyErr_SetFromErrno(PyExc_OSError);
+			failed = true;
+		}
+		if (PyErr_CheckSignals() < 0)
+			failed = true;
+		/* the server is stopped along with the engine */
+		if (failed || fds[1].revents != 0 || self->activity->stopping)
+			break;
+		if (n <= 0 || fds[0].revents == 0)
+			continue;
+
+		int fd;
+		Py_BEGIN_ALLOW_THREADS
+		fd = accept4(listen_fd, NULL, NULL, SOCK_CLOEXEC);
+		join_connections(connections, false);
+		Py_END_ALLOW_THREADS
+		if (fd < 0) {
+			if (errno == EINTR || errno == EAGAIN || errno == ECONNABORTED)
+				continue;
+			PyErr_SetFromErrno(PyExc_OSError);
+			break;
+		}
+		ServerConnection *c = new ServerConnection();
+		c->fd = fd;
+		c->thread = std::thread(serve_connection, self, c);
+		connections.push_back(c);
+	}
+	Py_BEGIN_ALLOW_THREADS
+	join_connections(connections, true);
+	Py_END_ALLOW_THREADS
 	if (PyErr_Occurred() != NULL)
 		return NULL;
-	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
-		return NULL;
-	}
 	Py_RETURN_NONE;
 }
 
-// "Exists" Method.
+// Compression statistics.
 static PyObject *
-pmemkv_NI_Exists(PmemkvObject *self, PyObject* args) {
-	Py_buffer key;
-	if (!PyArg_ParseTuple(args, "s*", &key)) {
-		return NULL;
-	}
-	int result = pmemkv_exists(self->db, (const char*) key.buf, key.len);
-	if (result != PMEMKV_STATUS_OK && result != PMEMKV_STATUS_NOT_FOUND) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
-		return NULL;
-	}
-	return PyBool_FromLong(result == PMEMKV_STATUS_OK);
+pmemkv_NI_CompressionStats(PmemkvObject *self) {
+	Compression *c = self->compression;
+	if (c == NULL)
+		Py_RETURN_NONE;
+	uint64_t raw_bytes = c->raw_bytes, compressed_bytes = c->compressed_bytes;
+	return Py_BuildValue(
+		"{s:K,s:K,s:K,s:K,s:d,s:d,s:K,s:d}", "compressed",
+		(unsigned long long)c->compressed.load(), "stored_raw",
+		(unsigned long long)c->stored_raw.load(), "raw_bytes",
+		(unsigned long long)raw_bytes, "compressed_bytes",
+		(unsigned long long)compressed_bytes, "ratio",
+		compressed_bytes > 0 ? (double)raw_bytes / compressed_bytes : 1.0,
+		"compress_cpu_s", c->compress_ns.load() / 1e9, "decompressed",
+		(unsigned long long)c->decompressed.load(), "decompress_cpu_s",
+		c->decompress_ns.load() / 1e9);
 }
 
-// "CRUD" Operations.
+// Memory usage.
+
+/*
+ * Returns estimated volatile memory used by the binding for the object,
+ * in bytes, by its parts: statistics, hot keys, change log, recorder,
+ * compression (dictionaries; per-thread zstd contexts are not counted),
+ * locks (engine lock or key locks) and warm-up. Buffers of server
+ * connections are owned by their threads and are not counted.
+ * Containers are estimated by their elements and a few pointers per node.
+ */
 static PyObject *
-pmemkv_NI_Put(PmemkvObject *self, PyObject* args) {
-	Py_buffer key, value;
-	if (!PyArg_ParseTuple(args, "s*s*", &key, &value)) {
-		return NULL;
+pmemkv_NI_MemoryUsage(PmemkvObject *self) {
+	const size_t node = 4 * sizeof(void *);
+	size_t statistics = self->stats != NULL ? sizeof(Statistics) : 0;
+	size_t hot_keys = 0, changes = 0, recorder = 0, compression = 0;
+	size_t locks = 0, warmup = 0;
+	if (self->lock != NULL)
+		locks += sizeof(std::recursive_mutex);
+	if (self->key_locks != NULL)
+		locks += KEY_LOCK_STRIPES * sizeof(std::recursive_mutex);
+	if (self->warmup != NULL)
+		warmup = sizeof(Warmup) +
+			self->warmup->threads.capacity() * sizeof(std::thread);
+	HotKeys *h = self->hot_keys;
+	if (h != NULL) {
+		std::lock_guard<std::mutex> lock(h->mtx);
+		hot_keys = sizeof(HotKeys);
+		/* each key is stored twice, in entries and counts */
+		for (auto &e : h->entries)
+			hot_keys += 2 * (e.first.capacity() + sizeof(std::string) + node) +
+				sizeof(HotKeys::Entry);
 	}
-	int result = pmemkv_put(self->db, (const char*) key.buf, key.len, (const char*) value.buf, value.len);
-	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
-		return NULL;
+	ChangeLog *log = self->changes;
+	if (log != NULL) {
+		std::lock_guard<std::mutex> lock(log->mtx);
+		changes = sizeof(ChangeLog);
+		for (auto &c : log->records)
+			changes += sizeof(Change) + c.key.capacity() + c.value.capacity();
 	}
-	Py_RETURN_NONE;
+	Recorder *r = self->recorder;
+	if (r != NULL) {
+		std::lock_guard<std::mutex> lock(r->mtx);
+		recorder = sizeof(Recorder) + r->buffer.capacity();
+	}
+	Compression *c = self->compression;
+	if (c != NULL) {
+		compression = sizeof(Compression) + c->dictionary.capacity();
+#ifdef PMEMKV_PY_ZSTD
+		compression += ZSTD_sizeof_CDict(c->cdict) + ZSTD_sizeof_DDict(c->ddict);
+#endif
+	}
+	return Py_BuildValue("{s:n,s:n,s:n,s:n,s:n,s:n,s:n}", "statistics",
+			     (Py_ssize_t)statistics, "hot_keys", (Py_ssize_t)hot_keys,
+			     "changes", (Py_ssize_t)changes, "recorder",
+			     (Py_ssize_t)recorder, "compression", (Py_ssize_t)compression,
+			     "locks", (Py_ssize_t)locks, "warmup", (Py_ssize_t)warmup);
 }
 
-static PyObject *pmemkv_NI_GetString(PmemkvObject *self, PyObject *args)
+/*
+ * Calls of all methods, except stop, which waits for them, are counted as
+ * running (see Activity).
+ */
+extern "C++" {
+template <PyObject *(*method)(PmemkvObject *)>
+static PyObject *active(PmemkvObject *self)
 {
-	Py_buffer key;
-	if (!PyArg_ParseTuple(args, "s*", &key)) {
+	ActivityGuard guard(self);
+	if (!guard.entered)
 		return NULL;
-	}
-	struct GetCallbackContext {
-		int status;
-		std::string value;
-	};
-	GetCallbackContext cxt = {PMEMKV_STATUS_NOT_FOUND, ""};
+	return method(self);
+}
 
-	auto callback = [](const char* v, size_t vb, void* context) {
-		const auto c = ((GetCallbackContext*) context);
-		c->status = PMEMKV_STATUS_OK;
-		c->value.append(v, vb);
-	};
-	int result = pmemkv_get(self->db, (const char*) key.buf, key.len, callback, &cxt);
-	if (PyErr_Occurred() != NULL)
+template <PyObject *(*method)(PmemkvObject *, PyObject *)>
+static PyObject *active(PmemkvObject *self, PyObject *args)
+{
+	ActivityGuard guard(self);
+	if (!guard.entered)
 		return NULL;
-	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
+	return method(self, args);
+}
+
+template <PyObject *(*method)(PmemkvObject *, PyObject *, PyObject *)>
+static PyObject *active(PmemkvObject *self, PyObject *args, PyObject *kwargs)
+{
+	ActivityGuard guard(self);
+	if (!guard.entered)
 		return NULL;
-	} else if (cxt.status == PMEMKV_STATUS_OK) {
-		return Py_BuildValue("s#", cxt.value.data(), cxt.value.size());
-	}
-	Py_RETURN_NONE;
+	return method(self, args, kwargs);
 }
 
-static PyObject *pmemkv_NI_Get(PmemkvObject *self, PyObject *args)
+/*
+ * Methods which start or stop background threads, or replace other parts of
+ * the object, run in a critical section of the object. In free-threaded
+ * builds they are then serialized, as they are by the GIL in other builds.
+ */
+template <PyObject *(*method)(PmemkvObject *)>
+static PyObject *locked(PmemkvObject *self)
 {
-	Py_buffer key;
-	PyObject *python_callback;
-	if (!PyArg_ParseTuple(args, "s*O:set_callback", &key, &python_callback)) {
+	PyObject *result;
+	Py_BEGIN_CRITICAL_SECTION(self);
+	result = method(self);
+	Py_END_CRITICAL_SECTION();
+	return result;
+}
+
+template <PyObject *(*method)(PmemkvObject *, PyObject *)>
+static PyObject *locked(PmemkvObject *self, PyObject *args)
+{
+	PyObject *result;
+	Py_BEGIN_CRITICAL_SECTION(self);
+	result = method(self, args);
+	Py_END_CRITICAL_SECTION();
+	return result;
+}
+
+template <PyObject *(*method)(PmemkvObject *, PyObject *, PyObject *)>
+static PyObject *locked(PmemkvObject *self, PyObject *args, PyObject *kwargs)
+{
+	PyObject *result;
+	Py_BEGIN_CRITICAL_SECTION(self);
+	result = method(self, args, kwargs);
+	Py_END_CRITICAL_SECTION();
+	return result;
+}
+}
+
+// Functions declarations.
+static PyMethodDef pmemkv_NI_methods[] = {
+	{"start", (PyCFunction)locked<active<pmemkv_NI_Start>>, METH_VARARGS | METH_KEYWORDS, NULL},
+	{"stop", (PyCFunction)locked<pmemkv_NI_Stop>, METH_NOARGS, NULL},
+	{"put", (PyCFunction)active<pmemkv_NI_Put>, METH_VARARGS, NULL},
+	{"get_string", (PyCFunction)active<pmemkv_NI_GetString>, METH_VARARGS, NULL},
+	{"get", (PyCFunction)active<pmemkv_NI_Get>, METH_VARARGS, NULL},
+	{"get_keys", (PyCFunction)active<pmemkv_NI_GetKeys>, METH_VARARGS, NULL},
+	{"get_keys_above", (PyCFunction)active<pmemkv_NI_GetKeysAbove>, METH_VARARGS, NULL},
+	{"get_keys_below", (PyCFunction)active<pmemkv_NI_GetKeysBelow>, METH_VARARGS, NULL},
+	{"get_keys_between", (PyCFunction)active<pmemkv_NI_GetKeysBetween>, METH_VARARGS, NULL},
+	{"count_all", (PyCFunction)active<pmemkv_NI_CountAll>, METH_NOARGS, NULL},
+	{"count_above", (PyCFunction)active<pmemkv_NI_CountAbove>, METH_VARARGS, NULL},
+	{"count_below", (PyCFunction)active<pmemkv_NI_CountBelow>, METH_VARARGS, NULL},
+	{"count_between", (PyCFunction)active<pmemkv_NI_CountBetween>, METH_VARARGS, NULL},
+	{"get_all", (PyCFunction)active<pmemkv_NI_GetAll>, METH_VARARGS, NULL},
+	{"get_above", (PyCFunction)active<pmemkv_NI_GetAbove>, METH_VARARGS, NULL},
+	{"get_below", (PyCFunction)active<pmemkv_NI_GetBelow>, METH_VARARGS, NULL},
+	{"get_between", (PyCFunction)active<pmemkv_NI_GetBetween>, METH_VARARGS, NULL},
+	{"exists", (PyCFunction)active<pmemkv_NI_Exists>, METH_VARARGS, NULL},
+	{"remove", (PyCFunction)active<pmemkv_NI_Remove>, METH_VARARGS, NULL},
+	{"scan_prefix", (PyCFunction)active<pmemkv_NI_ScanPrefix>, METH_VARARGS, NULL},
+	{"count_prefix", (PyCFunction)active<pmemkv_NI_CountPrefix>, METH_VARARGS, NULL},
+	{"remove_prefix", (PyCFunction)active<pmemkv_NI_RemovePrefix>, METH_VARARGS, NULL},
+	{"remove_range", (PyCFunction)active<pmemkv_NI_RemoveRange>, METH_VARARGS, NULL},
+	{"start_reaper", (PyCFunction)locked<active<pmemkv_NI_StartReaper>>, METH_VARARGS, NULL},
+	{"stop_reaper", (PyCFunction)locked<active<pmemkv_NI_StopReaper>>, METH_NOARGS, NULL},
+	{"reaper_stats", (PyCFunction)locked<active<pmemkv_NI_ReaperStats>>, METH_NOARGS, NULL},
+	{"compression_stats", (PyCFunction)active<pmemkv_NI_CompressionStats>, METH_NOARGS, NULL},
+	{"memory_usage", (PyCFunction)locked<active<pmemkv_NI_MemoryUsage>>, METH_NOARGS, NULL},
+	{"defrag", (PyCFunction)active<pmemkv_NI_Defrag>, METH_VARARGS, NULL},
+	{"export", (PyCFunction)active<pmemkv_NI_Export>, METH_VARARGS, NULL},
+	{"import_", (PyCFunction)active<pmemkv_NI_Import>, METH_VARARGS, NULL},
+	{"save_image", (PyCFunction)active<pmemkv_NI_SaveImage>, METH_VARARGS, NULL},
+	{"load_image", (PyCFunction)active<pmemkv_NI_LoadImage>, METH_VARARGS, NULL},
+	{"enable_changes", (PyCFunction)locked<active<pmemkv_NI_EnableChanges>>, METH_VARARGS, NULL},
+	{"disable_changes", (PyCFunction)locked<active<pmemkv_NI_DisableChanges>>, METH_NOARGS, NULL},
+	{"read_changes", (PyCFunction)active<pmemkv_NI_ReadChanges>, METH_VARARGS, NULL},
+	{"changes_stats", (PyCFunction)active<pmemkv_NI_ChangesStats>, METH_NOARGS, NULL},
+	{"create_index", (PyCFunction)locked<active<pmemkv_NI_CreateIndex>>, METH_VARARGS, NULL},
+	{"drop_index", (PyCFunction)locked<active<pmemkv_NI_DropIndex>>, METH_VARARGS, NULL},
+	{"index_range", (PyCFunction)active<pmemkv_NI_IndexRange>, METH_VARARGS, NULL},
+	{"start_defrag_scheduler", (PyCFunction)locked<active<pmemkv_NI_StartDefragScheduler>>,
+	 METH_VARARGS, NULL},
+	{"stop_defrag_scheduler", (PyCFunction)locked<active<pmemkv_NI_StopDefragScheduler>>,
+	 METH_NOARGS, NULL},
+	{"defrag_stats", (PyCFunction)locked<active<pmemkv_NI_DefragStats>>, METH_NOARGS, NULL},
+	{"serve", (PyCFunction)active<pmemkv_NI_Serve>, METH_VARARGS, NULL},
+	{"scan_range", (PyCFunction)active<pmemkv_NI_ScanRange>, METH_VARARGS, NULL},
+	{"put_many", (PyCFunction)active<pmemkv_NI_PutMany>, METH_VARARGS, NULL},
+	{"read", (PyCFunction)active<pmemkv_NI_Read>, METH_VARARGS, NULL},
+	{"write_range", (PyCFunction)active<pmemkv_NI_WriteRange>, METH_VARARGS, NULL},
+	{"incr", (PyCFunction)active<pmemkv_NI_Incr>, METH_VARARGS, NULL},
+	{"cas", (PyCFunction)active<pmemkv_NI_Cas>, METH_VARARGS, NULL},
+	{"update", (PyCFunction)active<pmemkv_NI_Update>, METH_VARARGS, NULL},
+	{"scan", (PyCFunction)active<pmemkv_NI_Scan>, METH_VARARGS, NULL},
+	{"sample", (PyCFunction)active<pmemkv_NI_Sample>, METH_VARARGS, NULL},
+	{"stats", (PyCFunction)active<pmemkv_NI_Stats>, METH_NOARGS, NULL},
+	{"enable_hot_keys", (PyCFunction)locked<active<pmemkv_NI_EnableHotKeys>>, METH_VARARGS, NULL},
+	{"disable_hot_keys", (PyCFunction)locked<active<pmemkv_NI_DisableHotKeys>>, METH_NOARGS, NULL},
+	{"hot_keys", (PyCFunction)active<pmemkv_NI_HotKeys>, METH_VARARGS, NULL},
+	{"start_recording", (PyCFunction)locked<active<pmemkv_NI_StartRecording>>, METH_VARARGS, NULL},
+	{"stop_recording", (PyCFunction)locked<active<pmemkv_NI_StopRecording>>, METH_NOARGS, NULL},
+	{"start_warmup", (PyCFunction)locked<active<pmemkv_NI_StartWarmup>>, METH_VARARGS, NULL},
+	{"stop_warmup", (PyCFunction)locked<active<pmemkv_NI_StopWarmup>>, METH_NOARGS, NULL},
+	{"warmup_stats", (PyCFunction)locked<active<pmemkv_NI_WarmupStats>>, METH_NOARGS, NULL},
+	{NULL, NULL, 0, NULL}};
+
+/*
+ * The comparator and index extractors are arbitrary Python objects which may
+ * refer back to the database, so the object takes part in garbage collection.
+ */
+static int
+Pmemkv_traverse(PmemkvObject *self, visitproc visit, void *arg) {
+	Py_VISIT(self->comparator);
+	Indexes *indexes = self->indexes;
+	if (indexes != NULL)
+		for (Index *index : indexes->list) {
+			Py_VISIT(index->callable);
+			Py_VISIT((PyObject *)index->db);
+		}
+	/* instances of heap types own a reference to the type since 3.9 */
+#if PY_VERSION_HEX >= 0x03090000
+	Py_VISIT(Py_TYPE(self));
+#endif
+	return 0;
+}
+
+/*
+ * Breaking a reference cycle stops the engine, as it can't be used without
+ * its comparator and indexes.
+ */
+static int
+Pmemkv_clear(PmemkvObject *self) {
+	Py_XDECREF(pmemkv_NI_Stop(self));
+	return 0;
+}
+
+/*
+ * Configuration of pmemkv_NI object. It's a heap type, created for each
+ * instance of the module.
+ */
+static PyType_Slot Pmemkv_slots[] = {
+	{Py_tp_dealloc, (void *)Pmemkv_dealloc},
+	{Py_tp_traverse, (void *)Pmemkv_traverse},
+	{Py_tp_clear, (void *)Pmemkv_clear},
+	{Py_tp_doc, (void *)"Pmemkv binding"},
+	{Py_tp_methods, (void *)pmemkv_NI_methods},
+	{Py_tp_members, (void *)pmemkv_NI_members},
+	{Py_tp_new, (void *)Pmemkv_new},
+	{0, NULL},
+};
+
+static PyType_Spec Pmemkv_spec = {
+	"pmemkv.pmemkv_NI",
+	sizeof(PmemkvObject),
+	0,
+	Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,
+	Pmemkv_slots,
+};
+
+// Module functions.
+static PyObject *
+pmemkv_TrainZstdDictionary(PyObject *module, PyObject *args) {
+	PyObject *samples;
+	Py_ssize_t dict_size;
+	if (!PyArg_ParseTuple(args, "On", &samples, &dict_size)) {
 		return NULL;
 	}
-	int result = pmemkv_get(self->db, (const char *)key.buf, key.len, value_callback,
-				python_callback);
+#ifdef PMEMKV_PY_ZSTD
+	PyObject *iterator = PyObject_GetIter(samples);
+	if (iterator == NULL)
+		return NULL;
+	std::string data;
+	std::vector<size_t> sizes;
+	PyObject *item;
+	while ((item = PyIter_Next(iterator)) != NULL) {
+		Py_buffer sample;
+		int rv = PyObject_GetBuffer(item, &sample, PyBUF_SIMPLE);
+		Py_DECREF(item);
+		if (rv < 0)
+			break;
+		data.append((const char *)sample.buf, sample.len);
+		sizes.push_back(sample.len);
+		PyBuffer_Release(&sample);
+	}
+	Py_DECREF(iterator);
 	if (PyErr_Occurred() != NULL)
 		return NULL;
-	if (result != PMEMKV_STATUS_OK) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
+	if (dict_size <= 0) {
+		PyErr_SetString(PyExc_ValueError, "Dictionary size should be positive");
 		return NULL;
 	}
-	Py_RETURN_NONE;
-}
 
-static PyObject *
-pmemkv_NI_Remove(PmemkvObject *self, PyObject* args) {
-	Py_buffer key;
-	if (!PyArg_ParseTuple(args, "s*", &key)) {
-		return NULL;
-	}
-	int result = pmemkv_remove(self->db, (const char*) key.buf, key.len);
-	if (result != PMEMKV_STATUS_OK && result != PMEMKV_STATUS_NOT_FOUND) {
-		PyErr_SetString(ExceptionDispatcher[result].exception, pmemkv_errormsg());
+	std::string dictionary(dict_size, '\0');
+	size_t n;
+	Py_BEGIN_ALLOW_THREADS
+	n = ZDICT_trainFromBuffer(&dictionary[0], dictionary.size(), data.data(),
+				  sizes.data(), (unsigned)sizes.size());
+	Py_END_ALLOW_THREADS
+	if (ZDICT_isError(n)) {
+		PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_INVALID_ARGUMENT),
+				ZDICT_getErrorName(n));
 		return NULL;
 	}
-	return PyBool_FromLong(result == PMEMKV_STATUS_OK);
+	return PyBytes_FromStringAndSize(dictionary.data(), n);
+#else
+	PyErr_SetString(pmemkv_exception(PMEMKV_STATUS_NOT_SUPPORTED),
+			"Binding was built without zstd support");
+	return NULL;
+#endif
 }
 
-// Functions declarations.
-static PyMethodDef pmemkv_NI_methods[] = {
-	{"start", (PyCFunction)pmemkv_NI_Start, METH_VARARGS, NULL},
-	{"stop", (PyCFunction)pmemkv_NI_Stop, METH_NOARGS, NULL},
-	{"put", (PyCFunction)pmemkv_NI_Put, METH_VARARGS, NULL},
-	{"get_string", (PyCFunction)pmemkv_NI_GetString, METH_VARARGS, NULL},
-	{"get", (PyCFunction)pmemkv_NI_Get, METH_VARARGS, NULL},
-	{"get_keys", (PyCFunction)pmemkv_NI_GetKeys, METH_VARARGS, NULL},
-	{"get_keys_above", (PyCFunction)pmemkv_NI_GetKeysAbove, METH_VARARGS, NULL},
-	{"get_keys_below", (PyCFunction)pmemkv_NI_GetKeysBelow, METH_VARARGS, NULL},
-	{"get_keys_between", (PyCFunction)pmemkv_NI_GetKeysBetween, METH_VARARGS, NULL},
-	{"count_all", (PyCFunction)pmemkv_NI_CountAll, METH_NOARGS, NULL},
-	{"count_above", (PyCFunction)pmemkv_NI_CountAbove, METH_VARARGS, NULL},
-	{"count_below", (PyCFunction)pmemkv_NI_CountBelow, METH_VARARGS, NULL},
-	{"count_between", (PyCFunction)pmemkv_NI_CountBetween, METH_VARARGS, NULL},
-	{"get_all", (PyCFunction)pmemkv_NI_GetAll, METH_VARARGS, NULL},
-	{"get_above", (PyCFunction)pmemkv_NI_GetAbove, METH_VARARGS, NULL},
-	{"get_below", (PyCFunction)pmemkv_NI_GetBelow, METH_VARARGS, NULL},
-	{"get_between", (PyCFunction)pmemkv_NI_GetBetween, METH_VARARGS, NULL},
-	{"exists", (PyCFunction)pmemkv_NI_Exists, METH_VARARGS, NULL},
-	{"remove", (PyCFunction)pmemkv_NI_Remove, METH_VARARGS, NULL},
+static PyMethodDef pmemkv_NI_module_methods[] = {
+	{"train_zstd_dictionary", (PyCFunction)pmemkv_TrainZstdDictionary, METH_VARARGS,
+	 NULL},
 	{NULL, NULL, 0, NULL}};
 
+// Module definition.
+
+/*
+ * Adds object to the module, which gets a new reference (the caller's one is
+ * kept in the module state). Fails if object is NULL.
+ */
+static int add_object(PyObject *m, const char *name, PyObject *object)
+{
+	if (object == NULL)
+		return -1;
+	Py_INCREF(object);
+	if (PyModule_AddObject(m, name, object) < 0) {
+		Py_DECREF(object);
+		return -1;
+	}
+	return 0;
+}
+
+static int
+pmemkv_NI_exec(PyObject *m) {
+	ModuleState *state = (ModuleState *)PyModule_GetState(m);
+	state->pmemkv_type = (PyTypeObject *)PyType_FromSpec(&Pmemkv_spec);
+	if (add_object(m, "pmemkv_NI", (PyObject *)state->pmemkv_type) < 0)
+		return -1;
+	state->value_buffer_type = (PyTypeObject *)PyType_FromSpec(&PmemkvValueBuffer_spec);
+	if (state->value_buffer_type == NULL)
+		return -1;
+#if PY_VERSION_HEX < 0x03090000
+	/* buffer slots can not be set by PyType_Spec in older versions */
+	state->value_buffer_type->tp_as_buffer->bf_getbuffer =
+		PmemkvValueBufferObject_getbuffer;
+#endif
+
+	PyObject *compressions = PyList_New(0);
+	for (auto c = Compressions; compressions != NULL && *c != NULL; c++) {
+		PyObject *name = PyUnicode_FromString(*c);
+		if (name == NULL || PyList_Append(compressions, name) < 0)
+			Py_CLEAR(compressions);
+		Py_XDECREF(name);
+	}
+	if (compressions == NULL || PyModule_AddObject(m, "compressions", compressions) < 0) {
+		Py_XDECREF(compressions);
+		return -1;
+	}
+
+	state->error = PyErr_NewException("pmemkv_NI.PmemkvException", NULL, NULL);
+	if (add_object(m, "Error", state->error) < 0)
+		return -1;
+	for (auto &e : ExceptionDispatcher) {
+		PyObject *exception = e.second.builtin;
+		if (exception != NULL) {
+			Py_INCREF(exception);
+		} else {
+			exception = PyErr_NewExceptionWithDoc(e.second.exception_name,
+							      e.second.docstring,
+							      state->error, NULL);
+			if (add_object(m, e.second.object_name, exception) < 0)
+				return -1;
+		}
+		state->exceptions[e.first] = exception;
+	}
+
+	std::lock_guard<std::mutex> lock(ModuleStatesMutex);
+	ModuleStates[current_interpreter()].push_back(state);
+	return 0;
+}
+
+static int
+pmemkv_NI_traverse(PyObject *m, visitproc visit, void *arg) {
+	ModuleState *state = (ModuleState *)PyModule_GetState(m);
+	if (state == NULL)
+		return 0;
+	Py_VISIT(state->error);
+	for (auto exception : state->exceptions)
+		Py_VISIT(exception);
+	Py_VISIT(state->pmemkv_type);
+	Py_VISIT(state->value_buffer_type);
+	return 0;
+}
+
+static int
+pmemkv_NI_clear(PyObject *m) {
+	ModuleState *state = (ModuleState *)PyModule_GetState(m);
+	if (state == NULL)
+		return 0;
+	Py_CLEAR(state->error);
+	for (auto &exception : state->exceptions)
+		Py_CLEAR(exception);
+	Py_CLEAR(state->pmemkv_type);
+	Py_CLEAR(state->value_buffer_type);
+	return 0;
+}
+
+static void
+pmemkv_NI_free(void *m) {
+	pmemkv_NI_clear((PyObject *)m);
+	ModuleState *state = (ModuleState *)PyModule_GetState((PyObject *)m);
+	std::lock_guard<std::mutex> lock(ModuleStatesMutex);
+	for (auto it = ModuleStates.begin(); it != ModuleStates.end(); ++it) {
+		auto &states = it->second;
+		auto found = std::find(states.begin(), states.end(), state);
+		if (found == states.end())
+			continue;
+		states.erase(found);
+		if (states.empty())
+			ModuleStates.erase(it);
+		break;
+	}
+}
+
 /*
- * Configuration of pmemkv_NI object.
+ * Module has no global state, so it may be imported by subinterpreters,
+ * each with its own GIL, and by free-threaded builds.
  */
-static PyTypeObject PmemkvType = {
-	PyVarObject_HEAD_INIT(NULL, 0)
-	.tp_name = "pmemkv.pmemkv_NI",
-	.tp_basicsize = sizeof(PmemkvObject),
-	.tp_dealloc = (destructor)Pmemkv_dealloc,
-	.tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
-	.tp_doc = "Pmemkv binding",
-	.tp_methods = pmemkv_NI_methods,
-	.tp_members = pmemkv_NI_members,
-	.tp_new = Pmemkv_new,
+static PyModuleDef_Slot pmemkv_NI_slots[] = {
+	{Py_mod_exec, (void *)pmemkv_NI_exec},
+#ifdef Py_mod_multiple_interpreters
+	{Py_mod_multiple_interpreters, Py_MOD_PER_INTERPRETER_GIL_SUPPORTED},
+#endif
+#ifdef Py_mod_gil
+	{Py_mod_gil, Py_MOD_GIL_NOT_USED},
+#endif
+	{0, NULL},
 };
 
-// Module definition.
 static struct PyModuleDef pmemkv_NI_module = {
 	PyModuleDef_HEAD_INIT,
 	"_pmemkv", /* name of the module */
 	NULL, /* module documentation, may be NULL */
-	-1, /* size of per-interpreter state of the module, or -1 if the module keeps state in global variables. */
+	sizeof(ModuleState), /* size of per-module state */
+	pmemkv_NI_module_methods,
+	pmemkv_NI_slots,
+	pmemkv_NI_traverse,
+	pmemkv_NI_clear,
+	pmemkv_NI_free,
 };
 
 // Creating dynamic module.
 PyMODINIT_FUNC
 PyInit__pmemkv(void) {
-	PyObject *m;
-	if (PyType_Ready(&PmemkvType) < 0)
-		return NULL;
-
-	m = PyModule_Create(&pmemkv_NI_module);
-	if (m == NULL)
-		return NULL;
-
-	try {
-		Py_INCREF(&PmemkvType);
-		if (PyModule_AddObject(m, "pmemkv_NI", (PyObject *)&PmemkvType) < 0) {
-			throw;
-		}
-		PmemkvException =
-			PyErr_NewException("pmemkv_NI.PmemkvException", NULL, NULL);
-		if (PyModule_AddObject(m, "Error", PmemkvException) < 0) {
-			throw;
-		}
-		for (auto &e : ExceptionDispatcher) {
-			if (e.second.exception == NULL) {
-				e.second.exception = PyErr_NewExceptionWithDoc(
-					e.second.exception_name, e.second.docstring,
-					PmemkvException, NULL);
-				if (PyModule_AddObject(m, e.second.object_name,
-						       e.second.exception) < 0) {
-					throw;
-				}
-			}
-		}
-	} catch (...) {
-		Py_XDECREF(&PmemkvType);
-		Py_XDECREF(m);
-		Py_XDECREF(PmemkvException);
-		Py_XDECREF(m);
-		for (auto &e : ExceptionDispatcher) {
-			Py_XDECREF(e.second.exception);
-			Py_XDECREF(m);
-		}
-		return NULL;
-	}
-	return m;
+	return PyModuleDef_Init(&pmemkv_NI_module);
 }
 
 #ifdef __cplusplus
@@ -31,7 +31,470 @@
 """ Python bindings for pmemkv. """
 
 import _pmemkv
+import asyncio
+import collections
+import concurrent.futures
+import io
 import json
+import logging
+import math
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+Change = collections.namedtuple("Change", ["seq", "op", "key", "value"])
+Change.__doc__ = """
+Mutation recorded in the change log (see Database.enable_changes()).
+
+seq is a sequence number of the change, op is 'put' or 'remove', key is
+bytes. value is bytes if change log records values, otherwise it's
+the length of the value (0 for removals).
+"""
+
+HotKey = collections.namedtuple("HotKey", ["key", "count", "error", "reads",
+                                           "writes"])
+HotKey.__doc__ = """
+Frequently accessed key (see Database.hot_keys()).
+
+key is bytes. count is the estimated number of accesses (get, get_string,
+exists, put and remove) and it's higher than the real one by at most error.
+reads and writes are estimated numbers of accesses of each kind, counted
+since the key started to be tracked.
+"""
+
+class JsonPointer():
+    """
+    Index extractor, which takes a value from JSON document pointed by
+    a JSON pointer (RFC 6901), e.g. '/user/email'. Strings are indexed
+    unescaped (as UTF-8), other scalars as they are written in the document.
+    Documents without such value (or with null) are not indexed. It's
+    executed natively.
+    """
+
+    def __init__(self, pointer):
+        self.pointer = pointer
+
+    def _spec(self):
+        return ("json", self.pointer)
+
+
+class StructField():
+    """
+    Index extractor, which takes a fixed-size field of a binary value.
+    Values shorter than offset + size are not indexed. It's executed natively.
+
+    Parameters
+    ----------
+    offset : int
+        Offset of the field, in bytes.
+    size : int
+        Size of the field, in bytes.
+    byteorder : str, optional
+        If 'little', bytes of the field are reversed, so little-endian unsigned
+        integers are ordered numerically in the index. Otherwise field is
+        indexed as it is (big-endian unsigned integers are ordered numerically).
+    signed : bool, optional
+        If true, the field is a two's complement integer. It's used only when
+        field is compared or aggregated by Database.scan().
+
+    Fields of up to 8 bytes may be also compared with integers (==, !=, <,
+    <=, >, >=), which gives a condition for Database.scan(), e.g.
+    StructField(0, 4, "little") >= 10. Values too short to contain the field
+    do not match.
+    """
+
+    def __init__(self, offset, size, byteorder="big", signed=False):
+        self.offset = offset
+        self.size = size
+        self.byteorder = byteorder
+        self.signed = signed
+
+    def _spec(self):
+        return ("struct", self.offset, self.size, self.byteorder == "little")
+
+    def _field(self):
+        return ("field", self.offset, self.size, self.byteorder == "little",
+                self.signed)
+
+    def __eq__(self, other):
+        return _Compare(self, "==", other)
+
+    def __ne__(self, other):
+        return _Compare(self, "!=", other)
+
+    def __lt__(self, other):
+        return _Compare(self, "<", other)
+
+    def __le__(self, other):
+        return _Compare(self, "<=", other)
+
+    def __gt__(self, other):
+        return _Compare(self, ">", other)
+
+    def __ge__(self, other):
+        return _Compare(self, ">=", other)
+
+    __hash__ = object.__hash__
+
+
+_TARGETS = {"key": 0, "value": 1}
+
+
+def _target(target):
+    if target not in _TARGETS:
+        raise ValueError("Target should be 'key' or 'value'")
+    return _TARGETS[target]
+
+
+def _ttl_ms(ttl):
+    # rounded up, so a positive ttl below a millisecond does not expire at once
+    if ttl < 0:
+        raise ValueError("TTL should be non-negative")
+    return math.ceil(ttl * 1000)
+
+
+class _Compare():
+    """ Condition comparing an integer field with a constant. """
+
+    def __init__(self, field, op, operand):
+        if not isinstance(operand, int) or isinstance(operand, bool):
+            raise TypeError("Field may be compared only with int")
+        self.field = field
+        self.op = op
+        self.operand = operand
+
+    def _spec(self):
+        return ("compare", self.field._field(), self.op, self.operand)
+
+
+class Prefix():
+    """
+    Condition for Database.scan(): key (or value) starts with the prefix.
+
+    Parameters
+    ----------
+    prefix : str or byte-like object
+        Expected prefix.
+    target : str, optional
+        'key' (default) or 'value'.
+    """
+
+    def __init__(self, prefix, target="key"):
+        self.prefix = _key_bytes(prefix)
+        self.target = _target(target)
+
+    def _spec(self):
+        return ("prefix", self.target, self.prefix)
+
+
+class Suffix():
+    """
+    Condition for Database.scan(): key (or value) ends with the suffix.
+
+    Parameters
+    ----------
+    suffix : str or byte-like object
+        Expected suffix.
+    target : str, optional
+        'key' (default) or 'value'.
+    """
+
+    def __init__(self, suffix, target="key"):
+        self.suffix = _key_bytes(suffix)
+        self.target = _target(target)
+
+    def _spec(self):
+        return ("suffix", self.target, self.suffix)
+
+
+class Length():
+    """
+    Length of value (or key), in bytes. Used as a condition for
+    Database.scan() it matches records of length within [min, max]. It may be
+    also aggregated, e.g. Sum(Length()) is the total size of values.
+
+    Parameters
+    ----------
+    min : int, optional
+        The lowest length (inclusive). Unbounded if not set.
+    max : int, optional
+        The highest length (inclusive). Unbounded if not set.
+    target : str, optional
+        'value' (default) or 'key'.
+    """
+
+    def __init__(self, min=None, max=None, target="value"):
+        if (min is not None and min < 0) or (max is not None and max < 0):
+            raise ValueError("Length bounds should be non-negative")
+        self.min = min
+        self.max = max
+        self.target = _target(target)
+
+    def _spec(self):
+        return ("length", self.target, -1 if self.min is None else self.min,
+                -1 if self.max is None else self.max)
+
+    def _field(self):
+        return ("length", self.target)
+
+
+class Count():
+    """ Aggregate for Database.scan(): number of matching records. """
+
+    def _spec(self):
+        return ("count",)
+
+
+class _FieldAggregate():
+
+    def __init__(self, field):
+        if not isinstance(field, (StructField, Length)):
+            raise TypeError("Field should be StructField or Length")
+        self.field = field
+
+    def _spec(self):
+        return (self._name, self.field._field())
+
+
+class Sum(_FieldAggregate):
+    """
+    Aggregate for Database.scan(): sum of the field (StructField or Length)
+    over matching records. Records without the field are skipped.
+    """
+    _name = "sum"
+
+
+class Min(_FieldAggregate):
+    """
+    Aggregate for Database.scan(): the lowest value of the field (StructField
+    or Length), or None if there are no records with the field.
+    """
+    _name = "min"
+
+
+class Max(_FieldAggregate):
+    """
+    Aggregate for Database.scan(): the highest value of the field (StructField
+    or Length), or None if there are no records with the field.
+    """
+    _name = "max"
+
+
+class Index():
+    """
+    Secondary index of a Database, see Database.create_index().
+    Index keys may be passed as Unicode objects (using 'utf-8' encoding)
+    or bytes-like objects.
+    """
+
+    def __init__(self, db, name, index_db):
+        self.name = name
+        self._db = db
+        self._index_db = index_db
+
+    def range(self, lo=None, hi=None, limit=None):
+        """
+        Returns primary keys of records, which index keys are within the range
+        [lo, hi), ordered by index key and then by primary key.
+
+        Parameters
+        ----------
+        lo : str or byte-like object, optional
+            The lowest index key (inclusive). Unbounded if not set.
+        hi : str or byte-like object, optional
+            Index keys lower than hi are returned. Unbounded if not set.
+        limit : int, optional
+            Maximum number of returned keys.
+
+        Returns
+        -------
+        keys : list of bytes
+            Primary keys of found records.
+        """
+        return self._db.db.index_range(self.name, lo, hi,
+                                       -1 if limit is None else limit)
+
+    def get(self, key, limit=None):
+        """
+        Returns primary keys of records with the given index key.
+
+        Parameters
+        ----------
+        key : str or byte-like object
+            Index key.
+        limit : int, optional
+            Maximum number of returned keys.
+
+        Returns
+        -------
+        keys : list of bytes
+            Primary keys of found records, in order.
+        """
+        return self._db.db.index_range(self.name, key, None,
+                                       -1 if limit is None else limit, True)
+
+
+# Manifest of a value stored by Database.put_stream(): magic, version, chunk
+# size, size of the value, number of chunks and generation, which is a part
+# of chunk keys (so chunks of the previous value are not overwritten).
+_STREAM_MAGIC = b"PMKVSTRM"
+_STREAM_VERSION = 1
+_STREAM_MANIFEST = struct.Struct("<8sB3xIQQ8s")
+
+
+def _key_bytes(key):
+    return key.encode("utf-8") if isinstance(key, str) else bytes(key)
+
+
+def _chunk_key(key, generation, index):
+    return key + b"\x00" + generation + index.to_bytes(8, "big")
+
+
+def _parse_manifest(data):
+    if len(data) != _STREAM_MANIFEST.size or not data.startswith(_STREAM_MAGIC):
+        return None
+    magic, version, chunk_size, size, chunks, generation = \
+        _STREAM_MANIFEST.unpack(data)
+    if version != _STREAM_VERSION:
+        return None
+    return chunk_size, size, chunks, generation
+
+
+def _split_chunks(source, chunk_size):
+    """ Yields chunk_size pieces (the last one may be shorter) of the source. """
+    if hasattr(source, "read"):
+        read = source.read
+        source = iter(lambda: read(chunk_size), b"")
+    pending = bytearray()
+    for piece in source:
+        if isinstance(piece, str):
+            piece = piece.encode("utf-8")
+        if not piece:
+            # text files return empty str at the end
+            break
+        pending += piece
+        while len(pending) >= chunk_size:
+            yield bytes(pending[:chunk_size])
+            del pending[:chunk_size]
+    if pending:
+        yield bytes(pending)
+
+
+class ValueStream(io.BufferedIOBase):
+    """
+    Read-only, seekable file-like object of a value stored by
+    Database.put_stream() (see Database.open_stream()). Chunks are read from
+    the database lazily, and the following ones are read ahead in a background
+    thread, so memory usage is bounded by (readahead + 1) * chunk size.
+    """
+
+    def __init__(self, db, key, chunk_size, size, chunks, generation, readahead):
+        super().__init__()
+        self.size = size
+        self._db = db
+        self._key = key
+        self._chunk_size = chunk_size
+        self._chunks = chunks
+        self._generation = generation
+        self._readahead = readahead
+        self._executor = None
+        self._pending = {}
+        self._position = 0
+        self._chunk_index = -1
+        self._chunk = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError("Invalid whence")
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self._position = offset
+        return offset
+
+    def _read_chunk(self, index):
+        data = self._db.read(_chunk_key(self._key, self._generation, index))
+        if len(data) != min(self._chunk_size, self.size - index * self._chunk_size):
+            raise ValueError("Chunk {} of the stream is corrupted".format(index))
+        return data
+
+    def _load_chunk(self, index):
+        future = self._pending.pop(index, None)
+        self._chunk = future.result() if future is not None else self._read_chunk(index)
+        self._chunk_index = index
+        # chunks read ahead for other position are dropped
+        for i in list(self._pending):
+            if i < index or i > index + self._readahead:
+                self._pending.pop(i).cancel()
+        if self._readahead > 0 and self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        for i in range(index + 1, min(index + 1 + self._readahead, self._chunks)):
+            if i not in self._pending:
+                self._pending[i] = self._executor.submit(self._read_chunk, i)
+
+    def read1(self, size=-1):
+        """ Reads up to size bytes, from one chunk at most. """
+        if self.closed:
+            raise ValueError("I/O operation on closed stream")
+        if self._position >= self.size:
+            return b""
+        index = self._position // self._chunk_size
+        if index != self._chunk_index:
+            self._load_chunk(index)
+        offset = self._position - index * self._chunk_size
+        end = len(self._chunk) if size is None or size < 0 else offset + size
+        data = self._chunk[offset:end]
+        self._position += len(data)
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(self.size - self._position, 0)
+        parts = []
+        while size > 0:
+            data = self.read1(size)
+            if not data:
+                break
+            parts.append(data)
+            size -= len(data)
+        return b"".join(parts)
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        n = 0
+        while n < len(view):
+            data = self.read1(len(view) - n)
+            if not data:
+                break
+            view[n:n + len(data)] = data
+            n += len(data)
+        return n
+
+    def close(self):
+        if self._executor is not None:
+            for future in self._pending.values():
+                future.cancel()
+            self._executor.shutdown()
+            self._executor = None
+        self._pending.clear()
+        self._chunk = b""
+        super().close()
+
 
 class Database():
     """
@@ -51,10 +514,15 @@ class Database():
     - ConfigTypeError,
     - StoppedByCallback,
     - WrongEngineName,
-    - TransactionScopeError.
+    - TransactionScopeError,
+    - DefragError,
+    - ComparatorMismatch.
     """
 
-    def __init__(self, engine, config):
+    def __init__(self, engine, config, comparator=None, expiry=False,
+                 compression=None, min_size=256, compression_level=0,
+                 compression_dict=None, stats=False, shared=False,
+                 warmup=None):
         """
         Parameters
         ----------
@@ -65,12 +533,84 @@ class Database():
             configuration parameters are dependent on particular engine.
             For more information on engine configuration please look into
             pmemkv man pages.
+        comparator : str or callable, optional
+            Defines order of keys in sorted engines (e.g. vsmap, stree, csmap).
+            It may be a name of one of the built-in comparators, which are
+            executed natively:
+
+            - 'uint64_le' - keys are compared as unsigned 64-bit little-endian
+              integers,
+            - 'reverse_bytes' - keys are sorted in descending bytewise order,
+            - 'int_string' - keys are compared as decimal integers, non-numeric
+              keys are placed after numbers.
+
+            It may also be a function, which accepts two keys (as bytes) and
+            returns negative number, zero or positive number if first key is
+            respectively lower, equal or greater than the second one. Function's
+            __name__ is stored by persistent engines and has to be the same
+            each time the pool is opened. Built-in comparators are considerably
+            faster, as Python comparator is called for each comparison.
+            Requires pmemkv 1.1 or later.
+        expiry : bool, optional
+            Enables time-to-live of records (see put() and start_reaper()).
+            Each value is then stored with a small header, holding expiration
+            time. A pool should be always opened with the same setting, as
+            records written with expiry enabled are not readable without it.
+        compression : str, optional
+            Enables transparent compression of values - 'lz4' or 'zstd'
+            (available ones are listed in pmemkv.compressions). Values are
+            compressed and decompressed natively, with the GIL released.
+            Compressed values are stored with a header (as with expiry),
+            so the same rules of opening a pool apply.
+        min_size : int, optional
+            Values smaller than this size (in bytes) are stored uncompressed.
+            Values which do not shrink after compression are stored uncompressed
+            as well.
+        compression_level : int, optional
+            Compression level, used by zstd. Default level is used if not set.
+        compression_dict : byte-like object, optional
+            Dictionary used by zstd compression, improves compression of small
+            values (see train_zstd_dictionary()). Values compressed with
+            a dictionary can be read only if the same dictionary is passed.
+        stats : bool, optional
+            Enables statistics of stored records (see stats()). They are
+            built by scanning all records when the database is opened and
+            then maintained by writes, each of which has to read the size of
+            the previous value.
+        shared : bool, optional
+            Shares the engine with other databases opened with shared=True
+            and the same engine and path (see open_shared()).
+        warmup : bool or str, optional
+            Starts warm-up of the engine in the background, once it's opened
+            (see warmup()) - 'keys' reads only keys, 'all' (or True) keys
+            and values.
         """
         if not isinstance(config, dict):
             raise TypeError("Config should be dictionary")
         self.config = json.dumps(config)
         self.db = _pmemkv.pmemkv_NI()
-        self.db.start(engine, self.config)
+        self._indexes = {}
+        self._shared = shared
+        self._usage_monitor = None
+        comparator_name = None
+        comparator_function = None
+        if isinstance(comparator, str):
+            comparator_name = comparator
+        elif callable(comparator):
+            comparator_name = getattr(comparator, "__name__", type(comparator).__name__)
+            comparator_function = comparator
+        elif comparator is not None:
+            raise TypeError("Comparator should be string or callable")
+        shared_key = None
+        if shared:
+            path = config.get("path")
+            shared_key = "{}:{}".format(engine, os.path.realpath(path)
+                                        if isinstance(path, str) else self.config)
+        self.db.start(engine, self.config, comparator_name, comparator_function,
+                      expiry, compression, min_size, compression_level,
+                      compression_dict, stats, shared_key)
+        if warmup:
+            self.warmup("all" if warmup is True else warmup)
 
     def __setitem__(self, key, value):
         self.put(key,value)
@@ -98,10 +638,20 @@ class Database():
         self.stop()
 
     def stop(self):
-        """ Stops the running engine. """
+        """
+        Stops the running engine, along with engines of its indexes. Shared
+        engine is stopped when the last database using it is stopped.
+        Operations running in other threads (and the server) are finished
+        first, operations started in the meantime raise InvalidArgument.
+        The engine can't be stopped by a callback of its own operation.
+        """
+        self.stop_usage_monitor()
         self.db.stop()
+        for index in self._indexes.values():
+            index._index_db.stop()
+        self._indexes.clear()
 
-    def put(self, key, value):
+    def put(self, key, value, ttl=None):
         """
         Inserts the key/value pair into the pmemkv datastore. This method
         accepts Unicode objects as well as bytes-like objects.
@@ -113,8 +663,41 @@ class Database():
             record's key; record will be put into database under its name.
         value : str or byte-like object
              data to be inserted into this new datastore record.
+        ttl : float, optional
+            Time to live of the record, in seconds. Expired records are not
+            returned by any read operation, they are removed by the reaper
+            (see start_reaper()). Requires database opened with expiry (or
+            compression) enabled.
+        """
+        if ttl is None:
+            self.db.put(key, value)
+        else:
+            self.db.put(key, value, _ttl_ms(ttl))
+
+    def put_many(self, items, ttl=None):
+        """
+        Inserts key/value pairs into the pmemkv datastore. Pairs are written
+        natively, with the GIL released, so it's considerably faster than
+        calling put() for each of them. Pairs are written one by one, so if
+        one of them fails, the preceding ones remain written.
+
+        Parameters
+        ----------
+        items : dict or iterable of (key, value) pairs
+            Records to insert. Keys and values are str or byte-like objects.
+        ttl : float, optional
+            Time to live of all records, in seconds (see put()).
+
+        Returns
+        -------
+        written : int
+            Number of written pairs.
         """
-        self.db.put(key, value)
+        if isinstance(items, dict):
+            items = list(items.items())
+        if ttl is None:
+            return self.db.put_many(items)
+        return self.db.put_many(items, _ttl_ms(ttl))
 
     def get_keys(self, func):
         """
@@ -397,3 +980,1295 @@ class Database():
             removal.
         """
         return self.db.remove(key)
+
+    def read(self, key, offset=0, length=None):
+        """
+        Reads part of the value for given key. Only the requested part is
+        copied out of the datastore (compressed values are decompressed
+        in full, natively).
+
+        Parameters
+        ----------
+        key : str or byte-like object
+            key to query for.
+        offset : int, optional
+            Offset of the part, in bytes.
+        length : int, optional
+            Maximum length of the part, in bytes. If not set, the value is
+            read up to its end.
+
+        Returns
+        -------
+        data : bytes
+            Requested part of the value. It's shorter than length (or empty)
+            if the value ends before.
+        """
+        if offset < 0 or (length is not None and length < 0):
+            raise ValueError("Offset and length should be non-negative")
+        return self.db.read(key, offset, -1 if length is None else length)
+
+    def write_range(self, key, offset, data):
+        """
+        Overwrites part of the value for given key, starting at offset,
+        extending the value if data goes past its end. The value is modified
+        natively (read, updated and written back while the engine is locked),
+        so it's not copied to Python. Expiration time of the record is kept.
+
+        Parameters
+        ----------
+        key : str or byte-like object
+            record's key.
+        offset : int
+            Offset in the value, in bytes. It may be at most the current
+            length of the value.
+        data : str or byte-like object
+            Data to write.
+
+        Returns
+        -------
+        length : int
+            New length of the value.
+        """
+        if offset < 0:
+            raise ValueError("Offset should be non-negative")
+        return self.db.write_range(key, offset, data)
+
+    def append(self, key, data):
+        """
+        Appends data to the value for given key, natively (see write_range()).
+        If the key does not exist, it's created with data as the value.
+
+        Parameters
+        ----------
+        key : str or byte-like object
+            record's key.
+        data : str or byte-like object
+            Data to append.
+
+        Returns
+        -------
+        length : int
+            New length of the value.
+        """
+        return self.db.write_range(key, -1, data)
+
+    def incr(self, key, delta=1, initial=0):
+        """
+        Atomically adds delta to the integer value for given key. Values of
+        counters are stored as signed 64-bit little-endian integers (e.g.
+        int.from_bytes(db.read(key), "little", signed=True) reads one).
+
+        It's atomic with respect to all other writes of the binding and it
+        runs with the GIL released. Engines which are not thread-safe are
+        locked anyway, for thread-safe ones (e.g. cmap) only a lock assigned
+        to the key is taken, so threads updating different counters rarely
+        wait for each other (benchmarks/counters_benchmark.py compares it
+        with a Python read-modify-write under a lock). Expiration time of
+        the record is kept.
+
+        Parameters
+        ----------
+        key : str or byte-like object
+            Counter's key.
+        delta : int, optional
+            Number to add, may be negative.
+        initial : int, optional
+            Value of the counter, if the key does not exist.
+
+        Returns
+        -------
+        value : int
+            New value of the counter.
+        """
+        return self.db.incr(key, delta, initial)
+
+    def cas(self, key, expected, new, ttl=None):
+        """
+        Atomically writes new value for given key, if its current value is
+        equal to expected (compare-and-swap, see incr() for atomicity).
+
+        Parameters
+        ----------
+        key : str or byte-like object
+            record's key.
+        expected : str or byte-like object or None
+            Expected current value. If None, the key is expected not to exist.
+        new : str or byte-like object or None
+            New value. If None, the record is removed.
+        ttl : float, optional
+            Time to live of the new value, in seconds (see put()).
+
+        Returns
+        -------
+        swapped : bool
+            true if the value was equal to expected and it was replaced.
+        """
+        if ttl is None:
+            return self.db.cas(key, expected, new)
+        return self.db.cas(key, expected, new, _ttl_ms(ttl))
+
+    def update(self, key, func):
+        """
+        Atomically replaces the value for given key with the result of func
+        (see incr() for atomicity). The key is locked while func is running,
+        so it should be short. Expiration time of the record is kept.
+
+        Parameters
+        ----------
+        key : str or byte-like object
+            record's key.
+        func : function
+            Called with the current value (as bytes, or None if the key does
+            not exist). It returns the new value (str or byte-like object), or
+            None to remove the record. If it raises an exception, the value
+            is not changed.
+
+        Returns
+        -------
+        value : str or byte-like object or None
+            Value returned by func.
+        """
+        return self.db.update(key, func)
+
+    def put_stream(self, key, source, chunk_size=4 << 20, batch_size=4):
+        """
+        Stores a large value, read from a file-like object or an iterable,
+        as a manifest (under the key) and chunks of fixed size (under keys
+        derived from it: key, 0x00 byte and 16 more bytes). Chunks are written
+        in batches (see put_many()), so at most batch_size chunks are held
+        in memory. The manifest is written at last, replacing the previous
+        value, which chunks are then removed. If writing fails, already
+        written chunks are removed and the previous value is kept.
+
+        Read the value with open_stream() and remove it with remove_stream().
+
+        Parameters
+        ----------
+        key : str or byte-like object
+            record's key.
+        source : file-like object or iterable
+            Object with read() method (e.g. a file opened in binary mode) or
+            iterable of byte-like (or str) objects.
+        chunk_size : int, optional
+            Size of chunks, in bytes.
+        batch_size : int, optional
+            Number of chunks written at once.
+
+        Returns
+        -------
+        size : int
+            Size of the stored value, in bytes.
+        """
+        if chunk_size <= 0 or batch_size <= 0:
+            raise ValueError("Chunk size and batch size should be positive")
+        key = _key_bytes(key)
+        generation = os.urandom(8)
+        chunks = size = 0
+        batch = []
+        try:
+            for chunk in _split_chunks(source, chunk_size):
+                batch.append((_chunk_key(key, generation, chunks), chunk))
+                chunks += 1
+                size += len(chunk)
+                if len(batch) == batch_size:
+                    self.db.put_many(batch)
+                    batch = []
+            if batch:
+                self.db.put_many(batch)
+            previous = self._stream_manifest(key)
+            self.db.put(key, _STREAM_MANIFEST.pack(_STREAM_MAGIC, _STREAM_VERSION,
+                                                   chunk_size, size, chunks,
+                                                   generation))
+        except BaseException:
+            self._remove_chunks(key, generation, chunks)
+            raise
+        if previous is not None:
+            self._remove_chunks(key, previous[3], previous[2])
+        return size
+
+    def open_stream(self, key, readahead=1):
+        """
+        Opens a value stored by put_stream() for reading.
+
+        Parameters
+        ----------
+        key : str or byte-like object
+            record's key.
+        readahead : int, optional
+            Number of chunks read ahead in a background thread, while
+            the current one is consumed.
+
+        Returns
+        -------
+        stream : ValueStream
+            Read-only, seekable file-like object, its size is available as
+            the size attribute. Reading fails if the value is overwritten
+            or removed meanwhile.
+        """
+        key = _key_bytes(key)
+        manifest = self._stream_manifest(key)
+        if manifest is None:
+            if not self.exists(key):
+                raise KeyError(key)
+            raise ValueError("Value was not stored by put_stream()")
+        chunk_size, size, chunks, generation = manifest
+        return ValueStream(self, key, chunk_size, size, chunks, generation,
+                           readahead)
+
+    def remove_stream(self, key):
+        """
+        Removes a value stored by put_stream(), along with its chunks. Other
+        values are removed as by remove().
+
+        Returns
+        -------
+        removed : bool
+            true if element was removed, false if element didn't exist before
+            removal.
+        """
+        key = _key_bytes(key)
+        manifest = self._stream_manifest(key)
+        removed = self.db.remove(key)
+        if manifest is not None:
+            self._remove_chunks(key, manifest[3], manifest[2])
+        return removed
+
+    def _stream_manifest(self, key):
+        try:
+            return _parse_manifest(self.db.read(key, 0, _STREAM_MANIFEST.size + 1))
+        except KeyError:
+            return None
+
+    def _remove_chunks(self, key, generation, chunks):
+        for index in range(chunks):
+            self.db.remove(_chunk_key(key, generation, index))
+
+    def scan_prefix(self, prefix, limit=None, start_after=None, keys_only=False):
+        """
+        Returns records stored in the pmemkv datastore, whose keys start with
+        the given prefix. Records are collected natively, without calling
+        Python code for each of them, and the GIL is released meanwhile.
+
+        Keys are matched bytewise, so for sorted engines with custom comparator
+        the result is not defined. Engines which do not support range queries
+        are scanned in full and results are sorted by key.
+
+        Parameters
+        ----------
+        prefix : str or byte-like object
+            Prefix of keys to look for. All keys are matched for empty prefix.
+        limit : int, optional
+            Maximum number of records to return.
+        start_after : str or byte-like object, optional
+            Only keys greater than this one are returned. Pass the last key
+            of the previous page to paginate through the results.
+        keys_only : bool, optional
+            If true, only keys are returned.
+
+        Returns
+        -------
+        records : list
+            List of (key, value) tuples or list of keys (if keys_only is set).
+            Keys and values are bytes, in order of keys.
+        """
+        if limit is None:
+            limit = -1
+        elif limit < 0:
+            raise ValueError("Limit should be non-negative")
+        return self.db.scan_prefix(prefix, limit, start_after, keys_only)
+
+    def scan_range(self, lo=None, hi=None, limit=None, start_after=None,
+                   keys_only=False):
+        """
+        Returns records stored in the pmemkv datastore, whose keys are greater
+        than or equal to lo and less than hi. Records are collected natively,
+        as in scan_prefix().
+
+        Keys are compared bytewise for engines which do not support range
+        queries (results are then sorted by key), otherwise engine's order
+        is used.
+
+        Parameters
+        ----------
+        lo : str or byte-like object, optional
+            Sets the inclusive lower bound. If not set, range is unbounded below.
+        hi : str or byte-like object, optional
+            Sets the exclusive upper bound. If not set, range is unbounded above.
+        limit : int, optional
+            Maximum number of records to return.
+        start_after : str or byte-like object, optional
+            Only keys greater than this one are returned. Pass the last key
+            of the previous page to paginate through the results.
+        keys_only : bool, optional
+            If true, only keys are returned.
+
+        Returns
+        -------
+        records : list
+            List of (key, value) tuples or list of keys (if keys_only is set).
+            Keys and values are bytes, in order of keys.
+        """
+        if limit is None:
+            limit = -1
+        elif limit < 0:
+            raise ValueError("Limit should be non-negative")
+        return self.db.scan_range(lo, hi, limit, start_after, keys_only)
+
+    def scan(self, lo=None, hi=None, where=None, select="record",
+             aggregate=None, limit=None):
+        """
+        Returns records within the range [lo, hi), which match all conditions,
+        or aggregates of them. Conditions and aggregates are evaluated
+        natively, with the GIL released, so Python objects are created only
+        for matching records (or not at all, when aggregating).
+
+        Range is handled as in scan_range().
+
+        Parameters
+        ----------
+        lo : str or byte-like object, optional
+            Sets the inclusive lower bound. If not set, range is unbounded below.
+        hi : str or byte-like object, optional
+            Sets the exclusive upper bound. If not set, range is unbounded above.
+        where : condition or list of conditions, optional
+            Prefix, Suffix, Length or comparison of StructField with an int,
+            e.g. [Prefix("user:"), StructField(0, 8, "little") > 100].
+        select : str, optional
+            'record' (default) for (key, value) tuples, 'key' or 'value'.
+        aggregate : aggregate or list of aggregates, optional
+            Count(), Sum(field), Min(field) or Max(field). If set, aggregates
+            are returned instead of records.
+        limit : int, optional
+            Maximum number of records to return. Can't be used with aggregate.
+
+        Returns
+        -------
+        result : list or int
+            List of records (as selected), in order of keys. If aggregate is
+            set, value of the aggregate, or list of values if list was passed.
+        """
+        if select not in ("record", "key", "value"):
+            raise ValueError("Select should be 'record', 'key' or 'value'")
+        if limit is None:
+            limit = -1
+        elif limit < 0:
+            raise ValueError("Limit should be non-negative")
+        if where is None:
+            where = []
+        elif not isinstance(where, (list, tuple)):
+            where = [where]
+        single = aggregate is not None and not isinstance(aggregate, (list, tuple))
+        if aggregate is None:
+            aggregate = []
+        elif single:
+            aggregate = [aggregate]
+        if aggregate and limit >= 0:
+            raise ValueError("Limit can't be used with aggregate")
+        selects = {"key": 0, "value": 1, "record": 2}
+        result = self.db.scan(lo, hi, [w._spec() for w in where],
+                              selects[select], [a._spec() for a in aggregate],
+                              limit)
+        return result[0] if single else result
+
+    def count_prefix(self, prefix):
+        """
+        Returns number of currently stored key/value pairs in the pmemkv
+        datastore, whose keys start with the given prefix.
+
+        Parameters
+        ----------
+        prefix : str or byte-like object
+            Prefix of keys to count.
+
+        Returns
+        -------
+        number : int
+            Number of key/value pairs in the datastore with the given prefix.
+        """
+        return self.db.count_prefix(prefix)
+
+    def remove_prefix(self, prefix):
+        """
+        Removes all key/value pairs from the pmemkv datastore, whose keys start
+        with the given prefix. Keys are removed natively in batches, with the
+        GIL released.
+
+        Parameters
+        ----------
+        prefix : str or byte-like object
+            Prefix of keys to remove. Whole datastore is cleared for empty prefix.
+
+        Returns
+        -------
+        removed : int
+            Number of removed key/value pairs.
+        """
+        return self.db.remove_prefix(prefix)
+
+    def remove_range(self, lo=None, hi=None):
+        """
+        Removes all key/value pairs from the pmemkv datastore, whose keys are
+        greater than or equal to lo and less than hi. Keys are removed natively
+        in batches, with the GIL released, so they are never gathered in Python.
+
+        Keys are compared bytewise for engines which do not support range
+        queries, otherwise engine's order is used. Engines which support
+        transactions are not required - removed keys are not rolled back if
+        an error occurs in the middle of the operation.
+
+        Parameters
+        ----------
+        lo : str or byte-like object, optional
+            Sets the inclusive lower bound. If not set, range is unbounded below.
+        hi : str or byte-like object, optional
+            Sets the exclusive upper bound. If not set, range is unbounded above.
+
+        Returns
+        -------
+        removed : int
+            Number of removed key/value pairs.
+        """
+        return self.db.remove_range(lo, hi)
+
+    def clear(self):
+        """
+        Removes all key/value pairs from the pmemkv datastore.
+
+        Returns
+        -------
+        removed : int
+            Number of removed key/value pairs.
+        """
+        return self.db.remove_range()
+
+    def start_reaper(self, interval=1.0, batch_size=1000, max_rate=None):
+        """
+        Starts a native background thread, which removes expired records.
+        Requires database opened with expiry enabled.
+
+        The reaper scans the datastore incrementally, holding engine's lock only
+        for batch_size records at once (engines which are not thread-safe
+        have to be locked), so foreground operations are not stalled. Until
+        expired records are removed, they are still counted by count_* methods.
+
+        Parameters
+        ----------
+        interval : float, optional
+            Time (in seconds) to wait after each full pass over the datastore.
+        batch_size : int, optional
+            Number of records scanned in one step.
+        max_rate : float, optional
+            Maximum number of removals per second. Unlimited by default.
+        """
+        self.db.start_reaper(interval, batch_size, max_rate or 0.0)
+
+    def stop_reaper(self):
+        """ Stops the reaper thread, if it's running. """
+        self.db.stop_reaper()
+
+    def reaper_stats(self):
+        """
+        Returns statistics of the running reaper.
+
+        Returns
+        -------
+        stats : dict or None
+            Dictionary with number of removed records ('removed') and completed
+            passes over the datastore ('passes'), None if reaper is not running.
+        """
+        return self.db.reaper_stats()
+
+    def compression_stats(self):
+        """
+        Returns statistics of values compression, collected since the
+        database was opened.
+
+        Returns
+        -------
+        stats : dict or None
+            Dictionary with number of compressed values ('compressed') and values
+            stored uncompressed ('stored_raw'), total size of compressed values
+            before and after compression ('raw_bytes', 'compressed_bytes') and
+            their ratio ('ratio'), number of decompressed values ('decompressed')
+            and CPU time spent on compression and decompression, in seconds
+            ('compress_cpu_s', 'decompress_cpu_s'). None if compression is disabled.
+        """
+        return self.db.compression_stats()
+
+    def stats(self):
+        """
+        Returns statistics of stored records, if they were enabled when
+        the database was opened. They are maintained with each write, so
+        it's a constant time operation.
+
+        Sizes of values are sizes of stored values, i.e. after compression,
+        with the header. Expired records are counted until they are removed.
+
+        Returns
+        -------
+        stats : dict or None
+            Dictionary with number of keys ('keys'), total size of keys and
+            values ('key_bytes', 'value_bytes') and histogram of value sizes
+            ('value_sizes') - list of (min_size, max_size, count) tuples for
+            non-empty buckets, which are powers of two. None if statistics
+            are disabled.
+        """
+        return self.db.stats()
+
+    def usage(self):
+        """
+        Returns memory usage of the pool and of the binding. pmemkv does not
+        report how much of the pool is allocated, so it's estimated by size of
+        stored records (known if statistics are enabled, see stats()), which
+        does not include allocator overhead and fragmentation.
+
+        Returns
+        -------
+        usage : dict
+            Dictionary with size of the pool ('pool_size' - size from
+            the config, or of the pool file), total size of stored keys and
+            values ('data_bytes') and its fraction of the pool size
+            ('used_fraction'), each None if unknown. 'allocated_bytes',
+            'free_bytes' and 'fragmentation' are None, as no engine exposes
+            them. 'binding_bytes' is estimated volatile memory used by the
+            binding, by its parts in 'binding' dictionary (statistics,
+            hot_keys, changes, recorder, compression, locks and warmup) and
+            by indexes. Buffers of server connections (see pmemkv.server)
+            are not included.
+        """
+        config = json.loads(self.config)
+        pool_size = config.get("size")
+        path = config.get("path")
+        if pool_size is None and isinstance(path, str) and os.path.isfile(path):
+            pool_size = os.path.getsize(path)
+        stats = self.db.stats()
+        data_bytes = None
+        if stats is not None:
+            data_bytes = stats["key_bytes"] + stats["value_bytes"]
+        binding = self.db.memory_usage()
+        binding["indexes"] = sum(index._index_db.usage()["binding_bytes"]
+                                 for index in self._indexes.values())
+        return {
+            "pool_size": pool_size,
+            "allocated_bytes": None,
+            "free_bytes": None,
+            "fragmentation": None,
+            "data_bytes": data_bytes,
+            "used_fraction": data_bytes / pool_size
+            if data_bytes is not None and pool_size else None,
+            "binding_bytes": sum(binding.values()),
+            "binding": binding,
+        }
+
+    def start_usage_monitor(self, callback, thresholds=(0.8, 0.9, 0.95),
+                            interval=1.0):
+        """
+        Starts a thread, which checks usage() every interval and calls
+        callback(threshold, usage) when used_fraction reaches one of
+        thresholds. Each threshold is reported once, until usage drops below
+        it. Callback is called from the thread, its exceptions are logged
+        (to 'pmemkv.pmemkv' logger) and ignored.
+        Running monitor is restarted.
+
+        Parameters
+        ----------
+        callback : callable
+            Function called with the reached threshold and usage() dictionary.
+        thresholds : iterable of float, optional
+            Fractions of the pool size.
+        interval : float, optional
+            Interval of checking usage, in seconds.
+
+        Raises
+        ------
+        ValueError
+            If statistics are disabled or pool size is unknown, so
+            used_fraction can not be computed.
+        """
+        if self.usage()["used_fraction"] is None:
+            raise ValueError("Usage monitor requires statistics and "
+                             "known pool size")
+        if interval <= 0:
+            raise ValueError("Interval should be positive")
+        self.stop_usage_monitor()
+        stopping = threading.Event()
+        thread = threading.Thread(target=self._monitor_usage,
+                                  args=(callback, sorted(thresholds), interval,
+                                        stopping),
+                                  daemon=True)
+        thread.start()
+        self._usage_monitor = (thread, stopping)
+
+    def stop_usage_monitor(self):
+        """ Stops the usage monitor, waiting for its thread. """
+        if self._usage_monitor is not None:
+            thread, stopping = self._usage_monitor
+            self._usage_monitor = None
+            stopping.set()
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def _monitor_usage(self, callback, thresholds, interval, stopping):
+        reached = set()
+        while not stopping.is_set():
+            usage = self.usage()
+            for threshold in thresholds:
+                if usage["used_fraction"] < threshold:
+                    reached.discard(threshold)
+                elif threshold not in reached:
+                    reached.add(threshold)
+                    try:
+                        callback(threshold, usage)
+                    except Exception:
+                        logger.exception("Usage monitor callback failed")
+            stopping.wait(interval)
+
+    def sample(self, n, lo=None, hi=None, seed=None):
+        """
+        Returns a uniform random sample of keys within the range [lo, hi),
+        with sizes of their values. It's collected with reservoir sampling,
+        in one native pass over the range, with the GIL released. Range is
+        handled as in scan_range().
+
+        Parameters
+        ----------
+        n : int
+            Size of the sample. All records are returned if there are fewer.
+        lo : str or byte-like object, optional
+            Sets the inclusive lower bound. If not set, range is unbounded below.
+        hi : str or byte-like object, optional
+            Sets the exclusive upper bound. If not set, range is unbounded above.
+        seed : int, optional
+            Seed of the random generator, for reproducible samples.
+
+        Returns
+        -------
+        sample : list of tuples
+            List of (key, value_size) tuples, in order of keys. Sizes are sizes
+            of stored values (as in stats()).
+        """
+        if n < 0:
+            raise ValueError("Sample size should be non-negative")
+        return self.db.sample(n, lo, hi, seed)
+
+
+    def export(self, target, lo=None, hi=None, compression=None,
+               compression_level=0):
+        """
+        Writes a snapshot of records within the range [lo, hi) into a file,
+        in a compact binary format, with checksums and optional compression
+        of blocks. Records are serialized and written natively, in large
+        blocks, with the GIL released. Expired records are skipped,
+        expiration times of others are preserved.
+
+        Parameters
+        ----------
+        target : str, path-like or file object
+            Path of the snapshot file or file object opened for writing
+            in binary mode.
+        lo : str or byte-like object, optional
+            The lowest exported key (inclusive). Exported from the beginning
+            if not set.
+        hi : str or byte-like object, optional
+            Keys lower than hi are exported. Exported up to the end if not set.
+        compression : str, optional
+            Compression of blocks - 'lz4' or 'zstd' (see pmemkv.compressions).
+        compression_level : int, optional
+            Compression level, used by zstd.
+
+        Returns
+        -------
+        number : int
+            Number of exported records.
+        """
+        return self.db.export(target, lo, hi, compression, compression_level)
+
+    def import_(self, source):
+        """
+        Writes records from a snapshot file (see export()) to the database,
+        overwriting existing ones. Records are read and written natively,
+        block by block, with the GIL released. Each block is verified before
+        its records are written. Expired records are skipped.
+
+        Parameters
+        ----------
+        source : str, path-like or file object
+            Path of the snapshot file or file object opened for reading
+            in binary mode.
+
+        Returns
+        -------
+        number : int
+            Number of imported records.
+
+        Raises
+        ------
+        InvalidArgument
+            If source is not a snapshot, or it contains records with
+            expiration time and expiry is not enabled for this database.
+        UnknownError
+            If snapshot is corrupted or truncated.
+        """
+        return self.db.import_(source)
+
+    def save_image(self, path):
+        """
+        Saves all records into an image file, sorted by key, so the
+        database may be quickly restored with from_image(). It's meant for
+        volatile engines (e.g. vsmap, vcmap), which lose their content when
+        stopped. Records are copied with the GIL released and the file is
+        replaced atomically, once it's completely written. Expired records
+        are skipped.
+
+        Parameters
+        ----------
+        path : str or path-like
+            Path of the image file.
+
+        Returns
+        -------
+        number : int
+            Number of saved records.
+        """
+        return self.db.save_image(path)
+
+    @classmethod
+    def from_image(cls, engine, config, path, **kwargs):
+        """
+        Opens a database and loads records from an image file created by
+        save_image(). The image is memory-mapped and records are inserted
+        natively, with the GIL released, so loading is limited by
+        sequential read bandwidth. The image is verified before any record
+        is inserted. Values are inserted as they were stored, so the
+        database should be opened with the same expiry and compression
+        settings as the saved one.
+
+        Parameters
+        ----------
+        engine : str
+            Name of the engine to work with.
+        config : dict
+            Dictionary with parameters specified for the engine.
+        path : str or path-like
+            Path of the image file.
+        **kwargs
+            Other parameters passed to Database.
+
+        Returns
+        -------
+        db : Database
+            Opened database, with records loaded from the image.
+
+        Raises
+        ------
+        InvalidArgument
+            If file is not an image, or it was saved with expiry or compression
+            enabled and they are disabled for this database.
+        UnknownError
+            If image is corrupted.
+        """
+        db = cls(engine, config, **kwargs)
+        try:
+            db.db.load_image(path)
+        except BaseException:
+            db.stop()
+            raise
+        return db
+
+    def enable_changes(self, capacity=65536, values=False, block=False):
+        """
+        Enables the change log - a bounded buffer of mutations (see Change),
+        which every write done by the binding appends to natively. It includes
+        writes done by background threads (e.g. removals of expired records)
+        and bulk operations. For thread-safe engines, concurrent writes of
+        the same key may be logged in any order.
+
+        Parameters
+        ----------
+        capacity : int, optional
+            Maximum number of changes kept in the log.
+        values : bool, optional
+            If True, changes contain written values, otherwise only their
+            lengths.
+        block : bool, optional
+            If True, writers wait (with the GIL released) until a consumer
+            makes space in the full log. Otherwise the oldest changes are
+            dropped.
+        """
+        self.db.enable_changes(capacity, values, block)
+
+    def disable_changes(self):
+        """
+        Disables the change log. Consumers receive pending changes and then
+        their iterators stop.
+        """
+        self.db.disable_changes()
+
+    def read_changes(self, max_changes=1000, timeout=None):
+        """
+        Removes changes from the log and returns them, waiting (with the GIL
+        released) until at least one is available.
+
+        Parameters
+        ----------
+        max_changes : int, optional
+            Maximum number of returned changes.
+        timeout : float, optional
+            Maximum time (in seconds) to wait. Waits until a change is
+            available if not set.
+
+        Returns
+        -------
+        changes : list of Change or None
+            Changes, an empty list on timeout, or None if the change log
+            is disabled.
+        """
+        changes = self.db.read_changes(max_changes,
+                                       -1.0 if timeout is None else timeout)
+        if changes is None:
+            return None
+        return [Change(*c) for c in changes]
+
+    def changes(self, batch_size=1000, poll_interval=0.1):
+        """
+        Returns a blocking iterator over changes, which stops when
+        the change log is disabled.
+
+        Parameters
+        ----------
+        batch_size : int, optional
+            Maximum number of changes read at once.
+        poll_interval : float, optional
+            Changes are waited for in steps of this length (in seconds), so
+            the iterator may be interrupted (e.g. by KeyboardInterrupt).
+        """
+        while True:
+            batch = self.read_changes(batch_size, poll_interval)
+            if batch is None:
+                return
+            yield from batch
+
+    async def changes_async(self, batch_size=1000, poll_interval=0.1):
+        """
+        Asynchronous iterator over changes, for use with asyncio. Changes are
+        waited for in the default executor of the running event loop, so
+        the loop is not blocked. Stops when the change log is disabled.
+
+        Parameters
+        ----------
+        batch_size : int, optional
+            Maximum number of changes read at once.
+        poll_interval : float, optional
+            Maximum time (in seconds) a single wait in the executor may take.
+        """
+        # get_running_loop() is available since Python 3.7, get_event_loop()
+        # returns the running loop in coroutines as well
+        if hasattr(asyncio, "get_running_loop"):
+            loop = asyncio.get_running_loop()
+        else:
+            loop = asyncio.get_event_loop()
+        while True:
+            batch = await loop.run_in_executor(None, self.read_changes,
+                                               batch_size, poll_interval)
+            if batch is None:
+                return
+            for change in batch:
+                yield change
+
+    def changes_stats(self):
+        """
+        Returns statistics of the change log.
+
+        Returns
+        -------
+        stats : dict or None
+            Dictionary with state of the log ('enabled'), sequence number of the
+            last change ('seq'), number of changes waiting for consumers
+            ('pending'), capacity of the log ('capacity'), number of dropped
+            changes ('dropped') and writes which had to wait for consumers
+            ('blocked'). None if change log was never enabled.
+        """
+        return self.db.changes_stats()
+
+    def enable_hot_keys(self, capacity=1024, sample_rate=16):
+        """
+        Enables tracking of the most frequently accessed keys (by get,
+        get_string, exists, put and remove). It's done natively, with
+        the Space-Saving algorithm, which counts at most capacity keys, and
+        only one of sample_rate operations (chosen at random) is counted.
+        Tracking is restarted if it was disabled or sample_rate has changed.
+
+        Parameters
+        ----------
+        capacity : int, optional
+            Number of counted keys. Keys much more frequent than
+            1 / capacity of all accesses are reliably found.
+        sample_rate : int, optional
+            One of sample_rate operations is counted, counts are scaled
+            accordingly. 1 counts every operation.
+        """
+        self.db.enable_hot_keys(capacity, sample_rate)
+
+    def disable_hot_keys(self):
+        """
+        Disables tracking of hot keys. Collected counts are still available
+        through hot_keys().
+        """
+        self.db.disable_hot_keys()
+
+    def hot_keys(self, k=10, reset=False):
+        """
+        Returns the most frequently accessed keys, tracked since
+        enable_hot_keys() was called or counts were reset.
+
+        Parameters
+        ----------
+        k : int, optional
+            Maximum number of returned keys.
+        reset : bool, optional
+            If True, counts are reset, so the next call returns keys accessed
+            since this one.
+
+        Returns
+        -------
+        keys : list of HotKey
+            Keys with their estimated counts, the most frequent first. Empty
+            if tracking was never enabled.
+        """
+        result = self.db.hot_keys(k, reset)
+        if result is None:
+            return []
+        return [HotKey(*key) for key in result[2]]
+
+    def hot_key_snapshots(self, k=10, interval=60.0):
+        """
+        Returns a blocking iterator over periodic snapshots of hot keys. Each
+        snapshot is a list of HotKey (as returned by hot_keys()) with keys
+        accessed during the last interval. Stops when tracking is disabled.
+
+        Parameters
+        ----------
+        k : int, optional
+            Maximum number of keys in a snapshot.
+        interval : float, optional
+            Time between snapshots, in seconds.
+        """
+        self.db.hot_keys(0, True)
+        while True:
+            time.sleep(interval)
+            result = self.db.hot_keys(k, True)
+            if result is None or not result[0]:
+                return
+            yield [HotKey(*key) for key in result[2]]
+
+    def start_recording(self, path, keys=False):
+        """
+        Starts recording operations done through the binding (get, put,
+        remove and exists) to a trace file, which can be replayed with
+        pmemkv.replay. Each operation is appended natively, as a record of
+        its time, type, sizes of the key and the value (for get it's known
+        only for get_string()) and a hash of the key. Records are buffered
+        and written in chunks. Running recording is restarted.
+
+        Parameters
+        ----------
+        path : str or path-like
+            Path of the trace file, it's overwritten.
+        keys : bool, optional
+            Records keys as well, not only their hashes.
+        """
+        self.db.start_recording(path, keys)
+
+    def stop_recording(self):
+        """
+        Stops recording and closes the trace.
+
+        Returns
+        -------
+        records : int or None
+            Number of recorded operations, None if recording was not started.
+
+        Raises
+        ------
+        OSError
+            If writing the trace failed.
+        """
+        return self.db.stop_recording()
+
+    def create_index(self, name, extractor, engine="vsmap", config=None):
+        """
+        Creates a secondary index, which maps keys extracted from values to
+        primary keys. It's kept in a separate database (which has to use a
+        sorted engine) and it's updated natively on every write done by
+        the binding. Existing records are indexed when the index is created -
+        index database is cleared first, so a persistent index is rebuilt each
+        time the database is opened. Writes wait until it's done.
+
+        Parameters
+        ----------
+        name : str
+            Name of the index.
+        extractor : JsonPointer, StructField, str or callable
+            Computes index key of a value. A string is treated as JSON pointer.
+            A callable is called with the value (as bytes), holding the GIL,
+            and it should return str, bytes-like object or None (if the value
+            should not be indexed). Its exceptions are reported as unraisable,
+            as the write can not be aborted.
+        engine : str, optional
+            Sorted engine used by the index (e.g. vsmap, stree, csmap).
+        config : dict, optional
+            Configuration of the index engine. It must not point to the pool
+            of this database.
+
+        Returns
+        -------
+        index : Index
+            Created index.
+        """
+        if self._shared:
+            raise _pmemkv.NotSupported(
+                "Index can not be created on a shared engine")
+        if name in self._indexes:
+            raise ValueError("Index already exists: {}".format(name))
+        if isinstance(extractor, str):
+            extractor = JsonPointer(extractor)
+        if isinstance(extractor, (JsonPointer, StructField)):
+            spec = extractor._spec()
+        elif callable(extractor):
+            spec = ("python", extractor)
+        else:
+            raise TypeError("Extractor should be JsonPointer, StructField, "
+                            "string or callable")
+        index_db = Database(engine, config if config is not None else {})
+        try:
+            self.db.create_index(name, index_db.db, spec)
+        except BaseException:
+            index_db.stop()
+            raise
+        self._indexes[name] = Index(self, name, index_db)
+        return self._indexes[name]
+
+    def index(self, name):
+        """
+        Returns an index created with create_index().
+
+        Raises
+        ------
+        KeyError
+            If there is no such index.
+        """
+        return self._indexes[name]
+
+    def drop_index(self, name):
+        """
+        Stops maintaining the index and stops its engine. Entries of
+        a persistent index are left in its pool.
+        """
+        self.db.drop_index(name)
+        self._indexes.pop(name)._index_db.stop()
+
+    def defrag(self, start_percent=0, amount_percent=100):
+        """
+        Defragments the given part of the pool, so memory released by
+        removed or overwritten records can be reused. Runs natively,
+        with the GIL released.
+
+        Parameters
+        ----------
+        start_percent : float, optional
+            Starting point of defragmentation, as percent of the pool.
+        amount_percent : float, optional
+            Amount of the pool to be defragmented, in percent.
+
+        Raises
+        ------
+        NotSupported
+            If engine does not support defragmentation.
+        DefragError
+            If defragmentation failed.
+        """
+        self.db.defrag(start_percent, amount_percent)
+
+    def start_defrag_scheduler(self, interval=60.0, slice_percent=5.0,
+                               cpu_budget=0.1, max_latency=0.01,
+                               max_write_rate=1000):
+        """
+        Starts a native background thread, which defragments the pool in small
+        slices. Slices are deferred while the database is under write load and
+        shrunk when they take longer than max_latency, so foreground operations
+        are not stalled.
+
+        Parameters
+        ----------
+        interval : float, optional
+            Time (in seconds) to wait after each full pass over the pool.
+        slice_percent : float, optional
+            Maximum part of the pool (in percent) defragmented at once.
+        cpu_budget : float, optional
+            Maximum fraction of a CPU used by the scheduler, from (0, 1].
+        max_latency : float, optional
+            Target duration of a single slice, in seconds.
+        max_write_rate : float, optional
+            Slices are deferred while the binding writes more records per second.
+            If 0, slices are never deferred.
+        """
+        self.db.start_defrag_scheduler(interval, slice_percent, cpu_budget,
+                                       max_latency, max_write_rate)
+
+    def stop_defrag_scheduler(self):
+        """ Stops the defragmentation scheduler, if it's running. """
+        self.db.stop_defrag_scheduler()
+
+    def defrag_stats(self):
+        """
+        Returns statistics of the running defragmentation scheduler.
+
+        Returns
+        -------
+        stats : dict or None
+            Dictionary with number of defragmented slices ('slices'), completed
+            passes over the pool ('passes'), deferred slices ('deferred'), failed
+            slices ('errors') with exception type of the last failure
+            ('last_error'), wall and CPU time spent, in seconds ('time_s',
+            'cpu_s') and current slice size ('slice_percent'). 'reclaimed_bytes'
+            is always None, as pmemkv does not report it. None if scheduler
+            is not running.
+        """
+        return self.db.defrag_stats()
+
+    def warmup(self, mode="all", budget_s=None, threads=2, batch_size=1000,
+               cpu_budget=0.5):
+        """
+        Starts background threads, which walk all records with the GIL
+        released, to fault in pages of a freshly opened pool, so first
+        requests do not pay for it. Records of sorted engines are walked in
+        batches, holding the engine lock for one batch at a time, and each
+        thread sleeps between batches to use at most cpu_budget of a CPU,
+        so requests are served during warm-up. Other engines are walked in
+        a single pass, which sleeps every batch_size records (holding the
+        engine lock, if the engine is not thread-safe). Running warm-up is
+        restarted.
+
+        Parameters
+        ----------
+        mode : str, optional
+            'keys' reads only keys (and engine structures leading to them),
+            'all' reads values as well.
+        budget_s : float, optional
+            Time after which warm-up gives up, unlimited if not set.
+        threads : int, optional
+            Number of threads. Only engines with keys sorted bytewise are
+            walked by more than one thread.
+        batch_size : int, optional
+            Number of records read at once.
+        cpu_budget : float, optional
+            Fraction of a CPU, which each thread may use, within (0, 1].
+        """
+        if mode not in ("keys", "all"):
+            raise ValueError("Warm-up mode should be 'keys' or 'all'")
+        self.db.start_warmup(mode == "keys", budget_s or 0, threads,
+                             batch_size, cpu_budget)
+
+    def stop_warmup(self):
+        """ Stops warm-up, waiting for its threads. """
+        self.db.stop_warmup()
+
+    def warmup_stats(self):
+        """
+        Returns progress of the warm-up.
+
+        Returns
+        -------
+        stats : dict or None
+            Dictionary with 'running' flag, number of records and bytes read
+            ('records', 'bytes'), estimated fraction of walked records
+            ('progress'), time it's been running or it took, in seconds
+            ('time_s') and 'timed_out' flag, set if budget_s was exceeded.
+            None if warm-up was never started.
+        """
+        return self.db.warmup_stats()
+
+    def wait_warmup(self, timeout=None, poll_interval=0.05):
+        """
+        Waits until warm-up is finished.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time to wait, in seconds. Unlimited if not set.
+        poll_interval : float, optional
+            Interval of checking the progress, in seconds.
+
+        Returns
+        -------
+        finished : bool
+            False if timeout passed before warm-up was finished.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stats = self.db.warmup_stats()
+            if stats is None or not stats["running"]:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_interval)
+
+
+def open_shared(engine, config, **kwargs):
+    """
+    Opens a database, which shares the engine with other shared databases
+    opened in the process with the same engine and path (or the same config,
+    if it has no path). The first call opens the engine, the following ones
+    return immediately, without parsing the config and recovering the pool.
+    Each returned database has to be stopped and the engine is closed when
+    the last one is.
+
+    Records, locks and statistics are shared. Reaper and defrag scheduler
+    are per database. Change log, hot keys and indexes would see only
+    operations done through one of the databases, so they are not supported
+    on shared databases (NotSupported is raised).
+
+    Parameters
+    ----------
+    engine : str
+        Name of the engine to work with.
+    config : dict
+        Dictionary with parameters specified for the engine. It has to be
+        the same each time the engine is shared.
+    **kwargs
+        Other parameters passed to Database. They have to be the same each
+        time the engine is shared, comparator has to be a built-in one.
+
+    Returns
+    -------
+    db : Database
+        Opened database.
+
+    Raises
+    ------
+    InvalidArgument
+        If the engine is already open with a different config or parameters.
+    NotSupported
+        If comparator is a callable.
+    """
+    return Database(engine, config, shared=True, **kwargs)
+
+
+def train_zstd_dictionary(samples, dict_size=16384):
+    """
+    Trains zstd dictionary, which may be passed to Database (compression_dict
+    parameter) to improve compression of small values.
+
+    Parameters
+    ----------
+    samples : iterable of byte-like objects
+        Samples of typical values, usually a few thousands of them.
+    dict_size : int, optional
+        Maximum size of the dictionary, in bytes.
+
+    Returns
+    -------
+    dictionary : bytes
+        Trained dictionary.
+    """
+    return _pmemkv.train_zstd_dictionary(samples, dict_size)
@@ -0,0 +1,239 @@
+#  Copyright 2019-2020, Intel Corporation
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+#
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in
+#        the documentation and/or other materials provided with the
+#        distribution.
+#
+#      * Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived
+#        from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Replays a trace of operations recorded by Database.start_recording() against
+any engine, to evaluate it with a real workload. Run it as:
+
+    python -m pmemkv.replay trace.bin --engine vsmap \\
+        --config '{"path": "/dev/shm", "size": 1073741824}' --threads 4
+
+Operations are replayed at the recorded pace (or faster, with --speed, or as
+fast as possible, with --speed 0). Keys recorded as hashes are replayed as
+the 8-byte hash, padded with zeros to the recorded key size - keys shorter
+than 8 bytes are replayed 8 bytes long, so distinct keys stay distinct.
+Values are zeros of the recorded size.
+"""
+
+import argparse
+import collections
+import json
+import struct
+import threading
+import time
+
+from pmemkv.pmemkv import Database
+
+TRACE_MAGIC = b"PMKVTRC1"
+TRACE_FLAG_KEYS = 0x01
+_HEADER = struct.Struct("<8sII")
+_RECORD = struct.Struct("<QBIIQ")
+
+OPERATIONS = {1: "get", 2: "put", 3: "remove", 4: "exists"}
+
+TraceRecord = collections.namedtuple(
+    "TraceRecord", ["time_us", "op", "key", "value_size", "key_hash"])
+TraceRecord.__doc__ = """
+Recorded operation: time in microseconds since recording started, name of
+the operation ('get', 'put', 'remove' or 'exists'), key (recorded or rebuilt
+from its hash, padded to max(key size, 8) bytes), size of the value (0 if
+unknown) and 64-bit FNV-1a hash of the key.
+"""
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def read_trace(path):
+    """
+    Reads a trace file.
+
+    Parameters
+    ----------
+    path : str or path-like
+        Path of the trace.
+
+    Yields
+    ------
+    record : TraceRecord
+        Recorded operations, in order of recording.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a trace or it's truncated.
+    """
+    with open(path, "rb") as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size or header[:8] != TRACE_MAGIC:
+            raise ValueError("Not a pmemkv trace: {}".format(path))
+        _, flags, _ = _HEADER.unpack(header)
+        keys = flags & TRACE_FLAG_KEYS
+        while True:
+            data = f.read(_RECORD.size)
+            if not data:
+                return
+            if len(data) < _RECORD.size:
+                raise ValueError("Truncated trace: {}".format(path))
+            time_us, op, key_size, value_size, key_hash = _RECORD.unpack(data)
+            if keys:
+                key = f.read(key_size)
+                if len(key) < key_size:
+                    raise ValueError("Truncated trace: {}".format(path))
+            else:
+                # truncating the hash would merge distinct keys
+                key = key_hash.to_bytes(8, "little").ljust(key_size, b"\0")
+            yield TraceRecord(time_us, OPERATIONS.get(op, "unknown"), key,
+                              value_size, key_hash)
+
+
+def _ignore(value):
+    pass
+
+
+def _replay_part(db, records, start, speed, latencies):
+    values = {}
+    for record in records:
+        if speed > 0:
+            delay = start + record.time_us / 1e6 / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        began = time.perf_counter()
+        if record.op == "get":
+            try:
+                db.get(record.key, _ignore)
+            except KeyError:
+                pass
+        elif record.op == "put":
+            value = values.get(record.value_size)
+            if value is None:
+                value = values[record.value_size] = bytes(record.value_size)
+            db.put(record.key, value)
+        elif record.op == "remove":
+            db.remove(record.key)
+        elif record.op == "exists":
+            db.exists(record.key)
+        else:
+            continue
+        latencies[record.op].append(time.perf_counter() - began)
+
+
+def _percentile(values, percent):
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def replay(db, records, threads=1, speed=1.0):
+    """
+    Replays recorded operations. Operations on the same key are replayed by
+    the same thread, in the recorded order.
+
+    Parameters
+    ----------
+    db : pmemkv.Database
+        Database to replay operations on.
+    records : iterable of TraceRecord
+        Operations to replay (see read_trace()).
+    threads : int, optional
+        Number of replaying threads.
+    speed : float, optional
+        Speed of replaying, relative to the recorded one. Operations are
+        replayed as fast as possible, if it's 0.
+
+    Returns
+    -------
+    report : dict
+        Dictionary with number of replayed operations ('operations'), time
+        it took in seconds ('time_s'), operations per second ('throughput')
+        and latencies of each kind of operations ('latency') - dictionaries
+        with their number ('count'), percentiles (e.g. 'p99') and maximum
+        ('max'), in seconds.
+    """
+    if threads <= 0 or speed < 0:
+        raise ValueError("Threads should be positive and speed non-negative")
+    parts = [[] for _ in range(threads)]
+    for record in records:
+        parts[record.key_hash % threads].append(record)
+    latencies = [collections.defaultdict(list) for _ in range(threads)]
+    start = time.perf_counter()
+    workers = [threading.Thread(target=_replay_part,
+                                args=(db, parts[i], start, speed, latencies[i]))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    report = {"operations": 0, "time_s": elapsed, "latency": {}}
+    for op in OPERATIONS.values():
+        values = sorted(v for part in latencies for v in part.get(op, ()))
+        if not values:
+            continue
+        stats = {"count": len(values), "max": values[-1]}
+        for percent in PERCENTILES:
+            stats["p{:g}".format(percent)] = _percentile(values, percent)
+        report["latency"][op] = stats
+        report["operations"] += len(values)
+    report["throughput"] = report["operations"] / elapsed if elapsed > 0 else 0.0
+    return report
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m pmemkv.replay",
+                                     description="Replays a trace of pmemkv "
+                                     "operations and reports their latency.")
+    parser.add_argument("trace", help="path of the trace")
+    parser.add_argument("--engine", required=True, help="name of the engine")
+    parser.add_argument("--config", required=True,
+                        help="configuration of the engine, as JSON object")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="number of replaying threads")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="speed relative to the recorded one, "
+                        "0 replays as fast as possible")
+    parser.add_argument("--expiry", action="store_true",
+                        help="enable time-to-live of records")
+    parser.add_argument("--compression", help="compression of values")
+    args = parser.parse_args(args)
+
+    with Database(args.engine, json.loads(args.config), expiry=args.expiry,
+                  compression=args.compression) as db:
+        report = replay(db, read_trace(args.trace), args.threads, args.speed)
+    print("operations: {}, time: {:.3f} s, throughput: {:.0f} ops/s".format(
+        report["operations"], report["time_s"], report["throughput"]))
+    for op, stats in report["latency"].items():
+        print("{:>7}: {:>9} ops, latency (us): {}, max {:.1f}".format(
+            op, stats["count"],
+            ", ".join("p{:g} {:.1f}".format(p, stats["p{:g}".format(p)] * 1e6)
+                      for p in PERCENTILES),
+            stats["max"] * 1e6))
+
+
+if __name__ == "__main__":
+    main()
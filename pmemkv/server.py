@@ -0,0 +1,132 @@
+#  Copyright 2019-2020, Intel Corporation
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+#
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in
+#        the documentation and/or other materials provided with the
+#        distribution.
+#
+#      * Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived
+#        from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Server exposing a pmemkv database to other processes on the same machine.
+
+Clients connect over a Unix domain socket (see pmemkv.client). Requests are
+executed natively, one thread per connection, without taking the GIL, so the
+server process does not limit throughput of its clients. Payloads are sent
+over the socket as well - shared-memory rings for payloads are not
+implemented, so each round trip costs a write and a read of the socket on
+both sides and it takes tens of microseconds rather than single digits.
+benchmarks/server_benchmark.py measures the latency. Run the server as:
+
+    python -m pmemkv.server --engine vsmap \\
+        --config '{"path": "/dev/shm", "size": 1073741824}' \\
+        --socket /tmp/pmemkv.sock
+"""
+
+import argparse
+import json
+import os
+import socket
+
+from pmemkv.pmemkv import Database
+
+
+class Server():
+    """
+    Serves the database over a Unix domain socket. The database is not
+    stopped along with the server.
+
+    Parameters
+    ----------
+    db : pmemkv.Database
+        Database to serve.
+    path : str
+        Path of the socket. Existing socket file is replaced.
+    backlog : int, optional
+        Maximum number of pending connections.
+    """
+
+    def __init__(self, db, path, backlog=128):
+        self.db = db
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(path)
+        self._socket.listen(backlog)
+        self._socket.setblocking(False)
+        self._wake_read, self._wake_write = os.pipe()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def serve_forever(self):
+        """
+        Accepts connections and handles their requests, until shutdown()
+        is called (e.g. from another thread) or a signal handler raises
+        an exception (e.g. KeyboardInterrupt). All client connections are
+        closed before it returns.
+        """
+        self.db.db.serve(self._socket.fileno(), self._wake_read)
+
+    def shutdown(self):
+        """ Makes serve_forever() return. """
+        os.write(self._wake_write, b"x")
+
+    def close(self):
+        """ Closes the socket and removes its file. """
+        self._socket.close()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m pmemkv.server",
+                                     description="Serves pmemkv database "
+                                     "over a Unix domain socket.")
+    parser.add_argument("--engine", required=True, help="name of the engine")
+    parser.add_argument("--config", required=True,
+                        help="configuration of the engine, as JSON object")
+    parser.add_argument("--socket", required=True, help="path of the socket")
+    parser.add_argument("--expiry", action="store_true",
+                        help="enable time-to-live of records")
+    parser.add_argument("--compression", help="compression of values")
+    args = parser.parse_args(args)
+
+    with Database(args.engine, json.loads(args.config), expiry=args.expiry,
+                  compression=args.compression) as db:
+        with Server(db, args.socket) as server:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == "__main__":
+    main()
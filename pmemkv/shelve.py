@@ -0,0 +1,197 @@
+#  Copyright 2019-2020, Intel Corporation
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+#
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in
+#        the documentation and/or other materials provided with the
+#        distribution.
+#
+#      * Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived
+#        from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+shelve-compatible persistent dictionary of Python objects, stored in a pmemkv
+pool (see pmemkv.dbm).
+"""
+
+import collections
+import pickle
+import shelve
+
+import pmemkv.dbm
+
+# pickle protocol 5 is available since Python 3.8
+DEFAULT_PROTOCOL = min(5, pickle.HIGHEST_PROTOCOL)
+
+_MISSING = object()
+
+
+class Shelf(shelve.Shelf):
+    """
+    Shelf with a bounded write-back cache. Without writeback it behaves as
+    shelve.Shelf - objects are pickled when assigned and unpickled on each
+    access. With writeback, up to cache_size recently used objects are kept
+    in memory, so accessing them again does not unpickle them. Assigned
+    objects are marked dirty and pickled when they are written: on sync(),
+    close(), when they are evicted from the cache, or before keys are
+    listed or counted. Objects loaded from the pool might be mutated in
+    place, so they are pickled again only by sync(), close() and eviction,
+    and written if their pickle differs from the loaded one.
+    """
+
+    def __init__(self, dict, protocol=None, writeback=False,
+                 keyencoding="utf-8", cache_size=1024):
+        if cache_size <= 0:
+            raise ValueError("Cache size should be positive")
+        super().__init__(dict, DEFAULT_PROTOCOL if protocol is None else protocol,
+                         writeback, keyencoding)
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+        # pickles of cached objects as loaded or last written
+        self._loaded = {}
+        # keys of assigned objects, which were not written yet
+        self._dirty = set()
+
+    def _encode(self, key):
+        return key.encode(self.keyencoding)
+
+    def _cache(self, key, value, data):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        if data is None:
+            self._loaded.pop(key, None)
+            self._dirty.add(key)
+        else:
+            self._loaded[key] = data
+        while len(self.cache) > self.cache_size:
+            victim, value = self.cache.popitem(last=False)
+            data = pickle.dumps(value, self._protocol)
+            if victim in self._dirty or data != self._loaded.get(victim):
+                self.dict[self._encode(victim)] = data
+            self._dirty.discard(victim)
+            self._loaded.pop(victim, None)
+
+    def _write_dirty(self):
+        """ Writes assigned objects at once. """
+        if self._dirty:
+            written = {key: pickle.dumps(self.cache[key], self._protocol)
+                       for key in self._dirty}
+            self.dict.update((self._encode(key), data)
+                             for key, data in written.items())
+            self._loaded.update(written)
+            self._dirty.clear()
+
+    def __iter__(self):
+        # keys of assigned objects have to be written first
+        self._write_dirty()
+        for key in self.dict.keys():
+            yield key.decode(self.keyencoding)
+
+    def __len__(self):
+        self._write_dirty()
+        return len(self.dict)
+
+    def __contains__(self, key):
+        return key in self.cache or self._encode(key) in self.dict
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key):
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            self.cache.move_to_end(key)
+            return value
+        data = self.dict[self._encode(key)]
+        value = pickle.loads(data)
+        if self.writeback:
+            self._cache(key, value, data)
+        return value
+
+    def __setitem__(self, key, value):
+        if self.writeback:
+            self._cache(key, value, None)
+        else:
+            self.dict[self._encode(key)] = pickle.dumps(value, self._protocol)
+
+    def __delitem__(self, key):
+        self.cache.pop(key, None)
+        self._loaded.pop(key, None)
+        dirty = key in self._dirty
+        self._dirty.discard(key)
+        try:
+            del self.dict[self._encode(key)]
+        except KeyError:
+            # assigned object might have not been written yet
+            if not dirty:
+                raise
+
+    def sync(self):
+        """
+        Writes assigned cached objects and loaded ones, which were mutated,
+        at once. Objects stay in the cache.
+        """
+        if self.writeback and self.cache:
+            written = {}
+            for key, value in self.cache.items():
+                data = pickle.dumps(value, self._protocol)
+                if key in self._dirty or data != self._loaded[key]:
+                    written[key] = data
+            if written:
+                self.dict.update((self._encode(key), data)
+                                 for key, data in written.items())
+                self._loaded.update(written)
+            self._dirty.clear()
+        if hasattr(self.dict, "sync"):
+            self.dict.sync()
+
+
+def open(filename, flag="c", protocol=None, writeback=False, cache_size=1024,
+         **kwargs):
+    """
+    Opens a persistent dictionary of Python objects stored in a pmemkv pool.
+
+    Parameters
+    ----------
+    filename : str or path-like
+        Path of the pool.
+    flag : str, optional
+        Flag passed to pmemkv.dbm.open().
+    protocol : int, optional
+        Pickle protocol, 5 (where available) by default.
+    writeback : bool, optional
+        Enables the write-back cache (see Shelf).
+    cache_size : int, optional
+        Maximum number of cached objects.
+    **kwargs
+        Other parameters passed to pmemkv.dbm.open() (e.g. engine).
+
+    Returns
+    -------
+    shelf : Shelf
+        Opened shelf, closed with close().
+    """
+    return Shelf(pmemkv.dbm.open(filename, flag, **kwargs), protocol,
+                 writeback, cache_size=cache_size)
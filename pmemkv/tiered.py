@@ -0,0 +1,431 @@
+#  Copyright 2019-2020, Intel Corporation
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#      * Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+#
+#      * Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in
+#        the documentation and/or other materials provided with the
+#        distribution.
+#
+#      * Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived
+#        from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+""" Two-tier storage: hot records in a volatile engine, all in a persistent one. """
+
+import collections
+import threading
+
+from pmemkv.pmemkv import Database, _key_bytes
+
+
+class _ClockPolicy():
+    """ CLOCK (second chance) replacement of resident keys. """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._referenced = {}
+        self._ring = []
+        self._hand = 0
+
+    def __contains__(self, key):
+        return key in self._referenced
+
+    def __len__(self):
+        return len(self._referenced)
+
+    def access(self, key):
+        self._referenced[key] = True
+
+    def admit(self, key):
+        """ Adds the key, returns the evicted key or None. """
+        victim = None
+        if len(self._referenced) >= self.capacity:
+            victim = self._evict()
+        self._referenced[key] = False
+        self._ring.append(key)
+        return victim
+
+    def _evict(self):
+        while True:
+            if self._hand >= len(self._ring):
+                self._hand = 0
+            key = self._ring[self._hand]
+            referenced = self._referenced.get(key)
+            if referenced:
+                self._referenced[key] = False
+                self._hand += 1
+                continue
+            # removes the entry, moving the last one into its place
+            self._ring[self._hand] = self._ring[-1]
+            self._ring.pop()
+            if referenced is not None:
+                del self._referenced[key]
+                return key
+
+    def remove(self, key):
+        # entry in the ring is removed lazily, by _evict()
+        if self._referenced.pop(key, None) is not None and \
+                len(self._ring) > 2 * self.capacity:
+            self._ring = list(self._referenced)
+            self._hand = 0
+
+
+class _TwoQueuePolicy():
+    """
+    2Q replacement: new keys enter FIFO queue (a quarter of the capacity),
+    keys accessed again after leaving it (remembered in a ghost queue) enter
+    LRU queue of frequently used keys.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._in_size = max(capacity // 4, 1)
+        self._out_size = max(capacity // 2, 1)
+        self._in = collections.OrderedDict()
+        self._out = collections.OrderedDict()
+        self._main = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._in or key in self._main
+
+    def __len__(self):
+        return len(self._in) + len(self._main)
+
+    def access(self, key):
+        if key in self._main:
+            self._main.move_to_end(key)
+
+    def admit(self, key):
+        victim = None
+        if len(self) >= self.capacity:
+            victim = self._evict()
+        if self._out.pop(key, None) is not None:
+            self._main[key] = None
+        else:
+            self._in[key] = None
+        return victim
+
+    def _evict(self):
+        if len(self._in) >= self._in_size or not self._main:
+            key, _ = self._in.popitem(last=False)
+            self._out[key] = None
+            if len(self._out) > self._out_size:
+                self._out.popitem(last=False)
+            return key
+        key, _ = self._main.popitem(last=False)
+        return key
+
+    def remove(self, key):
+        self._in.pop(key, None)
+        self._main.pop(key, None)
+        self._out.pop(key, None)
+
+
+_POLICIES = {"clock": _ClockPolicy, "2q": _TwoQueuePolicy}
+
+# Number of locks serializing write-through writes of keys (by their hash).
+_KEY_LOCKS = 64
+
+
+def _merge(cold, hot, limit, keys_only):
+    """ Merges sorted scan results, records of the hot tier take precedence. """
+    key = (lambda r: r) if keys_only else (lambda r: r[0])
+    merged = []
+    i = j = 0
+    while (i < len(cold) or j < len(hot)) and (limit is None or len(merged) < limit):
+        if j == len(hot) or (i < len(cold) and key(cold[i]) < key(hot[j])):
+            merged.append(cold[i])
+            i += 1
+        else:
+            if i < len(cold) and key(cold[i]) == key(hot[j]):
+                i += 1
+            merged.append(hot[j])
+            j += 1
+    return merged
+
+
+class TieredDatabase():
+    """
+    Database, which keeps all records in the cold (e.g. persistent) engine and
+    recently used ones also in the hot (e.g. volatile) engine, which serves
+    them faster. Keys read from the cold tier promote_after times are promoted
+    to the hot tier, which holds up to capacity keys - when it's full, a key
+    is demoted (removed from the hot tier) by the replacement policy.
+
+    Writes go to the cold tier and update the hot one (write-through), or
+    go to the hot tier only and are written to the cold one when the key is
+    demoted, by flush() or by a background thread (write-back). In the latter
+    mode, writes which were not flushed are lost if the process crashes.
+
+    Methods may be called from many threads. Values are bytes, keys may be
+    passed as Unicode objects (using 'utf-8' encoding) or bytes-like objects.
+    Range scans merge both tiers and, as for scan_prefix(), keys are compared
+    bytewise.
+    """
+
+    def __init__(self, hot, cold, policy="clock", capacity=100000, promote_after=2,
+                 write_back=False, flush_interval=1.0):
+        """
+        Parameters
+        ----------
+        hot : tuple
+            Engine name and its config of the hot tier, e.g. ("vcmap", {...}).
+            Engine is cleared, as the tier is rebuilt from the cold one.
+        cold : tuple
+            Engine name and its config of the cold tier, e.g. ("cmap", {...}).
+        policy : str, optional
+            Replacement policy of the hot tier - 'clock' or '2q'.
+        capacity : int, optional
+            Maximum number of keys in the hot tier.
+        promote_after : int, optional
+            Number of reads from the cold tier, after which the key is promoted.
+        write_back : bool, optional
+            Enables write-back mode (see above).
+        flush_interval : float, optional
+            Interval of flushing writes to the cold tier in write-back mode,
+            in seconds. If None, writes are flushed only by flush() and when
+            the keys are demoted.
+        """
+        if policy not in _POLICIES:
+            raise ValueError("Unknown policy: " + str(policy))
+        if capacity <= 0 or promote_after <= 0:
+            raise ValueError("Capacity and promote_after should be positive")
+        self.promote_after = promote_after
+        self.write_back = write_back
+        self.cold = Database(*cold)
+        try:
+            self.hot = Database(*hot)
+            self.hot.clear()
+        except BaseException:
+            self.cold.stop()
+            raise
+        self._policy = _POLICIES[policy](capacity)
+        self._reads = {}
+        self._dirty = set()
+        self._lock = threading.RLock()
+        # cold and hot writes of a key are done together (in write-through mode)
+        self._key_locks = [threading.Lock() for _ in range(_KEY_LOCKS)]
+        self._stats = dict.fromkeys(["hits", "misses", "promotions", "demotions",
+                                     "flushed"], 0)
+        self._flusher = None
+        self._stopping = threading.Event()
+        if write_back and flush_interval is not None:
+            self._flusher = threading.Thread(target=self._flush_loop,
+                                             args=(flush_interval,), daemon=True)
+            self._flusher.start()
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __getitem__(self, key):
+        return self.get_string(key)
+
+    def __len__(self):
+        return self.count_all()
+
+    def __contains__(self, key):
+        return self.exists(key)
+
+    def __delitem__(self, key):
+        if not self.remove(key):
+            raise KeyError(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.stop()
+
+    def stop(self):
+        """ Flushes writes (in write-back mode) and stops both engines. """
+        self._stopping.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        self.hot.stop()
+        self.cold.stop()
+
+    def put(self, key, value):
+        """ Inserts the key/value pair. """
+        key = _key_bytes(key)
+        if self.write_back:
+            with self._lock:
+                if key not in self._policy:
+                    self._admit(key)
+                self.hot.put(key, value)
+                self._dirty.add(key)
+                self._policy.access(key)
+            return
+        with self._key_lock(key):
+            self.cold.put(key, value)
+            with self._lock:
+                if key in self._policy:
+                    self.hot.put(key, value)
+                    self._policy.access(key)
+
+    def _key_lock(self, key):
+        return self._key_locks[hash(key) % _KEY_LOCKS]
+
+    def _admit(self, key):
+        """ Adds the key to the hot tier, demoting another one if needed. """
+        self._reads.pop(key, None)
+        victim = self._policy.admit(key)
+        if victim is None:
+            return
+        if victim in self._dirty:
+            self.cold.put(victim, self.hot.read(victim))
+            self._dirty.discard(victim)
+            self._stats["flushed"] += 1
+        self.hot.remove(victim)
+        self._stats["demotions"] += 1
+
+    def _read(self, key):
+        key = _key_bytes(key)
+        with self._lock:
+            resident = key in self._policy
+            if resident:
+                self._policy.access(key)
+        if resident:
+            try:
+                value = self.hot.read(key)
+                self._stats["hits"] += 1
+                return value
+            except KeyError:
+                # demoted meanwhile
+                pass
+        value = self.cold.read(key)
+        with self._lock:
+            self._stats["misses"] += 1
+            if key in self._policy:
+                return value
+            reads = self._reads.get(key, 0) + 1
+            if reads < self.promote_after:
+                self._reads[key] = reads
+                # forgets old reads, so keys are promoted by recent ones
+                if len(self._reads) > 4 * self._policy.capacity:
+                    self._reads = {k: n // 2 for k, n in self._reads.items() if n > 1}
+                return value
+            # value is read again, as it could be changed before taking the lock
+            try:
+                value = self.cold.read(key)
+            except KeyError:
+                self._reads.pop(key, None)
+                raise
+            self._admit(key)
+            self.hot.put(key, value)
+            self._stats["promotions"] += 1
+        return value
+
+    def get(self, key, func):
+        """
+        Executes callback function for value for given key. Value is passed
+        as a read-only memoryview.
+        """
+        func(memoryview(self._read(key)).toreadonly())
+
+    def get_string(self, key):
+        """ Gets copy (as a string) of value for given key. """
+        return self._read(key).decode("utf-8")
+
+    def exists(self, key):
+        """ Verifies the presence of key/value pair. """
+        key = _key_bytes(key)
+        with self._lock:
+            if key in self._policy:
+                return True
+        return self.cold.exists(key)
+
+    def remove(self, key):
+        """
+        Removes key/value pair for given key from both tiers. Returns true if
+        element was removed, false if it didn't exist.
+        """
+        key = _key_bytes(key)
+        if self.write_back:
+            with self._lock:
+                return self._remove(key)
+        with self._key_lock(key):
+            return self._remove(key)
+
+    def _remove(self, key):
+        removed = self.cold.remove(key)
+        with self._lock:
+            self._dirty.discard(key)
+            if key in self._policy:
+                self._policy.remove(key)
+                removed = self.hot.remove(key) or removed
+            self._reads.pop(key, None)
+        return removed
+
+    def count_all(self):
+        """ Returns number of records (pending writes are flushed first). """
+        self.flush()
+        return self.cold.count_all()
+
+    def scan_prefix(self, prefix, limit=None, start_after=None, keys_only=False):
+        """ Returns records with the given prefix, see Database.scan_prefix(). """
+        cold = self.cold.scan_prefix(prefix, limit, start_after, keys_only)
+        if not self._dirty:
+            return cold
+        hot = self.hot.scan_prefix(prefix, limit, start_after, keys_only)
+        return _merge(cold, hot, limit, keys_only)
+
+    def scan_range(self, lo=None, hi=None, limit=None, start_after=None,
+                   keys_only=False):
+        """ Returns records within the range, see Database.scan_range(). """
+        cold = self.cold.scan_range(lo, hi, limit, start_after, keys_only)
+        if not self._dirty:
+            return cold
+        hot = self.hot.scan_range(lo, hi, limit, start_after, keys_only)
+        return _merge(cold, hot, limit, keys_only)
+
+    def flush(self):
+        """ Writes pending writes to the cold tier (in write-back mode). """
+        with self._lock:
+            if not self._dirty:
+                return
+            self.cold.put_many([(key, self.hot.read(key)) for key in self._dirty])
+            self._stats["flushed"] += len(self._dirty)
+            self._dirty.clear()
+
+    def _flush_loop(self, interval):
+        while not self._stopping.wait(interval):
+            self.flush()
+
+    def stats(self):
+        """
+        Returns statistics of the tiers.
+
+        Returns
+        -------
+        stats : dict
+            Dictionary with number of reads served by the hot tier ('hits')
+            and by the cold one ('misses'), number of promoted and demoted
+            keys ('promotions', 'demotions'), writes flushed to the cold tier
+            ('flushed'), keys in the hot tier ('resident') and pending writes
+            ('dirty').
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["resident"] = len(self._policy)
+            stats["dirty"] = len(self._dirty)
+        return stats
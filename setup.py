@@ -30,14 +30,49 @@
  * OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 import setuptools
+import tempfile
+from distutils import ccompiler, sysconfig
+from distutils.errors import CompileError, LinkError
 from os import path
 
 project_dir = path.abspath(path.dirname(__file__))
 with open(path.join(project_dir, "README.md"), encoding="utf-8") as f:
     readme = f.read()
 
+
+def has_library(header, library):
+    """ Checks if optional library is installed, along with its header. """
+    compiler = ccompiler.new_compiler()
+    sysconfig.customize_compiler(compiler)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = path.join(tmp_dir, "check.c")
+        with open(source, "w") as f:
+            f.write("#include <%s>\nint main(void) { return 0; }\n" % header)
+        try:
+            objects = compiler.compile([source], output_dir=tmp_dir)
+            compiler.link_executable(
+                objects, path.join(tmp_dir, "check"), libraries=[library]
+            )
+        except (CompileError, LinkError):
+            return False
+    return True
+
+
+libraries = ["pmemkv", "pmemkv_json_config"]
+define_macros = []
+# Value compression is available only if the libraries are installed
+if has_library("lz4.h", "lz4"):
+    libraries.append("lz4")
+    define_macros.append(("PMEMKV_PY_LZ4", None))
+if has_library("zstd.h", "zstd"):
+    libraries.append("zstd")
+    define_macros.append(("PMEMKV_PY_ZSTD", None))
+
 link_modules = setuptools.Extension(
-    "_pmemkv", ["pmemkv/kvengine.cc"], libraries=["pmemkv", "pmemkv_json_config"]
+    "_pmemkv",
+    ["pmemkv/kvengine.cc"],
+    libraries=libraries,
+    define_macros=define_macros,
 )
 
 setuptools.setup(
@@ -0,0 +1,131 @@
+'''
+ * Copyright 2019-2020, Intel Corporation
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions
+ * are met:
+ *
+ *     * Redistributions of source code must retain the above copyright
+ *       notice, this list of conditions and the following disclaimer.
+ *
+ *     * Redistributions in binary form must reproduce the above copyright
+ *       notice, this list of conditions and the following disclaimer in
+ *       the documentation and/or other materials provided with the
+ *       distribution.
+ *
+ *     * Neither the name of the copyright holder nor the names of its
+ *       contributors may be used to endorse or promote products derived
+ *       from this software without specific prior written permission.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+ * "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+ * LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+ * A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+ * OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+ * SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+ * LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+ * DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+ * THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+ * (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+ * OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import pickle
+import unittest
+
+import pmemkv
+import pmemkv.dbm
+import pmemkv.shelve
+
+class TestDbm(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.engine = r"vsmap"
+        self.path = "/dev/shm"
+
+    def test_mapping(self):
+        with pmemkv.dbm.open(self.path, "c", engine=self.engine) as db:
+            db["key1"] = "value1"
+            db[b"key2"] = b"\xff\x00"
+            self.assertEqual(db[b"key1"], b"value1")
+            self.assertEqual(db["key2"], b"\xff\x00")
+            self.assertIn("key1", db)
+            self.assertEqual(sorted(db.keys()), [b"key1", b"key2"])
+            self.assertEqual(len(db), 2)
+            self.assertEqual(db.get("key3", b"default"), b"default")
+            self.assertEqual(db.setdefault("key3", b"value3"), b"value3")
+            db.update({"key4": "value4"}, key5=b"value5")
+            self.assertEqual(db["key5"], b"value5")
+            del db["key1"]
+            self.assertRaises(KeyError, db.__getitem__, "key1")
+            self.assertRaises(KeyError, db.__delitem__, "key1")
+            db.sync()
+        self.assertRaises(pmemkv.dbm.error, db.__getitem__, "key2")
+        self.assertRaises(ValueError, pmemkv.dbm.open, self.path, "x")
+
+    def test_read_only(self):
+        with pmemkv.dbm.open(self.path, "r", engine=self.engine,
+                             config={"size": 1073741824}) as db:
+            self.assertRaises(pmemkv.dbm.error, db.__setitem__, "key1", "v")
+            self.assertEqual(db.get("key1"), None)
+
+class TestShelve(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.engine = r"vsmap"
+        self.path = "/dev/shm"
+
+    def test_shelf(self):
+        with pmemkv.shelve.open(self.path, engine=self.engine) as shelf:
+            shelf["key1"] = {"a": [1, 2]}
+            value = shelf["key1"]
+            value["a"].append(3)
+            # without writeback objects are unpickled on each access
+            self.assertEqual(shelf["key1"], {"a": [1, 2]})
+            self.assertEqual(list(shelf), ["key1"])
+            del shelf["key1"]
+            self.assertNotIn("key1", shelf)
+
+    def test_writeback(self):
+        shelf = pmemkv.shelve.open(self.path, writeback=True, cache_size=2,
+                                   engine=self.engine)
+        db = shelf.dict
+        shelf["key1"] = [1]
+        self.assertNotIn("key1", db)
+        self.assertIn("key1", shelf)
+        shelf["key1"].append(2)
+        self.assertIs(shelf["key1"], shelf["key1"])
+        shelf.sync()
+        self.assertEqual(pickle.loads(db["key1"]), [1, 2])
+        shelf["key1"].append(3)
+        shelf["key2"] = "value2"
+        shelf["key3"] = "value3"
+        # least recently used object is written when it's evicted
+        self.assertEqual(pickle.loads(db["key1"]), [1, 2, 3])
+        self.assertNotIn("key1", shelf.cache)
+        self.assertEqual(len(shelf), 3)
+        del shelf["key3"]
+        shelf["key4"] = "value4"
+        del shelf["key4"]
+        self.assertEqual(sorted(shelf), ["key1", "key2"])
+        shelf.close()
+        self.assertRaises(ValueError, pmemkv.shelve.Shelf, {}, cache_size=0)
+
+    def test_writeback_dirty(self):
+        shelf = pmemkv.shelve.open(self.path, writeback=True, engine=self.engine)
+        db = shelf.dict
+        db["key1"] = pickle.dumps([1])
+        shelf["key1"].append(2)
+        shelf["key2"] = [3]
+        self.assertEqual(len(shelf), 2)
+        self.assertEqual(pickle.loads(db["key2"]), [3])
+        # loaded objects are checked for mutations only by sync()
+        self.assertEqual(pickle.loads(db["key1"]), [1])
+        shelf.sync()
+        self.assertEqual(pickle.loads(db["key1"]), [1, 2])
+        shelf.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+'''
+ * Copyright 2019-2020, Intel Corporation
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions
+ * are met:
+ *
+ *     * Redistributions of source code must retain the above copyright
+ *       notice, this list of conditions and the following disclaimer.
+ *
+ *     * Redistributions in binary form must reproduce the above copyright
+ *       notice, this list of conditions and the following disclaimer in
+ *       the documentation and/or other materials provided with the
+ *       distribution.
+ *
+ *     * Neither the name of the copyright holder nor the names of its
+ *       contributors may be used to endorse or promote products derived
+ *       from this software without specific prior written permission.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+ * "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+ * LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+ * A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+ * OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+ * SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+ * LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+ * DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+ * THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+ * (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+ * OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import asyncio
+import http.client
+import json
+import threading
+import unittest
+import urllib.parse
+
+import pmemkv
+from pmemkv.gateway import Gateway
+
+class TestGateway(unittest.TestCase):
+    engine = r"vsmap"
+
+    def setUp(self):
+        self.config = {"path":"/dev/shm","size":1073741824}
+        self.db = pmemkv.Database(self.engine, self.config)
+        self.gateway = Gateway(self.db, port=0, page_size=3)
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.gateway.start())
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.connection = http.client.HTTPConnection("127.0.0.1", self.gateway.port)
+
+    def tearDown(self):
+        self.connection.close()
+        asyncio.run_coroutine_threadsafe(self.gateway.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.db.stop()
+
+    def request(self, method, path, body=None):
+        self.connection.request(method, path, body)
+        response = self.connection.getresponse()
+        return response.status, response.read()
+
+    def test_single_records(self):
+        self.assertEqual(self.request("PUT", "/db/key%001", b"\xffvalue"), (204, b""))
+        self.assertEqual(self.request("GET", "/db/key%001"), (200, b"\xffvalue"))
+        self.db.get(b"key\x001", lambda v: self.assertEqual(bytes(v), b"\xffvalue"))
+        self.assertEqual(self.request("GET", "/db/key2")[0], 404)
+        self.assertEqual(self.request("DELETE", "/db/key%001"), (204, b""))
+        self.assertEqual(self.request("DELETE", "/db/key%001")[0], 404)
+        self.assertEqual(self.request("POST", "/db/key1")[0], 405)
+        self.assertEqual(self.request("GET", "/nope")[0], 404)
+
+    def test_batches(self):
+        items = {"key{}".format(i): "value{}".format(i) for i in range(100)}
+        status, body = self.request("POST", "/mput", json.dumps(items))
+        self.assertEqual((status, json.loads(body)), (200, {"written": 100}))
+        status, body = self.request("POST", "/mget",
+                                    json.dumps({"keys": ["key1", "nope", "key99"]}))
+        self.assertEqual(json.loads(body), {"values": ["value1", None, "value99"]})
+        self.assertEqual(self.request("POST", "/mget", b"{")[0], 400)
+        self.assertEqual(self.request("POST", "/mput", b"[]")[0], 400)
+
+    def test_streams_with_cursor(self):
+        for i in range(10):
+            self.db.put("key{}".format(i), str(i))
+        self.db.put(r"other", r"x")
+
+        status, body = self.request("GET", "/db?prefix=key&limit=4")
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(status, 200)
+        self.assertEqual(lines[0], {"key": "key0", "value": "0"})
+        self.assertEqual(lines[-1], {"cursor": "key3"})
+        status, body = self.request("GET", "/db?prefix=key&cursor=key3&keys_only=1")
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([l["key"] for l in lines],
+                         ["key4", "key5", "key6", "key7", "key8", "key9"])
+        status, body = self.request("GET", "/db?lo=key2&limit=2&keys_only=1")
+        self.assertEqual([json.loads(line) for line in body.splitlines()],
+                         [{"key": "key2"}, {"key": "key3"}, {"cursor": "key3"}])
+        status, body = self.request("GET", "/db?lo=key2&hi=key5")
+        self.assertEqual(len(body.splitlines()), 3)
+        self.assertEqual(len(self.request("GET", "/db")[1].splitlines()), 11)
+        self.assertEqual(self.request("GET", "/db?limit=x")[0], 400)
+
+    def test_binary_prefix_and_cursor(self):
+        for key in ("\u00e9a", "\u00e9b", "\u00e9c", "e"):
+            self.db.put(key, key)
+        self.db.put(b"\xe9\xff", b"x")
+        status, body = self.request("GET", "/db?prefix=%C3%A9&limit=2&keys_only=1")
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(status, 200)
+        self.assertEqual(lines, [{"key": "\u00e9a"}, {"key": "\u00e9b"},
+                                 {"cursor": "\u00e9b"}])
+        cursor = urllib.parse.quote(lines[-1]["cursor"].encode())
+        status, body = self.request("GET", "/db?prefix=%C3%A9&keys_only=1&cursor="
+                                    + cursor)
+        self.assertEqual([json.loads(line) for line in body.splitlines()],
+                         [{"key": "\u00e9c"}])
+        # keys which are not UTF-8 are escaped
+        status, body = self.request("GET", "/db?prefix=%E9")
+        self.assertEqual(json.loads(body), {"key": "\udce9\udcff", "value": "x"})
+        self.assertEqual(self.request("GET", "/db?%FF=1")[0], 400)
+
+
+class TestGatewayUnsorted(TestGateway):
+    # records of unsorted engines are collected from get_all
+    engine = r"vcmap"
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,11 +30,32 @@
  * OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
+import asyncio
+import gc
+import importlib.util
+import io
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import weakref
 
 from pmemkv import Database
+import _pmemkv
 import pmemkv
 
+try:
+    import _interpreters as interpreters
+except ImportError:
+    try:
+        import _xxsubinterpreters as interpreters
+    except ImportError:
+        interpreters = None
+
 
 class TestKVEngine(unittest.TestCase):
 
@@ -203,7 +224,8 @@ class TestKVEngine(unittest.TestCase):
         exceptions = [pmemkv.Error, pmemkv.UnknownError, pmemkv.NotSupported,
                   pmemkv.InvalidArgument, pmemkv.ConfigParsingError,
                   pmemkv.ConfigTypeError, pmemkv.StoppedByCallback,
-                  pmemkv.WrongEngineName, pmemkv.TransactionScopeError]
+                  pmemkv.WrongEngineName, pmemkv.TransactionScopeError,
+                  pmemkv.DefragError, pmemkv.ComparatorMismatch]
         with self.assertRaises(Exception):
             raise(pmemkv.Error)
         for ex in exceptions:
@@ -433,6 +455,1110 @@ class TestKVEngine(unittest.TestCase):
 
         db.stop()
 
+    def test_builtin_comparator_reverse_bytes(self):
+        db = Database(self.engine, self.config, comparator="reverse_bytes")
+        db.put(r"A", r"1")
+        db.put(r"B", r"2")
+        db.put(r"C", r"3")
+
+        self.key_and_value = r""
+        db.get_keys(self.all_and_each)
+        self.assertEqual(self.key_and_value, r"C,B,A,")
+
+        self.key_and_value = r""
+        db.get_keys_above(r"B", self.all_and_each)
+        self.assertEqual(self.key_and_value, r"A,")
+        self.assertEqual(db.count_between(r"C", r"A"), 1)
+        self.assertEqual(db.remove_range(r"A", r"B"), 0)
+        self.assertTrue(db.exists(r"A"))
+        db.stop()
+
+    def test_builtin_comparator_int_string(self):
+        db = Database(self.engine, self.config, comparator="int_string")
+        for key in [r"100", r"-5", r"20", r"3", r"abc"]:
+            db.put(key, key)
+
+        self.key_and_value = r""
+        db.get_keys(self.all_and_each)
+        self.assertEqual(self.key_and_value, r"-5,3,20,100,abc,")
+        self.assertEqual(db.count_between(r"3", r"100"), 1)
+        db.stop()
+
+    def test_builtin_comparator_uint64_le(self):
+        db = Database(self.engine, self.config, comparator="uint64_le")
+        for i in [256, 1, 65536, 2]:
+            db.put(i.to_bytes(8, "little"), str(i))
+        keys = []
+        db.get_keys(lambda k: keys.append(int.from_bytes(bytes(k), "little")))
+        self.assertEqual(keys, [1, 2, 256, 65536])
+        db.stop()
+
+    def test_python_comparator(self):
+        def by_length(key1, key2):
+            return len(key1) - len(key2) or (key1 > key2) - (key1 < key2)
+
+        db = Database(self.engine, self.config, comparator=by_length)
+        for key in [r"ccc", r"a", r"bb", r"aa"]:
+            db.put(key, key)
+
+        self.key_and_value = r""
+        db.get_keys(self.all_and_each)
+        self.assertEqual(self.key_and_value, r"a,aa,bb,ccc,")
+        self.assertEqual(db.count_between(r"a", r"ccc"), 2)
+        db.stop()
+
+    def test_comparator_cycle_is_collected(self):
+        class Comparator():
+            def __call__(self, key1, key2):
+                return (key1 > key2) - (key1 < key2)
+
+        comparator = Comparator()
+        comparator.db = Database(self.engine, self.config,
+                                 comparator=comparator)
+        comparator.db.put(r"key1", r"value1")
+        ref = weakref.ref(comparator)
+        del comparator
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_throws_exception_on_unknown_comparator(self):
+        with self.assertRaises(pmemkv.InvalidArgument):
+            Database(self.engine, self.config, comparator="nope")
+        with self.assertRaises(TypeError):
+            Database(self.engine, self.config, comparator=123)
+
+    def test_uses_scan_prefix(self):
+        db = Database(self.engine, self.config)
+        db.put(r"A", r"1")
+        db.put(r"AB", r"2")
+        db.put(r"AC", r"3")
+        db.put(r"B", r"4")
+        db.put(r"BB", r"5")
+
+        self.assertEqual(db.scan_prefix(r"A"),
+                         [(b"A", b"1"), (b"AB", b"2"), (b"AC", b"3")])
+        self.assertEqual(db.scan_prefix(r"B", keys_only=True), [b"B", b"BB"])
+        self.assertEqual(db.scan_prefix(r"C"), [])
+        self.assertEqual(len(db.scan_prefix(r"")), 5)
+        db.stop()
+
+    def test_scan_prefix_pagination(self):
+        db = Database(self.engine, self.config)
+        for i in range(10):
+            db.put("user:{}".format(i), str(i))
+        db.put(r"users", r"x")
+
+        pages = []
+        last = None
+        while True:
+            page = db.scan_prefix(r"user:", limit=3, start_after=last, keys_only=True)
+            if not page:
+                break
+            pages.append(page)
+            last = page[-1]
+        self.assertEqual([len(p) for p in pages], [3, 3, 3, 1])
+        self.assertEqual(pages[0][0], b"user:0")
+        self.assertEqual(pages[-1][-1], b"user:9")
+        self.assertEqual(db.scan_prefix(r"user:", limit=0), [])
+        with self.assertRaises(ValueError):
+            db.scan_prefix(r"user:", limit=-1)
+        db.stop()
+
+    def test_unsorted_scan_limit(self):
+        # lo is visited along with other records of unsorted engines
+        db = Database(r"vcmap", self.config)
+        for key in (r"a", r"b", r"ba", r"bb", r"bc", r"c"):
+            db.put(key, key)
+        self.assertEqual(db.scan_prefix(r"b", limit=2),
+                         [(b"b", b"b"), (b"ba", b"ba")])
+        self.assertEqual(db.scan_prefix(r"b", limit=2, start_after=r"ba",
+                                        keys_only=True), [b"bb", b"bc"])
+        self.assertEqual(db.scan_range(r"b", limit=2, keys_only=True),
+                         [b"b", b"ba"])
+        self.assertEqual(db.scan(r"b", select="key", limit=2), [b"b", b"ba"])
+        self.assertEqual(db.count_prefix(r"b"), 4)
+        db.stop()
+
+    def test_uses_scan_range(self):
+        db = Database(self.engine, self.config)
+        for i in range(10):
+            db.put("key{}".format(i), str(i))
+
+        self.assertEqual(db.scan_range(r"key3", r"key5"),
+                         [(b"key3", b"3"), (b"key4", b"4")])
+        self.assertEqual(db.scan_range(hi=r"key2", keys_only=True),
+                         [b"key0", b"key1"])
+        self.assertEqual(db.scan_range(r"key8", keys_only=True), [b"key8", b"key9"])
+        self.assertEqual(db.scan_range(r"key2", r"key8", limit=2,
+                                       start_after=r"key4", keys_only=True),
+                         [b"key5", b"key6"])
+        self.assertEqual(db.scan_range(r"key5", r"key5"), [])
+        self.assertEqual(len(db.scan_range()), 10)
+        with self.assertRaises(ValueError):
+            db.scan_range(limit=-1)
+        db.stop()
+
+    def test_put_many(self):
+        db = Database(self.engine, self.config)
+        self.assertEqual(db.put_many([(r"key1", r"value1"), [b"key2", b"value2"]]), 2)
+        self.assertEqual(db.put_many({"key{}".format(i): str(i) for i in range(3000)}),
+                         3000)
+        self.assertEqual(db.put_many([]), 0)
+        self.assertEqual(db[r"key1"], r"1")
+        self.assertEqual(db[r"key2"], r"2")
+        self.assertEqual(db.count_all(), 3000)
+        with self.assertRaises(TypeError):
+            db.put_many([(r"key1",)])
+        with self.assertRaises(TypeError):
+            db.put_many(123)
+        with self.assertRaises(pmemkv.InvalidArgument):
+            db.put_many([(r"key1", r"value1")], ttl=1)
+        db.stop()
+
+    def test_partial_values(self):
+        db = Database(self.engine, self.config, expiry=True)
+        db.put(r"key1", b"0123456789")
+        self.assertEqual(db.read(r"key1", 2, 3), b"234")
+        self.assertEqual(db.read(r"key1", 8), b"89")
+        self.assertEqual(db.read(r"key1", 20), b"")
+        self.assertEqual(db.read(r"key1"), b"0123456789")
+        with self.assertRaises(KeyError):
+            db.read(r"key2")
+        with self.assertRaises(ValueError):
+            db.read(r"key1", -1)
+
+        self.assertEqual(db.write_range(r"key1", 8, b"abcd"), 12)
+        self.assertEqual(db.write_range(r"key1", 0, r"X"), 12)
+        self.assertEqual(db.get_string(r"key1"), r"X1234567abcd")
+        with self.assertRaises(pmemkv.InvalidArgument):
+            db.write_range(r"key1", 13, b"x")
+        with self.assertRaises(KeyError):
+            db.write_range(r"key2", 0, b"x")
+
+        self.assertEqual(db.append(r"key2", b"ab"), 2)
+        self.assertEqual(db.append(r"key2", b"cd"), 4)
+        self.assertEqual(db.get_string(r"key2"), r"abcd")
+
+        db.put(r"key3", b"abc", ttl=60)
+        db.append(r"key3", b"d")
+        self.assertEqual(db.read(r"key3"), b"abcd")
+        db.put(r"key4", b"abc", ttl=0)
+        self.assertEqual(db.append(r"key4", b"d"), 1)
+        self.assertEqual(db.read(r"key4"), b"d")
+        db.stop()
+
+    def test_incr(self):
+        db = Database(self.engine, self.config)
+        self.assertEqual(db.incr(r"counter"), 1)
+        self.assertEqual(db.incr(r"counter", 10), 11)
+        self.assertEqual(db.incr(r"counter", -20), -9)
+        self.assertEqual(db.incr(r"other", 5, initial=100), 105)
+        self.assertEqual(int.from_bytes(db.read(r"counter"), "little", signed=True), -9)
+        db.put(r"text", r"abc")
+        with self.assertRaises(pmemkv.InvalidArgument):
+            db.incr(r"text")
+        db.incr(r"max", initial=2**63 - 2)
+        with self.assertRaises(pmemkv.InvalidArgument):
+            db.incr(r"max")
+        db.stop()
+
+    def test_incr_from_threads(self):
+        for engine in (self.engine, r"vcmap"):
+            db = Database(engine, self.config)
+            def worker():
+                for _ in range(1000):
+                    db.incr(r"counter")
+                    db.update(r"text", lambda v: (v or b"") + b"x")
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(db.incr(r"counter", 0), 8000)
+            self.assertEqual(len(db.read(r"text")), 8000)
+            db.stop()
+
+    def test_cas(self):
+        db = Database(self.engine, self.config)
+        self.assertTrue(db.cas(r"key1", None, r"value1"))
+        self.assertFalse(db.cas(r"key1", None, r"value2"))
+        self.assertFalse(db.cas(r"key1", r"other", r"value2"))
+        self.assertTrue(db.cas(r"key1", r"value1", b"value2"))
+        self.assertEqual(db[r"key1"], r"value2")
+        self.assertTrue(db.cas(r"key1", r"value2", None))
+        self.assertFalse(r"key1" in db)
+        self.assertTrue(db.cas(r"key1", None, None))
+        with self.assertRaises(pmemkv.InvalidArgument):
+            db.cas(r"key1", None, r"value1", ttl=1)
+        db.stop()
+
+    def test_update(self):
+        db = Database(self.engine, self.config, expiry=True)
+        self.assertEqual(db.update(r"key1", lambda v: r"new" if v is None else r"old"),
+                         r"new")
+        self.assertEqual(db.update(r"key1", lambda v: v + b"!"), b"new!")
+        self.assertEqual(db[r"key1"], r"new!")
+        self.assertIsNone(db.update(r"key1", lambda v: None))
+        self.assertFalse(r"key1" in db)
+
+        db.put(r"key2", r"value")
+        def fail(value):
+            raise RuntimeError("fail")
+        with self.assertRaises(RuntimeError):
+            db.update(r"key2", fail)
+        with self.assertRaises(TypeError):
+            db.update(r"key2", lambda v: 123)
+        self.assertEqual(db[r"key2"], r"value")
+        # function may access the database (but should not wait for other threads)
+        self.assertEqual(db.update(r"key2", lambda v: db.get_string(r"key2") + r"2"),
+                         r"value2")
+        db.stop()
+
+    def test_streams(self):
+        db = Database(self.engine, self.config)
+        data = os.urandom(100000)
+        self.assertEqual(db.put_stream(r"big", io.BytesIO(data), chunk_size=4096,
+                                       batch_size=3), len(data))
+        self.assertEqual(db.count_all(), 1 + 25)
+        with db.open_stream(r"big", readahead=2) as stream:
+            self.assertEqual(stream.size, len(data))
+            self.assertEqual(stream.read(10), data[:10])
+            stream.seek(5000)
+            self.assertEqual(stream.read(10000), data[5000:15000])
+            stream.seek(-10, io.SEEK_END)
+            self.assertEqual(stream.read(), data[-10:])
+            stream.seek(0)
+            self.assertEqual(stream.read(), data)
+
+        # replacing the value removes previous chunks
+        self.assertEqual(db.put_stream(r"big", [b"abc", r"def", b"g"], chunk_size=2), 7)
+        self.assertEqual(db.count_all(), 1 + 4)
+        self.assertEqual(db.open_stream(r"big", readahead=0).read(), b"abcdefg")
+
+        def failing():
+            yield b"x" * 10
+            raise RuntimeError("fail")
+        with self.assertRaises(RuntimeError):
+            db.put_stream(r"big", failing(), chunk_size=3, batch_size=1)
+        self.assertEqual(db.count_all(), 1 + 4)
+
+        db.put(r"small", r"value")
+        with self.assertRaises(ValueError):
+            db.open_stream(r"small")
+        with self.assertRaises(KeyError):
+            db.open_stream(r"nope")
+        self.assertTrue(db.remove_stream(r"big"))
+        self.assertFalse(db.remove_stream(r"big"))
+        self.assertEqual(db.count_all(), 1)
+        db.stop()
+
+    def test_scan_pushdown(self):
+        db = Database(self.engine, self.config)
+        for i in range(20):
+            db.put(r"user:%02d" % i, (i - 5).to_bytes(4, "little", signed=True)
+                   + b"x" * i)
+        db.put(r"other", r"abc")
+        amount = pmemkv.StructField(0, 4, "little", signed=True)
+
+        self.assertEqual(db.scan(where=pmemkv.Suffix(r"9"), select="key"),
+                         [b"user:09", b"user:19"])
+        self.assertEqual(db.scan(r"user:", r"user;", where=[amount >= 10, amount < 12],
+                                 select="key"), [b"user:15", b"user:16"])
+        self.assertEqual(db.scan(where=[pmemkv.Prefix(r"user:"), amount == -5]),
+                         [(b"user:00", (-5).to_bytes(4, "little", signed=True))])
+        self.assertEqual(db.scan(where=pmemkv.Length(max=3), select="value"),
+                         [b"abc"])
+        self.assertEqual(db.scan(where=pmemkv.Prefix(r"user:"), select="key",
+                                 limit=2), [b"user:00", b"user:01"])
+
+        self.assertEqual(db.scan(aggregate=pmemkv.Count()), 21)
+        self.assertEqual(db.scan(where=pmemkv.Prefix(r"user:"),
+                                 aggregate=[pmemkv.Count(), pmemkv.Sum(amount),
+                                            pmemkv.Min(amount), pmemkv.Max(amount),
+                                            pmemkv.Sum(pmemkv.Length())]),
+                         [20, sum(range(-5, 15)), -5, 14, 20 * 4 + sum(range(20))])
+        # values shorter than the field are skipped
+        self.assertEqual(db.scan(r"other", r"p", aggregate=pmemkv.Max(amount)),
+                         None)
+        # the same bytes compared as signed and unsigned integers
+        unsigned = pmemkv.StructField(0, 4, "little")
+        self.assertEqual(db.scan(where=[pmemkv.Prefix(r"user:"), amount > 2 ** 31],
+                                 aggregate=pmemkv.Count()), 0)
+        self.assertEqual(db.scan(where=[pmemkv.Prefix(r"user:"), unsigned > 2 ** 31],
+                                 select="key"),
+                         [b"user:%02d" % i for i in range(5)])
+        self.assertEqual(db.scan(where=pmemkv.Prefix(r"user:"),
+                                 aggregate=[pmemkv.Min(unsigned), pmemkv.Max(unsigned)]),
+                         [0, 2 ** 32 - 1])
+
+        with self.assertRaises(ValueError):
+            db.scan(aggregate=pmemkv.Count(), limit=1)
+        with self.assertRaises(ValueError):
+            db.scan(where=pmemkv.StructField(0, 9) == 1)
+        with self.assertRaises(TypeError):
+            amount == b"abc"
+        db.stop()
+
+    def test_sample_and_stats(self):
+        db = Database(self.engine, self.config)
+        self.assertIsNone(db.stats())
+        for i in range(100):
+            db.put(r"key%02d" % i, r"x" * i)
+        sample = db.sample(10, r"key10", r"key50", seed=1)
+        self.assertEqual(len(sample), 10)
+        self.assertEqual(sample, sorted(sample))
+        self.assertEqual(sample, db.sample(10, r"key10", r"key50", seed=1))
+        for key, size in sample:
+            self.assertTrue(b"key10" <= key < b"key50")
+            self.assertEqual(size, int(key[3:]))
+        self.assertEqual(len(db.sample(1000)), 100)
+        self.assertEqual(db.sample(0), [])
+        db.stop()
+
+        db = Database(self.engine, self.config, stats=True)
+        self.assertEqual(db.stats(), {"keys": 0, "key_bytes": 0, "value_bytes": 0,
+                                      "value_sizes": []})
+        for i in range(100):
+            db.put(r"key%02d" % i, r"x" * i)
+        stats = db.stats()
+        self.assertEqual(stats["keys"], 100)
+        self.assertEqual(stats["key_bytes"], 500)
+        self.assertEqual(stats["value_bytes"], sum(range(100)))
+        self.assertEqual(stats["value_sizes"][:3], [(0, 0, 1), (1, 1, 1), (2, 3, 2)])
+        db.put(r"key00", r"abcd")
+        db.put(r"new", r"")
+        db.remove(r"key99")
+        db.remove(r"missing")
+        stats = db.stats()
+        self.assertEqual(stats["keys"], 100)
+        self.assertEqual(stats["key_bytes"], 500 - 5 + 3)
+        self.assertEqual(stats["value_bytes"], sum(range(99)) + 4)
+        self.assertEqual(sum(count for _, _, count in stats["value_sizes"]), 100)
+        db.stop()
+
+    def test_hot_keys(self):
+        db = Database(self.engine, self.config)
+        self.assertEqual(db.hot_keys(), [])
+        db.enable_hot_keys(capacity=4, sample_rate=1)
+        for i in range(100):
+            db.put(r"key%d" % i, r"value")
+            db[r"hot"] = r"value"
+            db.get_string(r"hot")
+            db.exists(r"warm")
+        hot = db.hot_keys(2)
+        self.assertEqual([h.key for h in hot], [b"hot", b"warm"])
+        self.assertEqual((hot[0].count, hot[0].error), (200, 0))
+        self.assertEqual((hot[0].reads, hot[0].writes), (100, 100))
+        self.assertEqual(len(db.hot_keys(10, reset=True)), 4)
+        self.assertEqual(db.hot_keys(), [])
+
+        db.enable_hot_keys(capacity=4, sample_rate=10)
+        for i in range(10000):
+            db.get_string(r"hot")
+        self.assertTrue(5000 < db.hot_keys(1)[0].count < 15000)
+        db.disable_hot_keys()
+        db.get_string(r"hot")
+        self.assertEqual(len(db.hot_keys()), 1)
+        self.assertEqual(list(db.hot_key_snapshots(interval=0.01)), [])
+        db.stop()
+
+    def test_module_instances(self):
+        # each instance of the module has its own types and exceptions
+        spec = importlib.util.find_spec("_pmemkv")
+        other = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(other)
+        self.assertIsNot(other.pmemkv_NI, _pmemkv.pmemkv_NI)
+        self.assertIsNot(other.Error, pmemkv.Error)
+        self.assertTrue(issubclass(other.InvalidArgument, other.Error))
+        db = other.pmemkv_NI()
+        db.start(self.engine, json.dumps(self.config))
+        db.put(r"key1", r"value1")
+        self.assertEqual(db.get_string(r"key1"), r"value1")
+        db.stop()
+
+    @unittest.skipIf(interpreters is None, "subinterpreters are not available")
+    def test_subinterpreter(self):
+        code = """if True:
+            import pmemkv
+            db = pmemkv.Database(%r, %r)
+            db.put(r"key1", r"value1")
+            assert db.get_string(r"key1") == r"value1"
+            try:
+                db.put(r"key1", r"value1", ttl=1)
+            except pmemkv.InvalidArgument:
+                pass
+            db.stop()
+        """ % (self.engine, self.config)
+        interp = interpreters.create()
+        try:
+            self.assertIsNone(interpreters.run_string(interp, code))
+        finally:
+            interpreters.destroy(interp)
+
+    @unittest.skipIf(interpreters is None or sys.version_info < (3, 12),
+                     "subinterpreters with threads are not available")
+    def test_subinterpreter_callbacks(self):
+        # comparator is called by a native thread of the server
+        code = """if True:
+            import os, tempfile, threading
+            import pmemkv, pmemkv.client, pmemkv.server
+            import %s as interpreters
+            seen = set()
+
+            def compare(a, b):
+                seen.add(interpreters.get_current())
+                return (a > b) - (a < b)
+
+            db = pmemkv.Database(%r, %r, comparator=compare)
+            path = os.path.join(tempfile.mkdtemp(), "pmemkv.sock")
+            with pmemkv.server.Server(db, path) as server:
+                thread = threading.Thread(target=server.serve_forever)
+                thread.start()
+                with pmemkv.client.Database(path) as client:
+                    client.put_many({r"key2": r"2", r"key1": r"1"})
+                server.shutdown()
+                thread.join()
+            os.rmdir(os.path.dirname(path))
+            assert db.scan(select="key") == [b"key1", b"key2"]
+            assert seen == {interpreters.get_current()}, seen
+            db.stop()
+        """ % (interpreters.__name__, self.engine, self.config)
+        interp = interpreters.create()
+        try:
+            self.assertIsNone(interpreters.run_string(interp, code))
+        finally:
+            interpreters.destroy(interp)
+
+    def test_open_shared(self):
+        db1 = pmemkv.open_shared(self.engine, self.config)
+        db2 = pmemkv.open_shared(self.engine, self.config)
+        db1.put(r"key1", r"value1")
+        self.assertEqual(db2.get_string(r"key1"), r"value1")
+        self.assertRaises(pmemkv.InvalidArgument, pmemkv.open_shared,
+                          self.engine, self.config, expiry=True)
+        self.assertRaises(pmemkv.NotSupported, pmemkv.open_shared,
+                          self.engine, self.config,
+                          comparator=lambda a, b: 0)
+        self.assertRaises(pmemkv.NotSupported, db1.create_index, "name",
+                          "/name")
+        # index database is not opened
+        self.assertRaises(pmemkv.NotSupported, db1.create_index, "name",
+                          "/name", engine="unknown")
+        self.assertRaises(pmemkv.NotSupported, db1.enable_changes)
+        self.assertRaises(pmemkv.NotSupported, db1.enable_hot_keys)
+        db1.stop()
+        self.assertEqual(db2.get_string(r"key1"), r"value1")
+        db2.put(r"key2", r"value2")
+        self.assertEqual(db2.count_all(), 2)
+        db2.stop()
+        # volatile engine is closed along with the last database
+        db3 = pmemkv.open_shared(self.engine, self.config)
+        self.assertEqual(db3.count_all(), 0)
+        db3.stop()
+
+    def test_warmup(self):
+        db = Database(self.engine, self.config)
+        self.assertIsNone(db.warmup_stats())
+        for i in range(3000):
+            db.put(bytes([i % 256, i // 256]), b"v" * (i % 10))
+        db.warmup("keys", threads=4, batch_size=100, cpu_budget=1)
+        db.put(r"key1", r"value1")
+        self.assertEqual(db.get_string(r"key1"), r"value1")
+        self.assertTrue(db.wait_warmup(timeout=60))
+        stats = db.warmup_stats()
+        self.assertFalse(stats["running"])
+        self.assertFalse(stats["timed_out"])
+        self.assertEqual(stats["progress"], 1.0)
+        self.assertGreaterEqual(stats["records"], 3000)
+        self.assertRaises(ValueError, db.warmup, "values")
+        db.stop()
+
+        db = Database(self.engine, self.config, warmup=True)
+        self.assertIsNotNone(db.warmup_stats())
+        db.stop()
+
+    def test_warmup_unordered(self):
+        # unordered walk is throttled and gives up at the deadline
+        db = Database("vcmap", self.config)
+        for i in range(3000):
+            db.put(bytes([i % 256, i // 256]), b"v")
+        db.warmup("all", budget_s=0.1, batch_size=1, cpu_budget=0.001)
+        self.assertTrue(db.wait_warmup(timeout=60))
+        stats = db.warmup_stats()
+        self.assertTrue(stats["timed_out"])
+        self.assertLess(stats["records"], 3000)
+        db.warmup("all", batch_size=1, cpu_budget=0.001)
+        start = time.monotonic()
+        db.stop_warmup()
+        self.assertLess(time.monotonic() - start, 1)
+        db.stop()
+
+    def test_usage(self):
+        db = Database(self.engine, self.config)
+        usage = db.usage()
+        self.assertEqual(usage["pool_size"], self.config["size"])
+        self.assertIsNone(usage["data_bytes"])
+        self.assertIsNone(usage["used_fraction"])
+        self.assertIsNone(usage["allocated_bytes"])
+        # engine lock of the not thread-safe engine
+        self.assertGreater(usage["binding"]["locks"], 0)
+        self.assertEqual(usage["binding_bytes"], usage["binding"]["locks"])
+        self.assertRaises(ValueError, db.start_usage_monitor, print)
+        db.enable_hot_keys(sample_rate=1)
+        db.put(r"key1", r"value1")
+        usage = db.usage()
+        self.assertGreater(usage["binding"]["hot_keys"], 0)
+        self.assertEqual(usage["binding_bytes"], sum(usage["binding"].values()))
+        db.stop()
+
+    def test_usage_monitor(self):
+        size = self.config["size"]
+        db = Database(self.engine, self.config, stats=True)
+        db.put(r"key1", r"v" * 496)
+        self.assertEqual(db.usage()["data_bytes"], 500)
+        self.assertEqual(db.usage()["used_fraction"], 500 / size)
+        reached = queue.Queue()
+        db.start_usage_monitor(lambda t, usage: reached.put(t),
+                               thresholds=(500 / size, 900 / size),
+                               interval=0.01)
+        self.assertEqual(reached.get(timeout=10), 500 / size)
+        db.put(r"key2", r"v" * 446)
+        self.assertEqual(reached.get(timeout=10), 900 / size)
+
+        def fail(threshold, usage):
+            reached.put(threshold)
+            raise RuntimeError("callback failed")
+
+        # exceptions of the callback are logged
+        with self.assertLogs("pmemkv.pmemkv", "ERROR"):
+            db.start_usage_monitor(fail, thresholds=(500 / size,),
+                                   interval=0.01)
+            self.assertEqual(reached.get(timeout=10), 500 / size)
+            db.stop_usage_monitor()
+        db.stop()
+
+    def test_stop_waits_for_running_operations(self):
+        db = Database(self.engine, self.config)
+        for i in range(10):
+            db.put(r"key%d" % i, r"value")
+        started = threading.Event()
+        keys = []
+
+        def slow(key, value):
+            started.set()
+            time.sleep(0.01)
+            keys.append(bytes(key))
+
+        thread = threading.Thread(target=db.get_all, args=(slow,))
+        thread.start()
+        started.wait()
+        db.stop()
+        self.assertEqual(len(keys), 10)
+        thread.join()
+
+    def test_stop_from_own_callback(self):
+        db = Database(self.engine, self.config)
+        db.put(r"key1", r"value1")
+        with self.assertRaises(pmemkv.InvalidArgument):
+            db.get_all(lambda key, value: db.stop())
+        self.assertEqual(db.get_string(r"key1"), r"value1")
+        db.stop()
+
+    def test_prefix_with_0xff_bytes(self):
+        db = Database(self.engine, self.config)
+        db.put(b"a\xff", b"1")
+        db.put(b"a\xff\xff", b"2")
+        db.put(b"a\xff\xff\x00", b"3")
+        db.put(b"b", b"4")
+        db.put(b"\xff\xff", b"5")
+        db.put(b"\xff\xff\x01", b"6")
+
+        self.assertEqual(db.scan_prefix(b"a\xff\xff", keys_only=True),
+                         [b"a\xff\xff", b"a\xff\xff\x00"])
+        self.assertEqual(db.count_prefix(b"a\xff"), 3)
+        self.assertEqual(db.count_prefix(b"\xff\xff"), 2)
+        self.assertEqual(db.count_prefix(b""), 6)
+        db.stop()
+
+    def test_uses_count_prefix(self):
+        db = Database(self.engine, self.config)
+        db.put(r"tenant1:a", r"1")
+        db.put(r"tenant1:b", r"2")
+        db.put(r"tenant10:a", r"3")
+        db.put(r"tenant2:a", r"4")
+
+        self.assertEqual(db.count_prefix(r"tenant1:"), 2)
+        self.assertEqual(db.count_prefix(r"tenant1"), 3)
+        self.assertEqual(db.count_prefix(r"tenant3"), 0)
+        db.stop()
+
+    def test_uses_remove_prefix(self):
+        db = Database(self.engine, self.config)
+        for i in range(3000):
+            db.put("tenant1:{}".format(i), r"x")
+        db.put(r"tenant1", r"y")
+        db.put(r"tenant2:0", r"z")
+
+        self.assertEqual(db.remove_prefix(r"tenant1:"), 3000)
+        self.assertEqual(db.count_all(), 2)
+        self.assertTrue(db.exists(r"tenant1"))
+        self.assertTrue(db.exists(r"tenant2:0"))
+        self.assertEqual(db.remove_prefix(r"tenant1:"), 0)
+        db.stop()
+
+    def test_uses_remove_range(self):
+        db = Database(self.engine, self.config)
+        for i in range(2500):
+            db.put("{:05}".format(i), r"x")
+
+        self.assertEqual(db.remove_range(r"00100", r"02200"), 2100)
+        self.assertTrue(db.exists(r"00099"))
+        self.assertFalse(db.exists(r"00100"))
+        self.assertFalse(db.exists(r"02199"))
+        self.assertTrue(db.exists(r"02200"))
+        self.assertEqual(db.remove_range(hi=r"00050"), 50)
+        self.assertEqual(db.remove_range(lo=r"02400"), 100)
+        self.assertEqual(db.count_all(), 250)
+        self.assertEqual(db.remove_range(r"B", r"A"), 0)
+        self.assertEqual(db.count_all(), 250)
+        db.stop()
+
+    def test_uses_clear(self):
+        db = Database(self.engine, self.config)
+        for i in range(5000):
+            db[str(i)] = str(i)
+        self.assertEqual(db.clear(), 5000)
+        self.assertEqual(len(db), 0)
+        self.assertEqual(db.clear(), 0)
+        db.stop()
+
+    def test_put_with_ttl(self):
+        db = Database(self.engine, self.config, expiry=True)
+        db.put(r"short", r"1", ttl=0.05)
+        db.put(r"long", r"2", ttl=3600)
+        db.put(r"forever", r"3")
+
+        self.assertEqual(db.get_string(r"short"), r"1")
+        self.assertEqual(db[r"long"], r"2")
+        time.sleep(0.1)
+        self.assertFalse(db.exists(r"short"))
+        self.assertNotIn(r"short", db)
+        with self.assertRaises(KeyError):
+            db.get_string(r"short")
+        with self.assertRaises(KeyError):
+            db[r"short"]
+        with self.assertRaises(KeyError):
+            db.get(r"short", lambda v: None)
+        self.assertEqual(db.get_string(r"long"), r"2")
+        self.assertEqual(db.get_string(r"forever"), r"3")
+
+        self.formatter = r"<{}>,<{}>|"
+        self.key_and_value = r""
+        db.get_all(self.all_and_each)
+        self.assertEqual(self.key_and_value, r"<forever>,<3>|<long>,<2>|")
+        self.assertEqual(db.scan_prefix(r""), [(b"forever", b"3"), (b"long", b"2")])
+
+        # overwriting removes expiration time
+        db.put(r"short", r"4")
+        self.assertEqual(db.get_string(r"short"), r"4")
+        db.stop()
+
+    def test_throws_exception_on_ttl_without_expiry(self):
+        db = Database(self.engine, self.config)
+        with self.assertRaises(pmemkv.InvalidArgument):
+            db.put(r"key1", r"value1", ttl=10)
+        with self.assertRaises(pmemkv.InvalidArgument):
+            db.start_reaper()
+        with self.assertRaises(ValueError):
+            db.put(r"key1", r"value1", ttl=-1)
+        db.stop()
+
+    def test_reaper_removes_expired_keys(self):
+        db = Database(self.engine, self.config, expiry=True)
+        for i in range(2000):
+            db.put("temp{}".format(i), r"x", ttl=0.01)
+        db.put(r"keep", r"y", ttl=3600)
+        time.sleep(0.05)
+        self.assertEqual(db.count_all(), 2001)
+
+        db.start_reaper(interval=0.01, batch_size=100)
+        deadline = time.time() + 10
+        while db.count_all() > 1 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(db.count_all(), 1)
+        self.assertEqual(db.reaper_stats()["removed"], 2000)
+        db.stop_reaper()
+        self.assertIsNone(db.reaper_stats())
+        self.assertEqual(db[r"keep"], r"y")
+        db.stop()
+
+    def check_compression(self, compression):
+        if compression not in pmemkv.compressions:
+            self.skipTest("{} compression is not available".format(compression))
+        db = Database(self.engine, self.config, compression=compression,
+                      min_size=64)
+        large = r"value" * 1000
+        db.put(r"large", large)
+        db.put(r"small", r"x")
+        self.assertEqual(db.get_string(r"large"), large)
+        self.assertEqual(db[r"small"], r"x")
+        self.assertEqual(db.scan_prefix(r"l"), [(b"large", large.encode())])
+
+        stats = db.compression_stats()
+        self.assertEqual(stats["compressed"], 1)
+        self.assertEqual(stats["stored_raw"], 1)
+        self.assertEqual(stats["raw_bytes"], len(large))
+        self.assertLess(stats["compressed_bytes"], stats["raw_bytes"])
+        self.assertGreater(stats["ratio"], 1)
+        self.assertGreaterEqual(stats["decompressed"], 2)
+        db.stop()
+
+    def test_compression_lz4(self):
+        self.check_compression(r"lz4")
+
+    def test_compression_zstd(self):
+        self.check_compression(r"zstd")
+
+    def test_compression_zstd_dictionary(self):
+        if r"zstd" not in pmemkv.compressions:
+            self.skipTest("zstd compression is not available")
+        samples = [
+            '{{"id": {}, "name": "user{}", "active": true}}'.format(i, i).encode()
+            for i in range(2000)
+        ]
+        dictionary = pmemkv.train_zstd_dictionary(samples, 4096)
+        db = Database(self.engine, self.config, compression=r"zstd", min_size=0,
+                      compression_dict=dictionary)
+        db.put(r"key1", samples[5])
+        self.assertEqual(db[r"key1"], samples[5].decode())
+        db.stop()
+
+    def test_compression_stats_disabled(self):
+        db = Database(self.engine, self.config)
+        self.assertIsNone(db.compression_stats())
+        db.stop()
+
+    def test_throws_exception_on_unknown_compression(self):
+        with self.assertRaises(pmemkv.InvalidArgument):
+            Database(self.engine, self.config, compression=r"unknown")
+
+    def test_defrag(self):
+        db = Database(self.engine, self.config)
+        for i in range(1000):
+            db.put("key{}".format(i), r"x" * 100)
+        for i in range(0, 1000, 2):
+            db.remove("key{}".format(i))
+        try:
+            db.defrag()
+        except pmemkv.NotSupported:
+            db.stop()
+            self.skipTest("{} does not support defragmentation".format(self.engine))
+        db.defrag(50, 10)
+        with self.assertRaises(pmemkv.InvalidArgument):
+            db.defrag(50, 60)
+        self.assertEqual(db.count_all(), 500)
+        self.assertEqual(db[r"key1"], r"x" * 100)
+        db.stop()
+
+    def test_defrag_scheduler(self):
+        db = Database(self.engine, self.config)
+        self.assertIsNone(db.defrag_stats())
+        with self.assertRaises(ValueError):
+            db.start_defrag_scheduler(cpu_budget=0)
+        db.put(r"key1", r"value1")
+        db.start_defrag_scheduler(interval=0.01, slice_percent=50, cpu_budget=1)
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            stats = db.defrag_stats()
+            if stats["slices"] >= 2 or stats["last_error"] is not None:
+                break
+            time.sleep(0.01)
+        if stats["last_error"] is pmemkv.NotSupported:
+            # scheduler stops after the first slice
+            self.assertEqual(stats["slices"], 1)
+        else:
+            self.assertIsNone(stats["last_error"])
+            self.assertGreaterEqual(stats["passes"], 1)
+        self.assertIsNone(stats["reclaimed_bytes"])
+        db.stop_defrag_scheduler()
+        self.assertIsNone(db.defrag_stats())
+        self.assertEqual(db[r"key1"], r"value1")
+        db.stop()
+
+    def test_export_import(self):
+        db = Database(self.engine, self.config)
+        for i in range(100):
+            db.put("key{:03}".format(i), "value{}".format(i))
+        snapshot = io.BytesIO()
+        self.assertEqual(db.export(snapshot), 100)
+        db.stop()
+
+        snapshot.seek(0)
+        db = Database(self.engine, self.config)
+        self.assertEqual(db.import_(snapshot), 100)
+        self.assertEqual(db.count_all(), 100)
+        self.assertEqual(db[r"key042"], r"value42")
+        db.stop()
+
+    def test_export_import_file(self):
+        db = Database(self.engine, self.config)
+        for i in range(100):
+            db.put("key{:03}".format(i), "value{}".format(i) * 100)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "snapshot")
+            self.assertEqual(db.export(path, lo=r"key010", hi=r"key020"), 10)
+            db.stop()
+
+            db = Database(self.engine, self.config)
+            self.assertEqual(db.import_(path), 10)
+        self.assertEqual(db.count_all(), 10)
+        self.assertEqual(db[r"key010"], r"value10" * 100)
+        self.assertFalse(db.exists(r"key020"))
+        db.stop()
+
+    def test_export_import_compressed(self):
+        for compression in pmemkv.compressions:
+            db = Database(self.engine, self.config)
+            db.put(r"key1", r"value" * 10000)
+            snapshot = io.BytesIO()
+            db.export(snapshot, compression=compression)
+            self.assertLess(len(snapshot.getvalue()), 10000)
+            db.stop()
+
+            db = Database(self.engine, self.config)
+            self.assertEqual(db.import_(io.BytesIO(snapshot.getvalue())), 1)
+            self.assertEqual(db[r"key1"], r"value" * 10000)
+            db.stop()
+
+    def test_export_import_preserves_expiry(self):
+        db = Database(self.engine, self.config, expiry=True)
+        db.put(r"key1", r"value1", ttl=3600)
+        db.put(r"key2", r"value2", ttl=0.01)
+        time.sleep(0.05)
+        snapshot = io.BytesIO()
+        self.assertEqual(db.export(snapshot), 1)
+        db.stop()
+
+        db = Database(self.engine, self.config)
+        with self.assertRaises(pmemkv.InvalidArgument):
+            db.import_(io.BytesIO(snapshot.getvalue()))
+        db.stop()
+        db = Database(self.engine, self.config, expiry=True)
+        self.assertEqual(db.import_(io.BytesIO(snapshot.getvalue())), 1)
+        self.assertEqual(db[r"key1"], r"value1")
+        db.stop()
+
+    def test_import_corrupted_snapshot(self):
+        db = Database(self.engine, self.config)
+        db.put(r"key1", r"value1")
+        snapshot = io.BytesIO()
+        db.export(snapshot)
+        data = bytearray(snapshot.getvalue())
+        with self.assertRaises(pmemkv.InvalidArgument):
+            db.import_(io.BytesIO(b"not a snapshot"))
+        with self.assertRaises(pmemkv.UnknownError):
+            db.import_(io.BytesIO(bytes(data[:-1])))
+        data[30] ^= 0xFF
+        with self.assertRaises(pmemkv.UnknownError):
+            db.import_(io.BytesIO(bytes(data)))
+        db.stop()
+
+    def test_save_and_load_image(self):
+        db = Database(self.engine, self.config)
+        for i in range(1000):
+            db.put("key{}".format(i), "value{}".format(i))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "image")
+            self.assertEqual(db.save_image(path), 1000)
+            db.stop()
+
+            db = Database.from_image(self.engine, self.config, path)
+        self.assertEqual(db.count_all(), 1000)
+        self.assertEqual(db[r"key123"], r"value123")
+        db.stop()
+
+    def test_image_with_expiry(self):
+        db = Database(self.engine, self.config, expiry=True)
+        db.put(r"key1", r"value1", ttl=3600)
+        db.put(r"key2", r"value2", ttl=0.01)
+        time.sleep(0.05)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "image")
+            self.assertEqual(db.save_image(path), 1)
+            db.stop()
+
+            with self.assertRaises(pmemkv.InvalidArgument):
+                Database.from_image(self.engine, self.config, path)
+            db = Database.from_image(self.engine, self.config, path, expiry=True)
+        self.assertEqual(db.count_all(), 1)
+        self.assertEqual(db[r"key1"], r"value1")
+        db.stop()
+
+    def test_load_corrupted_image(self):
+        db = Database(self.engine, self.config)
+        db.put(r"key1", r"value1")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "image")
+            db.save_image(path)
+            db.stop()
+            with open(path, "rb") as f:
+                data = bytearray(f.read())
+            data[-1] ^= 0xFF
+            with open(path, "wb") as f:
+                f.write(data)
+            with self.assertRaises(pmemkv.UnknownError):
+                Database.from_image(self.engine, self.config, path)
+            db = Database(self.engine, self.config)
+            with self.assertRaises(pmemkv.UnknownError):
+                db.db.load_image(path)
+            self.assertFalse(db.exists(r"key1"))
+            db.stop()
+            with open(path, "wb") as f:
+                f.write(b"not an image")
+            with self.assertRaises(pmemkv.InvalidArgument):
+                Database.from_image(self.engine, self.config, path)
+            with self.assertRaises(FileNotFoundError):
+                Database.from_image(self.engine, self.config,
+                                    os.path.join(tmp_dir, "missing"))
+
+    def test_changes(self):
+        db = Database(self.engine, self.config)
+        db.put(r"before", r"x")
+        self.assertIsNone(db.changes_stats())
+        db.enable_changes(values=True)
+        db.put(r"key1", r"value1")
+        db[r"key2"] = r"value2"
+        db.remove(r"key1")
+        db.remove(r"missing")
+        self.assertEqual(db.read_changes(timeout=0), [
+            pmemkv.Change(1, r"put", b"key1", b"value1"),
+            pmemkv.Change(2, r"put", b"key2", b"value2"),
+            pmemkv.Change(3, r"remove", b"key1", 0),
+        ])
+        self.assertEqual(db.read_changes(timeout=0), [])
+
+        db.enable_changes(values=False)
+        db.put(r"key3", r"value3")
+        self.assertEqual(db.read_changes(timeout=0),
+                         [pmemkv.Change(4, r"put", b"key3", 6)])
+        db.disable_changes()
+        db.put(r"key4", r"value4")
+        self.assertIsNone(db.read_changes(timeout=0))
+        self.assertEqual(list(db.changes()), [])
+        db.stop()
+
+    def test_changes_drop_oldest(self):
+        db = Database(self.engine, self.config)
+        db.enable_changes(capacity=10)
+        for i in range(25):
+            db.put("key{}".format(i), r"x")
+        stats = db.changes_stats()
+        self.assertEqual(stats["pending"], 10)
+        self.assertEqual(stats["dropped"], 15)
+        changes = db.read_changes(timeout=0)
+        self.assertEqual([c.seq for c in changes], list(range(16, 26)))
+        db.stop()
+
+    def test_changes_block(self):
+        db = Database(self.engine, self.config)
+        db.enable_changes(capacity=10, block=True)
+        received = []
+
+        def consume():
+            for change in db.changes(batch_size=3, poll_interval=0.01):
+                received.append(change)
+                if len(received) == 100:
+                    db.disable_changes()
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        for i in range(100):
+            db.put("key{}".format(i), r"x")
+        consumer.join(10)
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual([c.seq for c in received], list(range(1, 101)))
+        self.assertEqual(db.changes_stats()["dropped"], 0)
+        db.stop()
+
+    def test_changes_async(self):
+        db = Database(self.engine, self.config)
+        db.enable_changes()
+        db.put(r"key1", r"value1")
+        db.remove(r"key1")
+        db.disable_changes()
+
+        async def collect():
+            return [c async for c in db.changes_async(poll_interval=0.01)]
+
+        loop = asyncio.new_event_loop()
+        try:
+            changes = loop.run_until_complete(collect())
+        finally:
+            loop.close()
+        self.assertEqual([(c.op, c.key) for c in changes],
+                         [(r"put", b"key1"), (r"remove", b"key1")])
+        db.stop()
+
+    def test_json_index(self):
+        db = Database(self.engine, self.config)
+        db.put(r"user1", r'{"name": "Ann", "email": "ann@example.com"}')
+        db.put(r"user2", r'{"name": "Bob", "email": "bob@example.com"}')
+        db.put(r"user3", r'{"name": "No email"}')
+        index = db.create_index(r"email", r"/email", config=self.config)
+        self.assertIs(db.index(r"email"), index)
+        self.assertEqual(index.get(r"bob@example.com"), [b"user2"])
+        self.assertEqual(index.range(), [b"user1", b"user2"])
+
+        db.put(r"user4", r'{"email": "ann@example.com", "name": "Ann 2"}')
+        db.put(r"user2", r'{"name": "Bob", "email": "robert@example.com"}')
+        db.remove(r"user1")
+        self.assertEqual(index.get(r"ann@example.com"), [b"user4"])
+        self.assertEqual(index.get(r"bob@example.com"), [])
+        self.assertEqual(index.range(r"b", r"s"), [b"user2"])
+        self.assertEqual(index.range(limit=1), [b"user4"])
+
+        db.drop_index(r"email")
+        with self.assertRaises(KeyError):
+            db.index(r"email")
+        db.stop()
+
+    def test_json_index_nested_values(self):
+        db = Database(self.engine, self.config)
+        index = db.create_index(r"city", pmemkv.JsonPointer(r"/address/0/city"),
+                                config=self.config)
+        db.put(r"a", r'{"address": [{"city": "Gda\u0144sk"}, {"city": "Oslo"}]}')
+        db.put(r"b", r'{"tags": ["x", {"y": 1}], "address": [{"city": "Oslo"}]}')
+        db.put(r"c", r'{"address": [{"city": null}]}')
+        db.put(r"d", r'not a json')
+        self.assertEqual(index.get("Gdańsk"), [b"a"])
+        self.assertEqual(index.get(r"Oslo"), [b"b"])
+        self.assertEqual(index.range(), [b"a", b"b"])
+        db.stop()
+
+    def test_struct_field_index(self):
+        db = Database(self.engine, self.config)
+        index = db.create_index(r"age", pmemkv.StructField(4, 2, "little"),
+                                config=self.config)
+        for name, age in [(r"a", 300), (r"b", 20), (r"c", 41)]:
+            db.put(name, b"\x00" * 4 + age.to_bytes(2, "little") + b"rest")
+        db.put(r"short", b"\x00")
+        self.assertEqual(index.range(), [b"b", b"c", b"a"])
+        self.assertEqual(index.range(lo=(41).to_bytes(2, "big")), [b"c", b"a"])
+        db.stop()
+
+    def test_python_index(self):
+        db = Database(self.engine, self.config)
+        db.put(r"key1", r"Value")
+        index = db.create_index(r"lower", lambda v: v.decode().lower(),
+                                config=self.config)
+        db.put(r"key2", r"VALUE")
+        self.assertEqual(index.get(r"value"), [b"key1", b"key2"])
+        with self.assertRaises(ValueError):
+            db.create_index(r"lower", r"/x", config=self.config)
+        with self.assertRaises(TypeError):
+            db.create_index(r"other", 42, config=self.config)
+        db.stop()
+
     def test_dict_set_item(self):
         db = Database(self.engine, self.config)
         db['string_value'] = "test"
@@ -0,0 +1,111 @@
+'''
+ * Copyright 2019-2020, Intel Corporation
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions
+ * are met:
+ *
+ *     * Redistributions of source code must retain the above copyright
+ *       notice, this list of conditions and the following disclaimer.
+ *
+ *     * Redistributions in binary form must reproduce the above copyright
+ *       notice, this list of conditions and the following disclaimer in
+ *       the documentation and/or other materials provided with the
+ *       distribution.
+ *
+ *     * Neither the name of the copyright holder nor the names of its
+ *       contributors may be used to endorse or promote products derived
+ *       from this software without specific prior written permission.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+ * "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+ * LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+ * A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+ * OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+ * SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+ * LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+ * DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+ * THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+ * (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+ * OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import pmemkv
+import pmemkv.replay
+
+class TestReplay(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.engine = r"vsmap"
+        self.config = {"path":"/dev/shm","size":1073741824}
+
+    def record(self, path, keys):
+        db = pmemkv.Database(self.engine, self.config)
+        self.assertIsNone(db.stop_recording())
+        db.start_recording(path, keys)
+        db.put(r"key1", r"value1")
+        db.put(b"key2", b"value22")
+        self.assertEqual(db.get_string(r"key1"), r"value1")
+        self.assertTrue(db.exists(r"key2"))
+        self.assertTrue(db.remove(r"key1"))
+        self.assertEqual(db.stop_recording(), 5)
+        # operations are not recorded after recording is stopped
+        db.put(r"key3", r"value3")
+        db.stop()
+
+    def test_record_and_replay(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace")
+            self.record(path, True)
+            records = list(pmemkv.replay.read_trace(path))
+            self.assertEqual([r.op for r in records],
+                             ["put", "put", "get", "exists", "remove"])
+            self.assertEqual(records[1].key, b"key2")
+            self.assertEqual(records[1].value_size, 7)
+            self.assertEqual(records[2].value_size, 6)
+            self.assertEqual(records[0].key_hash, records[4].key_hash)
+            self.assertEqual(sorted(r.time_us for r in records),
+                             [r.time_us for r in records])
+
+            db = pmemkv.Database(self.engine, self.config)
+            report = pmemkv.replay.replay(db, records, threads=2, speed=0)
+            self.assertEqual(report["operations"], 5)
+            self.assertEqual(report["latency"]["put"]["count"], 2)
+            self.assertLessEqual(report["latency"]["put"]["p50"],
+                                 report["latency"]["put"]["max"])
+            self.assertEqual(db.count_all(), 1)
+            self.assertEqual(db.read(b"key2"), bytes(7))
+            db.stop()
+
+    def test_hashed_keys(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace")
+            self.record(path, False)
+            records = list(pmemkv.replay.read_trace(path))
+            # keys shorter than the hash are not truncated
+            self.assertEqual(len(records[0].key), 8)
+            self.assertEqual(records[0].key,
+                             records[0].key_hash.to_bytes(8, "little"))
+            self.assertEqual(records[0].key, records[4].key)
+            self.assertNotEqual(records[0].key, records[1].key)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                pmemkv.replay.main([path, "--engine", self.engine, "--config",
+                                    '{"path":"/dev/shm","size":1073741824}',
+                                    "--speed", "0"])
+            self.assertIn("operations: 5", output.getvalue())
+
+            with open(path, "r+b") as f:
+                f.write(b"x")
+            with self.assertRaises(ValueError):
+                list(pmemkv.replay.read_trace(path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+'''
+ * Copyright 2019-2020, Intel Corporation
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions
+ * are met:
+ *
+ *     * Redistributions of source code must retain the above copyright
+ *       notice, this list of conditions and the following disclaimer.
+ *
+ *     * Redistributions in binary form must reproduce the above copyright
+ *       notice, this list of conditions and the following disclaimer in
+ *       the documentation and/or other materials provided with the
+ *       distribution.
+ *
+ *     * Neither the name of the copyright holder nor the names of its
+ *       contributors may be used to endorse or promote products derived
+ *       from this software without specific prior written permission.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+ * "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+ * LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+ * A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+ * OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+ * SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+ * LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+ * DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+ * THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+ * (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+ * OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import unittest
+import os
+import tempfile
+import threading
+
+import pmemkv
+import pmemkv.client
+import pmemkv.server
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = r"vsmap"
+        self.config = {"path":"/dev/shm","size":1073741824}
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "pmemkv.sock")
+        self.db = pmemkv.Database(self.engine, self.config, expiry=True)
+        self.server = pmemkv.server.Server(self.db, self.path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.close()
+        self.db.stop()
+        self.tmpdir.cleanup()
+
+    def test_crud(self):
+        with pmemkv.client.Database(self.path) as client:
+            client.put(r"key1", r"value1")
+            client[b"key2"] = b"\x00value2"
+            self.assertEqual(self.db.get_string(r"key1"), r"value1")
+            self.assertEqual(client[r"key1"], r"value1")
+            client.get(r"key2", lambda v: self.assertEqual(bytes(v), b"\x00value2"))
+            self.assertTrue(client.exists(r"key1"))
+            self.assertFalse(r"key3" in client)
+            self.assertEqual(len(client), 2)
+            self.assertTrue(client.remove(r"key1"))
+            self.assertFalse(client.remove(r"key1"))
+            with self.assertRaises(KeyError) as cm:
+                client[r"key1"]
+            self.assertEqual(cm.exception.args, (r"key1",))
+            with self.assertRaises(KeyError) as cm:
+                client.get(r"key1", print)
+            self.assertEqual(cm.exception.args, (r"key1",))
+            with self.assertRaises(KeyError):
+                del client[r"key1"]
+
+    def test_ttl(self):
+        with pmemkv.client.Database(self.path) as client:
+            client.put(r"key1", r"value1", ttl=0)
+            client.put(r"key2", r"value2", ttl=60)
+            self.assertFalse(client.exists(r"key1"))
+            self.assertEqual(client[r"key2"], r"value2")
+            with self.assertRaises(ValueError):
+                client.put(r"key3", r"value3", ttl=-1)
+
+    def test_scan_prefix(self):
+        with pmemkv.client.Database(self.path) as client:
+            client.put_many({r"a1": r"1", r"b1": r"2", r"b2": r"3", r"c1": r"4"})
+            self.assertEqual(client.scan_prefix(r"b"), [(b"b1", b"2"), (b"b2", b"3")])
+            self.assertEqual(client.scan_prefix(r"", limit=1), [(b"a1", b"1")])
+
+    def test_batches(self):
+        with pmemkv.client.Database(self.path) as client:
+            items = [(r"key" + str(i), r"value" + str(i)) for i in range(1000)]
+            client.put_many(items)
+            self.assertEqual(client.count_all(), 1000)
+            values = client.get_many([r"key0", r"missing", r"key999"])
+            self.assertEqual(values, [b"value0", None, b"value999"])
+            self.assertEqual(client.remove_many([k for k, _ in items[:10]] + [r"missing"]), 10)
+            self.assertEqual(self.db.count_all(), 990)
+
+    def test_large_batches(self):
+        with pmemkv.client.Database(self.path) as client:
+            items = [(r"key" + str(i), r"x" * 100) for i in range(100000)]
+            client.put_many(items)
+            self.assertEqual(client.count_all(), 100000)
+            values = client.get_many([k for k, _ in items])
+            self.assertEqual(values, [b"x" * 100] * 100000)
+
+    def test_exceptions(self):
+        db = pmemkv.Database(self.engine, self.config)
+        with pmemkv.server.Server(db, self.path + "2") as server:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            with pmemkv.client.Database(self.path + "2") as client:
+                with self.assertRaises(pmemkv.InvalidArgument):
+                    client.put(r"key1", r"value1", ttl=1)
+            server.shutdown()
+            thread.join()
+        db.stop()
+
+    def test_many_clients(self):
+        def worker(n):
+            with pmemkv.client.Database(self.path) as client:
+                for i in range(100):
+                    client.put(str(n) + r":" + str(i), str(i))
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.db.count_all(), 800)
+
+if __name__ == '__main__':
+    unittest.main()
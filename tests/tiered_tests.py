@@ -0,0 +1,120 @@
+'''
+ * Copyright 2019-2020, Intel Corporation
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions
+ * are met:
+ *
+ *     * Redistributions of source code must retain the above copyright
+ *       notice, this list of conditions and the following disclaimer.
+ *
+ *     * Redistributions in binary form must reproduce the above copyright
+ *       notice, this list of conditions and the following disclaimer in
+ *       the documentation and/or other materials provided with the
+ *       distribution.
+ *
+ *     * Neither the name of the copyright holder nor the names of its
+ *       contributors may be used to endorse or promote products derived
+ *       from this software without specific prior written permission.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+ * "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+ * LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+ * A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+ * OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+ * SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+ * LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+ * DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+ * THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+ * (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+ * OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import threading
+import unittest
+
+import pmemkv
+
+class TestTieredDatabase(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.config = {"path":"/dev/shm","size":1073741824}
+        self.hot = (r"vcmap", self.config)
+        self.cold = (r"vsmap", self.config)
+
+    def check_policy(self, policy, write_back):
+        db = pmemkv.TieredDatabase(self.hot, self.cold, policy=policy, capacity=10,
+                                   promote_after=2, write_back=write_back,
+                                   flush_interval=None)
+        for i in range(100):
+            db.put("key{:02}".format(i), "value{}".format(i))
+        for _ in range(3):
+            for i in range(5):
+                self.assertEqual(db.get_string("key{:02}".format(i)),
+                                 "value{}".format(i))
+        stats = db.stats()
+        self.assertGreater(stats["hits"], 0)
+        self.assertLessEqual(stats["resident"], 10)
+        self.assertEqual(db.hot.count_all(), stats["resident"])
+
+        db[r"key00"] = r"new"
+        self.assertEqual(db[r"key00"], r"new")
+        self.assertTrue(db.remove(r"key00"))
+        self.assertFalse(r"key00" in db)
+        self.assertFalse(db.remove(r"key00"))
+        self.assertEqual(len(db), 99)
+        db.stop()
+
+    def test_clock_write_through(self):
+        self.check_policy("clock", False)
+
+    def test_clock_write_back(self):
+        self.check_policy("clock", True)
+
+    def test_2q_write_through(self):
+        self.check_policy("2q", False)
+
+    def test_2q_write_back(self):
+        self.check_policy("2q", True)
+
+    def test_write_back_scans_and_flush(self):
+        db = pmemkv.TieredDatabase(self.hot, self.cold, capacity=100, write_back=True,
+                                   flush_interval=None)
+        db.cold.put(r"a1", r"old")
+        db.cold.put(r"a3", r"3")
+        db.put(r"a1", r"1")
+        db.put(r"a2", r"2")
+        self.assertFalse(db.cold.exists(r"a2"))
+        self.assertEqual(db.scan_prefix(r"a"), [(b"a1", b"1"), (b"a2", b"2"), (b"a3", b"3")])
+        self.assertEqual(db.scan_range(r"a2", limit=1, keys_only=True), [b"a2"])
+        db.flush()
+        self.assertEqual(db.cold.get_string(r"a1"), r"1")
+        self.assertEqual(db.stats()["dirty"], 0)
+        db.stop()
+
+    def test_concurrent_write_through(self):
+        db = pmemkv.TieredDatabase(self.hot, self.cold, capacity=10, promote_after=1)
+        db.put(r"key", r"initial")
+        db.get_string(r"key")
+
+        def writer(n):
+            for i in range(1000):
+                db.put(r"key", r"value{}-{}".format(n, i))
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(db.hot.read(r"key"), db.cold.read(r"key"))
+        db.stop()
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            pmemkv.TieredDatabase(self.hot, self.cold, policy="lru")
+        with self.assertRaises(ValueError):
+            pmemkv.TieredDatabase(self.hot, self.cold, capacity=0)
+
+if __name__ == '__main__':
+    unittest.main()
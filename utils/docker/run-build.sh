@@ -60,6 +60,11 @@ pip3 install dist/pmemkv-*.whl --user
 cd $WORKDIR/tests
 python3 -X faulthandler -m pytest -v pmemkv_tests.py
 python3 -X faulthandler -m pytest -v  nontrivial_data_tests.py
+python3 -X faulthandler -m pytest -v server_tests.py
+python3 -X faulthandler -m pytest -v gateway_tests.py
+python3 -X faulthandler -m pytest -v tiered_tests.py
+python3 -X faulthandler -m pytest -v dbm_tests.py
+python3 -X faulthandler -m pytest -v replay_tests.py
 
 echo
 echo "##########################################################"